@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+# Benchmark for the bulk channel: viewport latency (Render -> Result round
+# trip) while uploading a big scene, with everything going through one
+# connection vs. meshes going through a second connection, over TCP and
+# with uploads going through shared memory.
+# Runs against the stand-in server (see standin_server.py), which is made to
+# process meshes at PROCESSING_BANDWIDTH, or against the server listening on
+# the port given on the command line.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+	sys.path.append(path.dirname(path.abspath(__file__)))
+
+import struct
+import sys
+import time
+
+from network import  *
+from standin_server import StandinServer
+
+UPLOAD_SIZE				= 200 * 1024 * 1024
+MESH_SIZE				= 2 * 1024 * 1024
+PROCESSING_BANDWIDTH	= 1024 * 1024 * 1024	# Bytes per second the server processes
+RENDER_INTERVAL			= 1.0 / 60.0
+RESULT_WIDTH			= 64
+RESULT_HEIGHT			= 64
+
+class CallbackObj:
+	def __init__( self ):
+		self.numResults = 0
+
+	def processMessage( self, header_sizeBytes, header_messageType, data ):
+		if header_messageType == FromServer.Result:
+			self.numResults += 1
+
+def run( port, bulkChannel, sharedMemory=False ):
+	transport = TcpTransport( '127.0.0.1', port )
+	if sharedMemory:
+		transport = SharedMemoryTransport( transport )
+	n = Network()
+	n.connect( transport, bulkChannel )
+	n.startThreads()
+	callbackObj = CallbackObj()
+
+	mesh = bytearray( MESH_SIZE )
+	renderData = struct.pack( '=BQHH', 1, 0, RESULT_WIDTH, RESULT_HEIGHT )
+
+	latencies = []
+	numMeshes = UPLOAD_SIZE // MESH_SIZE
+	meshesSent = 0
+	startTime = time.perf_counter()
+	nextRender = startTime
+	while meshesSent < numMeshes or sum( [c.sendQueueBytes for c in n.channels] ) > 0:
+		if meshesSent < numMeshes:
+			n.sendData( FromClient.Mesh, mesh )
+			meshesSent += 1
+
+		if time.perf_counter() >= nextRender:
+			renderSendTime = time.perf_counter()
+			n.sendData( FromClient.Render, renderData )
+			numResults = callbackObj.numResults
+			while callbackObj.numResults == numResults:
+				n.receiveData( callbackObj )
+			latencies.append( time.perf_counter() - renderSendTime )
+			nextRender = time.perf_counter() + RENDER_INTERVAL
+	elapsed = time.perf_counter() - startTime
+
+	n.disconnect()
+
+	latencies.sort()
+	print( '%-19s upload took %7.1f ms, %4d frames, Render latency: median %7.2f ms, '\
+		   'p95 %7.2f ms, max %7.2f ms' %\
+		   (('Dual channel' if bulkChannel else 'Single') + (' + shm' if sharedMemory else ''),
+			elapsed * 1000.0, len( latencies ),
+			latencies[len( latencies ) // 2] * 1000.0,
+			latencies[len( latencies ) * 95 // 100] * 1000.0, latencies[-1] * 1000.0) )
+
+print( '%d MB upload in %d MB meshes, server processes %d MB/s' %\
+	   (UPLOAD_SIZE / (1024 * 1024), MESH_SIZE / (1024 * 1024),
+		PROCESSING_BANDWIDTH / (1024 * 1024)) )
+server = None
+if len( sys.argv ) > 1:
+	port = int( sys.argv[1] )
+else:
+	server = StandinServer( 0, verbose=False, processingBandwidth=PROCESSING_BANDWIDTH )
+	port = server.port
+for sharedMemory in ((False, True) if shared_memory is not None else (False,)):
+	run( port, False, sharedMemory )
+	run( port, True, sharedMemory )
+if server:
+	server.close()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+
+# Benchmark for Blender's tangents (Capability.ClientTangents): how long reading
+# them takes (MeshExport.readTangents) and what they add to the MeshV2 and
+# MeshIndexed messages, in time, size and welded vertices. In exchange the server
+# skips its own tangent generation. Blender's tangents are faked (see calcTangents),
+# and computed beforehand: only reading them is measured.
+# The RawTangents section of MeshV2, and the tangents of MeshIndexed's vertices,
+# are parsed back the way DergoSystem does and checked against Blender's, with
+# the handedness flipped (the server mirrors V).
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import struct
+
+import numpy
+
+from fake_bpy import FakeData, FakeCollection, createGrid, createQuads, createQuadLoopTriangles, \
+					 timeIt
+from mesh_export import MeshExport
+from network import Capability, FromClient, MeshSection, MeshFormat
+
+FACE_COUNTS		= (10000, 100000)
+NUM_RUNS		= 3
+CAPABILITIES	= Capability.CompactVertexFormats | Capability.SoaMeshes | \
+				  Capability.IndexedMeshes | Capability.ClientTangents
+
+# Bumpy quads grid split in loop triangles, with one UV set mirrored on half
+# of it (so both handedness are there)
+def createMesh( numFaces ):
+	rng = numpy.random.default_rng( numFaces )
+	gridSize, x, y = createGrid( numFaces )
+	co = numpy.stack( (x, y, rng.random( len( x ) ) * 0.1), axis=1 ).astype( numpy.float32 )
+	normal = numpy.tile( numpy.float32( [0, 0, 1] ), (len( co ), 1) )
+
+	loopVertices = createQuads( numFaces, gridSize ).reshape( -1 ).astype( numpy.int32 )
+	loopTriangles = createQuadLoopTriangles( numFaces )
+	numTriangles = len( loopTriangles )
+
+	uv = co[loopVertices, 0:2] / gridSize
+	mirrored = numpy.repeat( numpy.arange( numFaces ) % 2 == 1, 4 )
+	uv[mirrored, 0] = 1.0 - uv[mirrored, 0]
+
+	loops = FakeCollection( vertex_index=loopVertices, normal=normal[loopVertices] )
+	mesh = FakeData(
+		name='Mesh',
+		loop_triangles=FakeCollection( loops=loopTriangles,
+									   normal=numpy.tile( numpy.float32( [0, 0, 1] ), (numTriangles, 1) ),
+									   material_index=numpy.zeros( numTriangles, dtype=numpy.int32 ) ),
+		loops=loops,
+		vertices=FakeCollection( co=co, normal=normal ),
+		color_attributes=FakeData( active_color=None ),
+		uv_layers=[FakeData( name='UVMap', data=FakeCollection( uv=uv.astype( numpy.float32 ) ) )],
+		materials=[FakeData( dergo=FakeData( id=1 ) )] )
+	calcTangents( mesh, co[loopVertices], uv )
+	mesh.calc_tangents = lambda uvmap: None
+	mesh.free_tangents = lambda: None
+	return mesh
+
+# What Mesh.calc_tangents would give: tangent of each quad (its first triangle) from
+# the UV derivatives, averaged like MikkTSpace among the loops of a vertex with
+# the same bitangent sign, and that sign
+def calcTangents( mesh, loopCo, loopUv ):
+	p = loopCo.reshape( -1, 4, 3 )
+	t = loopUv.reshape( -1, 4, 2 )
+	edge1 = p[:, 1] - p[:, 0]
+	edge2 = p[:, 2] - p[:, 0]
+	du1 = t[:, 1] - t[:, 0]
+	du2 = t[:, 2] - t[:, 0]
+	r = 1.0 / (du1[:, 0] * du2[:, 1] - du2[:, 0] * du1[:, 1])
+	tangent = (edge1 * du2[:, 1:2] - edge2 * du1[:, 1:2]) * r[:, numpy.newaxis]
+	bitangent = (edge2 * du1[:, 0:1] - edge1 * du2[:, 0:1]) * r[:, numpy.newaxis]
+	tangent /= numpy.linalg.norm( tangent, axis=1, keepdims=True )
+	sign = numpy.where( numpy.sum( numpy.cross( (0.0, 0.0, 1.0), tangent ) * bitangent, axis=1 ) < 0.0,
+						-1.0, 1.0 )
+	loopSign = numpy.repeat( sign, 4 )
+	group = mesh.loops.arrays['vertex_index'] * 2 + (loopSign > 0.0)
+	groupTangent = numpy.zeros( (group.max() + 1, 3) )
+	numpy.add.at( groupTangent, group, numpy.repeat( tangent, 4, axis=0 ) )
+	groupTangent /= numpy.maximum( numpy.linalg.norm( groupTangent, axis=1, keepdims=True ), 1e-30 )
+	mesh.loops.arrays['tangent'] = groupTangent[group].astype( numpy.float32 )
+	mesh.loops.arrays['bitangent_sign'] = loopSign.astype( numpy.float32 )
+
+# The RawTangents section of a MeshV2 message, as DergoSystem::syncMeshV2 finds it
+def parseRawTangents( data ):
+	nameLength = struct.unpack_from( '=I', data, 4 )[0]
+	offset = 8 + nameLength
+	numFaces, numRawVertices, meshFormat, numUvs, tangentUvSource = \
+		struct.unpack_from( '=II3B', data, offset )
+	assert( meshFormat & MeshFormat.HasTangents )
+	offset += 11
+	if meshFormat & MeshFormat.QuantizedPositions:
+		offset += 24
+	numMaterials = struct.unpack_from( '=H', data, offset )[0]
+	offset += 2 + numMaterials * 4
+	numSections = struct.unpack_from( '=B', data, offset )[0]
+	offset += 1
+	for i in range( numSections ):
+		section, sectionOffset, sizeBytes = struct.unpack_from( '=BII', data, offset + i * 9 )
+		if section == MeshSection.RawTangents:
+			assert( sizeBytes == numRawVertices * 16 )
+			return numpy.frombuffer( data, dtype=numpy.float32, count=numRawVertices * 4,
+									 offset=sectionOffset ).reshape( -1, 4 )
+	return None
+
+# (vertices, indices) of a MeshIndexed message
+def parseMeshIndexed( data ):
+	nameLength = struct.unpack_from( '=I', data, 4 )[0]
+	offset = 8 + nameLength
+	numVertices, numTriangles, meshFormat, numUvs, tangentUvSource = \
+		struct.unpack_from( '=II3B', data, offset )
+	offset += 11
+	numMaterials = struct.unpack_from( '=H', data, offset )[0]
+	offset += 2 + numMaterials * 4
+
+	vertexDtype = MeshExport.getVertexDtype( meshFormat & MeshFormat.HasColour, numUvs,
+											 meshFormat & MeshFormat.HasTangents )
+	indexType = numpy.uint32 if numVertices > 0xFFFF else numpy.uint16
+	vertices = numpy.frombuffer( data, dtype=vertexDtype, count=numVertices, offset=offset )
+	offset += vertices.nbytes
+	indices = numpy.frombuffer( data, dtype=indexType, count=numTriangles * 3, offset=offset )
+	return (vertices, indices)
+
+def upload( mesh, sections, indexed, tangents ):
+	return list( MeshExport.generateUpload( 1, 'Mesh', mesh, 0, CAPABILITIES, sections,
+											indexed=indexed, tangents=tangents ) )
+
+print( '%8s %12s %12s %10s %14s %10s %14s %10s %16s' % ('Faces', 'Message', 'Tangents ms', 'Build ms',
+														 'With them ms', 'KB', 'With them KB',
+														 'Vertices', 'With them') )
+for numFaces in FACE_COUNTS:
+	mesh = createMesh( numFaces )
+	sections = MeshExport.readSections( mesh )
+	readTime, tangents = timeIt( lambda: MeshExport.readTangents( mesh, 0 ), NUM_RUNS )
+	assert( numpy.array_equal( tangents[:, 3], -mesh.loops.arrays['bitangent_sign'] ) )
+
+	for name, indexed in (('MeshV2', False), ('MeshIndexed', True)):
+		plainTime, plain = timeIt( lambda: upload( mesh, sections, indexed, None ), NUM_RUNS )
+		withTime, withTangents = timeIt( lambda: upload( mesh, sections, indexed, tangents ), NUM_RUNS )
+		assert( len( plain ) == 1 and len( withTangents ) == 1 )
+		messageType, data = withTangents[0]
+
+		numVertices = numPlainVertices = len( tangents )
+		if indexed:
+			numPlainVertices = len( parseMeshIndexed( plain[0][1] )[0] )
+			assert( messageType == FromClient.MeshIndexed )
+			vertices, indices = parseMeshIndexed( data )
+			deindexed, materialIds = MeshExport.deindexSections( sections, tangents )
+			assert( vertices[indices].tobytes() == deindexed.tobytes() )
+			numVertices = len( vertices )
+		else:
+			assert( messageType == FromClient.MeshV2 )
+			assert( numpy.array_equal( parseRawTangents( data ), tangents ) )
+
+		print( '%8d %12s %12.1f %10.1f %14.1f %10.1f %14.1f %10d %16d' % (numFaces, name,
+																		  readTime * 1000.0,
+																		  plainTime * 1000.0,
+																		  withTime * 1000.0,
+																		  len( plain[0][1] ) / 1024.0,
+																		  len( data ) / 1024.0,
+																		  numPlainVertices, numVertices) )
+
+print( 'Tangents match Blender\'s' )
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+# Benchmark for compact vertex formats (see MeshFormat): bytes sent per section
+# with DergoMeshSettings.vertex_format FULL, COMPACT and COMPACT_POSITIONS, how
+# long encoding takes, and the error the server ends up with after decoding
+# them the way VertexUtils::decodeSection does. Also prints the bytes per
+# vertex of the server's vertex buffers (QTangent & half UVs vs. floats).
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import math
+import struct
+
+import numpy
+
+from fake_bpy import createGrid, createQuads, createTessMesh, timeIt
+from mesh_export import MeshExport
+from network import MeshFormat
+
+NUM_FACES		= 200000
+NUM_UV_LAYERS	= 2
+NUM_MATERIALS	= 4
+
+def normalised( vectors ):
+	return (vectors / numpy.linalg.norm( vectors, axis=1, keepdims=True )).astype( numpy.float32 )
+
+# Wavy quads grid (10 units wide), a third of it split in triangles, with
+# vertex colours, NUM_UV_LAYERS UV sets (tiling a few times) and NUM_MATERIALS materials
+def createMesh( numFaces ):
+	rng = numpy.random.default_rng( numFaces )
+	gridSize, x, y = createGrid( numFaces )
+	x = x * 10.0 / gridSize
+	y = y * 10.0 / gridSize
+	co = numpy.stack( (x, y, numpy.sin( x ) * numpy.cos( y * 0.7 )), axis=1 ).astype( numpy.float32 )
+	normal = normalised( rng.standard_normal( (len( co ), 3) ) )
+
+	vertsRaw = createQuads( numFaces, gridSize, triangles=True )
+	faceNormal = normalised( rng.standard_normal( (numFaces, 3) ) )
+
+	colours = {}
+	for i in range( 4 ):
+		colours['color%d' % (i + 1)] = rng.random( (numFaces, 3), dtype=numpy.float32 )
+	uvLayers = [rng.random( (numFaces, 8), dtype=numpy.float32 ) * 4.0 for i in range( NUM_UV_LAYERS )]
+
+	return createTessMesh( co, normal, vertsRaw, faceNormal, numpy.arange( numFaces ) % 2 == 0,
+						   numpy.arange( numFaces ) % NUM_MATERIALS, colours, uvLayers, NUM_MATERIALS )
+
+# Puts generateMessages' output back together in createSendBuffer's layout
+def joinMessages( messages ):
+	joined = bytearray( messages[0][1] )
+	for messageType, data in messages[1:-1]:
+		joined += data[struct.calcsize( '=lBI' ):]
+	joined += messages[-1][1][4:]
+	return joined
+
+# Same as VertexUtils::decodeOctNormal
+def decodeOctNormals( octNormals ):
+	oct = numpy.maximum( octNormals / 32767.0, -1.0 )
+	x = oct[:, 0]
+	y = oct[:, 1]
+	z = 1.0 - numpy.abs( x ) - numpy.abs( y )
+	lower = z < 0.0
+	foldedX = numpy.where( lower, (1.0 - numpy.abs( y )) * numpy.where( x >= 0.0, 1.0, -1.0 ), x )
+	foldedY = numpy.where( lower, (1.0 - numpy.abs( x )) * numpy.where( y >= 0.0, 1.0, -1.0 ), y )
+	return normalised( numpy.stack( (foldedX, foldedY, z), axis=1 ) )
+
+def maxAngle( normals, decodedNormals ):
+	dot = numpy.clip( (normals * decodedNormals).sum( axis=1 ), -1.0, 1.0 )
+	return math.degrees( numpy.arccos( dot ).max() )
+
+# What the server's vertex buffers hold per vertex (see DergoSystem::buildMesh),
+# with a colour and normal mapping
+def getGpuVertexSize( meshFormat ):
+	normalSize = 4 * 2 if meshFormat & MeshFormat.CompactNormals else 4 * 3 + 4 * 4
+	uvSize = 2 * 2 if meshFormat & MeshFormat.CompactUvs else 4 * 2
+	return 4 * 3 + normalSize + 4 + uvSize * NUM_UV_LAYERS
+
+mesh = createMesh( NUM_FACES )
+sections = MeshExport.readSections( mesh )
+faces, colours, uvs, rawVertices = sections
+print( '%d faces, %d raw vertices, %d UV sets' % (len( faces ), len( rawVertices ), len( uvs )) )
+print( '%18s %10s %10s %10s %10s %10s %10s %8s' %\
+	   ('Vertex format', 'Faces KB', 'Colour KB', 'UVs KB', 'Raw KB', 'Total KB', 'Encode ms', 'GPU B/v') )
+
+for vertexFormat in ('FULL', 'COMPACT', 'COMPACT_POSITIONS'):
+	meshFormat = MeshExport.VERTEX_FORMATS[vertexFormat]
+	encodeTime, (aabb, encoded) = timeIt( lambda: MeshExport.encodeSections( sections, meshFormat ) )
+	sizes = [encoded[0].nbytes, encoded[1].nbytes, sum( uv.nbytes for uv in encoded[2] ),
+			 encoded[3].nbytes]
+	message = MeshExport.createSendBuffer( 1, 'Mesh', mesh, 0, sections, meshFormat )
+	assert( message == joinMessages( list( MeshExport.generateMessages( 1, 'Mesh', mesh, 0,
+																		 sections=sections,
+																		 meshFormat=meshFormat ) ) ) )
+	print( '%18s %10.1f %10.1f %10.1f %10.1f %10.1f %10.1f %8d' %\
+		   ((vertexFormat,) + tuple( size / 1024.0 for size in sizes ) +
+		    (len( message ) / 1024.0, encodeTime * 1000.0, getGpuVertexSize( meshFormat ))) )
+	assert( MeshExport.getElementSizes( meshFormat ) ==
+			(encoded[0][0:1].nbytes, encoded[1][0:1].nbytes, encoded[2][0][0:1].nbytes,
+			 encoded[3][0:1].nbytes) )
+
+	if meshFormat == 0:
+		continue
+
+	# Decode like the server, compare with what it would get with floats
+	faceError = maxAngle( faces['normal'], decodeOctNormals( encoded[0]['normal'] ) )
+	normalError = maxAngle( rawVertices[:, 3:6], decodeOctNormals( encoded[3]['normal'] ) )
+	# Both end up as the same bytes in the vertex buffer (see VertexUtils::deindex)
+	serverColours = encoded[1].reshape( -1, 4, 4 )[:, :, 0:3] / numpy.float32( 255.0 )
+	serverColours = numpy.floor( serverColours * numpy.float32( 255.0 ) + numpy.float32( 0.5 ) )
+	floatColours = numpy.floor( colours.reshape( -1, 4, 3 ) * 255.0 + 0.5 )
+	colourErrors = numpy.count_nonzero( serverColours != floatColours )
+	uvError = max( numpy.abs( uv.astype( numpy.float32 ) - srcUv ).max()
+				   for uv, srcUv in zip( encoded[2], uvs ) )
+	positionError = 0.0
+	if meshFormat & MeshFormat.QuantizedPositions:
+		aabbMin = numpy.array( struct.unpack( '=6f', aabb )[0:3], dtype=numpy.float32 )
+		aabbMax = numpy.array( struct.unpack( '=6f', aabb )[3:6], dtype=numpy.float32 )
+		decoded = aabbMin + encoded[3]['position'] * ((aabbMax - aabbMin) / numpy.float32( 65535.0 ))
+		positionError = numpy.abs( decoded - rawVertices[:, 0:3] ).max()
+	print( '%18s face normals %.4f deg, normals %.4f deg, %d colours off, UVs %.5f, positions %.6f' %\
+		   ('', faceError, normalError, colourErrors, uvError, positionError) )
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+
+# Benchmark for payload compression: ratio vs. throughput of every codec and
+# level, for a typical Mesh message and a typical Result frame. "Effective"
+# is how fast the payload gets across each of LINK_BANDWIDTHS once compression,
+# transfer and decompression are added up (uncompressed goes at link speed).
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import math
+import random
+import struct
+import time
+
+from fake_bpy import FakeData
+from mesh_export import MeshExport
+from compression import *
+
+# Fast ethernet & Gigabit ethernet, in bytes per second
+LINK_BANDWIDTHS	= (100 * 1000 * 1000 / 8, 1000 * 1000 * 1000 / 8)
+GRID_SIZE		= 256						# Mesh is a GRID_SIZE x GRID_SIZE quads terrain
+FRAME_WIDTH		= 1920
+FRAME_HEIGHT	= 1080
+
+def createMesh():
+	random.seed( 1 )
+	vertices = []
+	for y in range( GRID_SIZE + 1 ):
+		for x in range( GRID_SIZE + 1 ):
+			height = math.sin( x * 0.1 ) * math.cos( y * 0.07 ) + random.random() * 0.01
+			vertices.append( FakeData( co=(x * 0.1, y * 0.1, height), normal=(0.0, 0.0, 1.0) ) )
+
+	faces = []
+	uvs = []
+	for y in range( GRID_SIZE ):
+		for x in range( GRID_SIZE ):
+			v0 = y * (GRID_SIZE + 1) + x
+			quad = (v0, v0 + 1, v0 + GRID_SIZE + 2, v0 + GRID_SIZE + 1)
+			uv = (x / GRID_SIZE, y / GRID_SIZE, (x + 1) / GRID_SIZE, y / GRID_SIZE,
+				  (x + 1) / GRID_SIZE, (y + 1) / GRID_SIZE, x / GRID_SIZE, (y + 1) / GRID_SIZE)
+			# Split a third of them in triangles, like a typical mixed mesh
+			if (x + y) % 3 == 0:
+				faces.append( FakeData( vertices_raw=(quad[0], quad[1], quad[2], 0),
+										vertices=quad[:3], normal=(0.0, 0.0, 1.0),
+										use_smooth=True, material_index=0 ) )
+				faces.append( FakeData( vertices_raw=(quad[0], quad[2], quad[3], 0),
+										vertices=(quad[0], quad[2], quad[3]), normal=(0.0, 0.0, 1.0),
+										use_smooth=True, material_index=0 ) )
+				uvs.append( FakeData( uv_raw=uv[:6] + (0.0, 0.0) ) )
+				uvs.append( FakeData( uv_raw=uv[:2] + uv[4:] + (0.0, 0.0) ) )
+			else:
+				faces.append( FakeData( vertices_raw=quad, vertices=quad, normal=(0.0, 0.0, 1.0),
+										use_smooth=True, material_index=0 ) )
+				uvs.append( FakeData( uv_raw=uv ) )
+
+	mesh = FakeData( tessfaces=faces, vertices=vertices, tessface_vertex_colors=[],
+					 tessface_uv_textures=[FakeData( data=uvs )], materials=[] )
+	return memoryview( MeshExport.createSendBuffer( 1, 'Terrain', mesh, 0 ) )
+
+# Sky gradient on top, flat ground below, and a noisy (textured) block
+def createFrame():
+	random.seed( 2 )
+	frame = bytearray( 4 + FRAME_WIDTH * FRAME_HEIGHT * 4 )
+	struct.pack_into( '=HH', frame, 0, FRAME_WIDTH, FRAME_HEIGHT )
+	rowSize = FRAME_WIDTH * 4
+	for y in range( FRAME_HEIGHT ):
+		if y < FRAME_HEIGHT // 2:
+			c = 255 - y * 128 // FRAME_HEIGHT
+			row = bytes( (c // 2, c * 3 // 4, c, 255) ) * FRAME_WIDTH
+		else:
+			row = bytes( (90, 80, 70, 255) ) * (FRAME_WIDTH // 2) +\
+				  random.randbytes( rowSize // 2 )
+		frame[4 + y * rowSize:4 + (y + 1) * rowSize] = row
+	return memoryview( frame )
+
+def run( name, payload ):
+	print( '%s: %.1f MB' % (name, payload.nbytes / (1024.0 * 1024.0)) )
+	linkNames = ''.join( ['%6.0f Mbit' % (bandwidth * 8 / 1000000.0) for bandwidth in LINK_BANDWIDTHS] )
+	print( '\t%-12s %5s %8s %12s %12s %s' %\
+		   ('Codec', 'Level', 'Ratio', 'Comp MB/s', 'Decomp MB/s', linkNames) )
+	print( '\t%-12s %5s %8.3f %12s %12s %s' %\
+		   ('Uncompressed', '-', 1.0, '-', '-',
+			''.join( ['%11.1f' % (bandwidth / (1024.0 * 1024.0)) for bandwidth in LINK_BANDWIDTHS] )) )
+
+	codecs = [('zlib', Codec.Zlib, (1, 3, 6, 9))]
+	if getSupportedCodecs() & (1 << Codec.Lz4):
+		codecs.append( ('lz4', Codec.Lz4, (1, 3, 9)) )
+	else:
+		print( '\t(lz4 module not found, skipping LZ4)' )
+
+	sizeMB = payload.nbytes / (1024.0 * 1024.0)
+	for codecName, codec, levels in codecs:
+		for level in levels:
+			startTime = time.perf_counter()
+			compressed = compress( codec, level, payload )
+			compressTime = time.perf_counter() - startTime
+			if compressed is None:
+				print( '\t%-12s %5d %8s' % (codecName, level, 'no gain') )
+				continue
+
+			startTime = time.perf_counter()
+			decompressed = decompress( compressed )
+			decompressTime = time.perf_counter() - startTime
+			assert( decompressed == payload )
+
+			effective = ''
+			for bandwidth in LINK_BANDWIDTHS:
+				totalTime = compressTime + len( compressed ) / bandwidth + decompressTime
+				effective += '%11.1f' % (sizeMB / totalTime)
+			print( '\t%-12s %5d %8.3f %12.1f %12.1f %s' %\
+				   (codecName, level, len( compressed ) / payload.nbytes, sizeMB / compressTime,
+					sizeMB / decompressTime, effective) )
+
+print( 'Effective MB/s over each link (higher is better)' )
+run( 'Mesh (%dx%d grid, 1 UV set)' % (GRID_SIZE, GRID_SIZE), createMesh() )
+run( 'Result frame (%dx%d)' % (FRAME_WIDTH, FRAME_HEIGHT), createFrame() )
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+
+# Benchmark for MeshExport.indexSections vs. the original DeindexMesh and
+# vertexArrayToBytes: time to build the vertices of a mesh, ready to send, and
+# the memory the deindexed vertices take (ExportVertex lists vs. one structured
+# array; measured with tracemalloc). DeindexMesh never welds vertices; the
+# vectorized one does, with numpy.unique. Both must give the same vertices:
+# the deindexed ones go through the welded ones' indices to compare them.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import tracemalloc
+
+import numpy
+
+from fake_bpy import FakeData, FakeCollection, createGrid, createQuads, timeIt
+from mesh_export import MeshExport
+
+FACE_COUNTS		= (10000, 100000)
+NUM_UV_LAYERS	= 2
+
+# Quads grid, a third of it split in triangles, half of it flat, with vertex
+# colours and NUM_UV_LAYERS UV sets. UVs are shared by neighbouring faces, so
+# vertices can be welded. DeindexMesh sees them with V mirrored, like the server.
+def createMesh( numFaces ):
+	rng = numpy.random.default_rng( numFaces )
+	gridSize, x, y = createGrid( numFaces )
+	numVertices = len( x )
+	co = numpy.stack( (x, y, numpy.sin( x * 0.1 )), axis=1 ).astype( numpy.float32 )
+	normal = rng.standard_normal( (numVertices, 3) ).astype( numpy.float32 )
+	normal /= numpy.linalg.norm( normal, axis=1, keepdims=True )
+	vertexUv = (co[:, 0:2] / gridSize).astype( numpy.float32 )
+	vertexColour = (rng.integers( 0, 256, (numVertices, 3) ) / 255.0).astype( numpy.float32 )
+
+	vertsRaw = createQuads( numFaces, gridSize, triangles=True )
+	faceNormals = numpy.tile( numpy.float32( [0, 0, 1] ), (numFaces, 1) )
+	useSmooth = numpy.arange( numFaces ) % 2 == 0
+	materialIndex = numpy.arange( numFaces ) % 3
+
+	numCorners = 3 + (vertsRaw[:, 3] != 0)
+	faceElements = [FakeData( vertices=tuple( vertsRaw[i, 0:numCorners[i]] ),
+							  normal=tuple( faceNormals[i] ), use_smooth=bool( useSmooth[i] ),
+							  material_index=int( materialIndex[i] ) ) for i in range( numFaces )]
+	tessfaces = FakeCollection( faceElements, vertices_raw=vertsRaw, normal=faceNormals,
+								use_smooth=useSmooth, material_index=materialIndex )
+	vertices = FakeCollection( [FakeData( co=tuple( co[i] ), normal=tuple( normal[i] ) )
+								for i in range( numVertices )], co=co, normal=normal )
+
+	colours = vertexColour[vertsRaw]
+	colourElements = [FakeData( **{ 'color%d' % (j + 1): tuple( colours[i, j] ) for j in range( 4 ) } )
+					  for i in range( numFaces )]
+	colourLayer = FakeData( data=FakeCollection( colourElements,
+												 **{ 'color%d' % (j + 1): colours[:, j]
+													 for j in range( 4 ) } ) )
+
+	uvLayers = []
+	for layer in range( NUM_UV_LAYERS ):
+		uvs = vertexUv[vertsRaw] * (layer + 1)
+		mirrored = uvs.copy()
+		mirrored[:, :, 1] = numpy.float32( 1.0 ) - mirrored[:, :, 1]
+		uvElements = [FakeData( **{ 'uv%d' % (j + 1): tuple( mirrored[i, j] ) for j in range( 4 ) } )
+					  for i in range( numFaces )]
+		uvLayers.append( FakeData( data=FakeCollection( uvElements, uv_raw=uvs ) ) )
+
+	return FakeData( tessfaces=tessfaces, vertices=vertices,
+					 tessface_vertex_colors=[colourLayer], tessface_uv_textures=uvLayers,
+					 materials=[] )
+
+def original( mesh ):
+	materialTable = []
+	return (MeshExport.vertexArrayToBytes( MeshExport.DeindexMesh( mesh, materialTable ) ),
+			materialTable)
+
+def vectorized( mesh ):
+	return MeshExport.indexSections( MeshExport.readSections( mesh ) )
+
+# Bytes still allocated by what function returns
+def measureMemory( function, mesh ):
+	tracemalloc.start()
+	retVal = function( mesh )
+	sizeBytes = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return sizeBytes
+
+print( '%8s %10s %12s %14s %12s %14s %8s' % ('Faces', 'Vertices', 'Original ms', 'Vectorized ms',
+											 'ExportVertex MB', 'Structured MB', 'Welded') )
+for numFaces in FACE_COUNTS:
+	mesh = createMesh( numFaces )
+	sections = MeshExport.readSections( mesh )
+	originalTime, (originalBytes, materialTable) = timeIt( lambda: original( mesh ) )
+	vectorizedTime, (vertices, indices, materialIds) = timeIt( lambda: vectorized( mesh ) )
+
+	assert( vertices[indices].tobytes() == bytes( originalBytes ) )
+	assert( materialIds.tolist() == materialTable )
+
+	originalSize = measureMemory( lambda mesh: MeshExport.DeindexMesh( mesh, [] ), mesh )
+	vectorizedSize = measureMemory( lambda mesh: MeshExport.deindexSections( sections ), mesh )
+
+	print( '%8d %10d %12.1f %14.1f %12.1f %14.1f %8d' % (numFaces, len( indices ),
+														 originalTime * 1000.0,
+														 vectorizedTime * 1000.0,
+														 originalSize / (1024.0 * 1024.0),
+														 vectorizedSize / (1024.0 * 1024.0),
+														 len( vertices )) )
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+# Benchmark for MeshIndexed (Capability.IndexedMeshes): how long it takes to build
+# a Mesh vs. a MeshIndexed message, how big they are, and how many vertices the
+# server ends up with. Mesh leaves deindexing & welding to the server (which doesn't
+# weld meshes with more than 40000 deindexed vertices); MeshIndexed comes welded.
+# MeshIndexed is parsed back the way DergoSystem::syncMeshIndexed does, and its
+# vertices put through its indices must be the deindexed ones.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import struct
+
+import numpy
+
+from fake_bpy import createGrid, createQuads, createTessMesh, timeIt
+from mesh_export import MeshExport
+
+FACE_COUNTS		= (1000, 10000, 100000, 500000)
+NUM_RUNS		= 3
+
+# Bumpy quads grid with one UV set, half of it flat
+def createMesh( numFaces ):
+	rng = numpy.random.default_rng( numFaces )
+	gridSize, x, y = createGrid( numFaces )
+	co = numpy.stack( (x, y, rng.random( len( x ) ) * 0.1), axis=1 ).astype( numpy.float32 )
+	normal = numpy.tile( numpy.float32( [0, 0, 1] ), (len( co ), 1) )
+
+	vertsRaw = createQuads( numFaces, gridSize )
+	uvs = co[vertsRaw][:, :, 0:2].reshape( -1, 8 ) / gridSize
+	return createTessMesh( co, normal, vertsRaw, numpy.tile( numpy.float32( [0, 0, 1] ), (numFaces, 1) ),
+						   numpy.arange( numFaces ) % 2 == 0,
+						   numpy.arange( numFaces, dtype=numpy.int32 ) % 2, uvLayers=[uvs], numMaterials=2 )
+
+# (vertices, indices, materials) of a MeshIndexed message
+def parseMeshIndexed( data ):
+	nameLength = struct.unpack_from( '=I', data, 4 )[0]
+	offset = 8 + nameLength
+	numVertices, numTriangles, meshFormat, numUvs, tangentUvSource = \
+		struct.unpack_from( '=II3B', data, offset )
+	offset += 11
+	numMaterials = struct.unpack_from( '=H', data, offset )[0]
+	offset += 2 + numMaterials * 4
+
+	vertexDtype = MeshExport.getVertexDtype( meshFormat & 1, numUvs )
+	indexType = numpy.uint32 if numVertices > 0xFFFF else numpy.uint16
+	assert( offset + numVertices * vertexDtype.itemsize + numTriangles * 3 *
+			numpy.dtype( indexType ).itemsize + numTriangles * 2 == len( data ) )
+
+	vertices = numpy.frombuffer( data, dtype=vertexDtype, count=numVertices, offset=offset )
+	offset += vertices.nbytes
+	indices = numpy.frombuffer( data, dtype=indexType, count=numTriangles * 3, offset=offset )
+	offset += indices.nbytes
+	materials = numpy.frombuffer( data, dtype=numpy.uint16, count=numTriangles, offset=offset )
+	assert( numpy.all( indices < numVertices ) )
+	return (vertices, indices, materials)
+
+print( '%8s %10s %14s %10s %14s %16s %16s' % ('Faces', 'Mesh ms', 'MeshIndexed ms', 'Mesh KB',
+											  'MeshIndexed KB', 'Server vertices', 'Indexed vertices') )
+for numFaces in FACE_COUNTS:
+	mesh = createMesh( numFaces )
+	sections = MeshExport.readSections( mesh )
+	meshTime, meshData = timeIt( lambda: MeshExport.createSendBuffer( 1, 'Mesh', mesh, 0, sections ),
+								 NUM_RUNS )
+	indexedTime, indexedData = timeIt( lambda: MeshExport.createSendBufferIndexed( 1, 'Mesh', mesh, 0,
+																				  sections ), NUM_RUNS )
+
+	vertices, indices, materials = parseMeshIndexed( indexedData )
+	deindexed, materialIds = MeshExport.deindexSections( sections )
+	assert( vertices[indices].tobytes() == deindexed.tobytes() )
+	assert( numpy.array_equal( materials, materialIds ) )
+
+	# What the server has after DeindexTask & shrinkVertexBuffer
+	serverVertices = len( deindexed ) if len( deindexed ) >= 40000 else len( vertices )
+	print( '%8d %10.1f %14.1f %10.1f %14.1f %16d %16d' % (numFaces, meshTime * 1000.0,
+														  indexedTime * 1000.0,
+														  len( meshData ) / 1024.0,
+														  len( indexedData ) / 1024.0,
+														  serverVertices, len( vertices )) )
+
+print( 'MeshIndexed matches the deindexed mesh' )
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+# Benchmark for MeshDiskCache: time to export a scene the first time (nothing on
+# disk), and again in a new session (everything on disk), as Engine.uploadMesh
+# does: read each mesh, hash it, then get its messages. Messages go to a sink
+# that compresses them like Network.sendPayload (unless they came compressed),
+# so the network itself isn't measured. Also checks that the messages read
+# back are the same as the ones generated, and that eviction keeps the cache
+# within its size.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import os
+import tempfile
+
+import numpy
+
+from compression import Codec
+from fake_bpy import FakeData, FakeCollection, createGrid, createQuads, createTessMesh, timeIt
+from mesh_disk_cache import MeshDiskCache
+from mesh_export import MeshExport
+from network import Network, Capability
+
+NUM_OBJECTS		= 2000
+FACES_PER_MESH	= (1000, 20000)
+CAPABILITIES	= Capability.ChunkedMeshes | Capability.VertexUpdates | \
+				  Capability.CompactVertexFormats | Capability.SoaMeshes
+MAX_BYTES		= 1024 * 1024 * 1024
+
+# Bumpy quads grid with one UV set
+def createMesh( numFaces, seed ):
+	rng = numpy.random.default_rng( seed )
+	gridSize, x, y = createGrid( numFaces )
+	co = numpy.stack( (x, y, rng.random( len( x ) ) * 0.1), axis=1 ).astype( numpy.float32 )
+	normal = numpy.tile( numpy.float32( [0, 0, 1] ), (len( co ), 1) )
+
+	vertsRaw = createQuads( numFaces, gridSize )
+	uvs = co[vertsRaw][:, :, 0:2].reshape( -1, 8 ) / gridSize
+	return createTessMesh( co, normal, vertsRaw, numpy.tile( numpy.float32( [0, 0, 1] ), (numFaces, 1) ),
+						   numpy.ones( numFaces, dtype=bool ), numpy.zeros( numFaces, dtype=numpy.int32 ),
+						   uvLayers=[uvs], numMaterials=1 )
+
+# Stands for Network.sendData: compresses what didn't come compressed
+class Sink:
+	def __init__( self, network ):
+		self.network = network
+		self.numBytes = 0
+		self.messages = []
+
+	def sendData( self, messageType, data, compressed=None ):
+		if compressed is None:
+			compressed = self.network.compressPayload( messageType, data )
+		self.numBytes += len( compressed ) if compressed is not None else len( data )
+		self.messages.append( (messageType, bytes( data )) )
+
+def export( network, sink, meshes, diskCache ):
+	for meshId, mesh in enumerate( meshes ):
+		sections = MeshExport.readSections( mesh )
+		topology = MeshExport.computeTopology( mesh, sections, 0 )
+		digest = MeshExport.computeDigest( topology, sections )
+		if diskCache is None:
+			messages = MeshExport.generateUpload( meshId, 'Mesh', mesh, 0, network.capabilities,
+												  sections )
+		else:
+			messages = diskCache.getUpload( network, digest, meshId, 'Mesh', mesh, 0, sections, 0 )
+		for message in messages:
+			sink.sendData( *message )
+
+print( '%d objects' % NUM_OBJECTS )
+print( '%8s %12s %10s %10s %10s %10s' % ('Faces', 'Compression', 'No cache s', 'Cold s', 'Warm s',
+										 'Disk MB') )
+
+for codec, codecName in ((Codec.Uncompressed, 'None'), (Codec.Zlib, 'Zlib 1')):
+	network = Network()
+	network.capabilities = CAPABILITIES
+	network.compressionCodec = codec
+	for numFaces in FACES_PER_MESH:
+		# As many different meshes as objects: the MeshCache would catch the rest
+		shape = createMesh( numFaces, 0 )
+		meshes = []
+		for i in range( NUM_OBJECTS * 1000 // numFaces ):
+			co = shape.vertices.arrays['co'].copy()
+			co[:, 2] += i
+			meshes.append( FakeData( tessfaces=shape.tessfaces,
+									 vertices=FakeCollection( co=co,
+															  normal=shape.vertices.arrays['normal'] ),
+									 tessface_vertex_colors=[],
+									 tessface_uv_textures=shape.tessface_uv_textures,
+									 materials=shape.materials ) )
+
+		with tempfile.TemporaryDirectory() as directory:
+			sink = Sink( network )
+			noCacheTime, unused = timeIt( lambda: export( network, sink, meshes, None ) )
+			expected = sink.messages
+
+			sink = Sink( network )
+			diskCache = MeshDiskCache( directory, MAX_BYTES )
+			coldTime, unused = timeIt( lambda: export( network, sink, meshes, diskCache ) )
+			assert( sink.messages == expected )
+
+			# Next session
+			sink = Sink( network )
+			diskCache = MeshDiskCache( directory, MAX_BYTES )
+			warmTime, unused = timeIt( lambda: export( network, sink, meshes, diskCache ) )
+			assert( sink.messages == expected )
+			assert( diskCache.numMisses == 0 )
+
+			print( '%8d %12s %10.2f %10.2f %10.2f %10.1f' % (numFaces, codecName, noCacheTime,
+															 coldTime, warmTime,
+															 diskCache.sizeBytes / (1024.0 * 1024.0)) )
+			sink = None
+
+			# Only the most recently used half fits
+			sizeBytes = diskCache.sizeBytes
+			diskCache = MeshDiskCache( directory, sizeBytes // 2 )
+			assert( diskCache.sizeBytes <= sizeBytes // 2 )
+			assert( sum( entry.stat().st_size for entry in os.scandir( directory ) ) ==
+					diskCache.sizeBytes )
+			diskCache = None
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+# Benchmark for MeshExportPipeline: time to export a scene with 1,000 and 10,000
+# mesh objects (e.g. right after loading a file), one by one on the main thread
+# as Engine.uploadMesh does, vs. reading them on the main thread and leaving the
+# hashing, encoding and compression to the pipeline as Engine.queueMeshUpload
+# does. Messages go to a sink that compresses them like Network.sendPayload
+# (unless the pipeline already did), so the network itself isn't measured.
+# Speed ups depend on the number of cores: run it on the machine it matters for.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import os
+
+import numpy
+
+from compression import Codec
+from fake_bpy import createGrid, createQuads, createTessMesh, timeIt
+from mesh_export import MeshExport, MeshSnapshot
+from mesh_pipeline import MeshExportPipeline
+from network import Network, Capability
+
+NUM_OBJECTS		= (1000, 10000)
+FACES_PER_MESH	= 1000
+NUM_SHAPES		= 16
+NUM_THREADS		= (2, 4, 8)
+CAPABILITIES	= Capability.ChunkedMeshes | Capability.VertexUpdates | \
+				  Capability.CompactVertexFormats | Capability.SoaMeshes
+
+# Bumpy quads grid with one UV set
+def createMesh( numFaces, seed ):
+	rng = numpy.random.default_rng( seed )
+	gridSize, x, y = createGrid( numFaces )
+	co = numpy.stack( (x, y, rng.random( len( x ) ) * 0.1), axis=1 ).astype( numpy.float32 )
+	normal = numpy.tile( numpy.float32( [0, 0, 1] ), (len( co ), 1) )
+
+	vertsRaw = createQuads( numFaces, gridSize )
+	uvs = co[vertsRaw][:, :, 0:2].reshape( -1, 8 ) / gridSize
+	return createTessMesh( co, normal, vertsRaw, numpy.tile( numpy.float32( [0, 0, 1] ), (numFaces, 1) ),
+						   numpy.ones( numFaces, dtype=bool ), numpy.zeros( numFaces, dtype=numpy.int32 ),
+						   uvLayers=[uvs], numMaterials=1 )
+
+# Stands for Network.sendData: compresses what the pipeline didn't
+class Sink:
+	def __init__( self, network ):
+		self.network = network
+		self.numBytes = 0
+
+	def sendData( self, messageType, data, compressed=None ):
+		if compressed is None:
+			compressed = self.network.compressPayload( messageType, data )
+		self.numBytes += len( compressed ) if compressed is not None else len( data )
+
+def exportSequential( network, sink, meshes ):
+	for meshId, mesh in enumerate( meshes ):
+		sections = MeshExport.readSections( mesh )
+		topology = MeshExport.computeTopology( mesh, sections, 0 )
+		MeshExport.computeDigest( topology, sections )
+		for messageType, data in MeshExport.generateUpload( meshId, 'Mesh', mesh, 0,
+															network.capabilities, sections ):
+			sink.sendData( messageType, data )
+
+def exportPipelined( network, sink, meshes, pipeline ):
+	def sendMessages( result ):
+		topology, digest, messages = result
+		for message in messages:
+			sink.sendData( *message )
+
+	for meshId, mesh in enumerate( meshes ):
+		sections = MeshExport.readSections( mesh )
+		pipeline.submit( sendMessages, MeshExportPipeline.prepareUpload, network, None, meshId,
+						 'Mesh', MeshSnapshot( mesh ), sections, 0, 0, None )
+	pipeline.finish()
+
+shapes = [createMesh( FACES_PER_MESH, i ) for i in range( NUM_SHAPES )]
+print( '%d cores, %d faces per mesh' % (os.cpu_count(), FACES_PER_MESH) )
+print( '%8s %12s %12s %s' % ('Objects', 'Compression', 'Serial s',
+							 '  '.join( '%2d threads s' % numThreads for numThreads in NUM_THREADS )) )
+
+for codec, codecName in ((Codec.Uncompressed, 'None'), (Codec.Zlib, 'Zlib 1')):
+	network = Network()
+	network.capabilities = CAPABILITIES
+	network.compressionCodec = codec
+	for numObjects in NUM_OBJECTS:
+		meshes = [shapes[i % NUM_SHAPES] for i in range( numObjects )]
+		sink = Sink( network )
+		serialTime, unused = timeIt( lambda: exportSequential( network, sink, meshes ) )
+		serialBytes = sink.numBytes
+
+		pipelineTimes = []
+		for numThreads in NUM_THREADS:
+			pipeline = MeshExportPipeline( numThreads )
+			sink = Sink( network )
+			pipelineTime, unused = timeIt( lambda: exportPipelined( network, sink, meshes, pipeline ) )
+			pipelineTimes.append( pipelineTime )
+			pipeline.shutdown()
+			assert( sink.numBytes == serialBytes )
+
+		print( '%8d %12s %12.2f %s' % (numObjects, codecName, serialTime,
+									   '  '.join( '%12.2f' % pipelineTime
+												  for pipelineTime in pipelineTimes )) )
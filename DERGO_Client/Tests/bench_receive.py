@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+# Micro-benchmark for Network.receiveData: throughput (MB/s) when the server
+# sends back-to-back FromServer.Result frames (Full HD, RGBA8).
+# Compares against the old receive path, which sliced (i.e. copied) the
+# stream after every message.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import socket
+import struct
+import threading
+import time
+
+from network import  *
+
+WIDTH		= 1920
+HEIGHT		= 1080
+NUM_FRAMES	= 64
+
+class CallbackObj:
+	def __init__( self ):
+		self.numResults = 0
+		self.numBytes = 0
+
+	def processMessage( self, header_sizeBytes, header_messageType, data ):
+		if header_messageType == FromServer.Result:
+			resolution = struct.unpack_from( '=HH', data )
+			self.numResults += 1
+			self.numBytes += header_sizeBytes
+
+# The receive path before the ring buffer, kept here as a baseline.
+class OldNetwork( Network ):
+	def __init__( self ):
+		Network.__init__( self )
+		self.stream = bytearray()
+
+	def receiveData( self, callbackObj ):
+		chunk = self.socket.recv( 8192 * 1024 )
+		if chunk == b'':
+			raise ConnectionError( "socket connection broken" )
+
+		self.stream.extend( chunk )
+
+		remainingBytes = len( self.stream )
+
+		while remainingBytes >= self.HEADER_SIZE:
+			header = self.headerStruct.unpack_from( memoryview( self.stream ) )
+			header_sizeBytes	= header[0]
+			header_messageType	= header[1]
+
+			if header_sizeBytes > remainingBytes - self.HEADER_SIZE:
+				break;
+
+			callbackObj.processMessage( header_sizeBytes, header_messageType,
+										self.stream[self.HEADER_SIZE:(self.HEADER_SIZE + header_sizeBytes)] )
+
+			remainingBytes -= self.HEADER_SIZE
+			remainingBytes -= header_sizeBytes
+
+			self.stream = self.stream[(self.HEADER_SIZE + header_sizeBytes):]
+
+def sendFrames( sock ):
+	payload = bytearray( 4 + WIDTH * HEIGHT * 4 )
+	struct.pack_into( '=HH', payload, 0, WIDTH, HEIGHT )
+	header = struct.pack( '=IB', len( payload ), FromServer.Result )
+	for i in range( NUM_FRAMES ):
+		sock.sendall( header )
+		sock.sendall( payload )
+
+def run( networkClass ):
+	serverSock, clientSock = socket.socketpair()
+	clientSock.setsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024 )
+
+	n = networkClass()
+	n.useSockets( clientSock )
+	callbackObj = CallbackObj()
+
+	sender = threading.Thread( target=sendFrames, args=(serverSock,) )
+	startTime = time.perf_counter()
+	sender.start()
+	while callbackObj.numResults < NUM_FRAMES:
+		n.receiveData( callbackObj )
+	elapsed = time.perf_counter() - startTime
+	sender.join()
+
+	serverSock.close()
+	clientSock.close()
+
+	return callbackObj.numBytes / (1024.0 * 1024.0) / elapsed
+
+print( '%d Result frames of %dx%d' % (NUM_FRAMES, WIDTH, HEIGHT) )
+print( 'Old receive path:  %8.1f MB/s' % run( OldNetwork ) )
+print( 'Ring buffer:       %8.1f MB/s' % run( Network ) )
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+
+# Benchmark for reconnecting: a scene is uploaded to the stand-in server
+# (see standin_server.py), the server is restarted, and the client
+# reconnects. Compares replaying the payload cache against exporting every
+# mesh again (what Engine.reset() would cause), and checks the new server
+# ends up with exactly what the old one got.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+	sys.path.append(path.dirname(path.abspath(__file__)))
+
+import struct
+import time
+
+from fake_bpy import FakeData
+from mesh_export import MeshExport
+from network import  *
+from payload_cache import PayloadCache
+from standin_server import StandinServer
+
+NUM_MESHES		= 200
+GRID_SIZE		= 64		# Every mesh is a GRID_SIZE x GRID_SIZE quads grid
+ITEMS_PER_MESH	= 4
+NUM_LIGHTS		= 50
+NUM_MATERIALS	= 20
+
+def createMesh( seed ):
+	vertices = []
+	for y in range( GRID_SIZE + 1 ):
+		for x in range( GRID_SIZE + 1 ):
+			vertices.append( FakeData( co=(x * 0.1, y * 0.1, (x * y + seed) % 7 * 0.01),
+									   normal=(0.0, 0.0, 1.0) ) )
+	faces = []
+	uvs = []
+	for y in range( GRID_SIZE ):
+		for x in range( GRID_SIZE ):
+			v0 = y * (GRID_SIZE + 1) + x
+			quad = (v0, v0 + 1, v0 + GRID_SIZE + 2, v0 + GRID_SIZE + 1)
+			faces.append( FakeData( vertices_raw=quad, vertices=quad, normal=(0.0, 0.0, 1.0),
+									use_smooth=True, material_index=0 ) )
+			uvs.append( FakeData( uv_raw=(0.0, 0.0, 1.0, 0.0, 1.0, 1.0, 0.0, 1.0) ) )
+	return FakeData( tessfaces=faces, vertices=vertices, tessface_vertex_colors=[],
+					 tessface_uv_textures=[FakeData( data=uvs )], materials=[] )
+
+# Sends the whole scene, like Engine.syncScene after a reset.
+# Returns how long exporting the meshes took.
+def exportScene( n, meshes ):
+	exportTime = 0.0
+	n.sendData( FromClient.Reset, None )
+	for matId in range( 1, NUM_MATERIALS + 1 ):
+		n.sendData( FromClient.Material, struct.pack( '=l', matId ) + bytes( 300 ) )
+	for meshId, mesh in enumerate( meshes, 1 ):
+		startTime = time.perf_counter()
+		messages = list( MeshExport.generateUpload( meshId, 'Mesh%d' % meshId, mesh, 255,
+													n.capabilities ) )
+		exportTime += time.perf_counter() - startTime
+		for messageType, data in messages:
+			n.sendData( messageType, data )
+		for i in range( ITEMS_PER_MESH ):
+			itemId = meshId * ITEMS_PER_MESH + i
+			n.sendData( FromClient.Item, struct.pack( '=llI10f', meshId, itemId, 0,
+													  *([float( i )] * 10) ) )
+	for lightId in range( 1, NUM_LIGHTS + 1 ):
+		n.sendData( FromClient.Light, struct.pack( '=lI', 100000 + lightId, 0 ) + bytes( 60 ) )
+	# Some get removed; the replay must not bring them back
+	n.sendData( FromClient.ItemRemove, struct.pack( '=ll', 1, ITEMS_PER_MESH ) )
+	n.sendData( FromClient.LightRemove, struct.pack( '=l', 100001 ) )
+	n.sendData( FromClient.WorldParams, bytes( 80 ) )
+	return exportTime
+
+# Waits for the server to have processed everything we sent
+def sync( n ):
+	class CallbackObj:
+		def __init__( self ):
+			self.answered = False
+		def processMessage( self, header_sizeBytes, header_messageType, data ):
+			if header_messageType == FromServer.ConnectionTest:
+				self.answered = True
+	while sum( [c.sendQueueBytes for c in n.channels] ) > 0:
+		time.sleep( 0.001 )
+	callbackObj = CallbackObj()
+	n.sendData( FromClient.ConnectionTest, b'\0' )
+	while not callbackObj.answered:
+		n.receiveData( callbackObj )
+
+def getCounts( server ):
+	session = server.session
+	with session.lock:
+		return (list( session.messageCounts ), list( session.messageBytes ))
+
+def run( threaded, maxSizeBytes=None ):
+	meshes = [createMesh( i ) for i in range( NUM_MESHES )]
+
+	server = StandinServer( 0, verbose=False )
+	port = server.port
+	n = Network()
+	n.payloadCache = PayloadCache( maxSizeBytes )
+	n.connect( TcpTransport( '127.0.0.1', port ) )
+	if threaded:
+		n.startThreads()
+
+	startTime = time.perf_counter()
+	exportTime = exportScene( n, meshes )
+	sync( n )
+	uploadTime = time.perf_counter() - startTime
+
+	# What a fresh server should end up with: no removals (they were applied)
+	# and nothing that was removed.
+	expected = StandinServer( 0, verbose=False )
+	e = Network()
+	e.connect( TcpTransport( '127.0.0.1', expected.port ) )
+	e.sendData( FromClient.Reset, None )
+	for messageType, payload in n.payloadCache.generateReplay():
+		e.sendData( messageType, payload )
+	sync( e )
+	expectedCounts = getCounts( expected )
+	e.disconnect()
+	expected.close()
+
+	# Restart the server
+	server.close()
+	time.sleep( 0.1 )
+	try:
+		sync( n )
+	except ConnectionError:
+		pass
+	assert( not n.connected )
+	server = StandinServer( port, verbose=False )
+
+	startTime = time.perf_counter()
+	while not n.tryReconnect():
+		time.sleep( 0.01 )
+	sync( n )
+	reconnectTime = time.perf_counter() - startTime
+
+	counts = getCounts( server )
+	n.disconnect()
+	server.close()
+
+	print( '%-9s %s' % ('Threaded' if threaded else 'Direct', n.payloadCache.getStats()) )
+	print( '\tinitial upload %8.1f ms (mesh export alone %8.1f ms)' %\
+		   (uploadTime * 1000.0, exportTime * 1000.0) )
+	print( '\treconnect + replay %8.1f ms, %d attempts. Server state matches: %s' %\
+		   (reconnectTime * 1000.0, n.numReconnectAttempts, counts == expectedCounts) )
+	if n.payloadCache.overflowed:
+		print( '\tcache overflowed its %.0f MB cap: the scene must be exported again' %\
+			   (maxSizeBytes / (1024.0 * 1024.0)) )
+
+print( '%d meshes of %dx%d quads, %d items, %d lights, %d materials' %\
+	   (NUM_MESHES, GRID_SIZE, GRID_SIZE, NUM_MESHES * ITEMS_PER_MESH, NUM_LIGHTS, NUM_MATERIALS) )
+run( False )
+run( True )
+run( True, 16 * 1024 * 1024 )
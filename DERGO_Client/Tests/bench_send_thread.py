@@ -0,0 +1,89 @@
+#!/usr/bin/python
+
+# Micro-benchmark for Network's threaded mode: how long the calling (UI)
+# thread is blocked while uploading a big mesh to a server that can't keep
+# up, and how long a Render request sent right after it takes to arrive.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import socket
+import struct
+import threading
+import time
+
+from network import  *
+
+MESH_SIZE			= 200 * 1024 * 1024
+SERVER_BANDWIDTH	= 1024 * 1024 * 1024	# Bytes per second the fake server can process
+
+# Reads as fast as SERVER_BANDWIDTH allows, and records when Render arrives.
+class FakeServer:
+	def __init__( self, sock ):
+		self.sock = sock
+		self.renderArrivalTime = None
+		self.renderArrived = threading.Event()
+		self.thread = threading.Thread( target=self.run )
+		self.thread.start()
+
+	def run( self ):
+		headerStruct = struct.Struct( '=IB' )
+		stream = bytearray()
+		startTime = time.perf_counter()
+		totalBytes = 0
+		while True:
+			chunk = self.sock.recv( 4 * 1024 * 1024 )
+			if not chunk:
+				break
+			totalBytes += len( chunk )
+			stream.extend( chunk )
+			while len( stream ) >= 5:
+				sizeBytes, messageType = headerStruct.unpack_from( stream )
+				if len( stream ) < 5 + sizeBytes:
+					break
+				if messageType == FromClient.Render:
+					self.renderArrivalTime = time.perf_counter()
+					self.renderArrived.set()
+				del stream[:5 + sizeBytes]
+			# Pretend processing takes time
+			expectedTime = totalBytes / SERVER_BANDWIDTH
+			elapsed = time.perf_counter() - startTime
+			if expectedTime > elapsed:
+				time.sleep( expectedTime - elapsed )
+
+def run( threaded ):
+	clientSock, serverSock = socket.socketpair()
+	server = FakeServer( serverSock )
+
+	n = Network()
+	n.useSockets( clientSock )
+	if threaded:
+		n.startThreads()
+
+	mesh = bytearray( MESH_SIZE )
+
+	startTime = time.perf_counter()
+	n.sendData( FromClient.Mesh, mesh )
+	meshBlockTime = time.perf_counter() - startTime
+
+	renderSendTime = time.perf_counter()
+	n.sendData( FromClient.Render, bytes( 64 ) )
+	renderBlockTime = time.perf_counter() - renderSendTime
+
+	# Disconnecting drops whatever is still queued
+	server.renderArrived.wait()
+	n.disconnect()
+	server.thread.join()
+	serverSock.close()
+
+	print( '%-9s sendData(Mesh) blocked %8.2f ms, sendData(Render) blocked %8.2f ms, '\
+		   'Render arrived after %8.2f ms' %\
+		   ('Threaded' if threaded else 'Direct', meshBlockTime * 1000.0, renderBlockTime * 1000.0,
+			(server.renderArrivalTime - renderSendTime) * 1000.0) )
+
+print( '%d MB mesh upload, server processes %d MB/s' %\
+	   (MESH_SIZE / (1024 * 1024), SERVER_BANDWIDTH / (1024 * 1024)) )
+run( False )
+run( True )
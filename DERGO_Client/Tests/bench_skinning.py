@@ -0,0 +1,183 @@
+#!/usr/bin/python
+
+# Benchmark for server-side skinning (see skinning.py): what a playing
+# animation costs per frame when every character is exported again (the
+# evaluated mesh as a MeshVertexUpdate, or as a whole Mesh without vertex
+# updates) vs. sending only its bone matrices (MeshSkinPose).
+# Also checks the matrices, applied to the MeshSkin data the way the server
+# does (VertexUtils::skin), give what Blender's Armature modifier gives.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import math
+import struct
+
+import numpy
+
+from fake_bpy import FakeData, FakeCollection, createQuadLoopTriangles, timeIt
+from mesh_export import MeshExport
+from skinning import Skinning, SKIN_VERTEX_DTYPE
+
+NUM_CHARACTERS	= 24
+RINGS			= 100		# Every character is a RINGS x SEGMENTS quads tube
+SEGMENTS		= 50
+NUM_BONES		= 20		# Chained along the tube
+NUM_FRAMES		= 10
+
+# Blender's matrices are column major
+def toBlender( matrices ):
+	return numpy.ascontiguousarray( matrices.transpose( 0, 2, 1 ), dtype=numpy.float32 )
+
+def translation( x ):
+	matrix = numpy.identity( 4 )
+	matrix[0, 3] = x
+	return matrix
+
+def rotationZ( angle ):
+	matrix = numpy.identity( 4 )
+	matrix[0:2, 0:2] = ((math.cos( angle ), -math.sin( angle )), (math.sin( angle ), math.cos( angle )))
+	return matrix
+
+# Tube along X made of quads split in loop triangles, every vertex weighted
+# to the two closest bones
+def createCharacter():
+	ringX = numpy.arange( RINGS + 1 ) / RINGS * NUM_BONES
+	angles = numpy.arange( SEGMENTS ) / SEGMENTS * 2.0 * math.pi
+	x = numpy.repeat( ringX, SEGMENTS )
+	co = numpy.stack( (x, numpy.tile( numpy.cos( angles ), RINGS + 1 ),
+					   numpy.tile( numpy.sin( angles ), RINGS + 1 )), axis=1 ).astype( numpy.float32 )
+	normal = co * numpy.float32( (0.0, 1.0, 1.0) )
+	numVertices = len( co )
+
+	ring, segment = numpy.divmod( numpy.arange( RINGS * SEGMENTS ), SEGMENTS )
+	v0 = ring * SEGMENTS + segment
+	v1 = ring * SEGMENTS + (segment + 1) % SEGMENTS
+	polygons = numpy.stack( (v0, v1, v1 + SEGMENTS, v0 + SEGMENTS), axis=1 )
+	loopVertices = polygons.reshape( -1 ).astype( numpy.int32 )
+	loopTriangles = createQuadLoopTriangles( len( polygons ) )
+
+	boneX = numpy.clip( x - 0.5, 0.0, NUM_BONES - 1.0 )
+	firstBone = numpy.minimum( boneX.astype( int ), NUM_BONES - 2 )
+	secondWeight = boneX - firstBone
+	vertices = []
+	for i in range( numVertices ):
+		groups = [FakeData( group=int( firstBone[i] ), weight=float( 1.0 - secondWeight[i] ) ),
+				  FakeData( group=int( firstBone[i] + 1 ), weight=float( secondWeight[i] ) )]
+		vertices.append( FakeData( groups=groups ) )
+
+	numTriangles = len( loopTriangles )
+	return FakeData(
+		loop_triangles=FakeCollection( loops=loopTriangles,
+									   normal=numpy.zeros( (numTriangles, 3), dtype=numpy.float32 ),
+									   material_index=numpy.zeros( numTriangles, dtype=numpy.int32 ) ),
+		loops=FakeCollection( vertex_index=loopVertices, normal=normal[loopVertices] ),
+		vertices=FakeCollection( vertices, co=co, normal=normal ),
+		color_attributes=FakeData( active_color=None ), uv_layers=[], materials=[],
+		shape_keys=None, calc_loop_triangles=lambda: None )
+
+# Bones chained along X, listed in reverse in the pose (like Blender may do)
+def createArmature():
+	bones = [FakeData( name='Bone%d' % i, use_deform=True ) for i in range( NUM_BONES )]
+	restMatrices = numpy.stack( [translation( i ) for i in range( NUM_BONES )] )
+	poseBones = [FakeData( name=bone.name ) for bone in reversed( bones )]
+	armatureObject = FakeData( matrix_world=translation( 0.5 ).tolist(),
+							   data=FakeData( bones=FakeCollection( bones ) ),
+							   pose=FakeData( bones=FakeCollection( poseBones ) ) )
+	armatureObject.data.bones.arrays['matrix_local'] = toBlender( restMatrices )
+	return (armatureObject, restMatrices)
+
+# Bends every joint by the same angle. Returns the pose matrices (in bone order)
+def setPose( armatureObject, restMatrices, angle ):
+	poseMatrices = []
+	parentMatrix = numpy.identity( 4 )
+	for i in range( NUM_BONES ):
+		localMatrix = numpy.linalg.inv( restMatrices[i - 1] ) @ restMatrices[i] if i > 0 else restMatrices[0]
+		parentMatrix = parentMatrix @ localMatrix @ rotationZ( angle )
+		poseMatrices.append( parentMatrix )
+	poseMatrices = numpy.stack( poseMatrices )
+	armatureObject.pose.bones.arrays['matrix'] = toBlender( poseMatrices[::-1] )
+	return poseMatrices
+
+# What Blender's Armature modifier does with the object's vertices
+def deformLikeBlender( object, armatureObject, mesh, restMatrices, poseMatrices ):
+	toArmature = numpy.linalg.inv( numpy.array( armatureObject.matrix_world ) ) @ \
+				 numpy.array( object.matrix_world )
+	co = numpy.c_[mesh.vertices.arrays['co'], numpy.ones( len( mesh.vertices ) )]
+	co = co @ toArmature.T
+	deformed = numpy.zeros_like( co )
+	totalWeight = numpy.zeros( len( co ) )
+	for vertexIdx, vertex in enumerate( mesh.vertices ):
+		for group in vertex.groups:
+			boneMatrix = poseMatrices[group.group] @ numpy.linalg.inv( restMatrices[group.group] )
+			deformed[vertexIdx] += group.weight * (boneMatrix @ co[vertexIdx])
+			totalWeight[vertexIdx] += group.weight
+	deformed /= totalWeight[:, numpy.newaxis]
+	return (deformed @ numpy.linalg.inv( toArmature ).T)[:, 0:3]
+
+# Same as VertexUtils::skin, with the MeshSkin and MeshSkinPose payloads
+def skinLikeServer( skinPayload, poseData ):
+	meshId, numRawVertices, numBones = struct.unpack_from( '=lIH', skinPayload )
+	skinVertices = numpy.frombuffer( skinPayload, dtype=SKIN_VERTEX_DTYPE, offset=10 )
+	boneMatrices = numpy.frombuffer( poseData, dtype=numpy.float32, offset=6 ).reshape( -1, 3, 4 )
+	weights = skinVertices['weights']
+	blended = numpy.einsum( 'vw,vwij->vij', weights, boneMatrices[skinVertices['boneIndices']] )
+	blended /= weights.sum( axis=1 )[:, numpy.newaxis, numpy.newaxis]
+	rest = skinVertices['rawVertex']
+	return numpy.einsum( 'vij,vj->vi', blended[:, :, 0:3], rest[:, 0:3] ) + blended[:, :, 3]
+
+mesh = createCharacter()
+armatureObject, restMatrices = createArmature()
+object = FakeData( data=mesh, matrix_world=(translation( 2.0 ) @ rotationZ( 0.3 )).tolist(),
+				   vertex_groups=[FakeData( name='Bone%d' % i ) for i in range( NUM_BONES )],
+				   modifiers=[FakeData( type='ARMATURE', object=armatureObject, show_viewport=True,
+										use_vertex_groups=True, use_bone_envelopes=False,
+										use_deform_preserve_volume=False, vertex_group='' )] )
+assert( Skinning.getArmature( object ) is armatureObject )
+
+# Sent once: the rest pose and the skin
+sections = MeshExport.readSections( mesh )
+meshBytes = sum( len( data ) for messageType, data in
+				 MeshExport.generateUpload( 1, 'Character', mesh, 255, 0, sections ) )
+skinTime, (messageType, skinPayload) = timeIt(
+	lambda: Skinning.createSkin( 1, object, mesh, armatureObject, sections[3] ) )
+
+# What Blender would give us as the evaluated mesh, every frame
+poseMatrices = setPose( armatureObject, restMatrices, 0.15 )
+deformedCo = deformLikeBlender( object, armatureObject, mesh, restMatrices, poseMatrices ).astype( numpy.float32 )
+evaluatedMesh = createCharacter()
+evaluatedMesh.vertices.arrays['co'] = deformedCo
+
+messageType, poseData = Skinning.createSkinPose( 1, object, armatureObject )
+loopVertices = mesh.loops.arrays['vertex_index']
+maxError = numpy.abs( skinLikeServer( skinPayload, poseData ) - deformedCo[loopVertices] ).max()
+
+evaluatedTime = 0.0
+poseTime = 0.0
+for frame in range( NUM_FRAMES ):
+	setPose( armatureObject, restMatrices, 0.15 * math.sin( frame ) )
+	for character in range( NUM_CHARACTERS ):
+		def exportEvaluated():
+			frameSections = MeshExport.readSections( evaluatedMesh )
+			topology = MeshExport.computeTopology( evaluatedMesh, frameSections, 255 )
+			MeshExport.computeDigest( topology, frameSections )
+			return MeshExport.createVertexUpdate( 1, frameSections )
+		elapsed, (messageType, vertexUpdate) = timeIt( exportEvaluated )
+		evaluatedTime += elapsed
+		elapsed, (messageType, poseData) = timeIt(
+			lambda: Skinning.createSkinPose( 1, object, armatureObject ) )
+		poseTime += elapsed
+
+print( '%d characters of %d triangles (%d raw vertices), %d bones' %\
+	   (NUM_CHARACTERS, len( mesh.loop_triangles ), len( mesh.loops ), NUM_BONES) )
+print( 'Once per character: Mesh %.1f KB + MeshSkin %.1f KB (built in %.1f ms)' %\
+	   (meshBytes / 1024.0, len( skinPayload ) / 1024.0, skinTime * 1000.0) )
+print( 'Per frame, all characters:' )
+print( '\twhole Mesh        %8.1f KB' % (meshBytes * NUM_CHARACTERS / 1024.0) )
+print( '\tMeshVertexUpdate  %8.1f KB %8.2f ms' %\
+	   (len( vertexUpdate ) * NUM_CHARACTERS / 1024.0, evaluatedTime * 1000.0 / NUM_FRAMES) )
+print( '\tMeshSkinPose      %8.1f KB %8.2f ms' %\
+	   (len( poseData ) * NUM_CHARACTERS / 1024.0, poseTime * 1000.0 / NUM_FRAMES) )
+print( 'Max error vs. Blender\'s Armature modifier: %g' % maxError )
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+# Benchmark for MeshV2 (Capability.SoaMeshes): how long it takes to build a
+# Mesh vs. a MeshV2 message, and how big they are, for each vertex format.
+# MeshV2 is parsed back the way DergoSystem::syncMeshV2 does (section table,
+# then one array per section) and checked against the Mesh message, and so
+# are its MeshChunk messages.
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import struct
+
+import numpy
+
+from fake_bpy import createGrid, createQuads, createTessMesh, timeIt
+from mesh_export import MeshExport
+from network import FromClient, MeshSection, MeshFormat
+
+NUM_FACES		= 200000
+NUM_UV_LAYERS	= 2
+NUM_MATERIALS	= 4
+NUM_RUNS		= 5
+
+# Quads grid, a third of it split in triangles, with vertex colours,
+# NUM_UV_LAYERS UV sets and NUM_MATERIALS materials
+def createMesh( numFaces ):
+	rng = numpy.random.default_rng( numFaces )
+	gridSize, x, y = createGrid( numFaces )
+	co = numpy.stack( (x, y, numpy.sin( x * 0.1 )), axis=1 ).astype( numpy.float32 )
+	normal = rng.standard_normal( (len( co ), 3) ).astype( numpy.float32 )
+	normal /= numpy.linalg.norm( normal, axis=1, keepdims=True )
+
+	vertsRaw = createQuads( numFaces, gridSize, triangles=True )
+	faceNormal = numpy.tile( numpy.float32( [0, 0, 1] ), (numFaces, 1) )
+
+	colours = {}
+	for i in range( 4 ):
+		colours['color%d' % (i + 1)] = rng.random( (numFaces, 3), dtype=numpy.float32 )
+	uvLayers = [rng.random( (numFaces, 8), dtype=numpy.float32 ) for i in range( NUM_UV_LAYERS )]
+
+	return createTessMesh( co, normal, vertsRaw, faceNormal, numpy.arange( numFaces ) % 2 == 0,
+						   numpy.arange( numFaces ) % NUM_MATERIALS, colours, uvLayers, NUM_MATERIALS )
+
+# Bytes of every section of a MeshV2 message, like DergoSystem::syncMeshV2 reads
+# them. Returns (header up to the AABB, material table, { section: bytes })
+def parseMeshV2( data, meshFormat ):
+	nameLength = struct.unpack_from( '=I', data, 4 )[0]
+	offset = 8 + nameLength + 4 + 4 + 3
+	if meshFormat & MeshFormat.QuantizedPositions:
+		offset += 6 * 4
+	header = data[0:offset]
+
+	numMaterials = struct.unpack_from( '=H', data, offset )[0]
+	materialTable = data[offset:offset + 2 + numMaterials * 4]
+	offset += 2 + numMaterials * 4
+
+	numSections = data[offset]
+	offset += 1
+	sections = {}
+	for i in range( numSections ):
+		section, sectionOffset, sizeBytes = struct.unpack_from( '=BII', data, offset + i * 9 )
+		assert( sectionOffset % MeshExport.SOA_ALIGNMENT == 0 )
+		assert( sectionOffset + sizeBytes <= len( data ) )
+		sections[section] = data[sectionOffset:sectionOffset + sizeBytes]
+	return (header, materialTable, sections)
+
+# Mesh message with the faces put back together from the MeshV2's sections
+def soaToMesh( data, numFaces, hasColour, numUvs, meshFormat ):
+	header, materialTable, sections = parseMeshV2( data, meshFormat )
+	normalType = (numpy.int16, 2) if meshFormat & MeshFormat.CompactNormals else (numpy.float32, 3)
+	faces = numpy.empty( numFaces, dtype=[('vertices', numpy.uint32, 4), ('normal',) + normalType,
+										  ('flags', numpy.uint16), ('numVertices', numpy.uint8)] )
+	faces['vertices'] = numpy.frombuffer( sections[MeshSection.FaceIndices],
+										  dtype=numpy.uint32 ).reshape( -1, 4 )
+	faces['normal'] = numpy.frombuffer( sections[MeshSection.FaceNormals],
+										dtype=normalType[0] ).reshape( -1, normalType[1] )
+	flags = numpy.frombuffer( sections[MeshSection.FaceFlags], dtype=numpy.uint8 )
+	faces['flags'] = numpy.frombuffer( sections[MeshSection.FaceMaterials], dtype=numpy.uint16 ) | \
+					 ((flags.astype( numpy.uint16 ) >> 7) << 15)
+	faces['numVertices'] = flags & 0x7F
+
+	retVal = bytearray( header )
+	retVal += faces.tobytes()
+	if hasColour:
+		retVal += sections[MeshSection.FaceColours]
+	if numUvs:
+		retVal += sections[MeshSection.FaceUvs]
+	retVal += sections[MeshSection.RawVertices]
+	retVal += materialTable
+	return retVal
+
+# Puts MeshChunk messages of one mesh back into one buffer per section
+def joinChunks( messages, elementSizes ):
+	sections = {}
+	for messageType, data in messages:
+		if messageType != FromClient.MeshChunk:
+			continue
+		meshId, section, firstElement = struct.unpack_from( '=lBI', data )
+		chunk = bytes( data[9:] )
+		buffer = sections.setdefault( section, bytearray() )
+		start = firstElement * elementSizes[section]
+		assert( len( buffer ) == start )
+		buffer += chunk
+	return sections
+
+mesh = createMesh( NUM_FACES )
+sections = MeshExport.readSections( mesh )
+numFaces = len( sections[0] )
+print( '%d faces, %d raw vertices, %d UV sets' % (numFaces, len( sections[3] ), NUM_UV_LAYERS) )
+print( '%18s %12s %12s %10s %10s %10s' % ('Vertex format', 'Mesh ms', 'MeshV2 ms', 'Mesh KB',
+										  'MeshV2 KB', 'Padding B') )
+
+for vertexFormat in ('FULL', 'COMPACT', 'COMPACT_POSITIONS'):
+	meshFormat = MeshExport.VERTEX_FORMATS[vertexFormat]
+	meshTime, meshData = timeIt( lambda: MeshExport.createSendBuffer( 1, 'Mesh', mesh, 0, sections,
+																	   meshFormat ), NUM_RUNS )
+	soaTime, soaData = timeIt( lambda: MeshExport.createSendBufferSoa( 1, 'Mesh', mesh, 0, sections,
+																	   meshFormat ), NUM_RUNS )
+	# Section table is 1 + 9 bytes per section; the rest is padding
+	numSections = 4 + 1 + 1 + 1
+	padding = len( soaData ) - len( meshData ) - 1 - numSections * 9
+	print( '%18s %12.2f %12.2f %10.1f %10.1f %10d' % (vertexFormat, meshTime * 1000.0,
+													  soaTime * 1000.0, len( meshData ) / 1024.0,
+													  len( soaData ) / 1024.0, padding) )
+
+	assert( soaToMesh( soaData, numFaces, True, NUM_UV_LAYERS, meshFormat ) == meshData )
+
+	# Chunked: faces field by field must hold the same as the MeshV2 sections
+	aabb, encoded = MeshExport.encodeSections( sections, meshFormat )
+	elementSizes = { section: arrays[0][0:1].nbytes
+					 for section, arrays in MeshExport.getSectionArrays( encoded, soa=True ) }
+	chunks = joinChunks( MeshExport.generateMessages( 1, 'Mesh', mesh, 0, sections=sections,
+													  meshFormat=meshFormat, soa=True ),
+						 elementSizes )
+	assert( chunks == parseMeshV2( soaData, meshFormat )[2] )
+
+print( 'MeshV2 matches Mesh and the chunked upload' )
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+# Stand-ins for the bpy data the benchmarks export, so they run outside Blender.
+# Meshes are built from NumPy arrays: foreach_get copies them like Blender does,
+# and iterating a collection hands out one wrapper per element (FakeElement)
+# unless the elements are given.
+
+import math
+import time
+
+import numpy
+
+class FakeData:
+	def __init__( self, **kwargs ):
+		self.__dict__.update( kwargs )
+
+# One element of a FakeCollection, reading its attributes from the arrays
+class FakeElement:
+	__slots__ = ('arrays', 'index')
+
+	def __init__( self, arrays, index ):
+		self.arrays = arrays
+		self.index = index
+
+	def __getattr__( self, name ):
+		if name == 'vertices':
+			# MeshTessFace.vertices: 3 corners if it's a triangle
+			vertsRaw = self.arrays['vertices_raw'][self.index].tolist()
+			return vertsRaw if vertsRaw[3] != 0 else vertsRaw[:3]
+		return self.arrays[name][self.index].tolist()
+
+# Just enough of bpy's collections: len, iteration, indexing, foreach_get and find
+class FakeCollection:
+	def __init__( self, elements=None, **arrays ):
+		self.arrays = arrays
+		self.elements = elements
+		self.length = len( elements ) if elements is not None else len( next( iter( arrays.values() ) ) )
+
+	def __len__( self ):
+		return self.length
+
+	def __getitem__( self, index ):
+		if self.elements is not None:
+			return self.elements[index]
+		return FakeElement( self.arrays, index )
+
+	def __iter__( self ):
+		if self.elements is not None:
+			return iter( self.elements )
+		return (FakeElement( self.arrays, i ) for i in range( self.length ))
+
+	def foreach_get( self, name, out ):
+		out[...] = self.arrays[name].reshape( -1 )
+
+	def find( self, name ):
+		for i, element in enumerate( self.elements ):
+			if element.name == name:
+				return i
+		return -1
+
+# Grid of gridSize x gridSize quads, the smallest that fits numFaces.
+# Returns gridSize and the (x, y) coordinates, in quads, of its vertices
+def createGrid( numFaces ):
+	gridSize = int( math.ceil( math.sqrt( numFaces ) ) )
+	numVertices = (gridSize + 1) * (gridSize + 1)
+	y, x = numpy.divmod( numpy.arange( numVertices ), gridSize + 1 )
+	return (gridSize, x, y)
+
+# Corners of the first numFaces quads of the grid, row by row (as
+# MeshTessFace.vertices_raw). With triangles, every third one is a triangle
+def createQuads( numFaces, gridSize, triangles=False ):
+	y, x = numpy.divmod( numpy.arange( numFaces ), gridSize )
+	v0 = y * (gridSize + 1) + x
+	vertsRaw = numpy.stack( (v0, v0 + 1, v0 + gridSize + 2, v0 + gridSize + 1),
+							axis=1 ).astype( numpy.uint32 )
+	if triangles:
+		vertsRaw[::3, 3] = 0
+	return vertsRaw
+
+# Loops of the two triangles of every quad (as MeshLoopTriangle.loops), for
+# quads whose 4 loops are consecutive
+def createQuadLoopTriangles( numQuads ):
+	loopStart = numpy.arange( numQuads ) * 4
+	return numpy.concatenate( (numpy.stack( (loopStart, loopStart + 1, loopStart + 2), axis=1 ),
+							   numpy.stack( (loopStart, loopStart + 2, loopStart + 3), axis=1 )) )
+
+# Blender 2.7x mesh (tessfaces). colours are the color1..color4 arrays of its
+# only vertex colour layer (None for no layer), uvLayers the uv_raw array of
+# each UV layer. Material i + 1 has dergo.id == i + 1
+def createTessMesh( co, normal, vertsRaw, faceNormal, useSmooth, materialIndex,
+					colours=None, uvLayers=(), numMaterials=0 ):
+	tessfaces = FakeCollection( vertices_raw=vertsRaw, normal=faceNormal, use_smooth=useSmooth,
+								material_index=materialIndex )
+	vertexColours = [FakeData( data=FakeCollection( **colours ) )] if colours is not None else []
+	return FakeData( tessfaces=tessfaces, vertices=FakeCollection( co=co, normal=normal ),
+					 tessface_vertex_colors=vertexColours,
+					 tessface_uv_textures=[FakeData( data=FakeCollection( uv_raw=uvRaw ) )
+										   for uvRaw in uvLayers],
+					 materials=[FakeData( dergo=FakeData( id=i + 1 ) ) for i in range( numMaterials )] )
+
+# Returns (best time of numRuns calls, what the last call returned)
+def timeIt( function, numRuns=1 ):
+	bestTime = None
+	for i in range( numRuns ):
+		startTime = time.perf_counter()
+		retVal = function()
+		elapsed = time.perf_counter() - startTime
+		bestTime = elapsed if bestTime is None else min( bestTime, elapsed )
+	return (bestTime, retVal)
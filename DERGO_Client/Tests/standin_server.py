@@ -0,0 +1,406 @@
+#!/usr/bin/python
+
+# Stand-in for DERGO_Server, for testing the client's networking without
+# Ogre. Speaks the same protocol over TCP, Unix sockets and shared memory:
+#	* Answers ConnectionTest.
+#	* Answers Render (when returnResult is set) with a gradient Result frame.
+#	* Reads uploads from the shared memory ring, like the real server.
+#	* Counts every other message, and prints the totals on disconnect.
+#	* Accepts the client's second (bulk) channel, and keeps scene messages
+#	  in order across channels, like the real server.
+#	* Decompresses what the client compresses, and compresses Results if asked.
+#	* Answers the Handshake with the same capabilities as the real server.
+#
+# Usage: standin_server.py [--port 9995] [--unix /tmp/dergo.sock]
+
+# Make imports work in Python IDLE
+if __name__ == '__main__' and __package__ is None:
+	from os import sys, path
+	sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import argparse
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from network import  *
+import compression
+
+try:
+	from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+	shared_memory = None
+
+# Everything the real server keeps for its (single) client: the shared
+# memory segments, what arrived through each channel, and the deferral of
+# ordered messages across channels (see NetworkSystem::processIncomingMessage).
+# Connections run on their own threads, but process messages holding
+# self.lock, just like the real server is single-threaded. Like the real
+# server, the bulk channel lets the interactive one go first between messages.
+class StandinSession:
+	# Must match NetworkSystem::isOrderedMessage
+	UNORDERED_MESSAGES = Network.UNORDERED_MESSAGES
+
+	def __init__( self, verbose=True, processingBandwidth=None ):
+		self.verbose = verbose
+		# Bytes per second; when set, processing Mesh & Texture takes time
+		self.processingBandwidth = processingBandwidth
+		self.lock = threading.RLock()
+		# Set while the interactive connection waits for self.lock
+		self.interactivePending = threading.Event()
+		self.interactiveDone = threading.Condition( self.lock )
+		self.connections = []
+		self.reset()
+
+	# Same as NetworkSystem::getLocalCapabilities & DergoSystem::getCapabilities
+	@staticmethod
+	def getLocalCapabilities():
+		retVal = Capability.ChunkedMeshes | Capability.BulkChannel | Capability.VertexUpdates | \
+				 Capability.Skinning | Capability.CompactVertexFormats | Capability.SoaMeshes | \
+				 Capability.IndexedMeshes | Capability.ClientTangents | Capability.VertexOptimization
+		if shared_memory is not None:
+			retVal |= Capability.SharedMemory
+		for codec, capability in Capability.CODECS.items():
+			if compression.getSupportedCodecs() & (1 << codec):
+				retVal |= capability
+		return retVal
+
+	def reset( self ):
+		self.uploadSegment = None
+		self.uploadCapacity = 0
+		self.resultSegment = None
+		self.resultSize = 0
+		self.resultSequence = 0
+		self.messageCounts = [0] * FromClient.NumClientMessages
+		self.messageBytes = [0] * FromClient.NumClientMessages
+		self.lastResult = None
+		self.resultCodec = Codec.Uncompressed
+		self.resultCompressionLevel = 1
+		self.resultCompressionThreshold = 0
+		self.capabilities = 0
+		# Per channel: connection, numProcessed, waitForOther, deferred messages
+		self.channels = [ { 'connection': None, 'numProcessed': 0, 'waitForOther': 0,
+							'deferred': deque() } for i in range( 2 ) ]
+
+	@staticmethod
+	def openSegment( name ):
+		segment = shared_memory.SharedMemory( name=name )
+		try:
+			# The client owns it; don't let our resource tracker unlink it.
+			resource_tracker.unregister( segment._name, 'shared_memory' )
+		except Exception:
+			pass
+		return segment
+
+	def addConnection( self, connection ):
+		with self.lock:
+			self.connections.append( connection )
+			if self.channels[Channel.Interactive]['connection'] is None:
+				self.channels[Channel.Interactive]['connection'] = connection
+
+	# Replies always go through the interactive channel
+	def send( self, messageType, data, connection ):
+		interactive = self.channels[Channel.Interactive]['connection']
+		( interactive or connection ).send( messageType, data )
+
+	# Called by the bulk connection (holding self.lock) before each message.
+	# See NetworkSystem::yieldBulkChannel
+	def yieldToInteractive( self ):
+		while self.interactivePending.is_set():
+			self.interactiveDone.wait()
+
+	def isChannelBlocked( self, channelIdx ):
+		return self.channels[1 - channelIdx]['numProcessed'] < self.channels[channelIdx]['waitForOther']
+
+	def processIncomingMessage( self, connection, messageType, data ):
+		if messageType >= FromClient.NumClientMessages:
+			raise RuntimeError( 'Message type is higher than NumClientMessages. Message is corrupt!!!' )
+
+		if messageType == FromClient.ChannelInit:
+			channelIdx = data[0]
+			for channel in self.channels:
+				if channel['connection'] is connection:
+					channel['connection'] = None
+			connection.channel = channelIdx
+			self.channels[channelIdx]['connection'] = connection
+			return
+
+		if messageType in StandinSession.UNORDERED_MESSAGES and messageType != FromClient.Barrier:
+			self.processMessage( connection, messageType, data )
+			return
+
+		channel = self.channels[connection.channel]
+		if not channel['deferred']:
+			if messageType == FromClient.Barrier:
+				channel['waitForOther'] = struct.unpack_from( '=I', data )[0]
+				return
+			if not self.isChannelBlocked( connection.channel ):
+				self.processMessage( connection, messageType, data )
+				channel['numProcessed'] += 1
+				return
+
+		channel['deferred'].append( (messageType, bytes( data )) )
+
+	def processDeferredMessages( self ):
+		madeProgress = True
+		while madeProgress:
+			madeProgress = False
+			for channelIdx in range( 2 ):
+				channel = self.channels[channelIdx]
+				while channel['deferred']:
+					messageType, data = channel['deferred'][0]
+					if messageType == FromClient.Barrier:
+						channel['waitForOther'] = struct.unpack_from( '=I', data )[0]
+					elif self.isChannelBlocked( channelIdx ):
+						break
+					else:
+						self.processMessage( channel['connection'], messageType, memoryview( data ) )
+						channel['numProcessed'] += 1
+						madeProgress = True
+					channel['deferred'].popleft()
+
+	def processMessage( self, connection, messageType, data ):
+		if messageType == FromClient.SharedMemoryInit:
+			offset = 0
+			names = []
+			for i in range( 2 ):
+				strLength = struct.unpack_from( '=I', data, offset )[0]
+				offset += 4
+				name = bytes( data[offset:offset + strLength] ).decode( 'utf-8' )
+				offset += strLength
+				sizeBytes = struct.unpack_from( '=I', data, offset )[0]
+				offset += 4
+				names.append( (name, sizeBytes) )
+			self.uploadSegment = StandinSession.openSegment( names[0][0] )
+			self.uploadCapacity = names[0][1] - SharedMemoryRing.HEADER_SIZE
+			self.resultSegment = StandinSession.openSegment( names[1][0] )
+			self.resultSize = names[1][1]
+			if self.verbose:
+				print( 'Using shared memory: %s (%d bytes), %s (%d bytes)' %\
+					   (names[0][0], names[0][1], names[1][0], names[1][1]) )
+			return
+
+		if messageType == FromClient.Handshake:
+			clientVersion, clientCapabilities = struct.unpack_from( '=II', data )
+			localCapabilities = StandinSession.getLocalCapabilities()
+			if clientVersion == PROTOCOL_VERSION:
+				self.capabilities = clientCapabilities & localCapabilities
+			else:
+				self.capabilities = 0
+			# Through the same connection, which may not be the interactive channel yet
+			connection.send( FromServer.Handshake,
+							 struct.pack( '=II', PROTOCOL_VERSION, localCapabilities ) )
+			return
+
+		if messageType == FromClient.CompressionInit:
+			resultCodec, self.resultCompressionLevel, self.resultCompressionThreshold = \
+				struct.unpack_from( '=2BI', data )
+			if self.capabilities & Capability.CODECS.get( resultCodec, 0 ):
+				self.resultCodec = resultCodec
+			return
+
+		if messageType == FromClient.SharedMemoryData:
+			realType, startPos, sizeBytes = struct.unpack_from( '=BQI', data )
+			offset = SharedMemoryRing.HEADER_SIZE + startPos % self.uploadCapacity
+			realData = self.uploadSegment.buf[offset:offset + sizeBytes]
+			self.processMessage( connection, realType, realData )
+			realData.release()
+			struct.pack_into( '=Q', self.uploadSegment.buf, 0, startPos + sizeBytes )
+			return
+
+		self.messageCounts[messageType] += 1
+		self.messageBytes[messageType] += data.nbytes
+
+		if messageType == FromClient.ConnectionTest:
+			print( bytes( data ).decode( 'latin-1' ) )
+			self.send( FromServer.ConnectionTest, b'Hello you too\0', connection )
+		elif messageType == FromClient.Render:
+			returnResult, windowId, width, height = struct.unpack_from( '=BQHH', data )
+			if returnResult:
+				self.sendResult( width, height, connection )
+		elif messageType in (FromClient.Mesh, FromClient.MeshV2, FromClient.MeshIndexed,
+							 FromClient.MeshChunk, FromClient.Texture) and \
+				self.processingBandwidth:
+			time.sleep( data.nbytes / self.processingBandwidth )
+
+	def sendResult( self, width, height, connection ):
+		if self.lastResult is None or len( self.lastResult ) != 4 + width * height * 4:
+			frame = bytearray( 4 + width * height * 4 )
+			struct.pack_into( '=HH', frame, 0, width, height )
+			row = bytes( [(x * 255 // max( width - 1, 1 )) for x in range( width ) for c in range( 4 )] )
+			for y in range( height ):
+				frame[4 + y * width * 4:4 + (y + 1) * width * 4] = row
+			self.lastResult = frame
+
+		if self.resultSegment and \
+				len( self.lastResult ) <= SharedMemoryTransport.getResultSlotSize( self.resultSize ):
+			self.resultSequence += 1
+			slotOffset = SharedMemoryTransport.getResultSlotOffset( self.resultSize, self.resultSequence )
+			struct.pack_into( '=Q', self.resultSegment.buf, (self.resultSequence & 1) * 8, 0 )
+			self.resultSegment.buf[slotOffset:slotOffset + len( self.lastResult )] = self.lastResult
+			struct.pack_into( '=Q', self.resultSegment.buf, (self.resultSequence & 1) * 8,
+							  self.resultSequence )
+			self.send( FromServer.SharedMemoryResult,
+					   struct.pack( '=QI', self.resultSequence, len( self.lastResult ) ), connection )
+		else:
+			if self.resultCodec != Codec.Uncompressed and \
+					len( self.lastResult ) >= self.resultCompressionThreshold:
+				compressed = compression.compress( self.resultCodec, self.resultCompressionLevel,
+												   memoryview( self.lastResult ) )
+				if compressed is not None:
+					self.send( FromServer.Result | Network.COMPRESSED_FLAG, compressed, connection )
+					return
+			self.send( FromServer.Result, self.lastResult, connection )
+
+	def connectionClosed( self, connection ):
+		with self.lock:
+			self.connections.remove( connection )
+			for channel in self.channels:
+				if channel['connection'] is connection:
+					channel['connection'] = None
+			if self.connections:
+				return
+
+			for segment in (self.uploadSegment, self.resultSegment):
+				if segment:
+					segment.close()
+
+			if self.verbose:
+				print( 'Connection closed. Messages received:' )
+				for messageType in range( FromClient.NumClientMessages ):
+					if self.messageCounts[messageType]:
+						print( '\ttype %2d: %8d messages, %12d bytes' %\
+							   (messageType, self.messageCounts[messageType],
+							   self.messageBytes[messageType]) )
+			self.reset()
+
+class StandinConnection:
+	def __init__( self, sock, session ):
+		self.sock = sock
+		self.session = session
+		self.channel = Channel.Interactive
+		self.headerStruct = struct.Struct( '=IB' )
+		self.sendLock = threading.Lock()
+
+	def send( self, messageType, data ):
+		with self.sendLock:
+			self.sock.sendall( self.headerStruct.pack( len( data ), messageType ) + bytes( data ) )
+
+	def run( self ):
+		self.session.addConnection( self )
+		stream = bytearray()
+		try:
+			while True:
+				chunk = self.sock.recv( 4 * 1024 * 1024 )
+				if not chunk:
+					break
+				stream.extend( chunk )
+				offset = 0
+				interactive = self.channel == Channel.Interactive
+				if interactive:
+					self.session.interactivePending.set()
+				with self.session.lock:
+					if interactive:
+						self.session.interactivePending.clear()
+					while len( stream ) - offset >= 5:
+						if self.channel == Channel.Bulk:
+							self.session.yieldToInteractive()
+						sizeBytes, messageType = self.headerStruct.unpack_from( stream, offset )
+						if len( stream ) - offset - 5 < sizeBytes:
+							break
+						data = memoryview( stream )[offset + 5:offset + 5 + sizeBytes]
+						if messageType & Network.COMPRESSED_FLAG:
+							data.release()
+							data = memoryview( compression.decompress(
+												stream[offset + 5:offset + 5 + sizeBytes] ) )
+							messageType &= ~Network.COMPRESSED_FLAG
+						self.session.processIncomingMessage( self, messageType, data )
+						data.release()
+						offset += 5 + sizeBytes
+					# New data in this channel may have unblocked the other one
+					self.session.processDeferredMessages()
+					if interactive:
+						self.session.interactiveDone.notify_all()
+				del stream[:offset]
+		except ConnectionError:
+			pass
+		finally:
+			self.sock.close()
+			self.session.connectionClosed( self )
+
+# Listens on the given port and (if not None) Unix socket path.
+# Every connection is served on its own thread, but they all belong to the
+# same client session.
+class StandinServer:
+	def __init__( self, port=Network.DEFAULT_PORT, unixPath=None, verbose=True,
+				  processingBandwidth=None ):
+		self.session = StandinSession( verbose, processingBandwidth )
+		self.listeners = []
+
+		tcpSock = socket.socket()
+		tcpSock.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+		tcpSock.bind( ('', port) )
+		tcpSock.listen( 4 )
+		self.listeners.append( tcpSock )
+		self.port = tcpSock.getsockname()[1]
+
+		self.unixPath = unixPath
+		if unixPath:
+			if os.path.exists( unixPath ):
+				os.unlink( unixPath )
+			unixSock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+			unixSock.bind( unixPath )
+			unixSock.listen( 4 )
+			self.listeners.append( unixSock )
+
+		self.threads = [threading.Thread( target=self.acceptLoop, args=(sock,), daemon=True )
+						for sock in self.listeners]
+		for thread in self.threads:
+			thread.start()
+
+	def acceptLoop( self, listenSock ):
+		while True:
+			try:
+				sock, address = listenSock.accept()
+			except OSError:
+				return
+			if sock.family != socket.AF_UNIX:
+				# Like the real server. See NetworkSystem::_listener_cb
+				sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+			connection = StandinConnection( sock, self.session )
+			threading.Thread( target=connection.run, daemon=True ).start()
+
+	# Stops listening and drops the clients, like the real server exiting
+	def close( self ):
+		for sock in self.listeners:
+			# Wakes up acceptLoop; otherwise the port stays taken until it returns
+			try:
+				sock.shutdown( socket.SHUT_RDWR )
+			except OSError:
+				pass
+			sock.close()
+		if self.unixPath and os.path.exists( self.unixPath ):
+			os.unlink( self.unixPath )
+		with self.session.lock:
+			for connection in self.session.connections:
+				try:
+					connection.sock.shutdown( socket.SHUT_RDWR )
+				except OSError:
+					pass
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser( description='DERGO stand-in server' )
+	parser.add_argument( '--port', type=int, default=Network.DEFAULT_PORT )
+	parser.add_argument( '--unix', default=None, help='Also listen on this Unix socket path' )
+	args = parser.parse_args()
+
+	server = StandinServer( args.port, args.unix )
+	print( 'Listening on port %d%s' % (server.port, (' and ' + args.unix) if args.unix else '') )
+	try:
+		while True:
+			time.sleep( 1 )
+	except KeyboardInterrupt:
+		server.close()
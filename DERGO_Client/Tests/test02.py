@@ -10,7 +10,7 @@ from mesh_export import  *
 
 class CallbackObj:
 	def processMessage( self, header_sizeBytes, header_messageType, data ):
-		print( data.decode('latin-1') )
+		print( bytes( data ).decode('latin-1') )
 
 exportVertexArray = []
 
@@ -111,17 +111,26 @@ class DergoRenderEngine(bpy.types.RenderEngine):
 
 		self.renderedView = False
 		
+		if not engine.dergo.isConnected():
+			return
+
 		size_x = int(context.region.width)
 		size_y = int(context.region.height)
-		engine.dergo.sendViewRenderRequest( context, context.area, context.region_data,\
-											True, size_x, size_y )
-		
-		while not self.renderedView:
-			engine.dergo.network.receiveData( self )
+		try:
+			engine.dergo.sendViewRenderRequest( context, context.area, context.region_data,\
+												True, size_x, size_y )
+			
+			while not self.renderedView:
+				engine.dergo.network.receiveData( self )
+		except ConnectionError:
+			return
 		#context.area.tag_redraw()
 
 	def processMessage( self, header_sizeBytes, header_messageType, data ):
-		if header_messageType == FromServer.Result:
+		if engine.dergo.processMessage( header_sizeBytes, header_messageType, data ):
+			# Can't touch Blender data while drawing. Do it in view_update
+			self.tag_update()
+		elif header_messageType == FromServer.Result:
 			self.renderedView = True
 			resolution = struct.unpack_from( '=HH', memoryview( data ) )
 			imageSizeBytes = resolution[0] * resolution[1] * 4
@@ -186,6 +195,7 @@ classes = (
 	Dergo_PT_material_detail3,
 	Dergo_PT_material_emissive,
 	Dergo_PT_mesh,
+	Dergo_PT_network,
 	#DergoTexturePanel,
 	DergoTexture_PT_context,
 	DergoTexture_PT_dergo,
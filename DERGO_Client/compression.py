@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+import struct
+import zlib
+
+try:
+	import lz4.block
+except ImportError:
+	lz4 = None
+
+# Must match Network::Codec in the server's Compression.h
+class Codec:
+	Uncompressed, \
+	Zlib, \
+	Lz4, \
+	NumCodecs = range( 4 )
+
+# Compressed payloads start with uint8 codec, uint32 uncompressedSize
+PAYLOAD_HEADER = struct.Struct( "=BI" )
+
+# Bitmask of (1 << Codec) we can encode and decode
+def getSupportedCodecs():
+	supportedCodecs = 1 << Codec.Zlib
+	if lz4 is not None:
+		supportedCodecs |= 1 << Codec.Lz4
+	return supportedCodecs
+
+# Returns the compressed payload (header included), or None if it
+# didn't get any smaller, in which case it should be sent as is.
+# level goes from 1 (fastest) to 9 (smallest) for every codec.
+def compress( codec, level, payload ):
+	if codec == Codec.Zlib:
+		compressed = zlib.compress( payload, level )
+	elif codec == Codec.Lz4:
+		# Level 1 is plain LZ4, anything above uses LZ4 HC at that level
+		if level > 1:
+			compressed = lz4.block.compress( payload, mode='high_compression', compression=level,
+											 store_size=False )
+		else:
+			compressed = lz4.block.compress( payload, store_size=False )
+	else:
+		raise ValueError( "Unknown codec %d" % codec )
+
+	if PAYLOAD_HEADER.size + len( compressed ) >= payload.nbytes:
+		return None
+
+	return PAYLOAD_HEADER.pack( codec, payload.nbytes ) + compressed
+
+# Returns the original payload of what compress() returned
+def decompress( payload ):
+	codec, uncompressedSize = PAYLOAD_HEADER.unpack_from( payload )
+	compressed = payload[PAYLOAD_HEADER.size:]
+	if codec == Codec.Zlib:
+		data = zlib.decompress( compressed, bufsize=uncompressedSize )
+	elif codec == Codec.Lz4 and lz4 is not None:
+		data = lz4.block.decompress( compressed, uncompressed_size=uncompressedSize )
+	else:
+		raise RuntimeError( "Compressed message uses an unknown codec. Message is corrupt!!!" )
+
+	if len( data ) != uncompressedSize:
+		raise RuntimeError( "Could not decompress message. Message is corrupt!!!" )
+	return data
@@ -3,9 +3,16 @@ import bpy
 import bgl
 import mathutils
 import ctypes
+import os
+import time
 
-from .mesh_export import MeshExport
+from .mesh_cache import MeshCache
+from .mesh_disk_cache import MeshDiskCache
+from .mesh_export import MeshExport, MeshSnapshot
+from .mesh_pipeline import MeshExportPipeline
 from .network import  *
+from .payload_cache import PayloadCache
+from .skinning import Skinning
 from .instant_radiosity import InstantRadiosity
 from .parallax_corrected_cubemaps import ParallaxCorrectedCubemaps
 from .shadows import ShadowsSettings
@@ -67,21 +74,85 @@ class Engine:
 		self.activeObjects	= set()
 		self.activeLights	= set()
 		self.activeEmpties	= set()
+
+		# What the server asked to send again. See processMessage()
+		self.resyncEntities	= set()
+		self.needsFullResync = False
+
+		# Geometry the server already has. See syncItem()
+		self.meshCache = MeshCache()
+		# Objects whose meshes must be exported again during this syncScene
+		self.numStaleMeshes = 0
+		# Exports meshes in the background during syncScene. See queueMeshUpload()
+		self.meshPipeline = None
+		# Messages of meshes uploaded in previous sessions. See uploadMesh()
+		self.diskCache = None
 		
+		dscene = bpy.context.scene.dergo
+		if dscene.mesh_disk_cache:
+			directory = bpy.path.abspath( dscene.mesh_disk_cache_path ) or \
+						os.path.join( os.path.expanduser( '~' ), '.dergo_cache' )
+			try:
+				self.diskCache = MeshDiskCache( directory,
+												dscene.mesh_disk_cache_size * 1024 * 1024 )
+			except OSError as e:
+				print( 'DERGO: mesh disk cache disabled (%s)' % e )
+		self.network = Network()
+		if dscene.network_payload_cache:
+			self.network.payloadCache = PayloadCache( dscene.network_payload_cache_size * 1024 * 1024 )
 		try:
-			self.network = Network()
-			self.network.connect()
-			self.reset()
+			self.network.connect( Engine.createTransport( dscene ),
+								  dscene.network_threaded and dscene.network_bulk_channel )
 		except ConnectionError as e:
+			# We'll keep trying. See isConnected()
 			print( e )
-			pass
+		# If we're not connected, these apply once we are
+		if dscene.compression == 'ZLIB':
+			self.network.enableCompression( Codec.Zlib, dscene.compression_level,
+											dscene.compress_results )
+		elif dscene.compression == 'LZ4':
+			self.network.enableCompression( Codec.Lz4, dscene.compression_level,
+											dscene.compress_results )
+		if dscene.network_threaded:
+			self.network.startThreads()
+		# The main thread is busy reading meshes. With one core, it'd only add overhead
+		numExportThreads = min( dscene.mesh_export_threads, (os.cpu_count() or 1) - 1 )
+		if numExportThreads > 0:
+			self.meshPipeline = MeshExportPipeline( numExportThreads )
+		self.reset()
 		
 	def __del__(self):
 		return
+
+	@staticmethod
+	def createTransport( dscene ):
+		if dscene.transport == 'UNIX':
+			return UnixTransport( dscene.unix_socket_path )
+		elif dscene.transport == 'SHARED_MEMORY':
+			if dscene.shared_memory_control == 'UNIX':
+				return SharedMemoryTransport( UnixTransport( dscene.unix_socket_path ) )
+			return SharedMemoryTransport( TcpTransport( dscene.host, dscene.port ) )
+		return TcpTransport( dscene.host, dscene.port )
 		
+	# Returns False while the server is unreachable, in which case nothing
+	# should be sent. Tries to reconnect every now and then (see
+	# Network.tryReconnect), after which the server has our scene again.
+	def isConnected( self ):
+		if self.network.connected:
+			return True
+		if not self.network.tryReconnect():
+			return False
+		if self.network.payloadCache is None or self.network.payloadCache.overflowed:
+			# Nothing to replay. Export everything again
+			self.reset()
+		return True
+
 	def reset( self ):
 		# Tell server to reset
-		self.network.sendData( FromClient.Reset, None )
+		try:
+			self.network.sendData( FromClient.Reset, None )
+		except ConnectionError:
+			pass	# The server gets reset when we reconnect
 		# Remove our data
 		for object in bpy.data.objects:
 			object.dergo.in_sync	= False
@@ -109,9 +180,41 @@ class Engine:
 		self.activeObjects	= set()
 		self.activeLights	= set()
 		self.activeEmpties	= set()
+
+		self.meshCache.clear()
 		
 	def view_update(self, context):
+		# Coalesce everything we send during this update into as few
+		# syscalls as possible. Order is preserved.
+		try:
+			if not self.isConnected():
+				return
+			self.network.logStats = context.scene.dergo.network_stats
+			isFirstSync = self.frame == 1
+			startTime = time.perf_counter()
+			self.network.beginBatch()
+			try:
+				self.syncScene( context )
+			finally:
+				# Whatever didn't get sent (e.g. the connection was lost) is not in sync
+				if self.meshPipeline is not None:
+					self.meshPipeline.discard()
+				self.network.endBatch()
+			if self.network.logStats:
+				print( self.meshCache.getStats() )
+			if isFirstSync and self.diskCache is not None:
+				print( 'DERGO: first sync took %.2f seconds' % (time.perf_counter() - startTime) )
+				print( self.diskCache.getStats() )
+		except ConnectionError:
+			# Whatever we didn't get to send goes out after reconnecting, since
+			# it's either in the payload cache or not marked as in sync yet.
+			pass
+
+	def syncScene(self, context):
 		scene = context.scene
+
+		resyncMaterials = self.applyResyncs( scene )
+		self.meshCache.clearStacks()
 		
 		newActiveObjects	= set()
 		newActiveLights		= set()
@@ -150,27 +253,54 @@ class Engine:
 			# A reset. 
 			for mat in bpy.data.materials:
 				self.syncMaterialTextureSlots( mat )
-		elif self.textureSlotPanelOpen:
-			obj = context.active_object
-			if obj and obj.active_material:
-				self.syncMaterialTextureSlots( obj.active_material )
-			self.textureSlotPanelOpen = False
+		else:
+			for mat in resyncMaterials:
+				self.syncMaterialTextureSlots( mat )
+			if self.textureSlotPanelOpen:
+				obj = context.active_object
+				if obj and obj.active_material:
+					self.syncMaterialTextureSlots( obj.active_material )
+				self.textureSlotPanelOpen = False
 		
-		# Add and update all meshes & items
+		# Add and update all meshes & items. Blender 2.8+ evaluates the
+		# objects for us (see syncItem); older versions have no depsgraph.
+		depsgraph = None
+		if hasattr( context, 'evaluated_depsgraph_get' ):
+			depsgraph = context.evaluated_depsgraph_get()
+		meshObjects = []
 		for object in scene.objects:
 			if not object.visible_get():
 				object.dergo.in_sync = False
 				if object.is_updated_data and object.type == 'MESH':
 					object.data.dergo.frame_sync = 0
 			elif object.type == 'MESH':
-				self.syncItem( object, scene )
-				newActiveObjects.add( (object.dergo.id, object.dergo.id_mesh) )
+				self.syncItem( object, scene, depsgraph )
+				meshObjects.append( object )
 			elif object.type == 'LAMP':
 				self.syncLight( object, scene )
 				newActiveLights.add( object.dergo.id )
 			elif object.type == 'EMPTY' and Engine.isEmptyRelevant( object ):
 				self.syncEmpty( object, scene )
 				newActiveEmpties.add( object.dergo.id )
+
+		# Items are sent once their meshes are (see queueMeshUpload)
+		self.finishMeshUploads()
+		for object in meshObjects:
+			newActiveObjects.add( (object.dergo.id, object.dergo.id_mesh) )
+
+		# Some meshes were linked to one that just got new geometry (see
+		# syncItem). Their objects may have been synced already
+		while self.numStaleMeshes > 0:
+			self.numStaleMeshes = 0
+			meshObjects = []
+			for object in scene.objects:
+				if object.type == 'MESH' and not object.dergo.in_sync and object.visible_get():
+					newActiveObjects.discard( (object.dergo.id, object.dergo.id_mesh) )
+					self.syncItem( object, scene, depsgraph )
+					meshObjects.append( object )
+			self.finishMeshUploads()
+			for object in meshObjects:
+				newActiveObjects.add( (object.dergo.id, object.dergo.id_mesh) )
 		
 		# Remove items that are gone.
 		if newActiveObjects != self.activeObjects:
@@ -240,7 +370,7 @@ class Engine:
 					object.data.dergo.frame_sync= 0
 					object.data.dergo.id		= 0
 	
-	def syncItem( self, object, scene ):
+	def syncItem( self, object, scene, depsgraph ):
 		if object.dergo.id == 0:
 			object.dergo.id		= self.objId
 			object.dergo.name	= object.name
@@ -278,49 +408,93 @@ class Engine:
 			if \
 			((not object.dergo.in_sync or object.is_updated_data) and len( object.modifiers ) > 0) or \
 			((data.dergo.frame_sync == 0 or (data.dergo.frame_sync != self.frame and object.is_updated_data)) and len( object.modifiers ) == 0):
-				exportMesh = object.to_mesh()
-				
 				if not data.dergo.tangent_uv_source:
 					tangentUvSource = 255
 				else:
-					tangentUvSource = data.uv_textures.find( data.dergo.tangent_uv_source )
+					tangentUvSource = data.uv_layers.find( data.dergo.tangent_uv_source )
 					if tangentUvSource < 0: tangentUvSource = 255
-					
-				dataToSend = MeshExport.createSendBuffer( linkedMeshId, meshName,
-															exportMesh, tangentUvSource )
-				
-				self.network.sendData( FromClient.Mesh, dataToSend )
-				bpy.data.meshes.remove( exportMesh )
+
+				meshFormat = 0
+				if self.network.hasCapability( Capability.CompactVertexFormats ):
+					meshFormat = MeshExport.VERTEX_FORMATS[data.dergo.vertex_format]
+				if self.network.hasCapability( Capability.VertexOptimization ):
+					meshFormat |= MeshExport.VERTEX_OPTIMIZATIONS[data.dergo.vertex_optimization]
+				if data.dergo.client_tangents and tangentUvSource != 255 and \
+						self.network.hasCapability( Capability.ClientTangents ):
+					meshFormat |= MeshFormat.HasTangents
+
+				armatureObject = None
+				if self.network.hasCapability( Capability.Skinning ):
+					armatureObject = Skinning.getArmature( object )
+
+				if armatureObject is not None:
+					self.syncSkinnedMesh( object, armatureObject, linkedMeshId, meshName,
+										  tangentUvSource, meshFormat, scene )
+				else:
+					# Objects with the same mesh & modifiers evaluate to the same
+					# geometry. Only the first one is evaluated (see MeshCache)
+					stackKey = None
+					if len( object.modifiers ) > 0:
+						stackKey = MeshCache.computeStackKey( object )
+					if stackKey is None or self.meshCache.findStack( linkedMeshId, stackKey ) is None:
+						if depsgraph is not None:
+							# The evaluated object owns this mesh (modifiers applied), no
+							# datablock gets created. Must be freed with to_mesh_clear.
+							evaluatedObject = object.evaluated_get( depsgraph )
+							exportMesh = evaluatedObject.to_mesh()
+							freeExportMesh = evaluatedObject.to_mesh_clear
+						else:
+							# Blender 2.7x: a temporary datablock, with tessfaces
+							exportMesh = object.to_mesh( scene, True, 'PREVIEW' )
+							freeExportMesh = lambda: bpy.data.meshes.remove( exportMesh )
+						try:
+							self.queueMeshUpload( linkedMeshId, meshName, exportMesh,
+												  tangentUvSource, meshFormat, scene )
+						finally:
+							freeExportMesh()
+						if stackKey is not None:
+							self.meshCache.setStack( stackKey, linkedMeshId )
 				if len( object.modifiers ) == 0:
 					data.dergo.frame_sync = self.frame
-			
-			# Item is now linked to a different mesh! Remove ourselves			
-			if object.dergo.id_mesh != 0 and object.dergo.id_mesh != linkedMeshId:
-				self.network.sendData( FromClient.ItemRemove, struct.pack( '=ll', object.dergo.id_mesh, object.dergo.id ) )
-				object.dergo.in_sync = False
 
-			# Keep it up to date.
-			object.dergo.id_mesh = linkedMeshId
+			if self.meshPipeline is not None:
+				# Our mesh may still be in the pipeline, or be linked to one that is
+				self.meshPipeline.defer( lambda: self.sendItem( object, linkedMeshId ) )
+			else:
+				self.sendItem( object, linkedMeshId )
 
-			# Create or Update Item.
-			if not object.dergo.in_sync or object.is_updated:
-				# Mesh ID & Item ID
-				dataToSend = bytearray( struct.pack( '=ll', linkedMeshId, object.dergo.id ) )
-				
-				# Item name
-				asUtfBytes = object.data.name.encode('utf-8')
-				dataToSend.extend( struct.pack( '=I', len( asUtfBytes ) ) )
-				dataToSend.extend( asUtfBytes )
-				
-				loc, rot, scale = object.matrix_world.decompose()
-				dataToSend.extend( struct.pack( '=10f', loc[0], loc[1], loc[2],\
-														rot[0], rot[1], rot[2], rot[3],\
-														scale[0], scale[1], scale[2] ) )
-				
-				self.network.sendData( FromClient.Item, dataToSend )
+	# Links the object to the mesh the server has its geometry under, and
+	# sends its Item if it isn't in sync. See syncItem
+	def sendItem( self, object, linkedMeshId ):
+		linkedMeshId = self.meshCache.resolve( linkedMeshId )
+		
+		# Item is now linked to a different mesh! Remove ourselves			
+		if object.dergo.id_mesh != 0 and object.dergo.id_mesh != linkedMeshId:
+			self.network.sendData( FromClient.ItemRemove, struct.pack( '=ll', object.dergo.id_mesh, object.dergo.id ) )
+			object.dergo.in_sync = False
 
-			object.dergo.in_sync = True
+		# Keep it up to date.
+		object.dergo.id_mesh = linkedMeshId
+
+		# Create or Update Item.
+		if not object.dergo.in_sync or object.is_updated:
+			# Mesh ID & Item ID
+			dataToSend = bytearray( struct.pack( '=ll', linkedMeshId, object.dergo.id ) )
+			
+			# Item name
+			asUtfBytes = object.data.name.encode('utf-8')
+			dataToSend.extend( struct.pack( '=I', len( asUtfBytes ) ) )
+			dataToSend.extend( asUtfBytes )
+			
+			loc, rot, scale = object.matrix_world.decompose()
+			dataToSend.extend( struct.pack( '=10f', loc[0], loc[1], loc[2],\
+													rot[0], rot[1], rot[2], rot[3],\
+													scale[0], scale[1], scale[2] ) )
 			
+			self.network.sendData( FromClient.Item, dataToSend )
+
+		object.dergo.in_sync = True
+		
 	def syncLight( self, object, scene ):
 		if object.data.type not in {'POINT', 'SUN', 'SPOT'}:
 			return
@@ -657,9 +831,188 @@ class Engine:
 						region_data.is_perspective ) )
 		return
 
+	# Sends the mesh under meshId, unless the server already has it: either it didn't
+	# really change, or another one has the same geometry, in which case items link
+	# to that one instead (see MeshCache). If only positions & normals changed since
+	# the last upload (e.g. an armature deformed it), sends just those. Otherwise
+	# the messages come from the MeshDiskCache if there's one. The first upload
+	# goes already indexed when it can (see canUploadIndexed).
+	# Returns readSections' output if the mesh was sent, None if it wasn't (or
+	# if it couldn't be read with NumPy). Meshes that aren't shareable are
+	# never linked to others (see MeshCache.find).
+	def uploadMesh( self, meshId, meshName, mesh, tangentUvSource, meshFormat, scene, shareable=True ):
+		MeshExport.prepareMesh( mesh )
+		sections = None
+		topology = None
+		tangents = None
+		if MeshExport.canVectorize( mesh ):
+			sections = MeshExport.readSections( mesh )
+			tangents, meshFormat = self.readTangents( mesh, tangentUvSource, meshFormat )
+			topology = MeshExport.computeTopology( mesh, sections, tangentUvSource, meshFormat )
+			digest = MeshExport.computeDigest( topology, sections )
+		else:
+			messages = list( MeshExport.generateUpload( meshId, meshName, mesh, tangentUvSource,
+														self.network.capabilities ) )
+			digest = MeshCache.computeDigest( messages )
+
+		if self.meshCache.find( meshId, digest, shareable ) is not None:
+			return None
+
+		indexed = sections is not None and self.canUploadIndexed( meshId, meshFormat, sections,
+																  shareable )
+		if topology is not None and topology == self.meshCache.getTopology( meshId ) and \
+				self.network.hasCapability( Capability.VertexUpdates ):
+			messages = [MeshExport.createVertexUpdate( meshId, sections )]
+		elif sections is not None and self.diskCache is not None:
+			messages = self.diskCache.getUpload( self.network, digest, meshId, meshName, mesh,
+												 tangentUvSource, sections, meshFormat, indexed,
+												 tangents )
+		elif sections is not None:
+			messages = MeshExport.generateUpload( meshId, meshName, mesh, tangentUvSource,
+												  self.network.capabilities, sections, meshFormat,
+												  indexed, tangents )
+		if indexed:
+			# Can't be followed by vertex updates. The next change is sent in full
+			topology = None
+
+		self.sendMeshUpload( meshId, digest, topology, shareable, messages, scene )
+		return sections
+
+	# Blender's tangents for the mesh (see MeshExport.readTangents) if meshFormat asks
+	# for them (MeshFormat.HasTangents, see syncItem). Returns (tangents, meshFormat):
+	# if Blender has none, they're None and the server generates its own instead.
+	@staticmethod
+	def readTangents( mesh, tangentUvSource, meshFormat ):
+		tangents = None
+		if meshFormat & MeshFormat.HasTangents:
+			tangents = MeshExport.readTangents( mesh, tangentUvSource )
+			if tangents is None:
+				meshFormat &= ~MeshFormat.HasTangents
+		return (tangents, meshFormat)
+
+	# Whether meshId can be sent welded & indexed by us (MeshIndexed), sparing the server
+	# its deindexing. Only the first time: MeshIndexed can't be followed by vertex
+	# updates, so a mesh being edited goes back to regular uploads. Never for meshes
+	# that aren't shareable (i.e. skinned ones), since MeshSkin can't follow it either.
+	# Only for meshes the server would have optimized itself (see MeshFormat.OptimizeAlways,
+	# OptimizeNever), since welding big ones is slower than sending them as they are.
+	def canUploadIndexed( self, meshId, meshFormat, sections, shareable=True ):
+		if not shareable or not self.network.hasCapability( Capability.IndexedMeshes ) or \
+				self.meshCache.hasMesh( meshId ) or meshFormat & MeshFormat.OptimizeNever:
+			return False
+		return meshFormat & MeshFormat.OptimizeAlways != 0 or \
+			   MeshExport.countDeindexedVertices( sections ) < MeshExport.MAX_AUTO_OPTIMIZED_VERTICES
+
+	# Sends the messages uploading a mesh, and tells the MeshCache about it.
+	# Messages are (messageType, data) or (messageType, data, compressed)
+	def sendMeshUpload( self, meshId, digest, topology, shareable, messages, scene ):
+		for message in messages:
+			self.network.sendData( *message )
+		for staleMeshId in self.meshCache.uploaded( meshId, digest, topology, shareable ):
+			self.invalidateMesh( staleMeshId, scene )
+			self.numStaleMeshes += 1
+
+	# Same as uploadMesh, but with a MeshExportPipeline only the mesh's sections
+	# are read now. The rest happens in its threads, and the messages are sent
+	# from finishMeshUploads (or earlier, if too many meshes are in flight).
+	# Meshes that can't be read with NumPy are uploaded right away.
+	def queueMeshUpload( self, meshId, meshName, mesh, tangentUvSource, meshFormat, scene ):
+		if self.meshPipeline is None or not MeshExport.canVectorize( mesh ):
+			self.uploadMesh( meshId, meshName, mesh, tangentUvSource, meshFormat, scene )
+			return
+
+		MeshExport.prepareMesh( mesh )
+		sections = MeshExport.readSections( mesh )
+		tangents, meshFormat = self.readTangents( mesh, tangentUvSource, meshFormat )
+		self.meshPipeline.submit( lambda result: self.finishMeshUpload( meshId, scene, *result ),
+								  MeshExportPipeline.prepareUpload, self.network, self.diskCache,
+								  meshId, meshName, MeshSnapshot( mesh ), sections, tangentUvSource,
+								  meshFormat, self.meshCache.getTopology( meshId ),
+								  self.canUploadIndexed( meshId, meshFormat, sections ), tangents )
+
+	# See queueMeshUpload & MeshExportPipeline.prepareUpload
+	def finishMeshUpload( self, meshId, scene, topology, digest, messages ):
+		if self.meshCache.find( meshId, digest, True ) is None:
+			self.sendMeshUpload( meshId, digest, topology, True, messages, scene )
+
+	# Sends every mesh queued with queueMeshUpload, and the items waiting for them
+	def finishMeshUploads( self ):
+		if self.meshPipeline is not None:
+			self.meshPipeline.finish()
+
+	# Objects only deformed by an armature (see Skinning). The mesh is sent in its
+	# rest pose, with its skin, only when it changes; the pose every time.
+	def syncSkinnedMesh( self, object, armatureObject, meshId, meshName, tangentUvSource,
+						 meshFormat, scene ):
+		if not object.dergo.in_sync or object.data.is_updated:
+			# Not evaluated: without shape keys and other modifiers, it's the rest pose
+			sections = self.uploadMesh( meshId, meshName, object.data, tangentUvSource, meshFormat,
+										scene, shareable=False )
+			if sections is None and object.data.is_updated:
+				# Same geometry, but the weights may have changed (e.g. weight painting)
+				sections = MeshExport.readSections( object.data )
+			if sections is not None:
+				self.network.sendData( *Skinning.createSkin( meshId, object, object.data,
+															 armatureObject, sections[3] ) )
+		self.network.sendData( *Skinning.createSkinPose( meshId, object, armatureObject ) )
+
+	# Makes syncScene export the mesh again, and update the items using it
+	def invalidateMesh( self, meshId, scene ):
+		if meshId < 0:
+			# Mesh of an object with modifiers (see syncItem)
+			for object in scene.objects:
+				if object.dergo.id == meshId & 0x7FFFFFFF:
+					object.dergo.in_sync = False
+		else:
+			for mesh in bpy.data.meshes:
+				if mesh.dergo.id == meshId:
+					mesh.dergo.frame_sync = 0
+			for object in scene.objects:
+				if object.type == 'MESH' and object.data.dergo.id == meshId:
+					object.dergo.in_sync = False
+
+	# Invalidates whatever the server asked for via FromServer.Resync, so that
+	# syncScene sends it again. Returns the materials whose texture slots must
+	# be sent again too.
+	def applyResyncs( self, scene ):
+		if self.needsFullResync:
+			self.needsFullResync = False
+			self.resyncEntities.clear()
+			self.reset()
+			return []
+
+		resyncMaterials = []
+		for entityType, entityId in self.resyncEntities:
+			if entityType == ResyncEntity.Mesh:
+				# Meshes linked to it are gone too
+				for staleMeshId in self.meshCache.forget( entityId ):
+					self.invalidateMesh( staleMeshId, scene )
+				self.invalidateMesh( entityId, scene )
+			elif entityType == ResyncEntity.Item:
+				for object in scene.objects:
+					if object.dergo.id == entityId:
+						object.dergo.in_sync = False
+			elif entityType == ResyncEntity.Material:
+				for mat in bpy.data.materials:
+					if mat.dergo.id == entityId:
+						mat.dergo.in_sync = False
+						resyncMaterials.append( mat )
+		self.resyncEntities.clear()
+		return resyncMaterials
+
 	# Callback to process Network messages from server.
+	# Returns True if the scene needs to be synced again (see RenderEngine.tag_update).
 	def processMessage( self, header_sizeBytes, header_messageType, data ):
-		return
+		if header_messageType == FromServer.Resync:
+			if header_sizeBytes == 0:
+				# Server doesn't know what went wrong. Send everything again.
+				self.needsFullResync = True
+			else:
+				numEntries = struct.unpack_from( '=I', data )[0]
+				for i in range( numEntries ):
+					self.resyncEntities.add( struct.unpack_from( '=Bl', data, 4 + i * 5 ) )
+			return True
+		return False
 	
 dergo = None
 
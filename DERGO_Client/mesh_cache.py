@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+import collections
+import hashlib
+import struct
+
+# Also importable outside of the add-on (see Tests/)
+try:
+	from .network import FromClient
+except ImportError:
+	from network import FromClient
+
+# Remembers the geometry (blake2b digest of the exported mesh) the server has
+# under each mesh id, so that meshes that didn't really change aren't sent
+# again, and meshes identical to one the server already has are linked to it
+# instead (e.g. objects with the same modifier stack). See Engine.syncItem
+#
+# A mesh id linked to another is an alias. The server never got it, so when
+# the mesh it points to gets new geometry, the alias is dropped and the
+# meshes behind it must be exported again (uploaded() returns them).
+#
+# It also remembers the topology (see MeshExport.computeTopology) of what the
+# server has under each mesh id: if it didn't change, a MeshVertexUpdate will do.
+#
+# Objects with modifiers get their own mesh, yet a forest of trees with the
+# same mesh and modifier stack would evaluate to the same geometry over and
+# over. The first of them evaluated during a syncScene registers its stack
+# (see computeStackKey); the others are linked to its mesh without being
+# evaluated at all.
+class MeshCache:
+	MAX_DIGESTS = 4096
+
+	# Modifiers that depend on more than their settings and the mesh
+	# (simulations, particles); objects using them never share meshes
+	UNSHAREABLE_MODIFIERS = frozenset( ('CLOTH', 'COLLISION', 'DYNAMIC_PAINT', 'EXPLODE',
+										'FLUID', 'FLUID_SIMULATION', 'OCEAN', 'PARTICLE_INSTANCE',
+										'PARTICLE_SYSTEM', 'SMOKE', 'SOFT_BODY', 'SURFACE') )
+	# Modifier settings that don't change what the viewport shows
+	IGNORED_MODIFIER_SETTINGS = frozenset( ('rna_type', 'name', 'show_expanded', 'show_render',
+											'show_in_editmode', 'show_on_cage', 'is_active',
+											'is_override_data_editable', 'persistent_uid',
+											'use_pin_to_last', 'execution_time') )
+
+	def __init__( self, maxDigests=MAX_DIGESTS ):
+		self.maxDigests = maxDigests
+		self.numHits	= 0
+		self.numMisses	= 0
+		self.numStackHits = 0
+		self.clear()
+
+	# Forget everything (e.g. the server got reset). Counters are kept.
+	def clear( self ):
+		# digest -> mesh id uploaded with it, least recently used first
+		self.lru = collections.OrderedDict()
+		# mesh id -> digest of what the server has under that id
+		self.meshDigests = {}
+		# mesh id -> mesh id the server has its geometry under
+		self.aliases = {}
+		# mesh id -> topology of what the server has under that id
+		self.topologies = {}
+		self.clearStacks()
+
+	# Modifier stacks evaluated during the last syncScene are forgotten at the
+	# beginning of the next one: whatever they depend on may have changed since.
+	def clearStacks( self ):
+		# stack key -> mesh id the server has its geometry under
+		self.stacks = {}
+
+	# Digest of the geometry in the messages of MeshExport.generateUpload.
+	# The mesh id and name are left out, so identical meshes match.
+	@staticmethod
+	def computeDigest( messages ):
+		digest = hashlib.blake2b( digest_size=16 )
+		for messageType, data in messages:
+			data = memoryview( data )
+			if messageType in (FromClient.Mesh, FromClient.MeshV2, FromClient.MeshIndexed,
+							   FromClient.MeshBegin):
+				nameLength = struct.unpack_from( '=I', data, 4 )[0]
+				digest.update( data[8 + nameLength:] )
+			else:
+				digest.update( data[4:] )
+		return digest.digest()
+
+	# Key identifying what object evaluates to: its mesh plus the settings of
+	# its modifiers. None if it can't be shared with other objects (e.g. a
+	# modifier uses another object, which may move without us noticing).
+	@staticmethod
+	def computeStackKey( object ):
+		for slot in getattr( object, 'material_slots', () ):
+			if slot.link == 'OBJECT':
+				return None
+		modifiers = []
+		for modifier in object.modifiers:
+			if modifier.type in MeshCache.UNSHAREABLE_MODIFIERS:
+				return None
+			settings = MeshCache.getSettings( modifier )
+			if settings is None:
+				return None
+			modifiers.append( (modifier.type, settings) )
+		# Modifiers refer to vertex groups by name, which belong to the object
+		vertexGroups = tuple( group.name for group in object.vertex_groups )
+		shapeKey = (object.show_only_shape_key, object.active_shape_key_index) \
+					if object.data.shape_keys is not None else None
+		return (object.data.dergo.id, vertexGroups, shapeKey, tuple( modifiers ))
+
+	# Values of all the RNA properties of rnaStruct (e.g. a modifier), nested
+	# settings included. None if it points to another datablock.
+	@staticmethod
+	def getSettings( rnaStruct, depth=0 ):
+		settings = []
+		for prop in rnaStruct.bl_rna.properties:
+			if prop.identifier in MeshCache.IGNORED_MODIFIER_SETTINGS:
+				continue
+			value = getattr( rnaStruct, prop.identifier, None )
+			if prop.type == 'POINTER':
+				if value is not None:
+					if value == value.id_data or depth >= 3:
+						return None
+					value = MeshCache.getSettings( value, depth + 1 )
+					if value is None:
+						return None
+			elif prop.type == 'COLLECTION':
+				items = []
+				for item in value:
+					itemSettings = MeshCache.getSettings( item, depth + 1 )
+					if itemSettings is None:
+						return None
+					items.append( itemSettings )
+				value = tuple( items )
+			elif isinstance( value, set ):
+				value = tuple( sorted( value ) )
+			elif hasattr( value, '__len__' ) and not isinstance( value, str ):
+				value = tuple( value )
+			settings.append( value )
+		return tuple( settings )
+
+	# Mesh id the server has meshId's geometry under
+	def resolve( self, meshId ):
+		return self.aliases.get( meshId, meshId )
+
+	# Looks for a mesh the server already has with this geometry. Returns its
+	# id (meshId itself if it didn't change) or None if it must be uploaded
+	# as meshId, in which case uploaded() must be called afterwards.
+	# Meshes that aren't shareable (e.g. skinned by the server) are never
+	# linked to others, nor others to them.
+	def find( self, meshId, digest, shareable=True ):
+		if meshId not in self.aliases and self.meshDigests.get( meshId ) == digest:
+			self.numHits += 1
+			if digest in self.lru:
+				self.lru.move_to_end( digest )
+			return meshId
+
+		if not shareable:
+			self.numMisses += 1
+			return None
+
+		cachedMeshId = self.lru.get( digest )
+		if cachedMeshId is not None and self.meshDigests.get( cachedMeshId ) == digest:
+			self.numHits += 1
+			self.lru.move_to_end( digest )
+			if cachedMeshId == meshId:
+				self.aliases.pop( meshId, None )
+			else:
+				self.aliases[meshId] = cachedMeshId
+			return cachedMeshId
+
+		self.numMisses += 1
+		return None
+
+	# Looks for an object with the same modifier stack evaluated during this
+	# syncScene. Returns the id of its mesh, to which meshId gets linked, or None
+	# if there's none, in which case meshId must be evaluated, uploaded and
+	# passed to setStack().
+	def findStack( self, meshId, stackKey ):
+		cachedMeshId = self.stacks.get( stackKey )
+		if cachedMeshId is None:
+			return None
+		self.numStackHits += 1
+		if cachedMeshId == meshId:
+			self.aliases.pop( meshId, None )
+		else:
+			self.aliases[meshId] = cachedMeshId
+		return cachedMeshId
+
+	# meshId was just evaluated from an object with this modifier stack
+	def setStack( self, stackKey, meshId ):
+		self.stacks[stackKey] = self.resolve( meshId )
+
+	# The server got new geometry for meshId. Returns the aliases that pointed
+	# to its old geometry; their meshes must be exported again.
+	# topology is None if it's unknown (vertex updates won't be used).
+	def uploaded( self, meshId, digest, topology=None, shareable=True ):
+		self.aliases.pop( meshId, None )
+		staleAliases = []
+		if self.meshDigests.get( meshId ) != digest:
+			staleAliases = self.forget( meshId )
+		self.meshDigests[meshId] = digest
+		if topology is not None:
+			self.topologies[meshId] = topology
+		else:
+			self.topologies.pop( meshId, None )
+		if not shareable:
+			if self.lru.get( digest ) == meshId:
+				del self.lru[digest]
+			return staleAliases
+		self.lru[digest] = meshId
+		self.lru.move_to_end( digest )
+		while len( self.lru ) > self.maxDigests:
+			self.lru.popitem( last=False )
+		return staleAliases
+
+	# The server doesn't have meshId anymore (or has something else under it).
+	# Returns the aliases that pointed to it, which are dropped too.
+	def forget( self, meshId ):
+		self.meshDigests.pop( meshId, None )
+		self.topologies.pop( meshId, None )
+		self.aliases.pop( meshId, None )
+		staleAliases = [alias for alias, target in self.aliases.items() if target == meshId]
+		for alias in staleAliases:
+			del self.aliases[alias]
+		for stackKey in [stackKey for stackKey, target in self.stacks.items() if target == meshId]:
+			del self.stacks[stackKey]
+		return staleAliases
+
+	# Topology of what the server has under meshId, None if unknown
+	def getTopology( self, meshId ):
+		return self.topologies.get( meshId )
+
+	# Whether the server has some geometry under meshId
+	def hasMesh( self, meshId ):
+		return meshId in self.meshDigests
+
+	def getStats( self ):
+		numLookups = max( self.numHits + self.numMisses, 1 )
+		return 'DERGO mesh cache: %d hits, %d misses (%.1f%% hits), %d meshes, %d aliases, '\
+				'%d evaluations skipped' %\
+				(self.numHits, self.numMisses, self.numHits * 100.0 / numLookups,
+				len( self.meshDigests ), len( self.aliases ), self.numStackHits)
@@ -0,0 +1,210 @@
+#!/usr/bin/python
+
+import collections
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+# Also importable outside of the add-on (see Tests/)
+try:
+	from .mesh_export import MeshExport
+except ImportError:
+	from mesh_export import MeshExport
+
+# Keeps the messages of mesh uploads (see MeshExport.generateUpload) on disk, so
+# that opening the same .blend again (e.g. the next day) doesn't encode and compress
+# every mesh from scratch. Entries are keyed by the geometry's digest (see
+# MeshExport.computeDigest) plus everything else in the messages: the mesh id & name,
+# the capabilities negotiated with the server and whether it's a MeshIndexed. Mesh ids are given in the order
+# objects are found, so they match as long as the scene didn't change much.
+#
+# Every entry is a file holding all the messages of one upload, with their compressed
+# payload if they were compressed (see Network.compressPayload). Entries are memory
+# mapped when read: the messages are views into the file, which go to the socket
+# without being copied. The file is closed once nothing references them.
+#
+# The least recently used entries are deleted when the cache grows bigger than
+# maxBytes. Their modification time is the last time they were used, so the
+# order survives between sessions. Can be used from several threads at once
+# (see MeshExportPipeline).
+class MeshDiskCache:
+	# Bumped whenever the file format changes. Older files are ignored
+	FORMAT_VERSION = 1
+	MAGIC = b'DGMC'
+	# magic, version, codec of the compressed payloads, numMessages
+	FILE_HEADER = struct.Struct( '=4sIBI' )
+	# messageType, sizeBytes, compressedSizeBytes (0 = not compressed)
+	MESSAGE_HEADER = struct.Struct( '=BII' )
+	FILE_EXTENSION = '.dgmc'
+
+	def __init__( self, directory, maxBytes ):
+		self.directory = directory
+		self.maxBytes = maxBytes
+		self.lock = threading.Lock()
+		self.numHits = 0
+		self.numMisses = 0
+		self.numBytesRead = 0
+
+		os.makedirs( directory, exist_ok=True )
+
+		# file name -> size in bytes, least recently used first
+		self.lru = collections.OrderedDict()
+		self.sizeBytes = 0
+		entries = []
+		for entry in os.scandir( directory ):
+			if entry.name.endswith( MeshDiskCache.FILE_EXTENSION ) and entry.is_file():
+				stat = entry.stat()
+				entries.append( (stat.st_mtime, entry.name, stat.st_size) )
+		for mtime, fileName, sizeBytes in sorted( entries ):
+			self.lru[fileName] = sizeBytes
+			self.sizeBytes += sizeBytes
+		self.evict()
+
+	@staticmethod
+	def computeFileName( network, digest, meshId, meshName, indexed=False ):
+		key = hashlib.blake2b( digest, digest_size=20 )
+		key.update( struct.pack( '=IlI?', MeshDiskCache.FORMAT_VERSION, meshId, network.capabilities,
+								 indexed ) )
+		key.update( meshName.encode( 'utf-8' ) )
+		return key.hexdigest() + MeshDiskCache.FILE_EXTENSION
+
+	# Messages of MeshExport.generateUpload as (messageType, data, compressed), compressed
+	# being what Network.compressPayload returns. Read from disk if they were stored
+	# before, otherwise generated and stored. digest comes from MeshExport.computeDigest
+	# (which covers tangents: they're made from the sections, and flagged in meshFormat)
+	def getUpload( self, network, digest, meshId, meshName, mesh, tangentUvSource, sections,
+				   meshFormat, indexed=False, tangents=None ):
+		fileName = MeshDiskCache.computeFileName( network, digest, meshId, meshName, indexed )
+		messages = self.load( fileName, network.compressionCodec )
+		if messages is None:
+			messages = [(messageType, data, network.compressPayload( messageType, data ))
+						for messageType, data in MeshExport.generateUpload( meshId, meshName, mesh,
+																			 tangentUvSource,
+																			 network.capabilities,
+																			 sections, meshFormat,
+																			 indexed, tangents )]
+			self.store( fileName, network.compressionCodec, messages )
+		return messages
+
+	# Returns the messages stored under fileName, None if there's no such entry
+	# (or it's unreadable). Compressed payloads are only returned if they were
+	# compressed with codec.
+	def load( self, fileName, codec ):
+		with self.lock:
+			if fileName not in self.lru:
+				self.numMisses += 1
+				return None
+			self.lru.move_to_end( fileName )
+
+		path = os.path.join( self.directory, fileName )
+		try:
+			with open( path, 'rb' ) as f:
+				fileMap = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+			os.utime( path )
+			messages = MeshDiskCache.parse( memoryview( fileMap ), codec )
+		except (OSError, ValueError, struct.error) as e:
+			print( 'DERGO: discarding unreadable mesh cache entry %s (%s)' % (fileName, e) )
+			self.remove( fileName )
+			with self.lock:
+				self.numMisses += 1
+			return None
+
+		with self.lock:
+			self.numHits += 1
+			self.numBytesRead += len( fileMap )
+		return messages
+
+	@staticmethod
+	def parse( view, codec ):
+		magic, version, fileCodec, numMessages = MeshDiskCache.FILE_HEADER.unpack_from( view )
+		if magic != MeshDiskCache.MAGIC or version != MeshDiskCache.FORMAT_VERSION:
+			raise ValueError( 'not a mesh cache entry, or an old one' )
+
+		offset = MeshDiskCache.FILE_HEADER.size
+		headers = []
+		for i in range( numMessages ):
+			headers.append( MeshDiskCache.MESSAGE_HEADER.unpack_from( view, offset ) )
+			offset += MeshDiskCache.MESSAGE_HEADER.size
+
+		messages = []
+		for messageType, sizeBytes, compressedSizeBytes in headers:
+			data = view[offset:offset + sizeBytes]
+			offset += sizeBytes
+			compressed = None
+			if compressedSizeBytes and fileCodec == codec:
+				compressed = view[offset:offset + compressedSizeBytes]
+			offset += compressedSizeBytes
+			messages.append( (messageType, data, compressed) )
+
+		if offset != view.nbytes:
+			raise ValueError( 'truncated' )
+		return messages
+
+	# Writes the messages of an upload (as getUpload returns them) under fileName.
+	# Failing to write isn't an error: they just don't get cached.
+	def store( self, fileName, codec, messages ):
+		path = os.path.join( self.directory, fileName )
+		tmpPath = '%s.%d.tmp' % (path, threading.get_ident())
+		sizeBytes = MeshDiskCache.FILE_HEADER.size
+		try:
+			with open( tmpPath, 'wb' ) as f:
+				f.write( MeshDiskCache.FILE_HEADER.pack( MeshDiskCache.MAGIC,
+														 MeshDiskCache.FORMAT_VERSION, codec,
+														 len( messages ) ) )
+				for messageType, data, compressed in messages:
+					f.write( MeshDiskCache.MESSAGE_HEADER.pack(
+								messageType, memoryview( data ).nbytes,
+								len( compressed ) if compressed is not None else 0 ) )
+					sizeBytes += MeshDiskCache.MESSAGE_HEADER.size
+				for messageType, data, compressed in messages:
+					f.write( data )
+					sizeBytes += memoryview( data ).nbytes
+					if compressed is not None:
+						f.write( compressed )
+						sizeBytes += len( compressed )
+			# Readers never see half written files
+			os.replace( tmpPath, path )
+		except OSError as e:
+			print( 'DERGO: could not write mesh cache entry %s (%s)' % (fileName, e) )
+			try:
+				os.remove( tmpPath )
+			except OSError:
+				pass
+			return
+
+		with self.lock:
+			self.sizeBytes += sizeBytes - self.lru.pop( fileName, 0 )
+			self.lru[fileName] = sizeBytes
+		self.evict()
+
+	def remove( self, fileName ):
+		try:
+			os.remove( os.path.join( self.directory, fileName ) )
+		except OSError:
+			return False
+		with self.lock:
+			self.sizeBytes -= self.lru.pop( fileName, 0 )
+		return True
+
+	# Deletes the least recently used entries until we're within maxBytes.
+	# Entries that can't be deleted (e.g. still mapped on Windows) are skipped.
+	def evict( self ):
+		with self.lock:
+			if self.sizeBytes <= self.maxBytes:
+				return
+			fileNames = list( self.lru.keys() )
+		for fileName in fileNames:
+			self.remove( fileName )
+			with self.lock:
+				if self.sizeBytes <= self.maxBytes:
+					return
+
+	def getStats( self ):
+		numLookups = max( self.numHits + self.numMisses, 1 )
+		return 'DERGO mesh disk cache: %d hits, %d misses (%.1f%% hits), %.1f MB read, '\
+			   '%d entries, %.1f MB used' %\
+				(self.numHits, self.numMisses, self.numHits * 100.0 / numLookups,
+				 self.numBytesRead / (1024.0 * 1024.0), len( self.lru ),
+				 self.sizeBytes / (1024.0 * 1024.0))
@@ -1,8 +1,29 @@
 #!/usr/bin/python
 # Code based on Eric Langyel's OpenGEX exporter. All credits to him. His source code was released under public domain
 
+import hashlib
+import itertools
 import struct
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Also importable outside of the add-on (see Tests/)
+try:
+	from .network import FromClient, MeshSection, MeshFormat, Capability
+except ImportError:
+	from network import FromClient, MeshSection, MeshFormat, Capability
+
+if numpy is not None:
+	# Same layout as faceStruct ("=4I3fHB") in createSendBufferLoop
+	FACE_DTYPE = numpy.dtype( [('vertices', numpy.uint32, 4), ('normal', numpy.float32, 3),
+							   ('flags', numpy.uint16), ('numVertices', numpy.uint8)] )
+	# FACE_DTYPE with MeshFormat.CompactNormals (octahedral face normal)
+	COMPACT_FACE_DTYPE = numpy.dtype( [('vertices', numpy.uint32, 4), ('normal', numpy.int16, 2),
+									   ('flags', numpy.uint16), ('numVertices', numpy.uint8)] )
+
 class ExportVertex:
 	__slots__ = ("hash", "vertexIndex", "faceIndex", "position", "normal", "color", "texcoord")
 
@@ -42,6 +63,22 @@ class ExportVertex:
 
 
 class MeshExport:
+	# Meshes bigger than this are sent in chunks of this size (see generateMessages)
+	CHUNK_SIZE = 1024 * 1024
+	# Every section of a MeshV2 starts at a multiple of this from the start of the message
+	SOA_ALIGNMENT = 16
+
+	# DergoMeshSettings.vertex_format -> MeshFormat flags
+	COMPACT_FORMAT = MeshFormat.CompactNormals | MeshFormat.CompactColours | MeshFormat.CompactUvs
+	VERTEX_FORMATS = { 'FULL': 0, 'COMPACT': COMPACT_FORMAT,
+					   'COMPACT_POSITIONS': COMPACT_FORMAT | MeshFormat.QuantizedPositions }
+	# Meshes with more deindexed vertices than this aren't optimized by the server
+	# unless asked to (MeshFormat.OptimizeAlways). Must match c_maxAutoOptimizedVertices
+	MAX_AUTO_OPTIMIZED_VERTICES = 40000
+	# DergoMeshSettings.vertex_optimization -> MeshFormat flags
+	VERTEX_OPTIMIZATIONS = { 'AUTO': 0, 'ALWAYS': MeshFormat.OptimizeAlways,
+							 'NEVER': MeshFormat.OptimizeNever }
+
 	@staticmethod
 	def vertexArrayToBytes( exportVertexArray ):
 		bytesPerVertex = 3 + 3
@@ -202,9 +239,333 @@ class MeshExport:
 		#	ev.Hash()
 
 		return (exportVertexArray)
+
+	# Structured dtype of the vertices deindexSections builds. Same layout as the
+	# server's DeindexTask: position, normal, colour as 4 unorm bytes, the UVs, then
+	# the tangent & handedness (see readTangents).
+	@staticmethod
+	def getVertexDtype(hasColour, numUvs, hasTangents=False):
+		fields = [('position', numpy.float32, 3), ('normal', numpy.float32, 3)]
+		if hasColour:
+			fields.append( ('colour', numpy.uint8, 4) )
+		if numUvs:
+			fields.append( ('uv', numpy.float32, (numUvs, 2)) )
+		if hasTangents:
+			fields.append( ('tangent', numpy.float32, 4) )
+		return numpy.dtype( fields )
+
+	# Vectorized DeindexMesh, from readSections' output, exactly as the server's
+	# DeindexTask does it: 3 vertices per triangle, quads split as (0, 1, 2) and
+	# (0, 2, 3), flat faces with the face normal, V mirrored. tangents (see
+	# readTangents) are deindexed like the raw vertices, if given.
+	# Returns (vertices, materialIds), one material id per triangle.
+	@staticmethod
+	def deindexSections(sections, tangents=None):
+		faces, colours, uvs, rawVertices = sections
+		numFaces = len( faces )
+		isQuad = faces['numVertices'] == 4
+
+		# Face of every triangle, and which of its corners it uses
+		triangleFaces = numpy.repeat( numpy.arange( numFaces ), 1 + isQuad )
+		isSecondTriangle = numpy.zeros( len( triangleFaces ), dtype=numpy.bool_ )
+		isSecondTriangle[1:] = triangleFaces[1:] == triangleFaces[:-1]
+		corners = numpy.where( isSecondTriangle[:, numpy.newaxis], numpy.int8( [0, 2, 3] ),
+							   numpy.int8( [0, 1, 2] ) )
+		cornerFaces = triangleFaces[:, numpy.newaxis]
+
+		vertices = numpy.empty( (len( triangleFaces ), 3),
+								dtype=MeshExport.getVertexDtype( colours is not None, len( uvs ),
+																 tangents is not None ) )
+		rawIndices = faces['vertices'][cornerFaces, corners]
+		vertices['position'] = rawVertices[rawIndices, 0:3]
+		useSmooth = (faces['flags'][cornerFaces] & 0x8000) != 0
+		vertices['normal'] = numpy.where( useSmooth[:, :, numpy.newaxis], rawVertices[rawIndices, 3:6],
+										  faces['normal'][cornerFaces] )
+		if colours is not None:
+			colour = colours.reshape( numFaces, 4, 3 )[cornerFaces, corners]
+			vertices['colour'][:, :, 0:3] = colour * numpy.float32( 255.0 ) + numpy.float32( 0.5 )
+			vertices['colour'][:, :, 3] = 255
+		for i, uv in enumerate( uvs ):
+			uv = uv.reshape( numFaces, 4, 2 )[cornerFaces, corners]
+			vertices['uv'][:, :, i, 0] = uv[:, :, 0]
+			vertices['uv'][:, :, i, 1] = numpy.float32( 1.0 ) - uv[:, :, 1]
+		if tangents is not None:
+			vertices['tangent'] = tangents[rawIndices]
+
+		materialIds = faces['flags'][triangleFaces] & 0x7FFF
+		return (vertices.reshape( -1 ), materialIds)
+
+	# Merges identical vertices (bit by bit, like the server's shrinkVertexBuffer)
+	# with numpy.unique on the raw bytes of each. Returns (vertices, indices):
+	# the unique vertices in the order they first appear, and 16-bit indices if
+	# they fit. Same output as shrinkVertexBuffer and its vertexConversionLut.
+	@staticmethod
+	def weldVertices(vertices):
+		rawVertices = numpy.ascontiguousarray( vertices ).view(
+			numpy.dtype( (numpy.void, vertices.dtype.itemsize) ) )
+		unused, firstIndices, inverse = numpy.unique( rawVertices, return_index=True,
+													  return_inverse=True )
+		order = numpy.argsort( firstIndices )
+		newIndices = numpy.empty( len( order ), dtype=numpy.uint32 )
+		newIndices[order] = numpy.arange( len( order ), dtype=numpy.uint32 )
+		indexType = numpy.uint16 if len( order ) <= 0xFFFF else numpy.uint32
+		return (vertices[firstIndices[order]], newIndices[inverse.reshape( -1 )].astype( indexType ))
+
+	# deindexSections followed by weldVertices: what the server ends up with,
+	# ready to be sent. Returns (vertices, indices, materialIds)
+	@staticmethod
+	def indexSections(sections, tangents=None):
+		vertices, materialIds = MeshExport.deindexSections( sections, tangents )
+		vertices, indices = MeshExport.weldVertices( vertices )
+		return (vertices, indices, materialIds)
 	
+	# Vertices the server gets once it deindexes sections (see readSections):
+	# 3 per triangle, 6 per quad
+	@staticmethod
+	def countDeindexedVertices(sections):
+		faces = sections[0]
+		return 3 * len( faces ) + 3 * int( numpy.count_nonzero( faces['numVertices'] == 4 ) )
+
+	# Blender 2.8+ meshes have loop triangles instead of tessfaces
+	@staticmethod
+	def hasLoopTriangles(mesh):
+		return hasattr( mesh, 'loop_triangles' )
+
+	# Must be called on meshes from Object.to_mesh before exporting them:
+	# computes loop triangles and loop (split) normals, or the tessfaces
+	# before Blender 2.8.
+	@staticmethod
+	def prepareMesh(mesh):
+		if MeshExport.hasLoopTriangles( mesh ):
+			mesh.calc_loop_triangles()
+			# Blender 4.1+ keeps them always up to date
+			if hasattr( mesh, 'calc_normals_split' ):
+				mesh.calc_normals_split()
+		elif hasattr( mesh, 'calc_tessface' ):
+			mesh.calc_tessface()
+
+	# Active colour attribute (Blender 3.2+) or vertex colour layer, None if there's none
+	@staticmethod
+	def getColourAttribute(mesh):
+		colorAttributes = getattr( mesh, 'color_attributes', None )
+		if colorAttributes is not None:
+			return colorAttributes.active_color
+		return mesh.vertex_colors.active
+
+	# (numFaces, numVertices, hasColour, numUvs) as sent in the mesh's header.
+	# For loop triangles, every loop is sent as a raw vertex (so that it can
+	# have its own normal), and every triangle as a 3-vertex face.
+	@staticmethod
+	def getSectionCounts(mesh):
+		if isinstance( mesh, MeshSnapshot ):
+			return mesh.sectionCounts
+		if MeshExport.hasLoopTriangles( mesh ):
+			return (len( mesh.loop_triangles ), len( mesh.loops ),
+					MeshExport.getColourAttribute( mesh ) is not None, len( mesh.uv_layers ))
+		return (len( mesh.tessfaces ), len( mesh.vertices ),
+				len(mesh.tessface_vertex_colors) > 0, len( mesh.tessface_uv_textures ))
+
+	# Ids of the mesh's materials, as sent after its sections
+	@staticmethod
+	def getMaterialIdTable(mesh):
+		if isinstance( mesh, MeshSnapshot ):
+			return mesh.materialIdTable
+		return [mat.dergo.id for mat in mesh.materials]
+
+	# True if the mesh can be exported with NumPy (see fillSections). Needs
+	# Blender's collections, which have foreach_get. Loop triangles can only be
+	# exported this way (Blender 2.8+ always ships NumPy).
+	@staticmethod
+	def canVectorize(mesh):
+		if MeshExport.hasLoopTriangles( mesh ):
+			return True
+		return numpy is not None and hasattr( mesh.tessfaces, 'foreach_get' )
+
+	# Fills NumPy arrays with every section of the mesh, exactly as createSendBufferLoop
+	# packs them: faces (FACE_DTYPE), colours (numFaces x 12 floats, or None), uvs (one
+	# numFaces x 8 floats array per UV layer) and rawVertices (numVertices x 6 floats).
+	# They may be views into the send buffer. Sizes come from getSectionCounts.
+	@staticmethod
+	def fillSections(mesh, faces, colours, uvs, rawVertices):
+		if MeshExport.hasLoopTriangles( mesh ):
+			MeshExport.fillSectionsFromLoopTriangles( mesh, faces, colours, uvs, rawVertices )
+		else:
+			MeshExport.fillSectionsFromTessfaces( mesh, faces, colours, uvs, rawVertices )
+
+	# See fillSections. Same as what Blender would give us as tessfaces, but
+	# triangles only, and with the loops as raw vertices.
+	@staticmethod
+	def fillSectionsFromLoopTriangles(mesh, faces, colours, uvs, rawVertices):
+		loopTriangles = mesh.loop_triangles
+		numFaces = len( faces )
+		numLoops = len( rawVertices )
+
+		cornerLoops = numpy.empty( numFaces * 3, dtype=numpy.int32 )
+		loopTriangles.foreach_get( 'loops', cornerLoops )
+		cornerLoops = cornerLoops.reshape( numFaces, 3 )
+		facesVertices = faces['vertices']
+		facesVertices[:, 0:3] = cornerLoops
+		facesVertices[:, 3] = 0
+		faces['numVertices'] = 3
+
+		faceNormals = numpy.empty( numFaces * 3, dtype=numpy.float32 )
+		loopTriangles.foreach_get( 'normal', faceNormals )
+		faces['normal'] = faceNormals.reshape( numFaces, 3 )
+
+		# Always smooth: loop normals already are the face's normal on flat faces,
+		# and custom/auto smooth normals need to be kept as they are.
+		materialIndex = numpy.empty( numFaces, dtype=numpy.int32 )
+		loopTriangles.foreach_get( 'material_index', materialIndex )
+		faces['flags'] = materialIndex.astype( numpy.uint16 ) | 0x8000
+
+		loopVertices = numpy.empty( numLoops, dtype=numpy.int32 )
+		mesh.loops.foreach_get( 'vertex_index', loopVertices )
+
+		if colours is not None:
+			attribute = MeshExport.getColourAttribute( mesh )
+			colourData = attribute.data
+			colourName = 'color'
+			if len( colourData ) > 0 and 'color_srgb' in colourData[0].bl_rna.properties:
+				# Vertex colours were always sent as stored (sRGB)
+				colourName = 'color_srgb'
+			colour = numpy.empty( len( colourData ) * 4, dtype=numpy.float32 )
+			colourData.foreach_get( colourName, colour )
+			colour = colour.reshape( -1, 4 )[:, 0:3]
+			if getattr( attribute, 'domain', 'CORNER' ) == 'POINT':
+				colour = colour[loopVertices]
+			colours[:, 0:9] = colour[cornerLoops].reshape( numFaces, 9 )
+			colours[:, 9:12] = 0.0
+
+		uvData = numpy.empty( numLoops * 2, dtype=numpy.float32 )
+		for uv, uvLayer in zip( uvs, mesh.uv_layers ):
+			uvLayer.data.foreach_get( 'uv', uvData )
+			uv[:, 0:6] = uvData.reshape( numLoops, 2 )[cornerLoops].reshape( numFaces, 6 )
+			uv[:, 6:8] = 0.0
+
+		numVertices = len( mesh.vertices )
+		vertexData = numpy.empty( numVertices * 3, dtype=numpy.float32 )
+		mesh.vertices.foreach_get( 'co', vertexData )
+		rawVertices[:, 0:3] = vertexData.reshape( numVertices, 3 )[loopVertices]
+		loopNormals = numpy.empty( numLoops * 3, dtype=numpy.float32 )
+		mesh.loops.foreach_get( 'normal', loopNormals )
+		rawVertices[:, 3:6] = loopNormals.reshape( numLoops, 3 )
+
+	# See fillSections
+	@staticmethod
+	def fillSectionsFromTessfaces(mesh, faces, colours, uvs, rawVertices):
+		tessfaces = mesh.tessfaces
+		numFaces = len( faces )
+
+		vertsRaw = numpy.empty( numFaces * 4, dtype=numpy.int32 )
+		tessfaces.foreach_get( 'vertices_raw', vertsRaw )
+		vertsRaw = vertsRaw.reshape( numFaces, 4 )
+		faces['vertices'] = vertsRaw
+		# Blender's tessfaces are triangles when the 4th index is 0; that's
+		# what len( face.vertices ) looks at.
+		faces['numVertices'] = 3 + (vertsRaw[:, 3] != 0)
+
+		faceNormals = numpy.empty( numFaces * 3, dtype=numpy.float32 )
+		tessfaces.foreach_get( 'normal', faceNormals )
+		faces['normal'] = faceNormals.reshape( numFaces, 3 )
+
+		useSmooth = numpy.empty( numFaces, dtype=numpy.bool_ )
+		tessfaces.foreach_get( 'use_smooth', useSmooth )
+		materialIndex = numpy.empty( numFaces, dtype=numpy.int32 )
+		tessfaces.foreach_get( 'material_index', materialIndex )
+		faces['flags'] = (useSmooth.astype( numpy.uint16 ) << 15) | materialIndex.astype( numpy.uint16 )
+
+		if colours is not None:
+			colourData = mesh.tessface_vertex_colors[0].data
+			colour = numpy.empty( numFaces * 3, dtype=numpy.float32 )
+			for i in range( 4 ):
+				colourData.foreach_get( 'color%d' % (i + 1), colour )
+				colours[:, i * 3:i * 3 + 3] = colour.reshape( numFaces, 3 )
+
+		for uv, tessface_uv_texture in zip( uvs, mesh.tessface_uv_textures ):
+			tessface_uv_texture.data.foreach_get( 'uv_raw', uv.reshape( -1 ) )
+
+		numVertices = len( rawVertices )
+		vertexData = numpy.empty( numVertices * 3, dtype=numpy.float32 )
+		mesh.vertices.foreach_get( 'co', vertexData )
+		rawVertices[:, 0:3] = vertexData.reshape( numVertices, 3 )
+		mesh.vertices.foreach_get( 'normal', vertexData )
+		rawVertices[:, 3:6] = vertexData.reshape( numVertices, 3 )
+
+	# Same output as createSendBufferLoop, but every section is read with
+	# foreach_get and written straight into the send buffer (or copied from
+	# sections, readSections' output, if the caller already has it).
+	@staticmethod
+	def createSendBufferVectorized(meshId, meshName, mesh, tangentUvSource, sections=None):
+		nameAsUtfBytes = meshName.encode('utf-8')
+		numFaces, numVertices, hasColour, numUvs = MeshExport.getSectionCounts( mesh )
+
+		bytesNeeded = 4 + 4 + len( nameAsUtfBytes )
+		bytesNeeded += 4 + 4 + 1 + 1 + 1
+		bytesNeeded += numFaces * (31 + hasColour * 48 + numUvs * 32) + numVertices * 24
+		materialIdTable = MeshExport.getMaterialIdTable( mesh )
+		bytesNeeded += 2 + len( materialIdTable ) * 4
+
+		bytesObj = bytearray( bytesNeeded )
+
+		# Mesh ID, Name string and most of data's header
+		struct.pack_into( "=lI", bytesObj, 0, meshId, len( nameAsUtfBytes ) )
+		currentOffset = 8
+		bytesObj[currentOffset:currentOffset+len( nameAsUtfBytes )] = nameAsUtfBytes
+		currentOffset += len( nameAsUtfBytes )
+		struct.pack_into( "=II3B", bytesObj, currentOffset, numFaces, numVertices, hasColour,
+						  numUvs, tangentUvSource )
+		currentOffset += 4 + 4 + 3
+
+		# Views of every section in the buffer
+		faces = numpy.frombuffer( bytesObj, dtype=FACE_DTYPE, count=numFaces, offset=currentOffset )
+		currentOffset += numFaces * 31
+		colours = None
+		if hasColour:
+			colours = numpy.frombuffer( bytesObj, dtype=numpy.float32, count=numFaces * 12,
+										offset=currentOffset ).reshape( numFaces, 12 )
+			currentOffset += numFaces * 48
+		uvs = []
+		for i in range( numUvs ):
+			uvs.append( numpy.frombuffer( bytesObj, dtype=numpy.float32, count=numFaces * 8,
+										  offset=currentOffset ).reshape( numFaces, 8 ) )
+			currentOffset += numFaces * 32
+		rawVertices = numpy.frombuffer( bytesObj, dtype=numpy.float32, count=numVertices * 6,
+										offset=currentOffset ).reshape( numVertices, 6 )
+		currentOffset += numVertices * 24
+
+		if sections is None:
+			MeshExport.fillSections( mesh, faces, colours, uvs, rawVertices )
+		else:
+			faces[...] = sections[0]
+			if colours is not None:
+				colours[...] = sections[1]
+			for uv, srcUv in zip( uvs, sections[2] ):
+				uv[...] = srcUv
+			rawVertices[...] = sections[3]
+		# Release the views, or the buffer can't be resized later
+		del faces, colours, uvs, rawVertices
+
+		# Send the materials
+		struct.pack_into( '=H%sl' % len( materialIdTable ), bytesObj, currentOffset,
+							len( materialIdTable ), *materialIdTable )
+
+		return bytesObj
+
 	@staticmethod
-	def createSendBuffer(meshId, meshName, mesh, tangentUvSource):
+	def createSendBuffer(meshId, meshName, mesh, tangentUvSource, sections=None, meshFormat=0,
+						 tangents=None):
+		if meshFormat:
+			return MeshExport.createSendBufferCompact( meshId, meshName, mesh, tangentUvSource,
+													   meshFormat, sections, tangents )
+		if sections is not None or MeshExport.canVectorize( mesh ):
+			return MeshExport.createSendBufferVectorized( meshId, meshName, mesh, tangentUvSource,
+														  sections )
+		return MeshExport.createSendBufferLoop( meshId, meshName, mesh, tangentUvSource )
+
+	# Original exporter: one struct.pack_into per element. Used when NumPy
+	# isn't available, and as the reference for the vectorized one.
+	@staticmethod
+	def createSendBufferLoop(meshId, meshName, mesh, tangentUvSource):
 		nameAsUtfBytes = meshName.encode('utf-8')
 		hasColour = False
 		
@@ -277,7 +638,6 @@ class MeshExport:
 		# Send the Raw Vertices
 		vertices = mesh.vertices
 		for vertex in vertices:
-			#TODO: Should/could we send weights too? (vertex.groups)
 			position = vertex.co
 			normal = vertex.normal
 			rawVertexStruct.pack_into( bytesObj, currentOffset,
@@ -295,3 +655,510 @@ class MeshExport:
 		currentOffset += 2 + len( materialIdTable )
 
 		return bytesObj
+
+	# Size createSendBuffer would need, minus the name & material table
+	@staticmethod
+	def estimateSendBufferSize(mesh, meshFormat=0):
+		numFaces, numVertices, hasColour, numUvs = MeshExport.getSectionCounts( mesh )
+		faceSize, colourSize, uvSize, rawVertexSize = MeshExport.getElementSizes( meshFormat )
+		if meshFormat & MeshFormat.HasTangents:
+			rawVertexSize += 16
+		return numFaces * (faceSize + hasColour * colourSize + numUvs * uvSize) + \
+			   numVertices * rawVertexSize
+
+	# Bytes per face, face colour, face UV & raw vertex sent with meshFormat (see MeshFormat)
+	@staticmethod
+	def getElementSizes(meshFormat):
+		normalSize = 4 if meshFormat & MeshFormat.CompactNormals else 12
+		return (4 * 4 + normalSize + 2 + 1,
+				16 if meshFormat & MeshFormat.CompactColours else 48,
+				16 if meshFormat & MeshFormat.CompactUvs else 32,
+				(6 if meshFormat & MeshFormat.QuantizedPositions else 12) + normalSize)
+
+	# Octahedral encoding of unit vectors (n x 3) as n x 2 int16 snorm: the
+	# octahedron is unfolded onto a square. See VertexUtils::decodeOctNormal
+	@staticmethod
+	def encodeOctNormals(normals):
+		normals = normals / numpy.maximum( numpy.abs( normals ).sum( axis=1, keepdims=True ), 1e-20 )
+		x = normals[:, 0]
+		y = normals[:, 1]
+		# The lower hemisphere is folded over the diagonals
+		lower = normals[:, 2] < 0.0
+		octX = numpy.where( lower, (1.0 - numpy.abs( y )) * numpy.where( x >= 0.0, 1.0, -1.0 ), x )
+		octY = numpy.where( lower, (1.0 - numpy.abs( x )) * numpy.where( y >= 0.0, 1.0, -1.0 ), y )
+		return numpy.rint( numpy.stack( (octX, octY), axis=1 ) * 32767.0 ).astype( numpy.int16 )
+
+	# Converts sections (see readSections) to the formats meshFormat asks for (see
+	# MeshFormat). Returns (aabb, sections), aabb being what goes in the header
+	# with MeshFormat.QuantizedPositions (empty bytes otherwise).
+	@staticmethod
+	def encodeSections(sections, meshFormat):
+		faces, colours, uvs, rawVertices = sections
+		aabb = b''
+
+		if meshFormat & MeshFormat.CompactNormals:
+			compactFaces = numpy.empty( len( faces ), dtype=COMPACT_FACE_DTYPE )
+			compactFaces['vertices'] = faces['vertices']
+			compactFaces['normal'] = MeshExport.encodeOctNormals( faces['normal'] )
+			compactFaces['flags'] = faces['flags']
+			compactFaces['numVertices'] = faces['numVertices']
+			faces = compactFaces
+
+		if colours is not None and meshFormat & MeshFormat.CompactColours:
+			# Rounded the same way the server rounds floats (see VertexUtils::deindex)
+			rgba = numpy.full( (len( colours ), 4, 4), 255, dtype=numpy.uint8 )
+			rgba[:, :, 0:3] = numpy.clip( colours.reshape( -1, 4, 3 ) * 255.0 + 0.5, 0.0, 255.0 )
+			colours = rgba.reshape( -1, 16 )
+
+		if meshFormat & MeshFormat.CompactUvs:
+			uvs = [uv.astype( numpy.float16 ) for uv in uvs]
+
+		if meshFormat & (MeshFormat.CompactNormals | MeshFormat.QuantizedPositions):
+			positions = rawVertices[:, 0:3]
+			positionType = numpy.float32
+			if meshFormat & MeshFormat.QuantizedPositions:
+				aabbMin = positions.min( axis=0 ) if len( positions ) else numpy.zeros( 3, numpy.float32 )
+				aabbMax = positions.max( axis=0 ) if len( positions ) else numpy.zeros( 3, numpy.float32 )
+				aabb = struct.pack( '=6f', *aabbMin, *aabbMax )
+				extent = aabbMax - aabbMin
+				scale = numpy.where( extent > 0.0, 65535.0 / numpy.maximum( extent, 1e-30 ), 0.0 )
+				positions = numpy.rint( (positions - aabbMin) * scale )
+				positionType = numpy.uint16
+			normalType = (numpy.int16, 2) if meshFormat & MeshFormat.CompactNormals else (numpy.float32, 3)
+			compactVertices = numpy.empty( len( rawVertices ),
+										   dtype=[('position', positionType, 3), ('normal',) + normalType] )
+			compactVertices['position'] = positions
+			if meshFormat & MeshFormat.CompactNormals:
+				compactVertices['normal'] = MeshExport.encodeOctNormals( rawVertices[:, 3:6] )
+			else:
+				compactVertices['normal'] = rawVertices[:, 3:6]
+			rawVertices = compactVertices
+
+		return (aabb, (faces, colours, uvs, rawVertices))
+
+	# FromClient.Mesh message like createSendBufferVectorized's, with every
+	# section in the formats meshFormat asks for (see encodeSections). tangents
+	# (see readTangents) go after the raw vertices, with MeshFormat.HasTangents
+	@staticmethod
+	def createSendBufferCompact(meshId, meshName, mesh, tangentUvSource, meshFormat, sections,
+								tangents=None):
+		nameAsUtfBytes = meshName.encode('utf-8')
+		aabb, (faces, colours, uvs, rawVertices) = MeshExport.encodeSections( sections, meshFormat )
+
+		bytesObj = bytearray( struct.pack( "=lI", meshId, len( nameAsUtfBytes ) ) )
+		bytesObj += nameAsUtfBytes
+		bytesObj += struct.pack( "=II3B", len( faces ), len( rawVertices ),
+								 (colours is not None) | meshFormat, len( uvs ), tangentUvSource )
+		bytesObj += aabb
+
+		bytesObj += faces.tobytes()
+		if colours is not None:
+			bytesObj += colours.tobytes()
+		for uv in uvs:
+			bytesObj += uv.tobytes()
+		bytesObj += rawVertices.tobytes()
+		if tangents is not None:
+			bytesObj += tangents.tobytes()
+
+		materialIdTable = MeshExport.getMaterialIdTable( mesh )
+		bytesObj += struct.pack( '=H%sl' % len( materialIdTable ), len( materialIdTable ),
+								 *materialIdTable )
+		return bytesObj
+
+	# Splits sections (see readSections, encodeSections) into a list of
+	# (MeshSection, [arrays]) in the order they are sent. With soa, faces are sent
+	# as one array per field (FaceIndices, FaceNormals, FaceMaterials, FaceFlags)
+	# instead of FACE_DTYPE. FaceUvs has one array per UV set. tangents (see
+	# readTangents) are sent as RawTangents, if given.
+	@staticmethod
+	def getSectionArrays(sections, soa=False, tangents=None):
+		faces, colours, uvs, rawVertices = sections
+		if soa:
+			flags = faces['flags']
+			retVal = [(MeshSection.FaceIndices, [faces['vertices']]),
+					  (MeshSection.FaceNormals, [faces['normal']]),
+					  (MeshSection.FaceMaterials, [flags & 0x7FFF]),
+					  (MeshSection.FaceFlags, [(faces['numVertices'] |
+												((flags >> 15) << 7)).astype( numpy.uint8 )])]
+		else:
+			retVal = [(MeshSection.Faces, [faces])]
+		if colours is not None:
+			retVal.append( (MeshSection.FaceColours, [colours]) )
+		if uvs:
+			retVal.append( (MeshSection.FaceUvs, uvs) )
+		retVal.append( (MeshSection.RawVertices, [rawVertices]) )
+		if tangents is not None:
+			retVal.append( (MeshSection.RawTangents, [tangents]) )
+		return retVal
+
+	# FromClient.MeshV2 message: same header as createSendBufferCompact's, the material
+	# table, then a table of sections (see getSectionArrays) each one starting at a
+	# multiple of SOA_ALIGNMENT, so the server can read them as plain arrays.
+	@staticmethod
+	def createSendBufferSoa(meshId, meshName, mesh, tangentUvSource, sections, meshFormat=0,
+							tangents=None):
+		nameAsUtfBytes = meshName.encode('utf-8')
+		aabb, encodedSections = MeshExport.encodeSections( sections, meshFormat )
+		faces, colours, uvs, rawVertices = encodedSections
+		sectionArrays = MeshExport.getSectionArrays( encodedSections, soa=True, tangents=tangents )
+
+		header = bytearray( struct.pack( "=lI", meshId, len( nameAsUtfBytes ) ) )
+		header += nameAsUtfBytes
+		header += struct.pack( "=II3B", len( faces ), len( rawVertices ),
+							   (colours is not None) | meshFormat, len( uvs ), tangentUvSource )
+		header += aabb
+		materialIdTable = MeshExport.getMaterialIdTable( mesh )
+		header += struct.pack( '=H%sl' % len( materialIdTable ), len( materialIdTable ),
+							   *materialIdTable )
+		header += struct.pack( '=B', len( sectionArrays ) )
+
+		# Lay out the sections
+		sectionTableStruct = struct.Struct( '=BII' )
+		alignment = MeshExport.SOA_ALIGNMENT
+		currentOffset = len( header ) + len( sectionArrays ) * sectionTableStruct.size
+		sectionOffsets = []
+		for section, arrays in sectionArrays:
+			currentOffset = (currentOffset + alignment - 1) // alignment * alignment
+			sectionOffsets.append( currentOffset )
+			currentOffset += sum( array.nbytes for array in arrays )
+
+		bytesObj = bytearray( currentOffset )
+		bytesObj[0:len( header )] = header
+		currentOffset = len( header )
+		for (section, arrays), sectionOffset in zip( sectionArrays, sectionOffsets ):
+			sectionTableStruct.pack_into( bytesObj, currentOffset, section, sectionOffset,
+										  sum( array.nbytes for array in arrays ) )
+			currentOffset += sectionTableStruct.size
+
+		# Copy every array straight into its place (padding stays zeroed)
+		for (section, arrays), currentOffset in zip( sectionArrays, sectionOffsets ):
+			for array in arrays:
+				if array.size:
+					dst = numpy.frombuffer( bytesObj, dtype=array.dtype, count=array.size,
+											offset=currentOffset )
+					dst.reshape( array.shape )[...] = array
+					# Release the view, or the buffer can't be resized later
+					del dst
+				currentOffset += array.nbytes
+
+		return bytesObj
+
+	# FromClient.MeshIndexed message: the vertices already deindexed and welded
+	# (see indexSections), their indices and each triangle's material, so the server
+	# skips DeindexTask & shrinkVertexBuffer. Vertices are always floats: of meshFormat
+	# only the flags that affect the vertex buffer are kept (no QuantizedPositions),
+	# and MeshFormat.HasTangents is set iff tangents (see readTangents) are given.
+	@staticmethod
+	def createSendBufferIndexed(meshId, meshName, mesh, tangentUvSource, sections, meshFormat=0,
+								tangents=None):
+		nameAsUtfBytes = meshName.encode('utf-8')
+		vertices, indices, materialIds = MeshExport.indexSections( sections, tangents )
+		numUvs = vertices.dtype['uv'].shape[0] if 'uv' in vertices.dtype.names else 0
+		hasColour = 'colour' in vertices.dtype.names
+		meshFormat &= ~(MeshFormat.QuantizedPositions | MeshFormat.HasTangents)
+		if tangents is not None:
+			meshFormat |= MeshFormat.HasTangents
+
+		header = bytearray( struct.pack( "=lI", meshId, len( nameAsUtfBytes ) ) )
+		header += nameAsUtfBytes
+		header += struct.pack( "=II3B", len( vertices ), len( materialIds ), hasColour | meshFormat,
+							   numUvs, tangentUvSource )
+		materialIdTable = MeshExport.getMaterialIdTable( mesh )
+		header += struct.pack( '=H%sl' % len( materialIdTable ), len( materialIdTable ),
+							   *materialIdTable )
+
+		materialIds = materialIds.astype( numpy.uint16 )
+		bytesObj = bytearray( len( header ) + vertices.nbytes + indices.nbytes + materialIds.nbytes )
+		bytesObj[0:len( header )] = header
+		currentOffset = len( header )
+		for array in (vertices, indices, materialIds):
+			if array.size:
+				dst = numpy.frombuffer( bytesObj, dtype=array.dtype, count=array.size,
+										offset=currentOffset )
+				dst[...] = array
+				del dst
+			currentOffset += array.nbytes
+
+		return bytesObj
+
+	# Yields FromClient.MeshChunk messages for one section: each chunk holds as many
+	# elements as fit in chunkSizeBytes, packed into it by packElement( buffer, offset, element )
+	@staticmethod
+	def generateChunks( meshId, section, elements, elementSize, packElement,
+						chunkSizeBytes, firstElement=0 ):
+		chunkHeaderStruct = struct.Struct( "=lBI" )
+		elementsPerChunk = max( chunkSizeBytes // elementSize, 1 )
+		numElements = len( elements )
+		elementIt = iter( elements )
+
+		for chunkStart in range( 0, numElements, elementsPerChunk ):
+			numInChunk = min( elementsPerChunk, numElements - chunkStart )
+			bytesObj = bytearray( chunkHeaderStruct.size + numInChunk * elementSize )
+			chunkHeaderStruct.pack_into( bytesObj, 0, meshId, section, firstElement + chunkStart )
+			currentOffset = chunkHeaderStruct.size
+
+			for element in itertools.islice( elementIt, numInChunk ):
+				packElement( bytesObj, currentOffset, element )
+				currentOffset += elementSize
+
+			yield (FromClient.MeshChunk, bytesObj)
+
+	# Same as generateChunks, but the elements are the rows of a NumPy array
+	# (see fillSections), copied chunkSizeBytes at a time.
+	@staticmethod
+	def generateArrayChunks( meshId, section, array, chunkSizeBytes, firstElement=0 ):
+		chunkHeaderStruct = struct.Struct( "=lBI" )
+		elementSize = array[0:1].nbytes
+		elementsPerChunk = max( chunkSizeBytes // max( elementSize, 1 ), 1 )
+
+		for chunkStart in range( 0, len( array ), elementsPerChunk ):
+			bytesObj = bytearray( chunkHeaderStruct.pack( meshId, section, firstElement + chunkStart ) )
+			bytesObj += array[chunkStart:chunkStart + elementsPerChunk].tobytes()
+			yield (FromClient.MeshChunk, bytesObj)
+
+	# Reads every section into new NumPy arrays with fillSections.
+	# Returns (faces, colours, uvs, rawVertices)
+	@staticmethod
+	def readSections(mesh):
+		numFaces, numVertices, hasColour, numUvs = MeshExport.getSectionCounts( mesh )
+		faces = numpy.empty( numFaces, dtype=FACE_DTYPE )
+		colours = None
+		if hasColour:
+			colours = numpy.empty( (numFaces, 12), dtype=numpy.float32 )
+		uvs = [numpy.empty( (numFaces, 8), dtype=numpy.float32 ) for i in range( numUvs )]
+		rawVertices = numpy.empty( (numVertices, 6), dtype=numpy.float32 )
+
+		MeshExport.fillSections( mesh, faces, colours, uvs, rawVertices )
+		return (faces, colours, uvs, rawVertices)
+
+	# Blender's own (MikkTSpace) tangents, the same its bakes use, for MeshFormat.HasTangents:
+	# (numRawVertices, 4) float32 array of tangents & handedness, which is flipped
+	# since the server mirrors V. None if there are none: meshes without loop triangles
+	# (tessfaces share raw vertices between loops), or that Blender refuses (n-gons).
+	@staticmethod
+	def readTangents(mesh, tangentUvSource):
+		if not MeshExport.hasLoopTriangles( mesh ) or tangentUvSource >= len( mesh.uv_layers ):
+			return None
+		try:
+			mesh.calc_tangents( uvmap=mesh.uv_layers[tangentUvSource].name )
+		except RuntimeError as e:
+			print( 'DERGO: mesh %s gets server tangents (%s)' % (mesh.name, e) )
+			return None
+
+		numLoops = len( mesh.loops )
+		tangents = numpy.empty( (numLoops, 4), dtype=numpy.float32 )
+		loopTangents = numpy.empty( numLoops * 3, dtype=numpy.float32 )
+		mesh.loops.foreach_get( 'tangent', loopTangents )
+		tangents[:, 0:3] = loopTangents.reshape( numLoops, 3 )
+		bitangentSigns = numpy.empty( numLoops, dtype=numpy.float32 )
+		mesh.loops.foreach_get( 'bitangent_sign', bitangentSigns )
+		tangents[:, 3] = -bitangentSigns
+		mesh.free_tangents()
+		return tangents
+
+	# Fingerprint of everything in the mesh but positions & normals: counts, indices,
+	# flags, colours, UVs and materials. If it matches the last upload of the mesh,
+	# a MeshVertexUpdate is enough. sections comes from readSections.
+	@staticmethod
+	def computeTopology(mesh, sections, tangentUvSource, meshFormat=0):
+		faces, colours, uvs, rawVertices = sections
+		digest = hashlib.blake2b( digest_size=16 )
+		digest.update( struct.pack( "=II3B", len( faces ), len( rawVertices ),
+									(colours is not None) | meshFormat, len( uvs ), tangentUvSource ) )
+		digest.update( numpy.ascontiguousarray( faces['vertices'] ) )
+		digest.update( numpy.ascontiguousarray( faces['flags'] ) )
+		digest.update( numpy.ascontiguousarray( faces['numVertices'] ) )
+		if colours is not None:
+			digest.update( colours )
+		for uv in uvs:
+			digest.update( uv )
+		materialIdTable = MeshExport.getMaterialIdTable( mesh )
+		digest.update( struct.pack( '=%sl' % len( materialIdTable ), *materialIdTable ) )
+		return digest.digest()
+
+	# Digest of the whole mesh (see MeshCache), from its topology (computeTopology)
+	# plus the positions & normals. The mesh id and name are left out.
+	@staticmethod
+	def computeDigest(topology, sections):
+		faces, colours, uvs, rawVertices = sections
+		digest = hashlib.blake2b( topology, digest_size=16 )
+		digest.update( numpy.ascontiguousarray( faces['normal'] ) )
+		digest.update( rawVertices )
+		return digest.digest()
+
+	# FromClient.MeshVertexUpdate message: just the face normals and raw vertices,
+	# for a mesh whose topology didn't change since it was uploaded.
+	@staticmethod
+	def createVertexUpdate(meshId, sections):
+		faces, colours, uvs, rawVertices = sections
+		bytesObj = bytearray( struct.pack( "=lII", meshId, len( faces ), len( rawVertices ) ) )
+		bytesObj += faces['normal'].tobytes()
+		bytesObj += rawVertices.tobytes()
+		return (FromClient.MeshVertexUpdate, bytesObj)
+
+	# Yields the MeshChunk messages of generateMessages, reading every section
+	# at once with readSections (unless already given). Unlike the loop, the whole
+	# mesh is in memory while the chunks are sent (but only once, as NumPy arrays).
+	# With soa, faces are sent field by field (see getSectionArrays), and so are tangents.
+	@staticmethod
+	def generateChunksVectorized(meshId, mesh, chunkSizeBytes, sections=None, soa=False,
+								 tangents=None):
+		if sections is None:
+			sections = MeshExport.readSections( mesh )
+
+		for section, arrays in MeshExport.getSectionArrays( sections, soa, tangents ):
+			# e.g. UV sets are indexed as uvSet * numFaces + faceIdx
+			firstElement = 0
+			for array in arrays:
+				yield from MeshExport.generateArrayChunks( meshId, section, array, chunkSizeBytes,
+														   firstElement )
+				firstElement += len( array )
+
+	# Same data as createSendBuffer, but as a sequence of (messageType, data):
+	# MeshBegin, then one MeshChunk per chunkSizeBytes of faces, colours, UVs
+	# and raw vertices, then MeshEnd. Only one chunk lives in memory at a time,
+	# and other messages can be sent in between. sections is readSections' output,
+	# if the caller already has it. With meshFormat (see MeshFormat) sections must
+	# be given, and chunks are made of their compact formats (see encodeSections).
+	# soa (Capability.SoaMeshes) sends the faces field by field; sections must be given.
+	# So must they with tangents (see readTangents, MeshFormat.HasTangents).
+	@staticmethod
+	def generateMessages(meshId, meshName, mesh, tangentUvSource, chunkSizeBytes=CHUNK_SIZE,
+						 sections=None, meshFormat=0, soa=False, tangents=None):
+		nameAsUtfBytes = meshName.encode('utf-8')
+		numFaces, numVertices, hasColour, numUvs = MeshExport.getSectionCounts( mesh )
+		aabb = b''
+		if meshFormat:
+			aabb, sections = MeshExport.encodeSections( sections, meshFormat )
+
+		# Mesh ID, Name string and most of data's header
+		bytesObj = bytearray( struct.pack( "=lI", meshId, len( nameAsUtfBytes ) ) )
+		bytesObj.extend( nameAsUtfBytes )
+		bytesObj.extend( struct.pack( "=II3B", numFaces, numVertices, hasColour | meshFormat, numUvs,
+									  tangentUvSource ) )
+		bytesObj.extend( aabb )
+		yield (FromClient.MeshBegin, bytesObj)
+
+		if sections is not None or MeshExport.canVectorize( mesh ):
+			yield from MeshExport.generateChunksVectorized( meshId, mesh, chunkSizeBytes, sections,
+															soa, tangents )
+			yield MeshExport.createMeshEnd( meshId, mesh )
+			return
+
+		faceStruct = struct.Struct( "=4I3fHB" )
+		faceColourStruct = struct.Struct( "=12f" )
+		faceUvStruct = struct.Struct( "=8f" )
+		rawVertexStruct = struct.Struct( "=6f" )
+
+		# Send the faces
+		def packFace( bytesObj, offset, face ):
+			vertsRaw = face.vertices_raw
+			faceStruct.pack_into( bytesObj, offset,
+					vertsRaw[0], vertsRaw[1], vertsRaw[2], vertsRaw[3],
+					face.normal[0], face.normal[1], face.normal[2],
+					(face.use_smooth << 15) | face.material_index,
+					len(face.vertices) )
+
+		yield from MeshExport.generateChunks( meshId, MeshSection.Faces, mesh.tessfaces, 31,
+											  packFace, chunkSizeBytes )
+
+		# Send the vertex colour
+		if hasColour:
+			def packFaceColour( bytesObj, offset, cf ):
+				faceColourStruct.pack_into( bytesObj, offset,
+						cf.color1[0], cf.color1[1], cf.color1[2],
+						cf.color2[0], cf.color2[1], cf.color2[2],
+						cf.color3[0], cf.color3[1], cf.color3[2],
+						cf.color4[0], cf.color4[1], cf.color4[2] )
+
+			yield from MeshExport.generateChunks( meshId, MeshSection.FaceColours,
+												  mesh.tessface_vertex_colors[0].data, 48,
+												  packFaceColour, chunkSizeBytes )
+
+		# Send the UVs
+		def packFaceUv( bytesObj, offset, tf ):
+			faceUvStruct.pack_into( bytesObj, offset, *tf.uv_raw )
+
+		for uvIdx, tessface_uv_texture in enumerate( mesh.tessface_uv_textures ):
+			yield from MeshExport.generateChunks( meshId, MeshSection.FaceUvs,
+												  tessface_uv_texture.data, 32, packFaceUv,
+												  chunkSizeBytes, uvIdx * numFaces )
+
+		# Send the Raw Vertices
+		def packRawVertex( bytesObj, offset, vertex ):
+			position = vertex.co
+			normal = vertex.normal
+			rawVertexStruct.pack_into( bytesObj, offset,
+				position[0], position[1], position[2],
+				normal[0], normal[1], normal[2] )
+
+		yield from MeshExport.generateChunks( meshId, MeshSection.RawVertices, mesh.vertices, 24,
+											  packRawVertex, chunkSizeBytes )
+
+		yield MeshExport.createMeshEnd( meshId, mesh )
+
+	# FromClient.MeshEnd message: the materials
+	@staticmethod
+	def createMeshEnd(meshId, mesh):
+		materialIdTable = MeshExport.getMaterialIdTable( mesh )
+
+		return (FromClient.MeshEnd, struct.pack( '=lH%sl' % len( materialIdTable ), meshId,
+												 len( materialIdTable ), *materialIdTable ))
+
+	# Yields the (messageType, data) to upload the mesh in the best format both
+	# sides support. capabilities is Network.capabilities (see Capability).
+	# sections is readSections' output, if the caller already has it.
+	# meshFormat (see MeshFormat) needs Capability.CompactVertexFormats, and
+	# NumPy: it's ignored if the mesh can't be vectorized. So is Capability.SoaMeshes
+	# (MeshV2), otherwise used whenever the server supports it.
+	# indexed asks for a MeshIndexed (Capability.IndexedMeshes) instead, which is never
+	# chunked; it can't be followed by vertex updates, so the caller decides when.
+	# tangents (see readTangents) need sections; MeshFormat.HasTangents is set iff given.
+	@staticmethod
+	def generateUpload(meshId, meshName, mesh, tangentUvSource, capabilities, sections=None,
+					   meshFormat=0, indexed=False, tangents=None):
+		soa = (capabilities & Capability.SoaMeshes) != 0
+		indexed = indexed and (capabilities & Capability.IndexedMeshes) != 0
+		if tangents is not None and sections is not None:
+			meshFormat |= MeshFormat.HasTangents
+		else:
+			meshFormat &= ~MeshFormat.HasTangents
+			tangents = None
+		if (meshFormat or soa or indexed) and sections is None:
+			if MeshExport.canVectorize( mesh ):
+				sections = MeshExport.readSections( mesh )
+			else:
+				meshFormat = 0
+				soa = False
+				indexed = False
+
+		if indexed:
+			yield (FromClient.MeshIndexed, MeshExport.createSendBufferIndexed( meshId, meshName, mesh,
+																			   tangentUvSource,
+																			   sections, meshFormat,
+																			   tangents ))
+		elif capabilities & Capability.ChunkedMeshes and \
+				MeshExport.estimateSendBufferSize( mesh, meshFormat ) > MeshExport.CHUNK_SIZE:
+			# Stream it, so we never hold the whole thing in memory
+			yield from MeshExport.generateMessages( meshId, meshName, mesh, tangentUvSource,
+													sections=sections, meshFormat=meshFormat,
+													soa=soa, tangents=tangents )
+		elif soa:
+			yield (FromClient.MeshV2, MeshExport.createSendBufferSoa( meshId, meshName, mesh,
+																	  tangentUvSource, sections,
+																	  meshFormat, tangents ))
+		else:
+			yield (FromClient.Mesh, MeshExport.createSendBuffer( meshId, meshName, mesh,
+																  tangentUvSource, sections,
+																  meshFormat, tangents ))
+
+# What MeshExport needs from a mesh besides its sections (see readSections): the
+# counts of getSectionCounts and the material ids. Unlike bpy's meshes, it can be
+# used from any thread and outlives the mesh (e.g. the ones from Object.to_mesh).
+# See MeshExportPipeline
+class MeshSnapshot:
+	__slots__ = ("sectionCounts", "materialIdTable")
+
+	def __init__(self, mesh):
+		self.sectionCounts = MeshExport.getSectionCounts( mesh )
+		self.materialIdTable = MeshExport.getMaterialIdTable( mesh )
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+import collections
+import concurrent.futures
+
+# Also importable outside of the add-on (see Tests/)
+try:
+	from .mesh_export import MeshExport
+	from .network import Capability
+except ImportError:
+	from mesh_export import MeshExport
+	from network import Capability
+
+# Exports many meshes at once (e.g. the whole scene after a reset or loading a
+# file). Only the main thread may touch bpy, so all it does is copy each mesh
+# into NumPy arrays (MeshExport.readSections) and submit them along with a
+# MeshSnapshot. A pool of threads does the rest, which mostly releases the GIL:
+# hashing (computeTopology, computeDigest), encoding and assembling the messages
+# (generateUpload) and compressing them (Network.compressPayload).
+#
+# Results are handed back on the main thread in the order they were submitted
+# (see finish), so that whatever depends on them (MeshCache, Items linking to
+# the meshes) happens exactly as if they were exported one after another. Only
+# maxPending meshes are in flight at a time: submitting one more first finishes
+# the oldest, which bounds the memory used, and lets the network start sending
+# while the main thread keeps reading meshes.
+class MeshExportPipeline:
+	MAX_PENDING = 64
+
+	def __init__( self, numThreads, maxPending=MAX_PENDING ):
+		self.executor = concurrent.futures.ThreadPoolExecutor( max_workers=numThreads,
+															   thread_name_prefix='DERGO export' )
+		self.maxPending = maxPending
+		# (future, onDone) in submission order
+		self.pending = collections.deque()
+
+	# Drops whatever is in flight, and waits for the threads to exit
+	def shutdown( self ):
+		self.discard()
+		self.executor.shutdown( wait=True )
+
+	# Runs job( *args ) in the pool. finish() calls onDone( result ) on the calling
+	# thread afterwards. Exceptions raised by job are raised by finish().
+	def submit( self, onDone, job, *args ):
+		if len( self.pending ) >= self.maxPending:
+			self.finishOldest()
+		self.pending.append( (self.executor.submit( job, *args ), onDone) )
+
+	# Calls onDone() right after the onDone of every job submitted so far
+	# (right away if there's none in flight).
+	def defer( self, onDone ):
+		if not self.pending:
+			onDone()
+		else:
+			self.pending.append( (None, lambda result: onDone()) )
+
+	def finishOldest( self ):
+		future, onDone = self.pending.popleft()
+		onDone( future.result() if future is not None else None )
+
+	# Waits for every submitted job, and calls their onDone in submission order
+	def finish( self ):
+		while self.pending:
+			self.finishOldest()
+
+	# Forgets every submitted job without calling their onDone (e.g. we
+	# lost the connection halfway through finish)
+	def discard( self ):
+		for future, onDone in self.pending:
+			if future is not None:
+				future.cancel()
+		self.pending.clear()
+
+	# Job of Engine.queueMeshUpload: everything it needs to decide what to send, and the
+	# messages to send. mesh is a MeshSnapshot, sections readSections' output.
+	# If topology matches lastTopology (see MeshCache.getTopology) only positions &
+	# normals are sent. Returns (topology, digest, [(messageType, data, compressed)])
+	# with compressed as Network.compressPayload returned it. The messages are built
+	# even if MeshCache ends up finding the digest: it's cheaper than waiting for it.
+	# Full uploads come from diskCache (a MeshDiskCache) when there's one. indexed sends
+	# a MeshIndexed (see Engine.canUploadIndexed), whose topology is returned as None.
+	# tangents come from MeshExport.readTangents, read beforehand like the sections.
+	@staticmethod
+	def prepareUpload( network, diskCache, meshId, meshName, mesh, sections, tangentUvSource,
+					   meshFormat, lastTopology, indexed=False, tangents=None ):
+		topology = MeshExport.computeTopology( mesh, sections, tangentUvSource, meshFormat )
+		digest = MeshExport.computeDigest( topology, sections )
+
+		if topology == lastTopology and network.hasCapability( Capability.VertexUpdates ):
+			messages = [MeshExport.createVertexUpdate( meshId, sections )]
+		elif diskCache is not None:
+			messages = diskCache.getUpload( network, digest, meshId, meshName, mesh, tangentUvSource,
+											sections, meshFormat, indexed, tangents )
+			return (None if indexed else topology, digest, messages)
+		else:
+			messages = MeshExport.generateUpload( meshId, meshName, mesh, tangentUvSource,
+												  network.capabilities, sections, meshFormat,
+												  indexed, tangents )
+			if indexed:
+				topology = None
+
+		return (topology, digest, [(messageType, data, network.compressPayload( messageType, data ))
+								   for messageType, data in messages])
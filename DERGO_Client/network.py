@@ -1,7 +1,21 @@
 #!/usr/bin/python
 
+import queue
 import socket
 import struct
+import threading
+import time
+from collections import deque
+
+# Also importable outside of the add-on (see Tests/)
+try:
+	from .transport import *
+	from . import compression
+	from .compression import Codec
+except ImportError:
+	from transport import *
+	import compression
+	from compression import Codec
 
 class FromClient:
 	ConnectionTest, \
@@ -25,68 +39,934 @@ class FromClient:
 	Render, \
 	InitAsync, \
 	FinishAsync, \
-	NumClientMessages = range( 22 )
+	Export, \
+	SharedMemoryInit, \
+	SharedMemoryData, \
+	ChannelInit, \
+	Barrier, \
+	MeshBegin, \
+	MeshChunk, \
+	MeshEnd, \
+	CompressionInit, \
+	Handshake, \
+	MeshVertexUpdate, \
+	MeshSkin, \
+	MeshSkinPose, \
+	MeshV2, \
+	MeshIndexed, \
+	NumClientMessages = range( 37 )
+
+# Sections of a mesh in MeshChunk & MeshV2 messages. FaceIndices, FaceNormals,
+# FaceMaterials & FaceFlags are the fields of Faces as separate arrays
+# (Capability.SoaMeshes). RawTangents: one float4 per raw vertex, with
+# MeshFormat.HasTangents (Capability.ClientTangents)
+class MeshSection:
+	Faces, \
+	FaceColours, \
+	FaceUvs, \
+	RawVertices, \
+	FaceIndices, \
+	FaceNormals, \
+	FaceMaterials, \
+	FaceFlags, \
+	RawTangents = range( 9 )
+
+# Flags in the hasColour byte of Mesh & MeshBegin, if both sides have
+# Capability.CompactVertexFormats (or the capability that goes with the flag,
+# if noted). Must match Network::MeshFormat in the server.
+class MeshFormat:
+	HasColour			= 1 << 0
+	CompactNormals		= 1 << 1	# Octahedral, 2x int16 snorm
+	CompactColours		= 1 << 2	# 4x uint8 (rgba, alpha unused)
+	CompactUvs			= 1 << 3	# 2x float16
+	QuantizedPositions	= 1 << 4	# 3x uint16 unorm within the AABB in the header
+	HasTangents			= 1 << 5	# Blender's tangents, Capability.ClientTangents
+	# Whether the server removes duplicated vertices, Capability.VertexOptimization.
+	# Neither: it decides, and skips meshes being edited until they settle
+	OptimizeAlways		= 1 << 6
+	OptimizeNever		= 1 << 7
+
+# What FromServer.Resync asks us to send again
+class ResyncEntity:
+	Mesh, \
+	Item, \
+	Material = range( 3 )
 	
 class FromServer:
 	ConnectionTest, \
 	Resync, \
 	Result, \
-	NumServerMessages = range( 4 )
+	SharedMemoryResult, \
+	Handshake, \
+	NumServerMessages = range( 6 )
+
+# Bumped whenever the wire format changes in a way capabilities can't express
+PROTOCOL_VERSION = 1
+
+# Optional features, negotiated in the Handshake. Only what both sides
+# support can be used. Must match Network::Capabilities in the server.
+class Capability:
+	CompressionZlib			= 1 << 0
+	CompressionLz4			= 1 << 1
+	ChunkedMeshes			= 1 << 2	# MeshBegin, MeshChunk, MeshEnd
+	SharedMemory			= 1 << 4	# SharedMemoryInit, SharedMemoryData
+	CompactVertexFormats	= 1 << 5	# MeshFormat flags in Mesh & MeshBegin
+	BulkChannel				= 1 << 6	# ChannelInit, Barrier
+	VertexUpdates			= 1 << 7	# MeshVertexUpdate
+	Skinning				= 1 << 8	# MeshSkin, MeshSkinPose
+	SoaMeshes				= 1 << 9	# MeshV2, MeshSection.FaceIndices & co.
+	IndexedMeshes			= 1 << 10	# MeshIndexed
+	ClientTangents			= 1 << 11	# MeshFormat.HasTangents, MeshSection.RawTangents
+	VertexOptimization		= 1 << 12	# MeshFormat.OptimizeAlways, OptimizeNever
+
+	CODECS = { Codec.Zlib: CompressionZlib, Codec.Lz4: CompressionLz4 }
+
+# One connection to the server. Network uses one (Interactive) or two, in
+# which case big uploads go through the Bulk one so they don't hold back
+# camera updates. See Network.sendData
+class Channel:
+	Interactive	= 0
+	Bulk		= 1
+
+	def __init__( self, sock, index ):
+		self.socket = sock
+		self.index = index
+
+		# Batching. See Network.beginBatch()
+		self.batchBuffer = bytearray()
+
+		# Threaded mode. See Network.startThreads()
+		self.senderThread = None
+		self.sendCondition = threading.Condition()
+		self.sendQueue = deque()
+		self.sendQueueHigh = deque()
+		self.sendQueueBytes = 0
+		self.resetQueueStats()
+
+		# Ordering between channels. See Network.sendData()
+		self.numOrderedSent = 0
+		self.lastBarrier = 0
+
+	def resetQueueStats( self ):
+		self.maxQueueBytes = 0
+		self.maxQueueMessages = 0
+		self.numQueueWaits = 0
+		self.queueWaitTime = 0.0
+		self.numQueueSent = 0
+		self.queueLatency = 0.0
 
 class Network:
+	# Initial size of the receive buffer. Big enough to hold a Full HD
+	# Result frame, so that we don't need to grow on the first redraw.
+	INITIAL_RCV_BUFFER_SIZE = 16 * 1024 * 1024
+	# While batching, flush early once this many bytes have accumulated.
+	# Payloads at least this big are never copied into the batch.
+	BATCH_FLUSH_THRESHOLD = 256 * 1024
+	# Threaded mode: sendData blocks once this many bytes are waiting
+	# to be sent (but a single message bigger than this is still accepted).
+	SEND_QUEUE_MAX_BYTES = 64 * 1024 * 1024
+	# Threaded mode: these jump ahead of everything else already queued
+	# (e.g. camera updates while a huge mesh is waiting to be sent).
+	HIGH_PRIORITY_MESSAGES = frozenset( (FromClient.ConnectionTest, FromClient.Render,
+										 FromClient.InitAsync, FromClient.FinishAsync) )
+	# With a bulk channel, these go through it
+	BULK_MESSAGES = frozenset( (FromClient.Mesh, FromClient.MeshV2, FromClient.MeshIndexed,
+								FromClient.MeshBegin, FromClient.MeshChunk, FromClient.MeshEnd,
+								FromClient.MeshVertexUpdate, FromClient.MeshSkin, FromClient.Texture,
+								FromClient.ExportToFile) )
+	# Messages that don't modify the scene, and hence the server processes them as soon
+	# as they arrive, even if they have to wait for the other channel to catch up.
+	# Everything else is 'ordered' and gets processed in the same order we sent it.
+	# Must match isOrderedMessage in the server.
+	UNORDERED_MESSAGES = HIGH_PRIORITY_MESSAGES | frozenset( (FromClient.Handshake,
+															  FromClient.ChannelInit,
+															  FromClient.SharedMemoryInit,
+															  FromClient.CompressionInit,
+															  FromClient.Barrier) )
+	# Set in the header's messageType when the payload is compressed
+	COMPRESSED_FLAG = 0x80
+	# With compression enabled, only payloads at least this big get compressed.
+	# FromClient message types not listed here are never compressed.
+	COMPRESSION_THRESHOLDS = {
+		FromClient.Mesh:				64 * 1024,
+		FromClient.MeshV2:				64 * 1024,
+		FromClient.MeshIndexed:			64 * 1024,
+		FromClient.MeshChunk:			64 * 1024,
+		FromClient.MeshVertexUpdate:	64 * 1024,
+		FromClient.MeshSkin:			64 * 1024,
+		FromClient.Texture:				64 * 1024,
+		}
+	# Same, for the Result frames the server sends (see enableCompression)
+	RESULT_COMPRESSION_THRESHOLD = 64 * 1024
+	# With a shared memory transport, payloads at least this big
+	# go through the upload ring instead of the socket.
+	SHARED_MEMORY_THRESHOLD = 64 * 1024
+	# Seconds connect() waits for the server to answer the Handshake
+	HANDSHAKE_TIMEOUT = 10.0
+	# Seconds tryReconnect() waits after a failed attempt. Doubles every
+	# time, up to RECONNECT_MAX_DELAY
+	RECONNECT_MIN_DELAY = 0.25
+	RECONNECT_MAX_DELAY = 8.0
+	DEFAULT_PORT = 9995
+
 	def __init__( self ):
 		self.headerStruct = struct.Struct( "=IB" )
-		self.stream = bytearray()
-		
+
 		self.HEADER_SIZE = 5
 
-	def connect( self ):
-		self.socket = socket.socket()	# Create a socket object
-		host = socket.gethostname() 	# Get local machine name
-		port = 9995						# Reserve a port for your service.
-		self.socket.connect( (host, port) )
+		# Receive buffer. Unprocessed data lives in [rcvHead; rcvTail).
+		# recv_into() writes straight into it and handlers get a memoryview
+		# of each message, so nothing is copied. The pending bytes are only
+		# moved back to the start when we run out of space at the end.
+		self.rcvBuffer = bytearray( Network.INITIAL_RCV_BUFFER_SIZE )
+		self.rcvView = memoryview( self.rcvBuffer )
+		self.rcvHead = 0
+		self.rcvTail = 0
+
+		# See useSockets(). We only receive from the interactive one (self.socket)
+		self.socket = None
+		self.channels = []
+
+		# Batching. See beginBatch()
+		self.batchDepth = 0
+		self.batchFlushThreshold = Network.BATCH_FLUSH_THRESHOLD
+
+		# Statistics
+		self.logStats = False
+		self.numSendSyscalls = 0
+		self.numBatchedMessages = 0
+		self.numBatchFlushes = 0
+		self.numBatchBytes = 0
+
+		# Threaded mode. See startThreads()
+		self.threaded = False
+		self.stopThreads = False
+		self.threadError = None
+		self.receiverThread = None
+		self.sendQueueMaxBytes = Network.SEND_QUEUE_MAX_BYTES
+		self.inbox = queue.Queue()
+
+		# Shared memory. See transport.py
+		self.transport = None
+		self.uploadRing = None
+		self.resultView = None
+		self.resultSize = 0
+		self.numDroppedResults = 0
+		self.sharedMemoryStruct = struct.Struct( "=BQI" )
+
+		# Compression. See enableCompression()
+		self.compressionCodec = Codec.Uncompressed
+		self.compressionLevel = 1
+		self.compressionThresholds = dict( Network.COMPRESSION_THRESHOLDS )
+		self.resultCompressionThreshold = Network.RESULT_COMPRESSION_THRESHOLD
+		self.numCompressedBytesIn = 0
+		self.numCompressedBytesOut = 0
+
+		# Negotiated in connect(). See Capability
+		self.capabilities = 0
+		self.serverVersion = None
+		# True once the server turned out to predate the Handshake. See openConnection()
+		self.legacyServer = False
+
+		# Reconnect. See tryReconnect()
+		self.connected = False
+		self.bulkChannel = False
+		self.requestedCompression = None
+		self.restartThreads = False
+		self.reconnectDelay = Network.RECONNECT_MIN_DELAY
+		self.nextReconnectTime = 0.0
+		self.disconnectTime = None
+		self.numReconnectAttempts = 0
+		# Set to a PayloadCache to replay the scene after reconnecting
+		self.payloadCache = None
+
+	# transport defaults to TCP on this machine's port 9995
+	# If bulkChannel is True, a second connection is opened for Mesh, Texture & ExportToFile.
+	# It only helps in threaded mode; otherwise the UI still waits for the upload.
+	def connect( self, transport=None, bulkChannel=False ):
+		if transport is None:
+			transport = TcpTransport( socket.gethostname(), Network.DEFAULT_PORT )
+		if transport is not self.transport:
+			self.legacyServer = False
+		self.transport = transport
+		self.bulkChannel = bulkChannel
+		try:
+			self.openConnection()
+		except Exception:
+			self.closeConnection()
+			raise
+
+	def openConnection( self ):
+		transport = self.transport
+		sock = transport.connect()
+		self.useSockets( sock )
+		if self.legacyServer:
+			# Reconnecting to it. Don't make it drop us again
+			self.serverVersion = 0
+		elif not self.handshake():
+			# Servers older than the Handshake drop the connection on message types
+			# they don't know. Start over without it: protocol 0, no optional feature.
+			print( 'DERGO: server closed the connection on the handshake, it is probably too old. '
+				   'Optional features disabled' )
+			self.closeConnection()
+			self.useSockets( transport.connect() )
+			self.serverVersion = 0
+			self.legacyServer = True
+
+		if self.bulkChannel:
+			if self.hasCapability( Capability.BulkChannel ):
+				self.openBulkChannel( transport.openSocket() )
+			else:
+				print( 'DERGO: server does not support a bulk channel. Using a single connection' )
+
+		if transport.uploadRing and not self.hasCapability( Capability.SharedMemory ):
+			print( 'DERGO: server does not support shared memory. Sending everything through %s' %\
+				   str( transport.controlTransport ) )
+		elif transport.uploadRing:
+			# Must go through the channel that will use the ring, before any upload.
+			self.sendMessage( self.channels[-1], FromClient.SharedMemoryInit,
+							  memoryview( transport.getInitMessage() ) )
+			self.uploadRing = transport.uploadRing
+			self.resultView = transport.resultSegment.buf
+			self.resultSize = transport.resultSize
+
+	# Capabilities we could use if the server supports them too
+	def getLocalCapabilities( self ):
+		retVal = Capability.ChunkedMeshes | Capability.BulkChannel | Capability.VertexUpdates | \
+				 Capability.Skinning | Capability.CompactVertexFormats | Capability.SoaMeshes | \
+				 Capability.IndexedMeshes | Capability.ClientTangents | Capability.VertexOptimization
+		if shared_memory is not None:
+			retVal |= Capability.SharedMemory
+		for codec, capability in Capability.CODECS.items():
+			if compression.getSupportedCodecs() & (1 << codec):
+				retVal |= capability
+		return retVal
+
+	# True if both us and the server support it. See Capability
+	def hasCapability( self, capability ):
+		return (self.capabilities & capability) != 0
+
+	# Tells the server our version and capabilities, and waits for its own.
+	# Must be the first thing sent; connect() does it.
+	# Returns False if the server closed the connection instead of answering,
+	# which is what servers older than it do; see openConnection().
+	# Raises ConnectionError if it doesn't answer in HANDSHAKE_TIMEOUT.
+	def handshake( self ):
+		self.serverVersion = None
+		self.capabilities = 0
+		self.sendMessage( self.channels[Channel.Interactive], FromClient.Handshake,
+						  memoryview( struct.pack( '=II', PROTOCOL_VERSION,
+												   self.getLocalCapabilities() ) ) )
+
+		# The server doesn't send anything else before answering. Just in case,
+		# keep it where the receiver thread would have put it.
+		callbackObj = InboxWriter( self.inbox )
+		self.socket.settimeout( Network.HANDSHAKE_TIMEOUT )
+		try:
+			while self.serverVersion is None:
+				self.receiveFromSocket( callbackObj )
+		except socket.timeout:
+			raise ConnectionError( "server did not answer the handshake in %.0f s" %\
+								   Network.HANDSHAKE_TIMEOUT )
+		except ConnectionError:
+			return False
+		finally:
+			self.socket.settimeout( None )
+
+		if self.serverVersion != PROTOCOL_VERSION:
+			print( 'DERGO: server uses protocol version %d, we use %d. Optional features disabled' %\
+				   (self.serverVersion, PROTOCOL_VERSION) )
+			self.capabilities = 0
+		return True
+
+	# Compresses big payloads (see COMPRESSION_THRESHOLDS) with the given
+	# codec, level 1 (fastest) to 9 (smallest). compressResults asks the
+	# server to compress Result frames too.
+	# If the server can't decode the codec, things just go uncompressed.
+	# If we're not connected, it's applied once tryReconnect() succeeds.
+	def enableCompression( self, codec, level=1, compressResults=False ):
+		self.requestedCompression = (codec, level, compressResults)
+		if not self.connected:
+			return
+		if not self.hasCapability( Capability.CODECS.get( codec, 0 ) ):
+			print( 'DERGO: compression codec %d is not supported by both sides. Sending uncompressed' %\
+				   codec )
+			return
+
+		self.compressionCodec = codec
+		self.compressionLevel = level
+		resultCodec = codec if compressResults else Codec.Uncompressed
+		self.sendData( FromClient.CompressionInit,
+					   struct.pack( '=2BI', resultCodec, level,
+									self.resultCompressionThreshold ) )
+
+	# Uses already connected sockets. Mostly for testing; connect() also
+	# does the handshake, without it no capability is used.
+	def useSockets( self, sock, bulkSock=None ):
+		self.socket = sock
+		self.channels = [Channel( sock, Channel.Interactive )]
+		self.rcvHead = 0
+		self.rcvTail = 0
+		self.connected = True
+		if bulkSock:
+			self.openBulkChannel( bulkSock )
+
+	# Must be called before sending anything else
+	def openBulkChannel( self, bulkSock ):
+		self.channels.append( Channel( bulkSock, Channel.Bulk ) )
+		for channel in self.channels:
+			self.sendMessage( channel, FromClient.ChannelInit,
+							  memoryview( struct.pack( '=B', channel.index ) ) )
 
 	def disconnect( self ):
-		self.socket.close()
-		
-	def sendData( self, messageType, data ):
+		self.closeConnection()
+		self.transport = None
+
+	# Closes the sockets and the transport, but keeps the settings around
+	# so that tryReconnect() can open them again.
+	def closeConnection( self ):
+		self.connected = False
+		self.stopAndJoinThreads()
+		for channel in self.channels:
+			channel.socket.close()
+		self.channels = []
+		self.socket = None
+		self.compressionCodec = Codec.Uncompressed
+		self.capabilities = 0
+		if self.transport:
+			self.uploadRing = None
+			if self.resultView:
+				self.resultView.release()
+				self.resultView = None
+			self.transport.close()
+
+	# Called when sending or receiving failed. Drops the connection; see tryReconnect()
+	def connectionLost( self, error ):
+		if not self.connected:
+			return
+		print( 'DERGO: lost connection to the server: %s' % str( error ) )
+		# It may be lost again before tryReconnect() got to restart them
+		self.restartThreads = self.restartThreads or self.threaded
+		self.closeConnection()
+		# Whatever the receiver thread left there belongs to the old connection
+		self.inbox = queue.Queue()
+		self.disconnectTime = time.perf_counter()
+		self.numReconnectAttempts = 0
+		self.reconnectDelay = Network.RECONNECT_MIN_DELAY
+		self.nextReconnectTime = 0.0
+
+	# Call regularly (e.g. on every redraw) while not connected. Connects again
+	# with the same settings, but no more often than reconnectDelay, which doubles
+	# after every failed attempt (exponential backoff). Once connected, the server
+	# is Reset and the payloadCache (if any) is replayed, so that it ends up with
+	# the same scene it had. Returns True if we're connected.
+	def tryReconnect( self ):
+		if self.connected:
+			return True
+		if self.transport is None:
+			return False
+
+		now = time.perf_counter()
+		if now < self.nextReconnectTime:
+			return False
+
+		self.numReconnectAttempts += 1
+		try:
+			self.connect( self.transport, self.bulkChannel )
+		except (OSError, RuntimeError):
+			self.nextReconnectTime = now + self.reconnectDelay
+			self.reconnectDelay = min( self.reconnectDelay * 2.0, Network.RECONNECT_MAX_DELAY )
+			return False
+
+		connectedTime = time.perf_counter()
+		numEntities = 0
+		try:
+			if self.requestedCompression:
+				self.enableCompression( *self.requestedCompression )
+			if self.restartThreads:
+				self.startThreads()
+
+			self.beginBatch()
+			try:
+				self.sendPayload( FromClient.Reset, memoryview( bytes( 0 ) ) )
+				if self.payloadCache:
+					numEntities = self.payloadCache.getNumEntities()
+					for messageType, payload in self.payloadCache.generateReplay():
+						self.sendPayload( messageType, payload )
+			finally:
+				self.endBatch()
+		except OSError as e:
+			# e.g. the server went down again during the replay
+			self.connectionLost( e )
+			return False
+		replayTime = time.perf_counter() - connectedTime
+
+		downTime = 'n/a' if self.disconnectTime is None else\
+				   '%.2f s' % (connectedTime - self.disconnectTime)
+		print( 'DERGO: reconnected to %s after %d attempts (down for %s). '\
+			   'Replayed %d entities, %.1f MB in %.2f ms%s' %\
+			   (str( self.transport ), self.numReconnectAttempts, downTime, numEntities,
+				self.payloadCache.sizeBytes / (1024.0 * 1024.0) if self.payloadCache else 0.0,
+				replayTime * 1000.0, ' (queued)' if self.threaded else '') )
+		self.reconnectDelay = Network.RECONNECT_MIN_DELAY
+		self.disconnectTime = None
+		return True
+
+	# Moves all socket I/O to background threads, so that the UI thread
+	# never waits for the kernel to accept a big upload:
+	#	* sendData only queues the message. A sender thread per channel
+	#	  writes it. High priority messages (see HIGH_PRIORITY_MESSAGES) go first.
+	#	* A receiver thread parses incoming messages and puts a copy of them
+	#	  into an inbox, which receiveData drains on the calling thread.
+	# If we're not connected, they're started once tryReconnect() succeeds.
+	def startThreads( self ):
+		assert( not self.threaded )
+		if not self.connected:
+			self.restartThreads = True
+			return
+		self.threaded = True
+		self.stopThreads = False
+		self.threadError = None
+		for channel in self.channels:
+			channel.senderThread = threading.Thread( target=self.senderThreadMain, args=(channel,),
+													 name='DERGO sender %d' % channel.index,
+													 daemon=True )
+			channel.senderThread.start()
+		self.receiverThread = threading.Thread( target=self.receiverThreadMain,
+												name='DERGO receiver', daemon=True )
+		self.receiverThread.start()
+
+	# Stops the background threads, dropping whatever is still queued. The
+	# sockets are shut down first: a sender blocked writing to a server that
+	# stopped reading, or the receiver blocked in recv, would never return.
+	def stopAndJoinThreads( self ):
+		if not self.threaded:
+			return
+		self.stopThreads = True
+		for channel in self.channels:
+			with channel.sendCondition:
+				for queued in (channel.sendQueue, channel.sendQueueHigh):
+					channel.sendQueueBytes -= sum( entry[1] for entry in queued )
+				channel.sendQueue.clear()
+				channel.sendQueueHigh.clear()
+				channel.sendCondition.notify_all()
+			try:
+				channel.socket.shutdown( socket.SHUT_RDWR )
+			except OSError:
+				pass
+		for channel in self.channels:
+			channel.senderThread.join()
+			channel.senderThread = None
+		self.receiverThread.join()
+		self.receiverThread = None
+		self.threaded = False
+
+	def senderThreadMain( self, channel ):
+		try:
+			while True:
+				with channel.sendCondition:
+					while not channel.sendQueueHigh and not channel.sendQueue and not self.stopThreads:
+						channel.sendCondition.wait()
+					if channel.sendQueueHigh:
+						entry = channel.sendQueueHigh.popleft()
+					elif channel.sendQueue:
+						entry = channel.sendQueue.popleft()
+					else:
+						return	# Stopped, and nothing left to send
+					queuedTime, numBytes, buffers = entry
+					channel.queueLatency += time.perf_counter() - queuedTime
+					channel.numQueueSent += 1
+				self.writeBuffers( channel.socket, buffers )
+				del entry, buffers
+				with channel.sendCondition:
+					channel.sendQueueBytes -= numBytes
+					channel.sendCondition.notify_all()
+		except OSError as e:
+			self.threadError = e
+			with channel.sendCondition:
+				channel.sendCondition.notify_all()
+
+	def receiverThreadMain( self ):
+		inboxWriter = InboxWriter( self.inbox )
+		try:
+			while True:
+				self.receiveFromSocket( inboxWriter )
+		except (OSError, RuntimeError) as e:
+			# Hand it over to whoever is waiting on the inbox
+			if not self.stopThreads:
+				self.inbox.put( e )
+
+	# Queues the buffers for the channel's sender thread. Blocks while the queue
+	# is full (high priority messages are small and never wait).
+	# The buffers are not copied: their contents must not be modified afterwards.
+	def queueBuffers( self, channel, buffers, highPriority ):
+		numBytes = sum( buf.nbytes for buf in buffers )
+		with channel.sendCondition:
+			if not highPriority and channel.sendQueueBytes > 0 and \
+					channel.sendQueueBytes + numBytes > self.sendQueueMaxBytes:
+				startTime = time.perf_counter()
+				while self.threadError is None and channel.sendQueueBytes > 0 and \
+						channel.sendQueueBytes + numBytes > self.sendQueueMaxBytes:
+					channel.sendCondition.wait()
+				channel.queueWaitTime += time.perf_counter() - startTime
+				channel.numQueueWaits += 1
+			if self.threadError is not None:
+				raise ConnectionError( "sender thread failed: " + str( self.threadError ) )
+
+			entry = (time.perf_counter(), numBytes, buffers)
+			if highPriority:
+				channel.sendQueueHigh.append( entry )
+			else:
+				channel.sendQueue.append( entry )
+			channel.sendQueueBytes += numBytes
+			channel.maxQueueBytes = max( channel.maxQueueBytes, channel.sendQueueBytes )
+			channel.maxQueueMessages = max( channel.maxQueueMessages,
+											len( channel.sendQueue ) + len( channel.sendQueueHigh ) )
+			channel.sendCondition.notify_all()
+
+	def resetQueueStats( self ):
+		for channel in self.channels:
+			with channel.sendCondition:
+				channel.resetQueueStats()
+
+	# Back-pressure statistics since the last call to resetQueueStats:
+	# how full the send queue got, how long sendData was blocked because
+	# it was full, and how long messages sat in the queue before being sent.
+	def getQueueStats( self ):
+		lines = []
+		for channel in self.channels:
+			with channel.sendCondition:
+				numQueued = len( channel.sendQueue ) + len( channel.sendQueueHigh )
+				lines.append( 'DERGO %s send queue: %d messages / %.1f KB queued (max %d / %.1f KB), '\
+							  'blocked %d times for %.2f ms, avg latency %.2f ms' %\
+							  ('bulk' if channel.index == Channel.Bulk else 'interactive',
+							  numQueued, channel.sendQueueBytes / 1024.0,
+							  channel.maxQueueMessages, channel.maxQueueBytes / 1024.0,
+							  channel.numQueueWaits, channel.queueWaitTime * 1000.0,
+							  channel.queueLatency * 1000.0 / max( channel.numQueueSent, 1 )) )
+		return '\n'.join( lines )
+
+	# Sends all the buffers through the channel, in order.
+	# In threaded mode they're queued instead.
+	def sendBuffers( self, channel, buffers, highPriority=False ):
+		buffers = [buf for buf in buffers if buf.nbytes > 0]
+		if not buffers:
+			return
+
+		if self.threaded:
+			self.queueBuffers( channel, buffers, highPriority )
+		else:
+			self.writeBuffers( channel.socket, buffers )
+
+	# Writes all the buffers to the socket, in order, without concatenating them.
+	# Loops until every byte has been accepted by the kernel.
+	def writeBuffers( self, sock, buffers ):
+		if not hasattr( sock, 'sendmsg' ):
+			# No scatter-gather on this platform (i.e. Windows).
+			for buf in buffers:
+				sock.sendall( buf )
+			self.numSendSyscalls += len( buffers )
+			return
+
+		while buffers:
+			bytesSent = sock.sendmsg( buffers )
+			self.numSendSyscalls += 1
+			# Drop what was fully sent, and trim what was partially sent.
+			numFullySent = 0
+			while numFullySent < len( buffers ) and bytesSent >= buffers[numFullySent].nbytes:
+				bytesSent -= buffers[numFullySent].nbytes
+				numFullySent += 1
+			del buffers[:numFullySent]
+			if bytesSent > 0:
+				buffers[0] = buffers[0][bytesSent:]
+
+	# data can be None, bytes, bytearray, memoryview or anything exposing a
+	# C-contiguous buffer (e.g. a NumPy array). It is never copied, hence
+	# in threaded mode it must not be modified after calling sendData.
+	#
+	# With a bulk channel, messages can reach the server in a different order
+	# than we sent them. To prevent that (e.g. an Item arriving before its Mesh),
+	# we count the 'ordered' messages sent through each channel, and before
+	# sending one, if the other channel sent something since last time, we
+	# first send a Barrier telling the server to wait until it has processed
+	# that many messages from the other channel.
+	#
+	# compressed is what compressPayload returned for data, if it was called.
+	def sendData( self, messageType, data, compressed=None ):
 		assert( messageType < FromClient.NumClientMessages )
 		
-		if data == None:
-			sizeBytes = 0
-			data = bytes(0)
+		if data is None:
+			payload = memoryview( bytes(0) )
 		else:
-			sizeBytes = len( data )
-		
-		packet = self.headerStruct.pack( sizeBytes, messageType )
-		
-		self.socket.send( b''.join( (packet, bytes(data)) ) )
+			# len() isn't the size in bytes for every buffer type (e.g. NumPy
+			# arrays), so look at it as raw bytes.
+			payload = memoryview( data ).cast( 'B' )
+
+		# Even if we're not connected: it gets sent when we reconnect
+		if self.payloadCache is not None:
+			self.payloadCache.update( messageType, payload )
+
+		if not self.connected:
+			raise ConnectionError( "not connected to the server" )
+
+		try:
+			self.sendPayload( messageType, payload, compressed )
+		except OSError as e:
+			self.connectionLost( e )
+			raise
+
+	# Compresses data the way sendData would, so that it can be done ahead of time
+	# on another thread (see MeshExportPipeline). Only reads the settings.
+	# Returns None if sendData wouldn't compress it (or it didn't get smaller).
+	def compressPayload( self, messageType, data ):
+		payload = memoryview( data ).cast( 'B' )
+		codec = self.compressionCodec
+		if codec == Codec.Uncompressed or \
+				payload.nbytes < self.compressionThresholds.get( messageType, 0xFFFFFFFF ) or \
+				(self.uploadRing and payload.nbytes >= Network.SHARED_MEMORY_THRESHOLD):
+			return None
+		return compression.compress( codec, self.compressionLevel, payload )
+
+	def sendPayload( self, messageType, payload, compressed=None ):
+		channel = self.channels[Channel.Interactive]
+		if len( self.channels ) > 1:
+			if messageType in Network.BULK_MESSAGES:
+				channel = self.channels[Channel.Bulk]
+			if messageType not in Network.UNORDERED_MESSAGES:
+				otherChannel = self.channels[1 - channel.index]
+				if otherChannel.numOrderedSent != channel.lastBarrier:
+					channel.lastBarrier = otherChannel.numOrderedSent
+					self.sendMessage( channel, FromClient.Barrier,
+									  memoryview( struct.pack( '=I', channel.lastBarrier ) ) )
+				channel.numOrderedSent += 1
+
+		# With two channels, only the bulk one uses the ring, since the
+		# server must consume it in the same order we wrote it.
+		if self.uploadRing and payload.nbytes >= Network.SHARED_MEMORY_THRESHOLD and \
+				channel is self.channels[-1]:
+			startPos = self.uploadRing.write( payload )
+			if startPos is not None:
+				# Only the descriptor goes through the socket.
+				# If the ring is full, we just send it inline.
+				payload = memoryview( self.sharedMemoryStruct.pack( messageType, startPos,
+																	payload.nbytes ) )
+				messageType = FromClient.SharedMemoryData
+		elif self.compressionCodec != Codec.Uncompressed and \
+				payload.nbytes >= self.compressionThresholds.get( messageType, 0xFFFFFFFF ):
+			if compressed is None:
+				compressed = compression.compress( self.compressionCodec, self.compressionLevel,
+												   payload )
+			if compressed is not None:
+				self.numCompressedBytesIn += payload.nbytes
+				self.numCompressedBytesOut += len( compressed )
+				payload = memoryview( compressed )
+				messageType |= Network.COMPRESSED_FLAG
+
+		self.sendMessage( channel, messageType, payload )
+
+	def sendMessage( self, channel, messageType, payload ):
+		header = self.headerStruct.pack( payload.nbytes, messageType )
+
+		if self.threaded and messageType in Network.HIGH_PRIORITY_MESSAGES:
+			# Don't hold it back in the batch either
+			self.sendBuffers( channel, [memoryview( header ), payload], True )
+			return
+
+		if self.batchDepth > 0:
+			channel.batchBuffer.extend( header )
+			self.numBatchedMessages += 1
+			if payload.nbytes >= self.batchFlushThreshold:
+				# Too big to be worth copying. Send it right after what we've got so far.
+				self.flushBatch( channel, payload )
+			else:
+				channel.batchBuffer.extend( payload )
+				if len( channel.batchBuffer ) >= self.batchFlushThreshold:
+					self.flushBatch( channel )
+			return
 		
+		self.sendBuffers( channel, [memoryview( header ), payload] )
+
+	# Starts collecting every message sent via sendData into a single buffer
+	# (per channel), which is sent when the matching endBatch() is called (or
+	# earlier, if it grows past batchFlushThreshold). Order of messages is preserved.
+	# Calls can be nested; only the outermost endBatch() flushes.
+	def beginBatch( self ):
+		if self.batchDepth == 0:
+			self.numSendSyscalls	= 0
+			self.numBatchedMessages	= 0
+			self.numBatchFlushes	= 0
+			self.numBatchBytes		= 0
+			self.numCompressedBytesIn	= 0
+			self.numCompressedBytesOut	= 0
+		self.batchDepth += 1
+
+	def endBatch( self ):
+		assert( self.batchDepth > 0 )
+		self.batchDepth -= 1
+		if self.batchDepth == 0:
+			try:
+				for channel in self.channels:
+					self.flushBatch( channel )
+			except OSError as e:
+				self.connectionLost( e )
+				raise
+			if self.logStats and self.numBatchFlushes > 0:
+				print( self.getBatchStats() )
+				if self.numCompressedBytesIn > 0:
+					print( self.getCompressionStats() )
+				if self.threaded:
+					print( self.getQueueStats() )
+				if self.numDroppedResults > 0:
+					print( 'DERGO: %d frames from shared memory were dropped (overwritten '
+						   'before we read them)' % self.numDroppedResults )
+
+	def flushBatch( self, channel, extraPayload=None ):
+		buffers = [memoryview( channel.batchBuffer )]
+		if extraPayload is not None:
+			buffers.append( extraPayload )
+
+		numBytes = sum( buf.nbytes for buf in buffers )
+		if numBytes == 0:
+			return
+
+		self.sendBuffers( channel, buffers )
+		if self.threaded:
+			# The sender thread owns it now
+			channel.batchBuffer = bytearray()
+		else:
+			buffers[0].release()
+			del buffers
+			del channel.batchBuffer[:]
+
+		self.numBatchFlushes += 1
+		self.numBatchBytes += numBytes
+
+	def getBatchStats( self ):
+		numFlushes = max( self.numBatchFlushes, 1 )
+		return 'DERGO batch: %d messages, %d flushes, %d syscalls (%.1f per flush), '\
+				'%d bytes (%.1f KB per flush)' %\
+				(self.numBatchedMessages, self.numBatchFlushes, self.numSendSyscalls,
+				self.numSendSyscalls / numFlushes, self.numBatchBytes,
+				self.numBatchBytes / numFlushes / 1024.0)
+
+	def getCompressionStats( self ):
+		return 'DERGO compression: %.1f KB -> %.1f KB (%.1f%%)' %\
+				(self.numCompressedBytesIn / 1024.0, self.numCompressedBytesOut / 1024.0,
+				self.numCompressedBytesOut * 100.0 / max( self.numCompressedBytesIn, 1 ))
+
+	# Makes sure a message of messageSizeBytes (header included) starting
+	# at rcvHead fits in the receive buffer. Compacts the buffer if the
+	# message would run past its end; grows it if it's too small.
+	def reserveReceiveBuffer( self, messageSizeBytes ):
+		pendingBytes = self.rcvTail - self.rcvHead
+
+		if messageSizeBytes > len( self.rcvBuffer ):
+			# Allocate a new buffer rather than resizing; resizing a
+			# bytearray isn't allowed while there are memoryviews to it.
+			newSize = max( messageSizeBytes, len( self.rcvBuffer ) * 2 )
+			newBuffer = bytearray( newSize )
+			newBuffer[0:pendingBytes] = self.rcvView[self.rcvHead:self.rcvTail]
+			self.rcvView.release()
+			self.rcvBuffer = newBuffer
+			self.rcvView = memoryview( self.rcvBuffer )
+			self.rcvHead = 0
+			self.rcvTail = pendingBytes
+		elif self.rcvHead + messageSizeBytes > len( self.rcvBuffer ):
+			self.rcvView[0:pendingBytes] = self.rcvView[self.rcvHead:self.rcvTail]
+			self.rcvHead = 0
+			self.rcvTail = pendingBytes
+
+	# Blocks until at least one message arrives and calls
+	# callbackObj.processMessage for every complete message.
+	# 'data' may be a memoryview into our receive buffer: it is only valid
+	# during the call. Handlers that need to keep it must copy it (e.g. bytes( data ))
 	def receiveData( self, callbackObj ):
-		chunk = self.socket.recv( 8192 * 1024 )
-		if chunk == '':
-			raise RuntimeError("socket connection broken")
+		if not self.connected:
+			raise ConnectionError( "not connected to the server" )
+		try:
+			self.receiveAvailable( callbackObj )
+		except (OSError, RuntimeError) as e:
+			self.connectionLost( e )
+			raise ConnectionError( str( e ) )
 
-		self.stream.extend( chunk )
-		
-		remainingBytes = len( self.stream )
+	def receiveAvailable( self, callbackObj ):
+		if not self.threaded:
+			self.receiveFromSocket( callbackObj )
+			return
+
+		# Drain the inbox filled by the receiver thread
+		entry = self.inbox.get()
+		while True:
+			if isinstance( entry, Exception ):
+				raise ConnectionError( "receiver thread failed: " + str( entry ) )
+			callbackObj.processMessage( entry[0], entry[1], entry[2] )
+			try:
+				entry = self.inbox.get_nowait()
+			except queue.Empty:
+				break
+
+	# Reads whatever is available from the socket (blocks until there's something)
+	# and calls callbackObj.processMessage for every complete message.
+	def receiveFromSocket( self, callbackObj ):
+		if self.rcvTail == len( self.rcvBuffer ):
+			self.reserveReceiveBuffer( self.rcvTail - self.rcvHead + 1 )
+
+		bytesRead = self.socket.recv_into( self.rcvView[self.rcvTail:] )
+		if bytesRead == 0:
+			raise ConnectionError( "socket connection broken" )
+
+		self.rcvTail += bytesRead
 		
-		while remainingBytes >= self.HEADER_SIZE:
-			header = self.headerStruct.unpack_from( memoryview( self.stream ) )
+		while self.rcvTail - self.rcvHead >= self.HEADER_SIZE:
+			header = self.headerStruct.unpack_from( self.rcvBuffer, self.rcvHead )
 			header_sizeBytes	= header[0]
 			header_messageType	= header[1]
-			
-			if header_sizeBytes > remainingBytes - self.HEADER_SIZE:
+
+			messageEnd = self.rcvHead + self.HEADER_SIZE + header_sizeBytes
+			if messageEnd > self.rcvTail:
 				# Packet is incomplete. Process it the next time.
-				break;
+				self.reserveReceiveBuffer( self.HEADER_SIZE + header_sizeBytes )
+				break
 			
-			if header_messageType >= FromServer.NumServerMessages:
+			if header_messageType & ~Network.COMPRESSED_FLAG >= FromServer.NumServerMessages:
 				raise RuntimeError( "Message type is higher than NumServerMessages. Message is corrupt!!!" )
 			
-			callbackObj.processMessage( header_sizeBytes, header_messageType,
-										self.stream[self.HEADER_SIZE:(self.HEADER_SIZE + header_sizeBytes)] )
-			
-			remainingBytes -= self.HEADER_SIZE
-			remainingBytes -= header_sizeBytes
+			if header_messageType & Network.COMPRESSED_FLAG:
+				data = compression.decompress( self.rcvView[(self.rcvHead + self.HEADER_SIZE):messageEnd] )
+				callbackObj.processMessage( len( data ), header_messageType & ~Network.COMPRESSED_FLAG,
+											memoryview( data ) )
+			elif header_messageType == FromServer.Handshake:
+				self.serverVersion, serverCapabilities = struct.unpack_from(
+					'=II', self.rcvBuffer, self.rcvHead + self.HEADER_SIZE )
+				self.capabilities = self.getLocalCapabilities() & serverCapabilities
+			elif header_messageType == FromServer.SharedMemoryResult:
+				# The frame is in one of the result slots. If we fell two frames
+				# behind, the server may have overwritten it while we copied it.
+				# Then it's dropped: the newer ones are already on their way.
+				sequence, resultSize = struct.unpack_from( '=QI', self.rcvBuffer,
+														   self.rcvHead + self.HEADER_SIZE )
+				slotOffset = SharedMemoryTransport.getResultSlotOffset( self.resultSize, sequence )
+				with self.resultView[slotOffset:slotOffset + resultSize] as slotData:
+					resultData = bytes( slotData )
+				if struct.unpack_from( '=Q', self.resultView, (sequence & 1) * 8 )[0] == sequence:
+					callbackObj.processMessage( resultSize, FromServer.Result, memoryview( resultData ) )
+				else:
+					self.numDroppedResults += 1
+			else:
+				callbackObj.processMessage( header_sizeBytes, header_messageType,
+											self.rcvView[(self.rcvHead + self.HEADER_SIZE):messageEnd] )
 			
-			self.stream = self.stream[(self.HEADER_SIZE + header_sizeBytes):]
+			self.rcvHead = messageEnd
+
+		if self.rcvHead == self.rcvTail:
+			# Everything was consumed. Rewind for free.
+			self.rcvHead = 0
+			self.rcvTail = 0
+
+# Used by the receiver thread: keeps a copy of every message for the main thread.
+class InboxWriter:
+	def __init__( self, inbox ):
+		self.inbox = inbox
+
+	def processMessage( self, header_sizeBytes, header_messageType, data ):
+		self.inbox.put( (header_sizeBytes, header_messageType, bytes( data )) )
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+import hashlib
+import struct
+
+# Also importable outside of the add-on (see Tests/)
+try:
+	from .network import FromClient
+except ImportError:
+	from network import FromClient
+
+# Keeps the last payload sent for every entity the server currently has (meshes,
+# materials, textures, items, lights, empties and the world settings), so that
+# after a reconnect the whole scene can be sent again without looking at Blender
+# data. See Network.tryReconnect()
+# Payloads are stored by content (blake2b digest), so identical ones are only
+# kept once. Entities are identified by parsing the start of their payload.
+# MeshVertexUpdate, MeshSkin and MeshSkinPose are kept after the mesh they
+# modify (only the last one of each). They change every frame during playback,
+# so they're not worth hashing: they're stored under the mesh instead.
+# If it grows bigger than maxSizeBytes, everything is dropped and it stays
+# empty (overflowed) until the next Reset: the scene must be exported again.
+class PayloadCache:
+	# Order of the replay: everything only references entities sent before it
+	REPLAY_ORDER = ( FromClient.Texture, FromClient.Material, FromClient.MaterialTexture,
+					 FromClient.Mesh, FromClient.Item, FromClient.Light, FromClient.Empty,
+					 FromClient.WorldParams, FromClient.InstantRadiosity,
+					 FromClient.ParallaxCorrectedCubemaps, FromClient.ShadowsSettings )
+	# Entity kind and how to read its key from the start of the payload
+	KEYS = {
+		FromClient.Texture:						(FromClient.Texture, '=Q'),
+		FromClient.Material:					(FromClient.Material, '=l'),
+		FromClient.MaterialTexture:				(FromClient.MaterialTexture, '=lB'),
+		FromClient.Mesh:						(FromClient.Mesh, '=l'),
+		FromClient.MeshV2:						(FromClient.Mesh, '=l'),
+		FromClient.MeshIndexed:					(FromClient.Mesh, '=l'),
+		FromClient.MeshBegin:					(FromClient.Mesh, '=l'),
+		FromClient.Item:						(FromClient.Item, '=4xl'),
+		FromClient.Light:						(FromClient.Light, '=l'),
+		FromClient.Empty:						(FromClient.Empty, '=l'),
+		FromClient.WorldParams:					(FromClient.WorldParams, None),
+		FromClient.InstantRadiosity:			(FromClient.InstantRadiosity, None),
+		FromClient.ParallaxCorrectedCubemaps:	(FromClient.ParallaxCorrectedCubemaps, None),
+		FromClient.ShadowsSettings:				(FromClient.ShadowsSettings, None),
+		}
+	# Sent after a mesh to modify it
+	MESH_UPDATES = frozenset( (FromClient.MeshVertexUpdate, FromClient.MeshSkin,
+							   FromClient.MeshSkinPose) )
+	REMOVE_KEYS = {
+		FromClient.ItemRemove:	(FromClient.Item, '=4xl'),
+		FromClient.LightRemove:	(FromClient.Light, '=l'),
+		FromClient.EmptyRemove:	(FromClient.Empty, '=l'),
+		}
+
+	def __init__( self, maxSizeBytes=None ):
+		self.maxSizeBytes = maxSizeBytes
+		self.clear()
+
+	def clear( self ):
+		# digest (or (messageType, meshKey) for MESH_UPDATES) -> [payload, refCount]
+		self.blobs = {}
+		# kind -> { key -> [(messageType, digest), ...] }
+		self.entities = { kind : {} for kind in PayloadCache.REPLAY_ORDER }
+		# Chunked mesh being sent (MeshBegin..MeshEnd)
+		self.pendingMeshKey = None
+		self.sizeBytes = 0
+		self.overflowed = False
+
+	@staticmethod
+	def readKey( keyFormat, payload ):
+		if keyFormat is None:
+			return 0
+		return struct.unpack_from( keyFormat, payload )
+
+	# digest defaults to the payload's blake2b digest
+	def addBlob( self, payload, digest=None ):
+		if digest is None:
+			digest = hashlib.blake2b( payload, digest_size=16 ).digest()
+		blob = self.blobs.get( digest )
+		if blob is None:
+			self.blobs[digest] = [bytes( payload ), 1]
+			self.sizeBytes += payload.nbytes
+		else:
+			blob[1] += 1
+		return digest
+
+	def releaseBlobs( self, messages ):
+		for messageType, digest in messages:
+			blob = self.blobs[digest]
+			blob[1] -= 1
+			if blob[1] == 0:
+				self.sizeBytes -= len( blob[0] )
+				del self.blobs[digest]
+
+	def setEntity( self, kind, key, messages ):
+		oldMessages = self.entities[kind].pop( key, None )
+		if oldMessages is not None:
+			self.releaseBlobs( oldMessages )
+		if messages is not None:
+			self.entities[kind][key] = messages
+
+	# Called by Network.sendData for every message (payload is a memoryview of bytes)
+	def update( self, messageType, payload ):
+		if messageType == FromClient.Reset:
+			self.clear()
+		elif self.overflowed:
+			return
+		elif messageType in PayloadCache.KEYS:
+			kind, keyFormat = PayloadCache.KEYS[messageType]
+			key = PayloadCache.readKey( keyFormat, payload )
+			self.setEntity( kind, key, [(messageType, self.addBlob( payload ))] )
+			if messageType == FromClient.MeshBegin:
+				self.pendingMeshKey = key
+		elif messageType in PayloadCache.REMOVE_KEYS:
+			kind, keyFormat = PayloadCache.REMOVE_KEYS[messageType]
+			self.setEntity( kind, PayloadCache.readKey( keyFormat, payload ), None )
+		elif messageType in PayloadCache.MESH_UPDATES:
+			key = PayloadCache.readKey( '=l', payload )
+			messages = self.entities[FromClient.Mesh].get( key )
+			if messages is not None:
+				oldMessages = [message for message in messages if message[0] == messageType]
+				self.releaseBlobs( oldMessages )
+				messages[:] = [message for message in messages if message[0] != messageType]
+				messages.append( (messageType, self.addBlob( payload, (messageType, key) )) )
+		elif messageType in (FromClient.MeshChunk, FromClient.MeshEnd) and \
+				self.pendingMeshKey is not None:
+			self.entities[FromClient.Mesh][self.pendingMeshKey].append(
+				(messageType, self.addBlob( payload )) )
+			if messageType == FromClient.MeshEnd:
+				self.pendingMeshKey = None
+
+		if self.maxSizeBytes is not None and self.sizeBytes > self.maxSizeBytes:
+			print( 'DERGO: payload cache is bigger than %.1f MB. Dropped; the scene will be '
+				   'exported again after a reconnect' % (self.maxSizeBytes / (1024.0 * 1024.0)) )
+			self.clear()
+			self.overflowed = True
+
+	# Yields (messageType, payload) to rebuild the scene on a freshly reset server
+	def generateReplay( self ):
+		for kind in PayloadCache.REPLAY_ORDER:
+			for messages in self.entities[kind].values():
+				for messageType, digest in messages:
+					yield (messageType, memoryview( self.blobs[digest][0] ))
+
+	def getNumEntities( self ):
+		return sum( len( entities ) for entities in self.entities.values() )
+
+	def getStats( self ):
+		return 'DERGO payload cache: %d entities, %d unique payloads, %.1f MB' %\
+				(self.getNumEntities(), len( self.blobs ), self.sizeBytes / (1024.0 * 1024.0))
@@ -21,6 +21,35 @@ enum_attenuation_mode = (
 				"at which the light is considered too dim and is cut off (for performance reasons)."),
 	)
 
+enum_transport = (
+	('TCP', "TCP", "Connect to the server via TCP. Works over the network"),
+	('UNIX', "Unix Socket", "Connect via a Unix domain socket. Server must be on the same machine"),
+	('SHARED_MEMORY', "Shared Memory", "Send meshes and receive rendered frames via shared memory. Server must be on the same machine"),
+	)
+
+enum_control_transport = (
+	('TCP', "TCP", "Control messages go through TCP, using Host and Port"),
+	('UNIX', "Unix Socket", "Control messages go through a Unix domain socket, using Socket Path"),
+	)
+
+enum_compression = (
+	('NONE', "None", "Send everything uncompressed. Best when the server is on this machine"),
+	('ZLIB', "zlib", "Compress big meshes, textures and frames with zlib. Helps over slow networks"),
+	('LZ4', "LZ4", "Compress with LZ4. Faster than zlib, but compresses less. Needs the lz4 Python module"),
+	)
+
+enum_vertex_format = (
+	('FULL', "Full", "Send and render every vertex with floats"),
+	('COMPACT', "Compact", "Octahedral normals, 8-bit colours and half precision UVs. Smaller uploads and vertex buffers, barely visible loss"),
+	('COMPACT_POSITIONS', "Compact + Positions", "Compact, plus positions quantized to 16 bits within the mesh's bounds while uploading. Precision drops with the size of the mesh"),
+	)
+
+enum_vertex_optimization = (
+	('AUTO', "Auto", "Remove duplicated vertices unless the mesh is too big, or is being edited (until it stops changing for a moment)"),
+	('ALWAYS', "Always", "Always remove duplicated vertices. Slow to upload for big meshes"),
+	('NEVER', "Never", "Keep every vertex of every triangle. Fastest to upload, but heavier to render"),
+	)
+
 enum_fresnel_mode = (
 	('COEFF', "Coefficient", "Set the fresnel coefficient directly"),
 	('IOR', "Index of Refraction", "Same as coefficient, but based on an IOR value"),
@@ -135,6 +164,95 @@ class DergoSceneSettings(bpy.types.PropertyGroup):
 				description="Checks for errors in objects that make them incompatible with the material. Disable if UI responsiveness is degraded (e.g. many thousands of objects on scene)",
 				default=True,
 				)
+		cls.network_stats = BoolProperty(
+				name="Network Stats",
+				description="Prints to the console the number of messages, syscalls and bytes sent on every viewport update",
+				default=False,
+				)
+		cls.network_threaded = BoolProperty(
+				name="Background I/O",
+				description="Sends and receives from a background thread so that big uploads don't freeze the UI. Takes effect the next time the renderer connects",
+				default=False,
+				)
+		cls.network_bulk_channel = BoolProperty(
+				name="Separate Bulk Channel",
+				description="Uploads meshes and textures through a second connection, so that the viewport keeps updating during big uploads. Requires Background I/O. Takes effect the next time the renderer connects",
+				default=False,
+				)
+		cls.transport = EnumProperty(
+				name="Transport",
+				description="How to talk to the server. Takes effect the next time the renderer connects",
+				items=enum_transport,
+				default='TCP',
+				)
+		cls.host = StringProperty(
+				name="Host",
+				description="Server address. Leave empty for this machine",
+				default="",
+				)
+		cls.port = IntProperty(
+				name="Port",
+				description="Server TCP port",
+				min=1, max=65535, default=9995,
+				)
+		cls.unix_socket_path = StringProperty(
+				name="Socket Path",
+				description="Path to the server's Unix domain socket",
+				default="/tmp/dergo.sock",
+				)
+		cls.shared_memory_control = EnumProperty(
+				name="Control Connection",
+				description="How control messages reach the server in shared memory mode. Must match the server's. Takes effect the next time the renderer connects",
+				items=enum_control_transport,
+				default='TCP',
+				)
+		cls.compression = EnumProperty(
+				name="Compression",
+				description="Compresses big uploads. Takes effect the next time the renderer connects",
+				items=enum_compression,
+				default='NONE',
+				)
+		cls.compression_level = IntProperty(
+				name="Level",
+				description="1 is the fastest, 9 compresses the most",
+				min=1, max=9, default=1,
+				)
+		cls.compress_results = BoolProperty(
+				name="Compress Frames",
+				description="Also have the server compress the rendered frames it sends back",
+				default=False,
+				)
+		cls.mesh_export_threads = IntProperty(
+				name="Export Threads",
+				description="Threads that encode, hash and compress meshes while Blender's data of the next ones is being read, which speeds up exporting many objects at once (e.g. after loading a file). Capped to the number of CPU cores minus one. 0 exports them one by one. Takes effect the next time the renderer connects",
+				min=0, max=64, default=0,
+				)
+		cls.network_payload_cache = BoolProperty(
+				name="Fast Reconnect",
+				description="Keeps a copy of everything sent to the server, so that after a reconnect the scene is restored without exporting it again. Uses as much memory as the scene's data. Takes effect the next time the renderer connects",
+				default=False,
+				)
+		cls.network_payload_cache_size = IntProperty(
+				name="Max Size (MB)",
+				description="If the copy grows bigger than this, it's dropped, and the scene is exported again after a reconnect",
+				min=16, max=1024 * 1024, default=1024,
+				)
+		cls.mesh_disk_cache = BoolProperty(
+				name="Mesh Disk Cache",
+				description="Keeps exported meshes on disk, so that opening the same file again doesn't export its meshes from scratch. Takes effect the next time the renderer connects",
+				default=False,
+				)
+		cls.mesh_disk_cache_path = StringProperty(
+				name="Cache Folder",
+				description="Where the mesh disk cache is kept. Empty uses .dergo_cache in the home folder",
+				subtype='DIR_PATH',
+				default="",
+				)
+		cls.mesh_disk_cache_size = IntProperty(
+				name="Max Size (MB)",
+				description="The least recently used meshes are deleted when the cache grows bigger than this",
+				min=16, max=1024 * 1024, default=2048,
+				)
 
 	@classmethod
 	def unregister(cls):
@@ -319,6 +437,23 @@ class DergoMeshSettings(bpy.types.PropertyGroup):
 		cls.tangent_uv_source = StringProperty(
 				description="Select UV source for generating tangents for normal maps. Blank for none (faster if you don't use normal maps!)",
 				)
+		cls.vertex_format = EnumProperty(
+				name="Vertex Format",
+				description="Precision of the vertices sent to the server and kept in its vertex buffers",
+				items=enum_vertex_format,
+				default='FULL',
+				)
+		cls.vertex_optimization = EnumProperty(
+				name="Vertex Optimization",
+				description="Whether the server removes duplicated vertices, which makes rendering faster but uploads slower",
+				items=enum_vertex_optimization,
+				default='AUTO',
+				)
+		cls.client_tangents = BoolProperty(
+				name="Blender Tangents",
+				description="Send Blender's own (MikkTSpace) tangents for normal maps, the same its bakes use, instead of having the server generate them. Needs a UV for normal maps",
+				default=False,
+				)
 
 	@classmethod
 	def unregister(cls):
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+import struct
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Also importable outside of the add-on (see Tests/)
+try:
+	from .network import FromClient
+except ImportError:
+	from network import FromClient
+
+if numpy is not None:
+	# One raw vertex of a MeshSkin message
+	SKIN_VERTEX_DTYPE = numpy.dtype( [('rawVertex', numpy.float32, 6),
+									  ('boneIndices', numpy.uint16, 4),
+									  ('weights', numpy.float32, 4)] )
+
+# Armature deformation done by the server: the mesh is sent once in its rest
+# pose with the bone weights of every raw vertex (MeshSkin), and afterwards
+# only the bone matrices whenever the pose changes (MeshSkinPose), instead of
+# evaluating the mesh and sending it whole every frame. See Engine.syncItem
+class Skinning:
+	MAX_WEIGHTS = 4
+
+	# Armature object deforming the object, if the server can do it for us:
+	# the Armature modifier (vertex groups, linear blending) must be the only
+	# thing changing the mesh. Otherwise None, and the evaluated mesh is sent.
+	@staticmethod
+	def getArmature( object ):
+		if numpy is None or len( object.modifiers ) != 1:
+			return None
+		modifier = object.modifiers[0]
+		if modifier.type != 'ARMATURE' or modifier.object is None or \
+				not modifier.show_viewport or not modifier.use_vertex_groups or \
+				modifier.use_bone_envelopes or modifier.use_deform_preserve_volume or \
+				modifier.vertex_group:
+			return None
+		data = object.data
+		if data.shape_keys is not None or not hasattr( data, 'loop_triangles' ) or \
+				len( data.loops ) == 0:
+			return None
+		return modifier.object
+
+	# FromClient.MeshSkin message. mesh must be the one uploaded (in its rest
+	# pose) and rawVertices its raw vertices (see MeshExport.readSections).
+	# Weights come from the vertex groups named after deform bones; the
+	# MAX_WEIGHTS biggest of every vertex are kept.
+	@staticmethod
+	def createSkin( meshId, object, mesh, armatureObject, rawVertices ):
+		bones = armatureObject.data.bones
+		boneIndices = { bone.name : i for i, bone in enumerate( bones ) if bone.use_deform }
+		groupToBone = [boneIndices.get( group.name, -1 ) for group in object.vertex_groups]
+
+		numVertices = len( mesh.vertices )
+		vertexBones = numpy.zeros( (numVertices, Skinning.MAX_WEIGHTS), dtype=numpy.uint16 )
+		vertexWeights = numpy.zeros( (numVertices, Skinning.MAX_WEIGHTS), dtype=numpy.float32 )
+		# No foreach_get for vertex groups: every vertex has its own number of them
+		for vertexIdx, vertex in enumerate( mesh.vertices ):
+			influences = []
+			for group in vertex.groups:
+				if group.group < len( groupToBone ) and groupToBone[group.group] >= 0 and \
+						group.weight > 0.0:
+					influences.append( (group.weight, groupToBone[group.group]) )
+			if len( influences ) > Skinning.MAX_WEIGHTS:
+				influences.sort( reverse=True )
+				del influences[Skinning.MAX_WEIGHTS:]
+			for i, (weight, boneIdx) in enumerate( influences ):
+				vertexBones[vertexIdx, i] = boneIdx
+				vertexWeights[vertexIdx, i] = weight
+
+		# Raw vertices are the loops (see MeshExport.getSectionCounts)
+		numLoops = len( rawVertices )
+		loopVertices = numpy.empty( numLoops, dtype=numpy.int32 )
+		mesh.loops.foreach_get( 'vertex_index', loopVertices )
+
+		skinVertices = numpy.empty( numLoops, dtype=SKIN_VERTEX_DTYPE )
+		skinVertices['rawVertex'] = rawVertices
+		skinVertices['boneIndices'] = vertexBones[loopVertices]
+		skinVertices['weights'] = vertexWeights[loopVertices]
+
+		bytesObj = bytearray( struct.pack( "=lIH", meshId, numLoops, len( bones ) ) )
+		bytesObj += skinVertices.tobytes()
+		return (FromClient.MeshSkin, bytesObj)
+
+	# FromClient.MeshSkinPose message: for every bone, its transform from the rest
+	# pose to the current one in the object's space, like the Armature modifier.
+	@staticmethod
+	def createSkinPose( meshId, object, armatureObject ):
+		bones = armatureObject.data.bones
+		poseBones = armatureObject.pose.bones
+		numBones = len( bones )
+
+		# Blender's matrices are column major
+		restMatrices = numpy.empty( numBones * 16, dtype=numpy.float32 )
+		bones.foreach_get( 'matrix_local', restMatrices )
+		restMatrices = restMatrices.reshape( numBones, 4, 4 ).transpose( 0, 2, 1 )
+		poseMatrices = numpy.empty( numBones * 16, dtype=numpy.float32 )
+		poseBones.foreach_get( 'matrix', poseMatrices )
+		poseMatrices = poseMatrices.reshape( numBones, 4, 4 ).transpose( 0, 2, 1 )
+
+		# Pose bones aren't necessarily in the same order as the bones
+		boneOrder = [bones.find( poseBone.name ) for poseBone in poseBones]
+		orderedPoseMatrices = numpy.empty_like( poseMatrices )
+		orderedPoseMatrices[boneOrder] = poseMatrices
+
+		# Object space -> armature space
+		toArmature = numpy.linalg.inv( numpy.array( armatureObject.matrix_world ) ) @ \
+					 numpy.array( object.matrix_world )
+		skinMatrices = numpy.linalg.inv( toArmature ) @ orderedPoseMatrices @ \
+					   numpy.linalg.inv( restMatrices ) @ toArmature
+
+		bytesObj = bytearray( struct.pack( "=lH", meshId, numBones ) )
+		bytesObj += numpy.ascontiguousarray( skinMatrices[:, 0:3, :], dtype=numpy.float32 ).tobytes()
+		return (FromClient.MeshSkinPose, bytesObj)
@@ -4,7 +4,7 @@ from network import  *
 
 class CallbackObj:
 	def processMessage( self, header_sizeBytes, header_messageType, data ):
-		print( data.decode('latin-1') )
+		print( bytes( data ).decode('latin-1') )
 
 n = Network()
 n.connect()
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+
+import socket
+import struct
+
+try:
+	from multiprocessing import shared_memory
+except ImportError:
+	shared_memory = None
+
+# A transport knows how to open the socket Network talks through.
+# Transports that move big payloads out of band (i.e. SharedMemoryTransport)
+# also provide an upload ring and a result segment.
+class Transport:
+	def __init__( self ):
+		self.uploadRing		= None
+		self.resultSegment	= None
+
+	# Opens the transport and returns the first socket
+	def connect( self ):
+		return self.openSocket()
+
+	# Returns a new connection to the server (e.g. for a second channel)
+	def openSocket( self ):
+		raise NotImplementedError()
+
+	def close( self ):
+		return
+
+class TcpTransport( Transport ):
+	def __init__( self, host, port ):
+		Transport.__init__( self )
+		# Empty host means this machine, which is what DERGO always did
+		self.host = host if host else socket.gethostname()
+		self.port = port
+
+	def openSocket( self ):
+		sock = socket.socket()
+		sock.connect( (self.host, self.port) )
+		# Messages are written whole. Don't let Nagle hold back a Render until
+		# the server ACKs what we sent before.
+		sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+		return sock
+
+	def __str__( self ):
+		return 'TCP %s:%d' % (self.host, self.port)
+
+class UnixTransport( Transport ):
+	def __init__( self, path ):
+		Transport.__init__( self )
+		self.path = path
+
+	def openSocket( self ):
+		if not hasattr( socket, 'AF_UNIX' ):
+			raise ConnectionError( "Unix domain sockets are not supported on this platform" )
+		sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+		sock.connect( self.path )
+		return sock
+
+	def __str__( self ):
+		return 'Unix socket %s' % self.path
+
+# Ring buffer living in a shared memory segment, written by us and read by
+# the server. We send (over the socket) the position and size of every
+# payload we write; the server writes back at the start of the segment how
+# far it has consumed, which is how we know when space can be reused.
+# Positions are monotonically increasing; the offset is position % capacity.
+# Payloads are always contiguous: if one doesn't fit at the end, we skip to
+# the beginning.
+class SharedMemoryRing:
+	# uint64 consumedPos (written by the server), then padding for alignment
+	HEADER_SIZE = 64
+
+	def __init__( self, sizeBytes ):
+		self.segment = shared_memory.SharedMemory( create=True, size=sizeBytes )
+		self.view = self.segment.buf
+		self.capacity = sizeBytes - SharedMemoryRing.HEADER_SIZE
+		self.writePos = 0
+		struct.pack_into( '=Q', self.view, 0, 0 )
+
+	def getConsumedPos( self ):
+		return struct.unpack_from( '=Q', self.view, 0 )[0]
+
+	# Copies the payload (a memoryview of bytes) into the ring and returns
+	# its position. Returns None if there isn't enough free space right now.
+	def write( self, payload ):
+		sizeBytes = payload.nbytes
+		if sizeBytes > self.capacity:
+			return None
+
+		startPos = self.writePos
+		offset = startPos % self.capacity
+		if offset + sizeBytes > self.capacity:
+			startPos += self.capacity - offset
+			offset = 0
+
+		if startPos + sizeBytes - self.getConsumedPos() > self.capacity:
+			return None
+
+		offset += SharedMemoryRing.HEADER_SIZE
+		self.view[offset:offset + sizeBytes] = payload
+		self.writePos = startPos + sizeBytes
+		return startPos
+
+	def close( self ):
+		self.view.release()
+		self.segment.close()
+		self.segment.unlink()
+
+# Control messages go through another transport (AF_UNIX or TCP), while
+# big uploads (e.g. meshes) and Result frames go through shared memory.
+# Only works if the server runs on the same machine.
+# The result segment has two slots the server writes alternately, so that the
+# next frame doesn't overwrite the one we're reading. It starts with the
+# sequence of the Result each slot holds (see FromServer.SharedMemoryResult)
+class SharedMemoryTransport( Transport ):
+	DEFAULT_UPLOAD_SIZE	= 128 * 1024 * 1024
+	DEFAULT_RESULT_SIZE	= 128 * 1024 * 1024
+	RESULT_HEADER_SIZE	= 64
+
+	def __init__( self, controlTransport, uploadSize=DEFAULT_UPLOAD_SIZE,
+				  resultSize=DEFAULT_RESULT_SIZE ):
+		Transport.__init__( self )
+		self.controlTransport = controlTransport
+		self.uploadSize = uploadSize
+		self.resultSize = resultSize
+
+	def connect( self ):
+		if shared_memory is None:
+			raise ConnectionError( "multiprocessing.shared_memory is not available" )
+		sock = self.controlTransport.openSocket()
+		self.uploadRing		= SharedMemoryRing( self.uploadSize )
+		self.resultSegment	= shared_memory.SharedMemory( create=True, size=self.resultSize )
+		return sock
+
+	def openSocket( self ):
+		return self.controlTransport.openSocket()
+
+	# Size of each of the two result slots, for a result segment of resultSize bytes
+	@staticmethod
+	def getResultSlotSize( resultSize ):
+		return (resultSize - SharedMemoryTransport.RESULT_HEADER_SIZE) // 2
+
+	# Where the Result with that sequence is in the result segment
+	@staticmethod
+	def getResultSlotOffset( resultSize, sequence ):
+		return SharedMemoryTransport.RESULT_HEADER_SIZE + \
+			   (sequence & 1) * SharedMemoryTransport.getResultSlotSize( resultSize )
+
+	# Payload of FromClient.SharedMemoryInit
+	def getInitMessage( self ):
+		dataToSend = bytearray()
+		for name, sizeBytes in ( (self.uploadRing.segment.name, self.uploadSize),
+								 (self.resultSegment.name, self.resultSize) ):
+			asUtfBytes = name.encode('utf-8')
+			dataToSend.extend( struct.pack( '=I', len( asUtfBytes ) ) )
+			dataToSend.extend( asUtfBytes )
+			dataToSend.extend( struct.pack( '=I', sizeBytes ) )
+		return dataToSend
+
+	def close( self ):
+		if self.uploadRing:
+			self.uploadRing.close()
+			self.uploadRing = None
+		if self.resultSegment:
+			self.resultSegment.close()
+			self.resultSegment.unlink()
+			self.resultSegment = None
+
+	def __str__( self ):
+		return 'Shared memory (control: %s)' % str( self.controlTransport )
@@ -33,21 +33,24 @@ def everyFrame( scene ):
 	
 	screenName = bpy.context.window.screen.name
 	asyncPreviews = bpy.context.scene['DERGO']['async_preview']
-	if screenName not in asyncPreviews:
+	if screenName not in asyncPreviews or not engine.dergo.isConnected():
 		return
 
-	engine.dergo.network.sendData( FromClient.InitAsync, None )
-		
-	# Iterate through all screens in the currently active window
-	# and asynchronously render those that the user requested.
-	for area in bpy.context.window.screen.areas:
-		if area.type == 'VIEW_3D':
-			spaceId = str(area.spaces[0])
-			if spaceId in asyncPreviews[screenName]:
-				region_data = area.spaces[0].region_3d
-				engine.dergo.sendViewRenderRequest( bpy.context, area, region_data, False, 256, 256 )
-				
-	engine.dergo.network.sendData( FromClient.FinishAsync, None )
+	try:
+		engine.dergo.network.sendData( FromClient.InitAsync, None )
+			
+		# Iterate through all screens in the currently active window
+		# and asynchronously render those that the user requested.
+		for area in bpy.context.window.screen.areas:
+			if area.type == 'VIEW_3D':
+				spaceId = str(area.spaces[0])
+				if spaceId in asyncPreviews[screenName]:
+					region_data = area.spaces[0].region_3d
+					engine.dergo.sendViewRenderRequest( bpy.context, area, region_data, False, 256, 256 )
+					
+		engine.dergo.network.sendData( FromClient.FinishAsync, None )
+	except ConnectionError:
+		pass
 	return
 
 def draw_async_preview(self, context):
@@ -659,6 +662,48 @@ class Dergo_PT_mesh(DergoButtonsPanel, bpy.types.Panel):
 		dmesh = context.mesh.dergo
 
 		layout.prop_search( dmesh, "tangent_uv_source", mesh, "uv_textures", text="UV for normal maps" )
+		row = layout.row()
+		row.active = dmesh.tangent_uv_source != ""
+		row.prop( dmesh, "client_tangents" )
+		layout.prop( dmesh, "vertex_format" )
+		layout.prop( dmesh, "vertex_optimization" )
+
+class Dergo_PT_network(DergoButtonsPanel, bpy.types.Panel):
+	bl_label = "Network"
+	bl_context = "render"
+
+	def draw(self, context):
+		layout = self.layout
+		dscene = context.scene.dergo
+		layout.prop( dscene, "transport" )
+		controlTransport = dscene.transport
+		if dscene.transport == 'SHARED_MEMORY':
+			layout.prop( dscene, "shared_memory_control" )
+			controlTransport = dscene.shared_memory_control
+		if controlTransport == 'TCP':
+			row = layout.row()
+			row.prop( dscene, "host" )
+			row.prop( dscene, "port" )
+		else:
+			layout.prop( dscene, "unix_socket_path" )
+		layout.prop( dscene, "network_threaded" )
+		row = layout.row()
+		row.active = dscene.network_threaded
+		row.prop( dscene, "network_bulk_channel" )
+		row = layout.row()
+		row.prop( dscene, "compression" )
+		if dscene.compression != 'NONE':
+			row.prop( dscene, "compression_level" )
+			layout.prop( dscene, "compress_results" )
+		layout.prop( dscene, "network_payload_cache" )
+		if dscene.network_payload_cache:
+			layout.prop( dscene, "network_payload_cache_size" )
+		layout.prop( dscene, "mesh_export_threads" )
+		layout.prop( dscene, "mesh_disk_cache" )
+		if dscene.mesh_disk_cache:
+			layout.prop( dscene, "mesh_disk_cache_path" )
+			layout.prop( dscene, "mesh_disk_cache_size" )
+		layout.prop( dscene, "network_stats" )
 
 class DergoTexturePanel(DergoButtonsPanel):
 	bl_context = "texture"
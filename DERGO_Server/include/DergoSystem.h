@@ -9,6 +9,7 @@
 #include "OgreSceneFormatBase.h"
 
 #include "Utils/ShadowsUtils.h"
+#include "VertexUtils.h"
 
 namespace Ogre
 {
@@ -36,6 +37,52 @@ namespace DERGO
 
 		typedef std::vector<BlenderItem> BlenderItemVec;
 
+		/// What buildMesh leaves behind so that a MeshVertexUpdate can patch the
+		/// vertex buffer without deindexing & optimizing the mesh again.
+		struct VertexPatchData
+		{
+			/// Must match the MeshVertexUpdate
+			uint32_t	numFaces;
+			uint32_t	numRawVertices;
+
+			/// Vertices in the buffer (after shrinkVertexBuffer)
+			uint32_t	numVertices;
+			/// Size of a vertex once expanded to floats (see VertexUtils::expandVertices)
+			uint32_t	bytesPerVertex;
+			/// Offset to the tangent, 0 if there's no normal mapping
+			uint32_t	tangentStride;
+			uint32_t	tangentUvStride;
+			/// Size of a vertex in the buffer, smaller than bytesPerVertex with
+			/// Network::MeshFormat flags
+			uint32_t	gpuBytesPerVertex;
+			uint8_t		meshFormat;
+			bool		hasColour;
+			uint8_t		numUVs;
+
+			/// Deindexed vertex -> raw vertex its position (and normal, if smooth) comes from
+			std::vector<uint32_t>	rawVertexLut;
+			/// Deindexed vertex -> face its normal comes from, c_smoothVertex if smooth
+			std::vector<uint32_t>	flatFaceLut;
+			/// Deindexed vertex -> vertex in the buffer.
+			/// Empty if the mesh was too big to be optimized (1:1)
+			std::vector<uint32_t>	vertexConversionLut;
+
+			VertexPatchData() :
+				numFaces( 0 ), numRawVertices( 0 ), numVertices( 0 ), bytesPerVertex( 0 ),
+				tangentStride( 0 ), tangentUvStride( 0 ), gpuBytesPerVertex( 0 ),
+				meshFormat( 0 ), hasColour( false ), numUVs( 0 ) {}
+		};
+
+		/// Rest pose & bone weights of a mesh the server skins (see MeshSkin)
+		struct SkinData
+		{
+			uint16_t						numBones;
+			std::vector<BlenderRawVertex>	restVertices;
+			std::vector<BlenderSkinWeights>	skinWeights;
+
+			SkinData() : numBones( 0 ) {}
+		};
+
 		struct BlenderMesh
 		{
 			BlenderItemVec	items;
@@ -43,6 +90,15 @@ namespace DERGO
 
 			Ogre::String	userFriendlyName;
 
+			VertexPatchData	vertexPatchData;
+			SkinData		skinData;
+
+			/// When buildMesh last built it, or patchMeshVertices last patched
+			/// it, in ms (see Ogre::Timer)
+			unsigned long	lastChangeTime;
+
+			BlenderMesh() : meshPtr( 0 ), lastChangeTime( 0 ) {}
+
 			BlenderItemVec::iterator findItem( uint32_t itemId );
 		};
 
@@ -113,19 +169,71 @@ namespace DERGO
 			Ogre::Vector3		scale;
 		};
 
+		/// Mesh data as sent by the client, before it gets deindexed.
+		struct BlenderMeshData
+		{
+			Ogre::String	meshName;
+			uint32_t		numFaces;
+			uint32_t		numRawVertices;
+			bool			hasColour;
+			uint8_t			numUVs;
+			uint8_t			tangentUVSource;
+			/// Network::MeshFormat flags, for the wire & the vertex buffer
+			uint8_t			meshFormat;
+			/// Range of the positions, when they're Network::MeshFormat::QuantizedPositions
+			Ogre::Vector3	aabbMin;
+			Ogre::Vector3	aabbMax;
+
+			std::vector<BlenderFace>		faces;
+			std::vector<BlenderFaceColour>	faceColours;
+			std::vector<BlenderFaceUv>		faceUvs;
+			std::vector<BlenderRawVertex>	rawVertices;
+			/// One per raw vertex with Network::MeshFormat::HasTangents, otherwise empty
+			std::vector<BlenderRawTangent>	rawTangents;
+			std::vector<uint32_t>			materialTable;
+
+			/// Network::FromClient::MeshIndexed: the vertices were deindexed & their
+			/// duplicates removed by the client (DeindexTask's layout, with the tangent
+			/// only with Network::MeshFormat::HasTangents). 3 indices & 1 entry of
+			/// materialTable per triangle. faces, faceColours, faceUvs, rawVertices &
+			/// rawTangents are empty then.
+			bool							indexed;
+			uint32_t						numIndexedVertices;
+			std::vector<uint8_t>			indexedVertices;
+			std::vector<uint32_t>			indices;
+			std::vector<uint16_t>			triangleMaterials;
+
+			BlenderMeshData() :
+				numFaces( 0 ), numRawVertices( 0 ), hasColour( false ),
+				numUVs( 0 ), tangentUVSource( 255 ), meshFormat( 0 ),
+				aabbMin( Ogre::Vector3::ZERO ), aabbMax( Ogre::Vector3::ZERO ),
+				indexed( false ), numIndexedVertices( 0 ) {}
+		};
+
 		typedef std::vector<BlenderLight> BlenderLightVec;
 		typedef std::vector<BlenderEmpty> BlenderEmptyVec;
 		typedef std::vector<BlenderMaterial> BlenderMaterialVec;
 		typedef std::map<uint32_t, BlenderMesh> BlenderMeshMap;
+		typedef std::map<uint32_t, BlenderMeshData> BlenderMeshDataMap;
 		typedef std::vector<ItemData> ItemDataVec;
 		typedef std::map<Ogre::IdString, Ogre::String> TexAliasToFullPathMap;
 
 		BlenderMeshMap		m_meshes;
+		/// Meshes being uploaded in chunks (got MeshBegin, waiting for MeshEnd)
+		BlenderMeshDataMap	m_pendingMeshes;
 		BlenderLightVec		m_lights;
 		BlenderEmptyVec		m_empties;
 		BlenderMaterialVec	m_materials;
 		TexAliasToFullPathMap m_textures;
 
+		/// Entities the client must send again (entityType, id). See requestResync
+		typedef std::pair<uint8_t, uint32_t> ResyncEntry;
+		std::vector<ResyncEntry>	m_resyncEntries;
+
+		/// Meshes buildMesh didn't optimize because they're being edited, and when they
+		/// last changed (built or patched). See optimizeSettledMeshes
+		std::map<uint32_t, unsigned long>	m_unoptimizedMeshes;
+
 		bool					m_enableInstantRadiosity;
 		Ogre::InstantRadiosity	*m_instantRadiosity;
 		Ogre::IrradianceVolume	*m_irradianceVolume;
@@ -191,6 +299,177 @@ namespace DERGO
 		*/
 		void syncMesh( Network::SmartData &smartData );
 
+		/// Reads the start of a Mesh/MeshBegin message (after the meshId)
+		/// and allocates room for the rest of the data.
+		void readMeshHeader( Network::SmartData &smartData, BlenderMeshData &outMeshData );
+		void readMeshMaterialTable( Network::SmartData &smartData, BlenderMeshData &outMeshData );
+		/** Reads elements of one of the sections of a mesh (see Network::MeshSection)
+			in the format of the wire (see Network::MeshFormat) into outMeshData.
+		@param firstElement
+			First element to overwrite.
+		@param numElements
+			Number of elements to read. Caller must make sure they fit.
+		*/
+		void readMeshSection( Network::SmartData &smartData, BlenderMeshData &outMeshData,
+							  uint8_t section, size_t firstElement, size_t numElements );
+		/// Number of elements a whole section (see Network::MeshSection) has,
+		/// once readMeshHeader allocated meshData. 0 if section is unknown.
+		size_t getNumSectionElements( const BlenderMeshData &meshData, uint8_t section ) const;
+
+		/** Same as syncMesh, but reads the struct-of-arrays layout of Network::FromClient::MeshV2
+			where every section is found through the section table.
+		@param smartData
+			Network data from client.
+		@param sizeBytes
+			Size of the message.
+		@return
+			False if failed to sync due to an error. e.g. a section doesn't fit in the message.
+		*/
+		bool syncMeshV2( Network::SmartData &smartData, uint32_t sizeBytes );
+
+		/** Same as syncMesh, but the vertices of Network::FromClient::MeshIndexed are ready
+			for the vertex buffer: buildMesh skips DeindexTask & shrinkVertexBuffer.
+			Such meshes can't be patched by MeshVertexUpdate nor skinned.
+		@param smartData
+			Network data from client.
+		@param sizeBytes
+			Size of the message.
+		@return
+			False if failed to sync due to an error. e.g. an index out of range.
+		*/
+		bool syncMeshIndexed( Network::SmartData &smartData, uint32_t sizeBytes );
+
+		/** Starts a chunked mesh upload. See Network::FromClient::MeshBegin.
+		@param smartData
+			Network data from client.
+		*/
+		void syncMeshBegin( Network::SmartData &smartData );
+
+		/** Copies a chunk of a mesh being uploaded.
+		@param smartData
+			Network data from client.
+		@param sizeBytes
+			Size of the message.
+		@return
+			False if failed to sync due to an error. e.g. there was no MeshBegin.
+		*/
+		bool syncMeshChunk( Network::SmartData &smartData, uint32_t sizeBytes );
+
+		/** Finishes a chunked mesh upload, and builds the mesh.
+		@param smartData
+			Network data from client.
+		@return
+			False if failed to sync due to an error. e.g. there was no MeshBegin.
+		*/
+		bool syncMeshEnd( Network::SmartData &smartData );
+
+		/** Patches the positions & normals of an existing mesh, using the
+			VertexPatchData left behind by buildMesh.
+		@param smartData
+			Network data from client.
+		@param sizeBytes
+			Size of the whole message, to validate the counts it carries.
+		@return
+			False if failed to sync due to an error. e.g. the mesh doesn't exist
+			or its topology doesn't match.
+		*/
+		bool syncMeshVertexUpdate( Network::SmartData &smartData, uint32_t sizeBytes );
+
+		/** Stores the rest pose & bone weights of an existing mesh, so that
+			MeshSkinPose messages can deform it.
+		@param smartData
+			Network data from client.
+		@param sizeBytes
+			Size of the whole message, to validate the counts it carries.
+		@return
+			False if failed to sync due to an error. e.g. the mesh doesn't exist
+			or the number of vertices doesn't match.
+		*/
+		bool syncMeshSkin( Network::SmartData &smartData, uint32_t sizeBytes );
+
+		/** Skins the mesh with the received bone matrices (see syncMeshSkin)
+			and patches its vertex buffer.
+		@param smartData
+			Network data from client.
+		@param sizeBytes
+			Size of the whole message, to validate the counts it carries.
+		@return
+			False if failed to sync due to an error. e.g. the mesh doesn't have a skin.
+		*/
+		bool syncMeshSkinPose( Network::SmartData &smartData, uint32_t sizeBytes );
+
+		/** Overwrites the positions & normals in the vertex buffer of a mesh
+			built by buildMesh, using its VertexPatchData.
+		@param meshId
+			Mesh to patch, only for error messages & resyncs.
+		@param meshEntry
+			Mesh to patch.
+		@param faceNormals
+			Normal of every face. Empty to use the raw vertices' normals everywhere.
+		@param rawVertices
+			New positions & normals. Size must be VertexPatchData::numRawVertices.
+		@return
+			False if the mesh must be built again (e.g. vertices shrinkVertexBuffer
+			merged aren't the same anymore).
+		*/
+		bool patchMeshVertices( uint32_t meshId, BlenderMesh &meshEntry,
+								const std::vector<Ogre::Vector3> &faceNormals,
+								const std::vector<BlenderRawVertex> &rawVertices );
+
+		/// Remembers where every vertex of the mesh buildMesh just deindexed came from
+		void createVertexPatchData( VertexPatchData &outPatchData, const BlenderMeshData &meshData,
+									const Ogre::FastArray<uint32_t> &vertexConversionLut,
+									uint32_t optimizedNumVertices, bool optimized );
+
+		/** Prepares/compacts the mesh data, then checks if we need
+			to create a new Mesh or update an existing one.
+		@param meshData
+			Data received from client. Gets modified.
+		*/
+		void buildMesh( uint32_t meshId, BlenderMeshData &meshData );
+
+		/** Whether buildMesh should remove the duplicated vertices of a mesh (i.e.
+			VertexUtils::shrinkVertexBuffer, which is O(N^2)). See Network::MeshFormat.
+		@param meshFormat
+			Network::MeshFormat flags of the mesh, with its optimization policy.
+		@param numVertices
+			Deindexed vertices (3 per triangle).
+		@param timeSinceLastChange
+			ms since the mesh was last built or patched. Max value if it's a new one.
+		*/
+		bool shouldOptimizeMesh( uint8_t meshFormat, uint32_t numVertices,
+								 unsigned long timeSinceLastChange ) const;
+
+		/** Optimizes the meshes buildMesh didn't optimize because they were being
+			edited, once they haven't changed (not even patched by a MeshVertexUpdate
+			or MeshSkinPose) in c_meshSettleTime ms. See optimizeSettledMesh
+		*/
+		void optimizeSettledMeshes();
+
+		/** Runs VertexUtils::shrinkVertexBuffer over the shadow copy of an unoptimized
+			mesh (3 vertices per triangle), as if buildMesh had optimized it, without
+			asking the client to send it again. Tangents we generated are generated again.
+		@param meshId
+			Mesh to optimize. Does nothing if it doesn't exist or is already optimized.
+		*/
+		void optimizeSettledMesh( uint32_t meshId );
+
+		/** Puts the vertex & index data in the mesh: creates it, updates its buffers
+			or recreates it (see createMesh, updateMesh & recreateMesh).
+			Submeshes are left with the default material, see setMeshMaterials.
+		@param meshName
+			Name of the mesh, if it has to be created.
+		*/
+		void setMeshBuffers( uint32_t meshId, const Ogre::String &meshName,
+							 uint32_t optimizedNumVertices,
+							 const Ogre::VertexElement2VecVec &vertexElements,
+							 Ogre::FreeOnDestructor &vertexDataPtrContainer,
+							 const std::vector< std::vector<uint32_t> > &indices,
+							 const Ogre::Aabb &aabb );
+
+		/// Sets the material of every submesh, and of the items' subitems
+		void setMeshMaterials( uint32_t meshId, const std::vector<Ogre::String> &materialNames );
+
 		/** Creates a mesh.
 		@param meshName
 			Name of the mesh
@@ -219,7 +498,8 @@ namespace DERGO
 						 const std::vector< std::vector<uint32_t> > &indices,
 						 const Ogre::Aabb &aabb );
 
-		/** Destroys existing mesh, creates it again, then restores all asociated items.
+		/** Destroys existing mesh, creates it again, then restores all asociated items
+			and its VertexPatchData, SkinData & lastChangeTime.
 		@param meshEntry
 			Existing mesh entry to update. Must be a hard copy.
 		*/
@@ -308,6 +588,16 @@ namespace DERGO
 		/// Destroys everything. Useful for resync'ing
 		void reset();
 
+		/** Adds the entity to the next FromServer::Resync message.
+		@param entityType
+			See Network::ResyncEntity
+		@param id
+			ID of the entity, as sent by the client.
+		*/
+		void requestResync( Network::ResyncEntity::ResyncEntity entityType, uint32_t id );
+		/// Sends the FromServer::Resync with everything requested via requestResync
+		void sendResync( bufferevent *bev, NetworkSystem &networkSystem );
+
 		void exportToFile( Network::SmartData &smartData );
 
 	public:
@@ -325,6 +615,8 @@ namespace DERGO
 									 bufferevent *bev, NetworkSystem &networkSystem );
 		/// @coppydoc NetworkListener::allConnectionsTerminated
 		virtual void allConnectionsTerminated();
+		/// @coppydoc NetworkListener::getCapabilities
+		virtual Ogre::uint32 getCapabilities() const;
 
 		// HlmsJsonListener overload
 		virtual void savingChangeTextureName( Ogre::String &inOutTexName );
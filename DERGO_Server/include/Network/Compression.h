@@ -0,0 +1,63 @@
+#pragma once
+
+#include "OgrePrerequisites.h"
+#include <vector>
+
+namespace Network
+{
+	namespace Codec
+	{
+	/// Must match compression.py's Codec
+	enum Codec
+	{
+		Uncompressed,
+		Zlib,
+		Lz4,
+		NumCodecs
+	};
+	}
+}
+
+namespace DERGO
+{
+	/// Payload compression. Which codecs are available depends on the libraries
+	/// found at build time (DERGO_HAS_ZLIB, DERGO_HAS_LZ4).
+	///
+	/// Compressed payloads are laid out as:
+	///		uint8 codec
+	///		uint32 uncompressedSize
+	///		[compressed data]
+	class Compression
+	{
+	public:
+		static const size_t c_payloadHeaderSize = sizeof(Ogre::uint8) + sizeof(Ogre::uint32);
+
+		/// Network::Capabilities bits of the codecs we can encode and decode.
+		static Ogre::uint32 getCapabilities();
+		/// Network::Capabilities bit of the given codec. 0 if unknown.
+		static Ogre::uint32 getCodecCapability( Ogre::uint8 codec );
+
+		/** Reads the header of a compressed payload.
+		@return
+			False if the header is corrupt or the codec is not supported.
+		*/
+		static bool readPayloadHeader( const Ogre::uint8 *src, size_t srcSize,
+									   Ogre::uint8 &outCodec, Ogre::uint32 &outUncompressedSize );
+
+		/** Decompresses a payload (header included, see readPayloadHeader)
+		@param dst
+			Must hold outUncompressedSize bytes, as returned by readPayloadHeader.
+		@return
+			False on failure (e.g. corrupt data).
+		*/
+		static bool decompress( const Ogre::uint8 *src, size_t srcSize,
+								Ogre::uint8 *dst, size_t dstSize );
+
+		/** Compresses into outDst, header included.
+		@return
+			False on failure, or if it didn't get any smaller. In that case send it uncompressed.
+		*/
+		static bool compress( Ogre::uint8 codec, int level, const Ogre::uint8 *src, size_t srcSize,
+							  std::vector<Ogre::uint8> &outDst );
+	};
+}
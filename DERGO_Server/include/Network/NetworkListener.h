@@ -29,5 +29,9 @@ namespace DERGO
 		virtual void processMessage( const Network::MessageHeader &header, Network::SmartData &smartData,
 									 bufferevent *bev, NetworkSystem &networkSystem ) = 0;
 		virtual void allConnectionsTerminated() {}
+
+		/// Network::Capabilities this listener implements (e.g. ChunkedMeshes),
+		/// announced to the client in the Handshake.
+		virtual Ogre::uint32 getCapabilities() const { return 0; }
 	};
 }
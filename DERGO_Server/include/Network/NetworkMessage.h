@@ -68,25 +68,29 @@ namespace Network
 			//string meshName (UTF-8)
 			//uint32 numFaces
 			//uint32 numRawVertices
-			//uint8 hasColour
+			//uint8 hasColour (with CompactVertexFormats: MeshFormat flags)
 			//uint8 numUVs
 			//uint8 tangentUVSource (255 = disable tangents)
+			//[float3 aabbMin, float3 aabbMax][MeshFormat::QuantizedPositions]
 			//[
 			//	uint4	vertexIndices
-			//	float3	faceNormal
+			//	float3	faceNormal (int16 oct[2] if MeshFormat::CompactNormals)
 			//	ushort	materialId -> Last bit is use_smooth
 			//	uint8_t	numIndicesInFace;
 			//]
 			//[
-			//	float3 vertexColour[numFaces][4]
+			//	float3 vertexColour[numFaces][4] (uint8 rgba if MeshFormat::CompactColours)
 			//][hasColour]
 			//[
-			//	float2 uv[numFaces][4]
+			//	float2 uv[numFaces][4] (half2 if MeshFormat::CompactUvs)
 			//][numUVs]
 			//[
-			//	float3 position
-			//	float3 normal
+			//	float3 position (uint16[3] if MeshFormat::QuantizedPositions)
+			//	float3 normal (int16 oct[2] if MeshFormat::CompactNormals)
 			//][numRawVertices]
+			//[
+			//	float4 tangent (w = handedness, for V mirrored)
+			//][numRawVertices][MeshFormat::HasTangents]
 			//uint16 numMaterials
 			//[uint32 materialIds]	(Table with size = numMaterials)
 		Item,
@@ -188,26 +192,218 @@ namespace Network
 		InitAsync,
 		FinishAsync,
 		Export,
+		SharedMemoryInit,
+			//string uploadSegmentName (UTF-8)
+			//uint32 uploadSegmentSize
+			//string resultSegmentName (UTF-8)
+			//uint32 resultSegmentSize
+			//The result segment starts with a uint64 sequence for each of its two
+			//slots. Slot i starts at byte 64 + i * (resultSegmentSize - 64) / 2.
+			//The upload segment starts with a uint64 consumedPos, which the
+			//server updates after processing each SharedMemoryData message.
+			//Data starts at byte 64, capacity = uploadSegmentSize - 64.
+		SharedMemoryData,
+			//uint8 messageType (the actual message, e.g. Mesh)
+			//uint64 startPos (offset into the ring = startPos % capacity)
+			//uint32 sizeBytes
+		ChannelInit,
+			//uint8 channel (0 = Interactive, 1 = Bulk)
+			//First message of each connection when the client uses more than one.
+		Barrier,
+			//uint32 numOrderedMessages
+			//Ordered messages from this channel that follow must wait until
+			//the other channel processed numOrderedMessages ordered messages.
+		MeshBegin,
+			//Same as the start of Mesh (meshId up to the AABB).
+			//Big meshes are sent as MeshBegin, N MeshChunk then MeshEnd instead
+			//of a single Mesh message. Sections can arrive in any order.
+		MeshChunk,
+			//uint32 meshId
+			//uint8 section (see MeshSection)
+			//uint32 firstElement
+			//[element][...] Elements are laid out exactly as in Mesh, and
+			//FaceUvs elements are indexed as uvSet * numFaces + faceIdx
+			//With SoaMeshes, Faces may be sent as FaceIndices, FaceNormals,
+			//FaceMaterials & FaceFlags instead
+		MeshEnd,
+			//uint32 meshId
+			//uint16 numMaterials
+			//[uint32 materialIds]	(Table with size = numMaterials)
+		CompressionInit,
+			//uint8 resultCodec (codec the client wants for Result; Uncompressed = don't compress)
+			//uint8 resultLevel
+			//uint32 resultThreshold (only compress Results at least this big)
+			//Sent after the Handshake if the client wants to use compression.
+		Handshake,
+			//uint32 protocolVersion (PROTOCOL_VERSION)
+			//uint32 capabilities (see Capabilities)
+			//Must be the first message. The server replies with FromServer::Handshake.
+			//Features in capabilities can only be used if both sides have them
+			//and protocolVersion matches.
+		MeshVertexUpdate,
+			//uint32 meshId
+			//uint32 numFaces
+			//uint32 numRawVertices
+			//[float3 faceNormal] (numFaces of them)
+			//[float3 position, float3 normal] (numRawVertices of them, as in Mesh)
+			//New positions & normals for a mesh whose faces, colours, UVs and
+			//materials didn't change since it was last sent. If it doesn't match,
+			//the server asks for the whole mesh (see FromServer::Resync).
+			//Tangents are generated by the server again, even if the mesh was
+			//sent with MeshFormat::HasTangents.
+		MeshSkin,
+			//uint32 meshId
+			//uint32 numRawVertices
+			//uint16 numBones
+			//[float3 position, float3 normal, uint16 boneIndices[4], float weights[4]]
+			//(numRawVertices of them)
+			//Rest pose & bone weights of a mesh the server deforms itself (linear blend
+			//skinning) whenever a MeshSkinPose arrives. Sent after the mesh (the server
+			//forgets it whenever the mesh gets rebuilt).
+		MeshSkinPose,
+			//uint32 meshId
+			//uint16 numBones
+			//[float m[3][4]] (numBones of them)
+			//Row-major transform of every bone, from the rest pose to the current
+			//one, in mesh space. Needs a MeshSkin first.
+		MeshV2,
+			//Same as Mesh up to tangentUVSource & the AABB, then
+			//uint16 numMaterials
+			//[uint32 materialIds]	(Table with size = numMaterials)
+			//uint8 numSections
+			//[uint8 section, uint32 offset, uint32 sizeBytes] (numSections of them)
+			//Every section (see MeshSection) is an array starting at its offset
+			//from the start of the message (meshId), which is a multiple of 16:
+			//FaceIndices, FaceNormals, FaceMaterials, FaceFlags, [FaceColours],
+			//[FaceUvs (every UV set one after another)], RawVertices, [RawTangents].
+			//Elements are in the same formats as in Mesh (see MeshFormat).
+		MeshIndexed,
+			//uint32 meshId
+			//string meshName (UTF-8)
+			//uint32 numVertices
+			//uint32 numTriangles
+			//uint8 meshFormat (see MeshFormat. Only affects the vertex buffer;
+			//                  vertices are always sent as floats)
+			//uint8 numUVs
+			//uint8 tangentUVSource
+			//uint16 numMaterials
+			//[uint32 materialIds]	(Table with size = numMaterials)
+			//[float3 position, float3 normal, [uint8 colour[4]], [float2 uv] (numUVs),
+			// [float4 tangent][MeshFormat::HasTangents]]
+			//(numVertices of them) Already deindexed & without duplicates, exactly
+			//as DeindexTask & shrinkVertexBuffer would leave them (V mirrored)
+			//[uint16 indices[3]] (numTriangles; uint32 if numVertices > 0xFFFF)
+			//[uint16 material] (numTriangles; index in the material table)
+			//Can't be followed by MeshVertexUpdate nor MeshSkin.
 		NumClientMessages
 	};
 	}
 
+	namespace MeshSection
+	{
+	enum MeshSection
+	{
+		Faces,
+		FaceColours,
+		FaceUvs,
+		RawVertices,
+		/// The fields of Faces as separate arrays (Capabilities::SoaMeshes)
+		FaceIndices,	/// uint32[4]
+		FaceNormals,	/// float3 (int16 oct[2] if MeshFormat::CompactNormals)
+		FaceMaterials,	/// uint16
+		FaceFlags,		/// uint8: numIndicesInFace | (use_smooth << 7)
+		RawTangents		/// float4 (MeshFormat::HasTangents)
+	};
+	}
+
+	/// Flags in the hasColour byte of Mesh & MeshBegin, if both sides have
+	/// Capabilities::CompactVertexFormats (or the capability that goes with
+	/// the flag, if noted). Must match network.py's MeshFormat
+	namespace MeshFormat
+	{
+	enum MeshFormat
+	{
+		HasColour			= 1u << 0u,
+		CompactNormals		= 1u << 1u,	/// Octahedral, 2x int16 snorm. GPU: QTangent
+		CompactColours		= 1u << 2u,	/// 4x uint8 (rgba, alpha unused)
+		CompactUvs			= 1u << 3u,	/// 2x half. GPU: VET_HALF2
+		QuantizedPositions	= 1u << 4u,	/// 3x uint16 unorm within the AABB in the header
+		/// Tangents come from the client (Capabilities::ClientTangents), one per raw
+		/// vertex, instead of being generated. Ignored without normal mapping.
+		HasTangents			= 1u << 5u,
+		/// Whether the server removes duplicated vertices (shrinkVertexBuffer), with
+		/// Capabilities::VertexOptimization. Neither: it decides (see DergoSystem::buildMesh)
+		OptimizeAlways		= 1u << 6u,
+		OptimizeNever		= 1u << 7u
+	};
+	}
+
+	/// What FromServer::Resync asks to send again
+	namespace ResyncEntity
+	{
+	enum ResyncEntity
+	{
+		Mesh,		/// id is the meshId as sent by the client
+		Item,
+		Material
+	};
+	}
+
+#define PROTOCOL_VERSION 1
+
+	/// Optional features, negotiated in the Handshake. Must match network.py's Capability
+	namespace Capabilities
+	{
+	enum Capabilities
+	{
+		CompressionZlib			= 1u << 0u,
+		CompressionLz4			= 1u << 1u,
+		ChunkedMeshes			= 1u << 2u,	/// MeshBegin, MeshChunk, MeshEnd
+		SharedMemory			= 1u << 4u,	/// SharedMemoryInit, SharedMemoryData
+		CompactVertexFormats	= 1u << 5u,	/// MeshFormat flags in Mesh & MeshBegin
+		BulkChannel				= 1u << 6u,	/// ChannelInit, Barrier
+		VertexUpdates			= 1u << 7u,	/// MeshVertexUpdate
+		Skinning				= 1u << 8u,	/// MeshSkin, MeshSkinPose
+		SoaMeshes				= 1u << 9u,	/// MeshV2, MeshSection::FaceIndices & co.
+		IndexedMeshes			= 1u << 10u,	/// MeshIndexed
+		ClientTangents			= 1u << 11u,	/// MeshFormat::HasTangents, MeshSection::RawTangents
+		VertexOptimization		= 1u << 12u	/// MeshFormat::OptimizeAlways, OptimizeNever
+	};
+	}
+
 	namespace FromServer
 	{
 	enum FromServer
 	{
 		ConnectionTest,
 			//"Hello you too"
-		Resync, /// Tels the client we want a Reset.
+		Resync,
+			//uint32 numEntries
+			//[numEntries]
+			//	uint8 entityType (see ResyncEntity)
+			//	uint32 id
+			//Tells the client to send those entities again.
+			//An empty message means we want a Reset.
 		Result,
 			//uint16 width
 			//uint16 height
 			//[width * height * 3] Image data
+		SharedMemoryResult,
+			//uint64 sequence
+			//uint32 sizeBytes
+			//Same as Result, but the data is in slot (sequence % 2) of the result
+			//segment. The server zeroes the slot's sequence while it writes, then
+			//sets it to sequence. If it doesn't match after copying, drop the frame.
+		Handshake,
+			//uint32 protocolVersion (PROTOCOL_VERSION)
+			//uint32 capabilities (see Capabilities)
 		NumServerMessages
 	};
 	}
 
 #define HEADER_SIZE 5
+/// Set in MessageHeader::messageType when the payload is compressed (see Compression.h)
+#define COMPRESSED_MESSAGE_FLAG 0x80
 #pragma pack( push, 1 )
 	struct MessageHeader
 	{
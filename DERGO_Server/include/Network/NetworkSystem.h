@@ -3,7 +3,11 @@
 
 #include "OgrePrerequisites.h"
 #include "Network/NetworkListener.h"
+#include "Network/SharedMemory.h"
+#include "Network/Compression.h"
 #include <event2/util.h>
+#include <deque>
+#include <map>
 
 namespace Network
 {
@@ -11,24 +15,134 @@ namespace Network
 }
 
 struct event_base;
+struct event;
 struct bufferevent;
 struct sockaddr;
 struct evconnlistener;
 
 namespace DERGO
 {
-	/// Single-connection network manager. Process reads, creates packets for sending.
+	/// Single-client network manager. Process reads, creates packets for sending.
 	///	Encapusaltes libevent
+	///
+	/// The client may use two connections ("channels"): an interactive one, and a
+	/// bulk one for big uploads (see FromClient::ChannelInit). Scene messages are
+	/// processed in the order the client sent them regardless of the channel they
+	/// came through, thanks to FromClient::Barrier. Messages that don't modify the
+	/// scene (e.g. Render) are processed as soon as they arrive.
+	///
+	/// The bulk channel processes one message per event loop iteration and has a
+	/// lower libevent priority, so a Render never waits behind a queue of uploads;
+	/// only behind the one upload being processed when it arrived.
 	class NetworkSystem
 	{
+	public:
+		enum Channel
+		{
+			Interactive,
+			Bulk,
+			NumChannels
+		};
+
+	protected:
+		struct Connection
+		{
+			std::vector<Ogre::uint8>	stream;	/// Received data not processed yet
+			/// Where the data not processed yet starts in stream
+			size_t						streamStart;
+			Ogre::uint8					channel;
+
+			Connection() : streamStart( 0 ), channel( Interactive ) {}
+		};
+
+		typedef std::map<bufferevent*, Connection> ConnectionMap;
+		typedef std::deque< std::vector<Ogre::uint8> > MessageDeque;
+
+		struct ChannelState
+		{
+			bufferevent		*bev;
+			/// Number of ordered messages processed so far
+			Ogre::uint32	numProcessed;
+			/// From the last Barrier: don't process more ordered messages from
+			/// this channel until the other channel processed this many.
+			Ogre::uint32	waitForOther;
+			/// Copies of the messages (header included) waiting for the other channel
+			MessageDeque	deferred;
+
+			ChannelState() : bev( 0 ), numProcessed( 0 ), waitForOther( 0 ) {}
+		};
+
 		event_base *m_eventBase;
+		/// Activated when the bulk channel stopped processing to let the
+		/// interactive one go first. See m_bulkMessageProcessed
+		event *m_resumeBulkEvent;
 
-		std::vector<Ogre::uint8>		m_currentStream;
+		ConnectionMap					m_connections;
+		ChannelState					m_channels[NumChannels];
 		std::vector<Ogre::uint8>		m_stashData;
 		std::vector<Ogre::uint8>		m_rcvBuffer;
 		std::vector<NetworkListener*>	m_listeners;
 
 		Ogre::uint32 m_numActiveConnections;
+		/// Set by abortConnection. Stops processing whatever is left in the stream.
+		bool m_connectionAborted;
+		/// Set once the bulk channel processed a message in this event loop
+		/// iteration. It won't process another one until the next iteration.
+		bool m_bulkMessageProcessed;
+
+		/// Set by the client via FromClient::SharedMemoryInit. See NetworkMessage.h
+		SharedMemory	m_uploadMemory;
+		SharedMemory	m_resultMemory;
+
+		/// Capabilities both sides have. Set by the client via FromClient::Handshake
+		Ogre::uint32	m_capabilities;
+
+		/// Set by the client via FromClient::CompressionInit. See NetworkMessage.h
+		Ogre::uint8		m_resultCodec;
+		Ogre::uint8		m_resultCompressionLevel;
+		Ogre::uint32	m_resultCompressionThreshold;
+		/// Number of Results sent through m_resultMemory
+		Ogre::uint64	m_resultSequence;
+		/// Header + payload of the last message we decompressed
+		std::vector<Ogre::uint8>		m_decompressBuffer;
+		std::vector<Ogre::uint8>		m_compressBuffer;
+
+		void dispatchMessage( const Network::MessageHeader &header, Network::SmartData &smartData,
+							  bufferevent *bev );
+
+		/// False for messages that don't modify the scene. Must match Network.UNORDERED_MESSAGES
+		static bool isOrderedMessage( Ogre::uint8 messageType );
+		bool isChannelBlocked( size_t channelIdx ) const;
+
+		/// Processes the message now, or defers it if the other channel needs to catch up.
+		void processIncomingMessage( Connection &connection, const Network::MessageHeader &header,
+									 Network::SmartData &smartData, bufferevent *bev );
+		/// Processes every deferred message that no longer has to wait.
+		void processDeferredMessages();
+		/// Processes the complete messages in connection.stream.
+		void processStream( Connection &connection, bufferevent *bev );
+		/// True if the bulk channel must wait for the next event loop iteration
+		/// before processing another message (which is then scheduled).
+		bool yieldBulkChannel( size_t channelIdx );
+
+		void connectionClosed( bufferevent *bev );
+
+		/// Handles the messages that are about the connection itself rather than the scene.
+		/// @return True if the message was handled (and must not reach the listeners).
+		bool processSharedMemoryMessage( const Network::MessageHeader &header,
+										 Network::SmartData &smartData, bufferevent *bev );
+		bool processCompressionMessage( const Network::MessageHeader &header,
+										Network::SmartData &smartData, bufferevent *bev );
+		bool processHandshakeMessage( const Network::MessageHeader &header,
+									  Network::SmartData &smartData, bufferevent *bev );
+
+		/// Writes the message to bev as is. See send()
+		void writeMessage( bufferevent *bev, Ogre::uint8 messageType,
+						   const void *data, Ogre::uint32 sizeBytes );
+
+		/// Decompresses a message with COMPRESSED_MESSAGE_FLAG set, then processes it.
+		void processCompressedMessage( Connection &connection, const Network::MessageHeader &header,
+									   Network::SmartData &smartData, bufferevent *bev );
 
 	public:
 		NetworkSystem();
@@ -36,8 +150,23 @@ namespace DERGO
 
 		void addListener( NetworkListener *listener );
 
-		int start();
+		/// Network::Capabilities we (and our listeners) support
+		Ogre::uint32 getLocalCapabilities() const;
+		/// Network::Capabilities both us and the client support. 0 before the Handshake
+		Ogre::uint32 getCapabilities() const		{ return m_capabilities; }
+
+		/**
+		@param port
+			TCP port to listen on.
+		@param unixSocketPath
+			When not empty, also listen on this Unix domain socket. Ignored on Windows.
+		*/
+		int start( Ogre::uint16 port, const Ogre::String &unixSocketPath );
 
+		/// Messages always go through the interactive channel (bev is ignored if
+		/// the client is using more than one). Result messages are sent through
+		/// shared memory if the client set it up, otherwise they're compressed
+		/// if the client asked for it.
 		void send( bufferevent *bev, Network::FromServer::FromServer msg,
 				   const void *data, Ogre::uint32 sizeBytes );
 
@@ -50,6 +179,8 @@ namespace DERGO
 		void _buffered_on_read( bufferevent *bev );
 		/// Called when a special event happened (i.e. connection terminated)
 		void _conn_eventcb( bufferevent *bev, short events );
+		/// Called on the event loop iteration after the bulk channel yielded
+		void _resume_bulk_cb();
 		/// Called on interrupts (e.g. Ctrl+C)
 		void _signal_cb( evutil_socket_t sig, short events );
 	};
@@ -0,0 +1,37 @@
+#pragma once
+
+#include "OgrePrerequisites.h"
+
+namespace DERGO
+{
+	/// Maps a named shared memory segment created by the client
+	/// (Python's multiprocessing.shared_memory). The client owns it:
+	/// we never create nor unlink it.
+	class SharedMemory
+	{
+		Ogre::uint8	*m_data;
+		size_t		m_sizeBytes;
+#ifdef _WIN32
+		void		*m_fileMapping;
+#endif
+
+	public:
+		SharedMemory();
+		~SharedMemory();
+
+		/**
+		@param name
+			Name as reported by SharedMemory.name on the client (e.g. "psm_1234abcd")
+		@param sizeBytes
+			Size of the segment. Must not be bigger than the segment itself.
+		@return
+			False on failure.
+		*/
+		bool open( const Ogre::String &name, size_t sizeBytes );
+		void close();
+
+		bool isOpen() const				{ return m_data != 0; }
+		Ogre::uint8* getData() const	{ return m_data; }
+		size_t getSizeBytes() const		{ return m_sizeBytes; }
+	};
+}
@@ -4,6 +4,7 @@
 #include "DergoCommon.h"
 #include "OgreVector2.h"
 #include "OgreVector3.h"
+#include "OgreQuaternion.h"
 #include "Vao/OgreVertexBufferPacked.h"
 #include "Threading/OgreBarrier.h"
 #include "Threading/OgreUniformScalableTask.h"
@@ -19,6 +20,8 @@ namespace DERGO
 	};
 	static const uint32_t c_sizeOfBlenderFace = sizeof(uint32_t) * 4 + sizeof(Ogre::Vector3) +
 												sizeof(uint16_t) + sizeof(uint8_t);
+	/// Vertex whose normal comes from its raw vertex. See DergoSystem::VertexPatchData
+	static const uint32_t c_smoothVertex = 0xFFFFFFFFu;
 	struct BlenderFaceUv
 	{
 		Ogre::Vector2	uv[4];
@@ -32,10 +35,50 @@ namespace DERGO
 		Ogre::Vector3	vPos;
 		Ogre::Vector3	vNormal;
 	};
+	/// Tangent of a raw vertex computed by the client (see MeshFormat::HasTangents)
+	struct BlenderRawTangent
+	{
+		Ogre::Vector3	vTangent;
+		float			handedness;
+	};
+	/// Up to 4 bones influencing a raw vertex (see FromClient::MeshSkin)
+	struct BlenderSkinWeights
+	{
+		uint16_t		boneIndices[4];
+		float			weights[4];
+	};
+	/// Row-major 3x4 transform: rest pose -> current pose, in mesh space
+	struct BlenderBoneMatrix
+	{
+		float			m[3][4];
+	};
 
 	class VertexUtils
 	{
 	public:
+		/// Size of one element of a mesh section (see Network::MeshSection) as sent
+		/// by the client, which depends on the mesh's Network::MeshFormat flags.
+		static size_t getWireElementSize( uint8_t section, uint8_t meshFormat );
+
+		/** Converts elements of a mesh section as sent by the client (possibly in
+			compact formats) into our own structs.
+		@param dstData [out]
+			BlenderFace, BlenderFaceColour, BlenderFaceUv, BlenderRawVertex or
+			BlenderRawTangent array,
+			depending on section. Must hold numElements. Sections with only some fields
+			of the faces (e.g. MeshSection::FaceNormals) leave the rest untouched.
+		@param srcData
+			numElements * getWireElementSize( section, meshFormat ) bytes.
+		@param aabbMin
+			Bounds positions were quantized to. Only used with MeshFormat::QuantizedPositions
+		*/
+		static void decodeSection( void * RESTRICT_ALIAS dstData, const uint8_t *srcData,
+								   size_t numElements, uint8_t section, uint8_t meshFormat,
+								   const Ogre::Vector3 &aabbMin, const Ogre::Vector3 &aabbMax );
+
+		/// Decodes an octahedral normal (MeshFormat::CompactNormals)
+		static Ogre::Vector3 decodeOctNormal( int16_t x, int16_t y );
+
 		/** Deindexes all vertex positions & normals from Blender's representation
 			into 3 vertices per triangle.
 		@param dstData [out]
@@ -81,6 +124,12 @@ namespace DERGO
 							 const BlenderFace *faces, uint32_t numFaces,
 							 const BlenderFaceUv *faceUv, uint32_t uvStride );
 
+		/// Same as the raw vertices' version, for tangents sent by the client.
+		/// They're written as float4 at tangentStride, like generateTangents does.
+		static void deindex( uint8_t * RESTRICT_ALIAS dstData, uint32_t bytesPerVertex,
+							 const BlenderFace *faces, uint32_t numFaces,
+							 const BlenderRawTangent *rawTangents, uint32_t tangentStride );
+
 		/** Shrinks vertex buffer by removing duplicates and converting from tri list to
 			indexed tri list.
 		@param dstData [in/out]
@@ -100,6 +149,25 @@ namespace DERGO
 											uint32_t bytesPerVertex,
 											uint32_t numVertices );
 
+		/** Linear blend skinning of Blender's raw vertices.
+		@param restVertices
+			Positions & normals in the rest pose.
+		@param skinWeights
+			Bones influencing each vertex. Weights are normalised; if they add up
+			to ~0 the vertex stays in the rest pose (like Blender's Armature modifier).
+		@param boneMatrices
+			Transform of each bone. Bone indices must be valid.
+		@param outVertices [out]
+			Skinned positions & normals.
+		@param numVertices
+			Number of vertices in restVertices, skinWeights and outVertices.
+		*/
+		static void skin( const BlenderRawVertex *restVertices,
+						  const BlenderSkinWeights *skinWeights,
+						  const BlenderBoneMatrix *boneMatrices,
+						  BlenderRawVertex * RESTRICT_ALIAS outVertices,
+						  uint32_t numVertices );
+
 		/// Non-indexed lists
 		static void generateTangents( uint8_t *vertexData, uint32_t bytesPerVertex,
 									  uint32_t numVertices, uint32_t posStride, uint32_t normalStride,
@@ -157,6 +225,32 @@ namespace DERGO
 											 uint32_t tangentStride,
 											 Ogre::Vector3 * RESTRICT_ALIAS inOutUvBuffer,
 											 size_t numThreads );
+
+		/** Converts deindexed vertices into the compact formats the mesh's Network::MeshFormat
+			asks for: MeshFormat::CompactNormals turns normal & tangent into a QTangent
+			(VET_SHORT4_SNORM), MeshFormat::CompactUvs turns UVs into VET_HALF2.
+			Positions & colours are kept as they are.
+		@param dstData [out]
+			numVertices bytes of the mesh's vertex format on the GPU.
+		@param srcData
+			Deindexed vertices (with their tangents already generated, if any).
+		*/
+		static void compactVertices( uint8_t * RESTRICT_ALIAS dstData, const uint8_t *srcData,
+									 uint32_t bytesPerVertex, uint32_t numVertices,
+									 bool hasColour, uint8_t numUVs, bool hasTangent,
+									 uint8_t meshFormat );
+
+		/// QTangent (see compactVertices) of a normal & its tangent. If the tangent is
+		/// zero (e.g. no normal mapping), any perpendicular one gets used.
+		static Ogre::Quaternion createQTangent( const Ogre::Vector3 &vNormal,
+												Ogre::Vector3 vTangent, float parity );
+
+		/// Opposite of compactVertices. QTangents can't tell apart a tangent from an
+		/// arbitrary one if the mesh had none; it'll be regenerated anyway.
+		static void expandVertices( uint8_t * RESTRICT_ALIAS dstData, const uint8_t *srcData,
+									uint32_t bytesPerVertex, uint32_t numVertices,
+									bool hasColour, uint8_t numUVs, bool hasTangent,
+									uint8_t meshFormat );
 	};
 
 	class GenerateTangentsTask : public Ogre::UniformScalableTask
@@ -195,6 +289,28 @@ namespace DERGO
 		virtual void execute( size_t threadId, size_t numThreads );
 	};
 
+	class SkinningTask : public Ogre::UniformScalableTask
+	{
+		const BlenderRawVertex		*restVertices;
+		const BlenderSkinWeights	*skinWeights;
+		const BlenderBoneMatrix		*boneMatrices;
+		BlenderRawVertex			*outVertices;
+		uint32_t					numVertices;
+
+	public:
+		SkinningTask( const BlenderRawVertex *_restVertices,
+					  const BlenderSkinWeights *_skinWeights,
+					  const BlenderBoneMatrix *_boneMatrices,
+					  BlenderRawVertex *_outVertices, uint32_t _numVertices ) :
+			restVertices( _restVertices ), skinWeights( _skinWeights ),
+			boneMatrices( _boneMatrices ), outVertices( _outVertices ),
+			numVertices( _numVertices )
+		{
+		}
+
+		virtual void execute( size_t threadId, size_t numThreads );
+	};
+
 	class DeindexTask : public Ogre::UniformScalableTask
 	{
 		uint8_t *vertexData;
@@ -210,6 +326,9 @@ namespace DERGO
 		const std::vector<BlenderFaceUv>		*faceUv;
 		const std::vector<BlenderRawVertex>		*blenderRawVertices;
 		Ogre::FastArray<uint16_t>				*materialIds;
+		/// Client tangents (empty to leave them to GenerateTangentsTask)
+		const std::vector<BlenderRawTangent>	*rawTangents;
+		uint32_t tangentStride;
 
 	public:
 		DeindexTask( uint8_t *_vertexData, uint32_t _bytesPerVertex, uint32_t _numVertices,
@@ -218,17 +337,21 @@ namespace DERGO
 					 const std::vector<BlenderFaceColour>	*_facesColour,
 					 const std::vector<BlenderFaceUv>		*_faceUv,
 					 const std::vector<BlenderRawVertex>	*_blenderRawVertices,
-					 Ogre::FastArray<uint16_t>				*_materialIds ) :
+					 Ogre::FastArray<uint16_t>				*_materialIds,
+					 const std::vector<BlenderRawTangent>	*_rawTangents,
+					 uint32_t _tangentStride ) :
 			vertexData( _vertexData ), bytesPerVertex( _bytesPerVertex ),
 			numVertices( _numVertices ), numUVs( _numUVs ),
 			vertexStartThreadIdx( _vertexStartThreadIdx ),
 			faces( _faces ), facesColour( _facesColour ),
 			faceUv( _faceUv ), blenderRawVertices( _blenderRawVertices ),
-			materialIds( _materialIds )
+			materialIds( _materialIds ), rawTangents( _rawTangents ),
+			tangentStride( _tangentStride )
 		{
 			assert( materialIds->size() == numVertices / 3u );
 			assert( faceUv->size() == faces->size() * numUVs );
 			assert( facesColour->empty() || facesColour->size() == faces->size() );
+			assert( rawTangents->empty() || rawTangents->size() == blenderRawVertices->size() );
 		}
 
 		virtual void execute( size_t threadId, size_t numThreads );
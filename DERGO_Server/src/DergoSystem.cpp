@@ -5,6 +5,7 @@
 #include "System/WindowEventListener.h"
 
 #include "OgreRoot.h"
+#include "OgreTimer.h"
 #include "OgreException.h"
 
 #include "OgreRenderWindow.h"
@@ -48,6 +49,14 @@
 
 namespace DERGO
 {
+	/// Meshes built again within this many ms of their last change (built or patched)
+	/// are likely being edited: they aren't optimized until they settle.
+	/// See DergoSystem::shouldOptimizeMesh
+	static const unsigned long c_meshSettleTime = 2000ul;
+	/// Beyond this many deindexed vertices, meshes are only optimized if the client
+	/// asks for it: shrinkVertexBuffer is O(N^2)
+	static const uint32_t c_maxAutoOptimizedVertices = 40000u;
+
 	Ogre::String toStr64( uint64_t val )
 	{
 		Ogre::StringStream stream;
@@ -601,16 +610,612 @@ namespace DERGO
 			vaoManager->destroyVertexBuffer( vertexBuffer );
 	}
 	//-----------------------------------------------------------------------------------
+	void DergoSystem::readMeshHeader( Network::SmartData &smartData, BlenderMeshData &outMeshData )
+	{
+		outMeshData.meshName		= smartData.getString();
+		outMeshData.numFaces		= smartData.read<Ogre::uint32>();
+		outMeshData.numRawVertices	= smartData.read<Ogre::uint32>();
+		outMeshData.meshFormat		= smartData.read<Ogre::uint8>();
+		outMeshData.numUVs			= smartData.read<Ogre::uint8>();
+		outMeshData.tangentUVSource	= smartData.read<uint8_t>();
+
+		//Clients without Capabilities::CompactVertexFormats send 0 or 1 (hasColour) here
+		outMeshData.hasColour = (outMeshData.meshFormat & Network::MeshFormat::HasColour) != 0;
+
+		if( outMeshData.meshFormat & Network::MeshFormat::QuantizedPositions )
+		{
+			outMeshData.aabbMin = smartData.read<Ogre::Vector3>();
+			outMeshData.aabbMax = smartData.read<Ogre::Vector3>();
+		}
+
+		outMeshData.faces.clear();
+		outMeshData.faceColours.clear();
+		outMeshData.faceUvs.clear();
+		outMeshData.rawVertices.clear();
+		outMeshData.rawTangents.clear();
+		outMeshData.materialTable.clear();
+
+		outMeshData.faces.resize( outMeshData.numFaces );
+		if( outMeshData.hasColour )
+			outMeshData.faceColours.resize( outMeshData.numFaces );
+		outMeshData.faceUvs.resize( outMeshData.numFaces * outMeshData.numUVs );
+		outMeshData.rawVertices.resize( outMeshData.numRawVertices );
+		if( outMeshData.meshFormat & Network::MeshFormat::HasTangents )
+			outMeshData.rawTangents.resize( outMeshData.numRawVertices );
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::readMeshMaterialTable( Network::SmartData &smartData,
+											 BlenderMeshData &outMeshData )
+	{
+		const uint16_t materialTableSize = smartData.read<uint16_t>();
+		outMeshData.materialTable.resize( materialTableSize );
+
+		if( !outMeshData.materialTable.empty() )
+		{
+			smartData.read( reinterpret_cast<uint8_t*>( &outMeshData.materialTable[0] ),
+							sizeof(uint32_t) * outMeshData.materialTable.size() );
+		}
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::readMeshSection( Network::SmartData &smartData, BlenderMeshData &outMeshData,
+									   uint8_t section, size_t firstElement, size_t numElements )
+	{
+		if( !numElements )
+			return;
+
+		void *dstData = 0;
+
+		switch( section )
+		{
+		case Network::MeshSection::Faces:
+			dstData = &outMeshData.faces[firstElement];
+			break;
+		case Network::MeshSection::FaceColours:
+			dstData = &outMeshData.faceColours[firstElement];
+			break;
+		case Network::MeshSection::FaceUvs:
+			dstData = &outMeshData.faceUvs[firstElement];
+			break;
+		case Network::MeshSection::RawVertices:
+			dstData = &outMeshData.rawVertices[firstElement];
+			break;
+		case Network::MeshSection::FaceIndices:
+		case Network::MeshSection::FaceNormals:
+		case Network::MeshSection::FaceMaterials:
+		case Network::MeshSection::FaceFlags:
+			dstData = &outMeshData.faces[firstElement];
+			break;
+		case Network::MeshSection::RawTangents:
+			dstData = &outMeshData.rawTangents[firstElement];
+			break;
+		}
+
+		const uint8_t *srcData = reinterpret_cast<const uint8_t*>( smartData.getCurrentPtr() );
+		VertexUtils::decodeSection( dstData, srcData, numElements, section, outMeshData.meshFormat,
+									outMeshData.aabbMin, outMeshData.aabbMax );
+		smartData.seekCur( static_cast<int>( numElements *
+											 VertexUtils::getWireElementSize( section,
+																			  outMeshData.meshFormat ) ) );
+	}
+	//-----------------------------------------------------------------------------------
+	size_t DergoSystem::getNumSectionElements( const BlenderMeshData &meshData,
+											   uint8_t section ) const
+	{
+		switch( section )
+		{
+		case Network::MeshSection::Faces:
+		case Network::MeshSection::FaceIndices:
+		case Network::MeshSection::FaceNormals:
+		case Network::MeshSection::FaceMaterials:
+		case Network::MeshSection::FaceFlags:
+			return meshData.faces.size();
+		case Network::MeshSection::FaceColours:
+			return meshData.faceColours.size();
+		case Network::MeshSection::FaceUvs:
+			return meshData.faceUvs.size();
+		case Network::MeshSection::RawVertices:
+			return meshData.rawVertices.size();
+		case Network::MeshSection::RawTangents:
+			return meshData.rawTangents.size();
+		}
+
+		return 0;
+	}
+	//-----------------------------------------------------------------------------------
 	void DergoSystem::syncMesh( Network::SmartData &smartData )
 	{
 		uint32_t meshId = smartData.read<uint32_t>();
-		Ogre::String meshName = smartData.getString();
 
-		const Ogre::uint32 numFaces			= smartData.read<Ogre::uint32>();
-		const Ogre::uint32 numRawVertices	= smartData.read<Ogre::uint32>();
-		const bool hasColour				= smartData.read<Ogre::uint8>() != 0;
-		const Ogre::uint8 numUVs			= smartData.read<Ogre::uint8>();
-		uint8_t tangentUVSource				= smartData.read<uint8_t>();
+		BlenderMeshData meshData;
+		readMeshHeader( smartData, meshData );
+
+		readMeshSection( smartData, meshData, Network::MeshSection::Faces,
+						 0, meshData.faces.size() );
+		readMeshSection( smartData, meshData, Network::MeshSection::FaceColours,
+						 0, meshData.faceColours.size() );
+		readMeshSection( smartData, meshData, Network::MeshSection::FaceUvs,
+						 0, meshData.faceUvs.size() );
+		readMeshSection( smartData, meshData, Network::MeshSection::RawVertices,
+						 0, meshData.rawVertices.size() );
+		readMeshSection( smartData, meshData, Network::MeshSection::RawTangents,
+						 0, meshData.rawTangents.size() );
+
+		readMeshMaterialTable( smartData, meshData );
+
+		buildMesh( meshId, meshData );
+	}
+	//-----------------------------------------------------------------------------------
+	bool DergoSystem::syncMeshV2( Network::SmartData &smartData, uint32_t sizeBytes )
+	{
+		const size_t messageStart = smartData.getOffset();
+		const uint32_t meshId = smartData.read<uint32_t>();
+
+		BlenderMeshData meshData;
+		readMeshHeader( smartData, meshData );
+		readMeshMaterialTable( smartData, meshData );
+
+		uint32_t requiredSections = 0;
+		if( !meshData.faces.empty() )
+		{
+			requiredSections |= (1u << Network::MeshSection::FaceIndices) |
+								(1u << Network::MeshSection::FaceNormals) |
+								(1u << Network::MeshSection::FaceMaterials) |
+								(1u << Network::MeshSection::FaceFlags);
+		}
+		if( !meshData.faceColours.empty() )
+			requiredSections |= 1u << Network::MeshSection::FaceColours;
+		if( !meshData.faceUvs.empty() )
+			requiredSections |= 1u << Network::MeshSection::FaceUvs;
+		if( !meshData.rawVertices.empty() )
+			requiredSections |= 1u << Network::MeshSection::RawVertices;
+		if( !meshData.rawTangents.empty() )
+			requiredSections |= 1u << Network::MeshSection::RawTangents;
+
+		uint32_t receivedSections = 0;
+
+		const uint8_t numSections = smartData.read<uint8_t>();
+		const size_t tableStart = smartData.getOffset();
+		for( uint8_t i=0; i<numSections; ++i )
+		{
+			smartData.seekSet( tableStart + i * (sizeof(uint8_t) + sizeof(uint32_t) * 2u) );
+			const uint8_t section		= smartData.read<uint8_t>();
+			const uint32_t offset		= smartData.read<uint32_t>();
+			const uint32_t sectionSize	= smartData.read<uint32_t>();
+
+			const size_t elementSize = VertexUtils::getWireElementSize( section,
+																		meshData.meshFormat );
+			const size_t numElements = getNumSectionElements( meshData, section );
+
+			if( !elementSize || section == Network::MeshSection::Faces ||
+				static_cast<size_t>( offset ) + sectionSize > sizeBytes ||
+				sectionSize != numElements * elementSize )
+			{
+				printf( "Received corrupt MeshV2 for mesh %i. Resyncing.\n", meshId );
+				requestResync( Network::ResyncEntity::Mesh, meshId );
+				return false;
+			}
+
+			smartData.seekSet( messageStart + offset );
+			readMeshSection( smartData, meshData, section, 0, numElements );
+			receivedSections |= 1u << section;
+		}
+
+		if( (receivedSections & requiredSections) != requiredSections )
+		{
+			printf( "Received MeshV2 for mesh %i with missing sections. Resyncing.\n", meshId );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			return false;
+		}
+
+		buildMesh( meshId, meshData );
+
+		return true;
+	}
+	//-----------------------------------------------------------------------------------
+	bool DergoSystem::syncMeshIndexed( Network::SmartData &smartData, uint32_t sizeBytes )
+	{
+		const size_t messageStart = smartData.getOffset();
+		const uint32_t meshId = smartData.read<uint32_t>();
+
+		BlenderMeshData meshData;
+		meshData.indexed			= true;
+		meshData.meshName			= smartData.getString();
+		meshData.numIndexedVertices	= smartData.read<Ogre::uint32>();
+		const uint32_t numTriangles	= smartData.read<Ogre::uint32>();
+		meshData.meshFormat			= smartData.read<Ogre::uint8>();
+		meshData.numUVs				= smartData.read<Ogre::uint8>();
+		meshData.tangentUVSource	= smartData.read<uint8_t>();
+		meshData.hasColour = (meshData.meshFormat & Network::MeshFormat::HasColour) != 0;
+
+		readMeshMaterialTable( smartData, meshData );
+
+		const size_t bytesPerVertex = sizeof(float) * 3u * 2u + (meshData.hasColour ? 4u : 0u) +
+									  sizeof(float) * 2u * meshData.numUVs +
+									  ((meshData.meshFormat & Network::MeshFormat::HasTangents) ?
+										   sizeof(float) * 4u : 0u);
+		const size_t bytesPerIndex = meshData.numIndexedVertices > 0xffff ? 4u : 2u;
+		const size_t numIndices = static_cast<size_t>( numTriangles ) * 3u;
+
+		if( smartData.getOffset() - messageStart + meshData.numIndexedVertices * bytesPerVertex +
+			numIndices * bytesPerIndex + numTriangles * sizeof(uint16_t) != sizeBytes )
+		{
+			printf( "Received corrupt MeshIndexed for mesh %i. Resyncing.\n", meshId );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			return false;
+		}
+
+		meshData.indexedVertices.resize( meshData.numIndexedVertices * bytesPerVertex );
+		meshData.indices.resize( numIndices );
+		meshData.triangleMaterials.resize( numTriangles );
+
+		if( !meshData.indexedVertices.empty() )
+		{
+			smartData.read( &meshData.indexedVertices[0], meshData.indexedVertices.size() );
+		}
+
+		if( numIndices )
+		{
+			if( bytesPerIndex == 4u )
+			{
+				smartData.read( reinterpret_cast<uint8_t*>( &meshData.indices[0] ),
+								numIndices * sizeof(uint32_t) );
+			}
+			else
+			{
+				for( size_t i=0; i<numIndices; ++i )
+					meshData.indices[i] = smartData.read<uint16_t>();
+			}
+
+			for( size_t i=0; i<numIndices; ++i )
+			{
+				if( meshData.indices[i] >= meshData.numIndexedVertices )
+				{
+					printf( "Received MeshIndexed for mesh %i with invalid indices. Resyncing.\n",
+							meshId );
+					requestResync( Network::ResyncEntity::Mesh, meshId );
+					return false;
+				}
+			}
+
+			smartData.read( reinterpret_cast<uint8_t*>( &meshData.triangleMaterials[0] ),
+							numTriangles * sizeof(uint16_t) );
+		}
+
+		buildMesh( meshId, meshData );
+
+		return true;
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::syncMeshBegin( Network::SmartData &smartData )
+	{
+		uint32_t meshId = smartData.read<uint32_t>();
+
+		//If a previous upload of this mesh never finished, it gets discarded.
+		readMeshHeader( smartData, m_pendingMeshes[meshId] );
+	}
+	//-----------------------------------------------------------------------------------
+	bool DergoSystem::syncMeshChunk( Network::SmartData &smartData, uint32_t sizeBytes )
+	{
+		const uint32_t meshId			= smartData.read<uint32_t>();
+		const uint8_t section			= smartData.read<uint8_t>();
+		const uint32_t firstElement		= smartData.read<uint32_t>();
+		const uint32_t bytesInChunk		= sizeBytes - (sizeof(uint32_t) * 2u + sizeof(uint8_t));
+
+		BlenderMeshDataMap::iterator itor = m_pendingMeshes.find( meshId );
+		if( itor == m_pendingMeshes.end() )
+		{
+			printf( "Received MeshChunk for mesh %i without MeshBegin. Resyncing.\n", meshId );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			return false;
+		}
+
+		BlenderMeshData &meshData = itor->second;
+
+		const size_t elementSize = VertexUtils::getWireElementSize( section, meshData.meshFormat );
+		const size_t numElements = getNumSectionElements( meshData, section );
+
+		const size_t numElementsInChunk = elementSize ? (bytesInChunk / elementSize) : 0;
+		if( !elementSize || bytesInChunk % elementSize != 0 ||
+			firstElement + numElementsInChunk > numElements )
+		{
+			printf( "Received corrupt MeshChunk for mesh %i. Resyncing.\n", meshId );
+			m_pendingMeshes.erase( itor );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			return false;
+		}
+
+		readMeshSection( smartData, meshData, section, firstElement, numElementsInChunk );
+
+		return true;
+	}
+	//-----------------------------------------------------------------------------------
+	bool DergoSystem::syncMeshEnd( Network::SmartData &smartData )
+	{
+		const uint32_t meshId = smartData.read<uint32_t>();
+
+		BlenderMeshDataMap::iterator itor = m_pendingMeshes.find( meshId );
+		if( itor == m_pendingMeshes.end() )
+		{
+			printf( "Received MeshEnd for mesh %i without MeshBegin. Resyncing.\n", meshId );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			return false;
+		}
+
+		readMeshMaterialTable( smartData, itor->second );
+		buildMesh( meshId, itor->second );
+		m_pendingMeshes.erase( itor );
+
+		return true;
+	}
+	//-----------------------------------------------------------------------------------
+	bool DergoSystem::syncMeshVertexUpdate( Network::SmartData &smartData, uint32_t sizeBytes )
+	{
+		const uint32_t meshId			= smartData.read<uint32_t>();
+		const uint32_t numFaces			= smartData.read<uint32_t>();
+		const uint32_t numRawVertices	= smartData.read<uint32_t>();
+
+		BlenderMeshMap::iterator itor = m_meshes.find( meshId );
+		if( itor == m_meshes.end() ||
+			itor->second.vertexPatchData.numFaces != numFaces ||
+			itor->second.vertexPatchData.numRawVertices != numRawVertices ||
+			sizeBytes != sizeof(uint32_t) * 3u + sizeof(Ogre::Vector3) * numFaces +
+						 sizeof(BlenderRawVertex) * numRawVertices )
+		{
+			printf( "Received MeshVertexUpdate for mesh %i that doesn't match. Resyncing.\n",
+					meshId );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			return false;
+		}
+
+		std::vector<Ogre::Vector3> faceNormals( numFaces );
+		std::vector<BlenderRawVertex> rawVertices( numRawVertices );
+		if( !faceNormals.empty() )
+		{
+			smartData.read( reinterpret_cast<uint8_t*>( &faceNormals[0] ),
+							sizeof(Ogre::Vector3) * faceNormals.size() );
+		}
+		if( !rawVertices.empty() )
+		{
+			smartData.read( reinterpret_cast<uint8_t*>( &rawVertices[0] ),
+							sizeof(BlenderRawVertex) * rawVertices.size() );
+		}
+
+		return patchMeshVertices( meshId, itor->second, faceNormals, rawVertices );
+	}
+	//-----------------------------------------------------------------------------------
+	bool DergoSystem::syncMeshSkin( Network::SmartData &smartData, uint32_t sizeBytes )
+	{
+		const uint32_t meshId			= smartData.read<uint32_t>();
+		const uint32_t numRawVertices	= smartData.read<uint32_t>();
+		const uint16_t numBones			= smartData.read<uint16_t>();
+
+		BlenderMeshMap::iterator itor = m_meshes.find( meshId );
+		if( itor == m_meshes.end() ||
+			itor->second.vertexPatchData.numRawVertices != numRawVertices ||
+			sizeBytes != sizeof(uint32_t) * 2u + sizeof(uint16_t) +
+						 (sizeof(BlenderRawVertex) + sizeof(BlenderSkinWeights)) * numRawVertices )
+		{
+			printf( "Received MeshSkin for mesh %i that doesn't match. Resyncing.\n", meshId );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			return false;
+		}
+
+		SkinData &skinData = itor->second.skinData;
+		skinData.numBones = numBones;
+		skinData.restVertices.resize( numRawVertices );
+		skinData.skinWeights.resize( numRawVertices );
+
+		for( uint32_t i=0; i<numRawVertices; ++i )
+		{
+			smartData.read( reinterpret_cast<uint8_t*>( &skinData.restVertices[i] ),
+							sizeof(BlenderRawVertex) );
+			smartData.read( reinterpret_cast<uint8_t*>( &skinData.skinWeights[i] ),
+							sizeof(BlenderSkinWeights) );
+
+			for( int j=0; j<4; ++j )
+			{
+				if( skinData.skinWeights[i].boneIndices[j] >= numBones )
+				{
+					printf( "Received MeshSkin for mesh %i with invalid bones. Resyncing.\n",
+							meshId );
+					itor->second.skinData = SkinData();
+					requestResync( Network::ResyncEntity::Mesh, meshId );
+					return false;
+				}
+			}
+		}
+
+		return true;
+	}
+	//-----------------------------------------------------------------------------------
+	bool DergoSystem::syncMeshSkinPose( Network::SmartData &smartData, uint32_t sizeBytes )
+	{
+		const uint32_t meshId	= smartData.read<uint32_t>();
+		const uint16_t numBones	= smartData.read<uint16_t>();
+
+		BlenderMeshMap::iterator itor = m_meshes.find( meshId );
+		if( itor == m_meshes.end() ||
+			itor->second.skinData.restVertices.empty() ||
+			itor->second.skinData.numBones != numBones ||
+			sizeBytes != sizeof(uint32_t) + sizeof(uint16_t) + sizeof(BlenderBoneMatrix) * numBones )
+		{
+			printf( "Received MeshSkinPose for mesh %i without a matching MeshSkin. Resyncing.\n",
+					meshId );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			return false;
+		}
+
+		const SkinData &skinData = itor->second.skinData;
+
+		std::vector<BlenderBoneMatrix> boneMatrices( numBones );
+		if( !boneMatrices.empty() )
+		{
+			smartData.read( reinterpret_cast<uint8_t*>( &boneMatrices[0] ),
+							sizeof(BlenderBoneMatrix) * boneMatrices.size() );
+		}
+
+		//TODO: Skin on the GPU (bone weights & indices as vertex elements, matrices in a
+		//const buffer). Skinning and patching on the CPU is ~18ms per frame on one core
+		//for bench_skinning's 24 characters, and re-uploads the whole vertex buffer.
+		std::vector<BlenderRawVertex> rawVertices( skinData.restVertices.size() );
+		SkinningTask skinningTask( &skinData.restVertices[0], &skinData.skinWeights[0],
+								   boneMatrices.empty() ? 0 : &boneMatrices[0],
+								   &rawVertices[0], static_cast<uint32_t>( rawVertices.size() ) );
+		mSceneManager->executeUserScalableTask( &skinningTask, true );
+
+		//No face normals: skinned meshes come from loop triangles, which are all smooth
+		return patchMeshVertices( meshId, itor->second, std::vector<Ogre::Vector3>(), rawVertices );
+	}
+	//-----------------------------------------------------------------------------------
+	bool DergoSystem::patchMeshVertices( uint32_t meshId, BlenderMesh &meshEntry,
+										 const std::vector<Ogre::Vector3> &faceNormals,
+										 const std::vector<BlenderRawVertex> &rawVertices )
+	{
+		VertexPatchData &patchData = meshEntry.vertexPatchData;
+		Ogre::Mesh *meshPtr = meshEntry.meshPtr;
+
+		//Still being edited: keep it from being optimized (see optimizeSettledMeshes)
+		const unsigned long now = mRoot->getTimer()->getMilliseconds();
+		meshEntry.lastChangeTime = now;
+		std::map<uint32_t, unsigned long>::iterator unoptimizedIt = m_unoptimizedMeshes.find( meshId );
+		if( unoptimizedIt != m_unoptimizedMeshes.end() )
+			unoptimizedIt->second = now;
+
+		//Empty mesh. Nothing to patch.
+		if( meshPtr->getNumSubMeshes() == 0 || patchData.numVertices == 0 || rawVertices.empty() )
+			return true;
+
+		//Start from what the GPU has (colours, UVs) and overwrite positions & normals
+		Ogre::VertexBufferPacked *vertexBuffer =
+				meshPtr->getSubMesh( 0 )->mVao[0][0]->getVertexBuffers()[0];
+		const uint32_t bytesPerVertex	= patchData.bytesPerVertex;
+		const uint32_t numVertices		= patchData.numVertices;
+
+		unsigned char *vertexData = reinterpret_cast<unsigned char*>( OGRE_MALLOC_SIMD(
+																		  numVertices * bytesPerVertex,
+																		  Ogre::MEMCATEGORY_GEOMETRY ) );
+		Ogre::FreeOnDestructor dataPtrContainer( vertexData );
+		const bool hasTangent = patchData.tangentStride != 0;
+		if( patchData.gpuBytesPerVertex == bytesPerVertex )
+			memcpy( vertexData, vertexBuffer->getShadowCopy(), numVertices * bytesPerVertex );
+		else
+		{
+			VertexUtils::expandVertices( vertexData,
+										 reinterpret_cast<const uint8_t*>(
+											 vertexBuffer->getShadowCopy() ),
+										 bytesPerVertex, numVertices, patchData.hasColour,
+										 patchData.numUVs, hasTangent, patchData.meshFormat );
+		}
+
+		const bool optimized = !patchData.vertexConversionLut.empty();
+		const size_t numDeindexedVertices = patchData.rawVertexLut.size();
+
+		//Two passes: vertices shrinkVertexBuffer merged were identical when the mesh
+		//was built. If they aren't anymore, the mesh must be built again.
+		for( int pass=0; pass<2; ++pass )
+		{
+			for( size_t i=0; i<numDeindexedVertices; ++i )
+			{
+				const uint32_t vertexIdx = optimized ? patchData.vertexConversionLut[i] :
+													   static_cast<uint32_t>( i );
+				const BlenderRawVertex &rawVertex = rawVertices[patchData.rawVertexLut[i]];
+				const uint32_t flatFace = patchData.flatFaceLut[i];
+				const Ogre::Vector3 &vNormal = flatFace == c_smoothVertex || faceNormals.empty() ?
+													rawVertex.vNormal : faceNormals[flatFace];
+
+				Ogre::Vector3 *dstPos = reinterpret_cast<Ogre::Vector3*>(
+											vertexData + vertexIdx * bytesPerVertex );
+				Ogre::Vector3 *dstNormal = dstPos + 1;
+
+				if( pass == 0 )
+				{
+					*dstPos		= rawVertex.vPos;
+					*dstNormal	= vNormal;
+				}
+				else if( *dstPos != rawVertex.vPos || *dstNormal != vNormal )
+				{
+					printf( "MeshVertexUpdate for mesh %i splits merged vertices. Resyncing.\n",
+							meshId );
+					requestResync( Network::ResyncEntity::Mesh, meshId );
+					return false;
+				}
+			}
+
+			//Nothing got merged, nothing to check
+			if( !optimized || numVertices == numDeindexedVertices )
+				break;
+		}
+
+		if( hasTangent )
+		{
+			uint32_t *indexData = patchData.vertexConversionLut.empty() ?
+									  0 : &patchData.vertexConversionLut[0];
+			GenerateTangentsTask tangentTask( vertexData, bytesPerVertex, numVertices, 0,
+											  sizeof(float)*3, patchData.tangentStride,
+											  patchData.tangentUvStride, indexData,
+											  patchData.vertexConversionLut.size(),
+											  mSceneManager->getNumWorkerThreads() );
+			mSceneManager->executeUserScalableTask( &tangentTask, true );
+		}
+
+		if( patchData.gpuBytesPerVertex != bytesPerVertex )
+		{
+			unsigned char *gpuVertexData = reinterpret_cast<unsigned char*>(
+											   OGRE_MALLOC_SIMD( numVertices * patchData.gpuBytesPerVertex,
+																 Ogre::MEMCATEGORY_GEOMETRY ) );
+			VertexUtils::compactVertices( gpuVertexData, vertexData, bytesPerVertex, numVertices,
+										  patchData.hasColour, patchData.numUVs, hasTangent,
+										  patchData.meshFormat );
+			OGRE_FREE_SIMD( vertexData, Ogre::MEMCATEGORY_GEOMETRY );
+			vertexData = gpuVertexData;
+			dataPtrContainer.ptr = vertexData;
+		}
+
+		vertexBuffer->upload( vertexData, 0, numVertices );
+
+		//Calculate AABB
+		Ogre::Vector3 vMin(  std::numeric_limits<Ogre::Real>::max() );
+		Ogre::Vector3 vMax( -std::numeric_limits<Ogre::Real>::max() );
+
+		std::vector<BlenderRawVertex>::const_iterator rawVerticesIt = rawVertices.begin();
+		std::vector<BlenderRawVertex>::const_iterator rawVerticesEn = rawVertices.end();
+
+		while( rawVerticesIt != rawVerticesEn )
+		{
+			vMax.makeCeil( rawVerticesIt->vPos );
+			vMin.makeFloor( rawVerticesIt->vPos );
+			++rawVerticesIt;
+		}
+
+		Ogre::Aabb aabb( Ogre::Aabb::BOX_NULL );
+		aabb.setExtents( vMin, vMax );
+		meshPtr->_setBounds( aabb );
+
+		return true;
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::buildMesh( uint32_t meshId, BlenderMeshData &meshData )
+	{
+		const Ogre::String &meshName		= meshData.meshName;
+		const Ogre::uint32 numFaces			= meshData.numFaces;
+		const bool hasColour				= meshData.hasColour;
+		const Ogre::uint8 numUVs			= meshData.numUVs;
+		uint8_t tangentUVSource				= meshData.tangentUVSource;
+		const uint8_t meshFormat			= meshData.meshFormat;
+
+		std::vector<BlenderFace> &blenderFaces				= meshData.faces;
+		std::vector<BlenderFaceColour> &blenderFaceColour	= meshData.faceColours;
+		std::vector<BlenderFaceUv> &blenderFaceUv			= meshData.faceUvs;
+		std::vector<BlenderRawVertex> &blenderRawVertices	= meshData.rawVertices;
+		const std::vector<uint32_t> &materialTable			= meshData.materialTable;
+
+		const unsigned long now = mRoot->getTimer()->getMilliseconds();
+		unsigned long timeSinceLastChange = std::numeric_limits<unsigned long>::max();
+		{
+			BlenderMeshMap::const_iterator lastChangeIt = m_meshes.find( meshId );
+			if( lastChangeIt != m_meshes.end() )
+				timeSinceLastChange = now - lastChangeIt->second.lastChangeTime;
+		}
 
 		Ogre::VertexElement2VecVec vertexElements( 1 );
 		vertexElements[0].push_back( Ogre::VertexElement2( Ogre::VET_FLOAT3, Ogre::VES_POSITION ) );
@@ -635,105 +1240,96 @@ namespace DERGO
 			tangentUVSource = std::min<uint8_t>( numUVs - 1u, tangentUVSource );
 		}
 
-		//Read face data
-		std::vector<BlenderFace> blenderFaces;
-		std::vector<BlenderFaceColour> blenderFaceColour;
-		std::vector<BlenderFaceUv> blenderFaceUv;
-		std::vector<BlenderRawVertex> blenderRawVertices;
-		blenderFaces.resize( numFaces );
-		if( hasColour )
-			blenderFaceColour.resize( numFaces );
-		blenderFaceUv.resize( numFaces * numUVs );
-		blenderRawVertices.resize( numRawVertices );
-
-		for( uint32_t i=0; i<numFaces; ++i )
-		{
-			smartData.read( reinterpret_cast<uint8_t*>(&blenderFaces[i]), c_sizeOfBlenderFace );
-		}
+		//The client computed the tangents (i.e. MikkTSpace, like Blender's bakes).
+		//They get deindexed like everything else, and we don't generate them.
+		const bool hasClientTangents = (meshFormat & Network::MeshFormat::HasTangents) != 0;
+		const bool clientTangents = hasNormalMapping && hasClientTangents;
+		if( !clientTangents )
+			meshData.rawTangents.clear();
 
-		if( !blenderFaceColour.empty() )
+		//What the GPU gets. Deindexing, optimizing & generating tangents is
+		//done with floats (vertexElements), then compacted if needed.
+		//Positions stay as floats: Hlms can't dequantize them.
+		Ogre::VertexElement2VecVec gpuVertexElements( 1 );
+		gpuVertexElements[0].push_back( Ogre::VertexElement2( Ogre::VET_FLOAT3, Ogre::VES_POSITION ) );
+		if( meshFormat & Network::MeshFormat::CompactNormals )
 		{
-			smartData.read( reinterpret_cast<uint8_t*>(&blenderFaceColour[0]),
-							sizeof(BlenderFaceColour) * numFaces );
+			//Normal & tangent in a quaternion
+			gpuVertexElements[0].push_back( Ogre::VertexElement2( Ogre::VET_SHORT4_SNORM,
+																  Ogre::VES_NORMAL ) );
 		}
-		if( !blenderFaceUv.empty() )
+		else
 		{
-			smartData.read( reinterpret_cast<uint8_t*>(&blenderFaceUv[0]),
-							sizeof(BlenderFaceUv) * numFaces * numUVs );
+			gpuVertexElements[0].push_back( Ogre::VertexElement2( Ogre::VET_FLOAT3, Ogre::VES_NORMAL ) );
 		}
-		if( !blenderRawVertices.empty() )
+		if( hasColour )
 		{
-			smartData.read( reinterpret_cast<uint8_t*>(&blenderRawVertices[0]),
-							sizeof(BlenderRawVertex) * numRawVertices );
+			gpuVertexElements[0].push_back( Ogre::VertexElement2( Ogre::VET_UBYTE4_NORM,
+																  Ogre::VES_DIFFUSE ) );
 		}
-
-		// A face can either be 3 vertices (1 tri) or 6 vertices (2 tris).
-		//Go through the faces and calculate the actual number of vertices
-		//needed, and offsets for each thread to start from.
-		uint32_t numVertices = 0;
-		std::vector<uint32_t> vertexStartThreadIdx;
-
-		vertexStartThreadIdx.resize( mSceneManager->getNumWorkerThreads() + 1, 0 );
-
+		for( Ogre::uint8 i=0; i<numUVs; ++i )
 		{
-			const size_t numThreads = mSceneManager->getNumWorkerThreads();
-			const uint32_t numFacesPerThread = Ogre::alignToNextMultiple( numFaces,
-																		  numThreads ) / numThreads;
-
-
-			std::vector<BlenderFace>::const_iterator itor = blenderFaces.begin();
-			std::vector<BlenderFace>::const_iterator end  = blenderFaces.end();
-			while( itor != end )
-			{
-				if( itor->numIndicesInFace == 4 )
-					numVertices += 6;
-				else
-					numVertices += 3;
-
-				const size_t threadIdx = ( itor - blenderFaces.begin() ) / numFacesPerThread + 1;
-				vertexStartThreadIdx[threadIdx] = numVertices;
-
-				++itor;
-			}
+			gpuVertexElements[0].push_back( Ogre::VertexElement2(
+												(meshFormat & Network::MeshFormat::CompactUvs) ?
+													Ogre::VET_HALF2 : Ogre::VET_FLOAT2,
+												Ogre::VES_TEXTURE_COORDINATES ) );
 		}
+		if( hasNormalMapping && !(meshFormat & Network::MeshFormat::CompactNormals) )
+			gpuVertexElements[0].push_back( Ogre::VertexElement2( Ogre::VET_FLOAT4, Ogre::VES_TANGENT ) );
 
-		//Deindex vertex data
 		const Ogre::uint32 bytesPerVertex = Ogre::VaoManager::calculateVertexSize( vertexElements[0] );
 		const uint32_t bytesPerVertexWithoutTangent =
 				bytesPerVertex - (hasNormalMapping ? (sizeof(float) * 4) : 0);
 
-		unsigned char *vertexData = reinterpret_cast<unsigned char*>( OGRE_MALLOC_SIMD(
-																		  numVertices * bytesPerVertex,
-																		  Ogre::MEMCATEGORY_GEOMETRY ) );
-
+		//Vertices once deindexed (3 per triangle), and where each of them
+		//ends up in the vertex buffer once duplicates are removed
+		uint32_t numVertices = 0;
+		size_t optimizedNumVertices = 0;
+		Ogre::FastArray<uint32_t> vertexConversionLut;
+		bool optimized = true;
+		//Material of every triangle (index in materialTable)
 		Ogre::FastArray<uint16_t> materialIds;
-		materialIds.resize( numVertices / 3 );
 
+		unsigned char *vertexData = 0;
 		//We need this to free the pointer in case we raise an exception too early.
-		Ogre::FreeOnDestructor dataPtrContainer( vertexData );
+		Ogre::FreeOnDestructor dataPtrContainer( 0 );
 
-		DeindexTask deindexTask( vertexData, bytesPerVertex, numVertices,
-								 numUVs, vertexStartThreadIdx, &blenderFaces,
-								 &blenderFaceColour, &blenderFaceUv, &blenderRawVertices,
-								 &materialIds );
+		Ogre::Aabb aabb( Ogre::Aabb::BOX_NULL );
 
-		mSceneManager->executeUserScalableTask( &deindexTask, true );
+		if( meshData.indexed )
+		{
+			//The client already did the deindexing & removed the duplicates
+			//(see syncMeshIndexed). Just make room for the tangents.
+			numVertices				= static_cast<uint32_t>( meshData.indices.size() );
+			optimizedNumVertices	= meshData.numIndexedVertices;
 
-		//Remove duplicates (we now have 3 vertices per triangle!)
-		Ogre::FastArray<uint32_t> vertexConversionLut;
-		size_t optimizedNumVertices = 0;
+			vertexData = reinterpret_cast<unsigned char*>( OGRE_MALLOC_SIMD(
+															   optimizedNumVertices * bytesPerVertex,
+															   Ogre::MEMCATEGORY_GEOMETRY ) );
+			dataPtrContainer.ptr = vertexData;
 
-		Ogre::Aabb aabb( Ogre::Aabb::BOX_NULL );
+			const uint32_t wireBytesPerVertex = bytesPerVertexWithoutTangent +
+												(hasClientTangents ? sizeof(float) * 4u : 0u);
+			for( size_t i=0; i<optimizedNumVertices; ++i )
+			{
+				memcpy( vertexData + i * bytesPerVertex,
+						&meshData.indexedVertices[i * wireBytesPerVertex],
+						clientTangents ? bytesPerVertex : bytesPerVertexWithoutTangent );
+			}
 
-		if( numVertices != 0 )
-		{
-			if( numVertices < 40000 )
+			vertexConversionLut.resize( numVertices );
+			materialIds.resize( numVertices / 3u );
+			if( numVertices != 0 )
 			{
-				//Optimize memory and GPU performance.
-				optimizedNumVertices = VertexUtils::shrinkVertexBuffer( vertexData, vertexConversionLut,
-																		bytesPerVertex, numVertices );
+				memcpy( vertexConversionLut.begin(), &meshData.indices[0],
+						numVertices * sizeof(uint32_t) );
+				memcpy( materialIds.begin(), &meshData.triangleMaterials[0],
+						(numVertices / 3u) * sizeof(uint16_t) );
+			}
 
-				if( hasNormalMapping )
+			if( optimizedNumVertices != 0 )
+			{
+				if( hasNormalMapping && !clientTangents )
 				{
 					tangentTask = new GenerateTangentsTask( vertexData, bytesPerVertex,
 															optimizedNumVertices, 0, sizeof(float)*3,
@@ -745,55 +1341,129 @@ namespace DERGO
 															mSceneManager->getNumWorkerThreads() );
 					mSceneManager->executeUserScalableTask( tangentTask, false );
 				}
+
+				//Calculate AABB. Unlike raw vertices, these are all used.
+				Ogre::Vector3 vMin(  std::numeric_limits<Ogre::Real>::max() );
+				Ogre::Vector3 vMax( -std::numeric_limits<Ogre::Real>::max() );
+
+				for( size_t i=0; i<optimizedNumVertices; ++i )
+				{
+					const Ogre::Vector3 *vPos = reinterpret_cast<const Ogre::Vector3*>(
+													vertexData + i * bytesPerVertex );
+					vMax.makeCeil( *vPos );
+					vMin.makeFloor( *vPos );
+				}
+
+				aabb.setExtents( vMin, vMax );
 			}
-			else
+		}
+		else
+		{
+			// A face can either be 3 vertices (1 tri) or 6 vertices (2 tris).
+			//Go through the faces and calculate the actual number of vertices
+			//needed, and offsets for each thread to start from.
+			std::vector<uint32_t> vertexStartThreadIdx;
+
+			vertexStartThreadIdx.resize( mSceneManager->getNumWorkerThreads() + 1, 0 );
+
 			{
-				if( hasNormalMapping )
+				const size_t numThreads = mSceneManager->getNumWorkerThreads();
+				const uint32_t numFacesPerThread = Ogre::alignToNextMultiple( numFaces,
+																			  numThreads ) / numThreads;
+
+
+				std::vector<BlenderFace>::const_iterator itor = blenderFaces.begin();
+				std::vector<BlenderFace>::const_iterator end  = blenderFaces.end();
+				while( itor != end )
 				{
-					tangentTask = new GenerateTangentsTask( vertexData, bytesPerVertex, numVertices, 0,
-															sizeof(float)*3,
-															bytesPerVertexWithoutTangent,
-															sizeof(float)*3*2 +
-																sizeof(float) * 2 * tangentUVSource,
-															(uint32_t*)0, 0,
-															mSceneManager->getNumWorkerThreads() );
-					mSceneManager->executeUserScalableTask( tangentTask, false );
-				}
+					if( itor->numIndicesInFace == 4 )
+						numVertices += 6;
+					else
+						numVertices += 3;
+
+					const size_t threadIdx = ( itor - blenderFaces.begin() ) / numFacesPerThread + 1;
+					vertexStartThreadIdx[threadIdx] = numVertices;
 
-				//Mesh is too big. O(N!) complexity. Just rely on the sheer power of the GPU.
-				//TODO: Client option to force optimized or force non-optimized, or auto)
-				optimizedNumVertices = numVertices;
-				vertexConversionLut.resize( numVertices );
-				for( uint32_t i=0; i<numVertices; ++i )
-					vertexConversionLut[i] = i;
+					++itor;
+				}
 			}
 
-			//Calculate AABB
-			Ogre::Vector3 vMin(  std::numeric_limits<Ogre::Real>::max() );
-			Ogre::Vector3 vMax( -std::numeric_limits<Ogre::Real>::max() );
+			//Deindex vertex data
+			vertexData = reinterpret_cast<unsigned char*>( OGRE_MALLOC_SIMD(
+															   numVertices * bytesPerVertex,
+															   Ogre::MEMCATEGORY_GEOMETRY ) );
+			dataPtrContainer.ptr = vertexData;
+			materialIds.resize( numVertices / 3 );
+
+			DeindexTask deindexTask( vertexData, bytesPerVertex, numVertices,
+									 numUVs, vertexStartThreadIdx, &blenderFaces,
+									 &blenderFaceColour, &blenderFaceUv, &blenderRawVertices,
+									 &materialIds, &meshData.rawTangents,
+									 bytesPerVertexWithoutTangent );
 
-			std::vector<BlenderRawVertex>::const_iterator rawVerticesIt = blenderRawVertices.begin();
-			std::vector<BlenderRawVertex>::const_iterator rawVerticesEn = blenderRawVertices.end();
+			mSceneManager->executeUserScalableTask( &deindexTask, true );
 
-			while( rawVerticesIt != rawVerticesEn )
+			//Remove duplicates (we now have 3 vertices per triangle!)
+			if( numVertices != 0 )
 			{
-				vMax.makeCeil( rawVerticesIt->vPos );
-				vMin.makeFloor( rawVerticesIt->vPos );
-				++rawVerticesIt;
-			}
+				if( shouldOptimizeMesh( meshFormat, numVertices, timeSinceLastChange ) )
+				{
+					//Optimize memory and GPU performance.
+					optimizedNumVertices = VertexUtils::shrinkVertexBuffer( vertexData, vertexConversionLut,
+																			bytesPerVertex, numVertices );
 
-			aabb.setExtents( vMin, vMax );
-		}
+					if( hasNormalMapping && !clientTangents )
+					{
+						tangentTask = new GenerateTangentsTask( vertexData, bytesPerVertex,
+																optimizedNumVertices, 0, sizeof(float)*3,
+																bytesPerVertexWithoutTangent,
+																sizeof(float)*3*2 +
+																	sizeof(float) * 2 * tangentUVSource,
+																vertexConversionLut.begin(),
+																vertexConversionLut.size(),
+																mSceneManager->getNumWorkerThreads() );
+						mSceneManager->executeUserScalableTask( tangentTask, false );
+					}
+				}
+				else
+				{
+					if( hasNormalMapping && !clientTangents )
+					{
+						tangentTask = new GenerateTangentsTask( vertexData, bytesPerVertex, numVertices, 0,
+																sizeof(float)*3,
+																bytesPerVertexWithoutTangent,
+																sizeof(float)*3*2 +
+																	sizeof(float) * 2 * tangentUVSource,
+																(uint32_t*)0, 0,
+																mSceneManager->getNumWorkerThreads() );
+						mSceneManager->executeUserScalableTask( tangentTask, false );
+					}
 
-		//Read material table
-		const uint16_t materialTableSize = smartData.read<uint16_t>();
-		std::vector<uint32_t> materialTable;
-		materialTable.resize( materialTableSize );
+					//Mesh is too big (O(N^2) complexity), being edited, or the client
+					//asked so. Just rely on the sheer power of the GPU.
+					optimized = false;
+					optimizedNumVertices = numVertices;
+					vertexConversionLut.resize( numVertices );
+					for( uint32_t i=0; i<numVertices; ++i )
+						vertexConversionLut[i] = i;
+				}
 
-		if( !materialTable.empty() )
-		{
-			smartData.read( reinterpret_cast<uint8_t*>( &materialTable[0] ),
-							sizeof(uint32_t) * materialTable.size() );
+				//Calculate AABB
+				Ogre::Vector3 vMin(  std::numeric_limits<Ogre::Real>::max() );
+				Ogre::Vector3 vMax( -std::numeric_limits<Ogre::Real>::max() );
+
+				std::vector<BlenderRawVertex>::const_iterator rawVerticesIt = blenderRawVertices.begin();
+				std::vector<BlenderRawVertex>::const_iterator rawVerticesEn = blenderRawVertices.end();
+
+				while( rawVerticesIt != rawVerticesEn )
+				{
+					vMax.makeCeil( rawVerticesIt->vPos );
+					vMin.makeFloor( rawVerticesIt->vPos );
+					++rawVerticesIt;
+				}
+
+				aabb.setExtents( vMin, vMax );
+			}
 		}
 
 		//Holds references to materialTable[], each entry is unique (i.e. no duplicates)
@@ -837,13 +1507,299 @@ namespace DERGO
 			tangentTask = 0;
 		}
 
+		const uint32_t gpuBytesPerVertex =
+				Ogre::VaoManager::calculateVertexSize( gpuVertexElements[0] );
+		if( gpuBytesPerVertex != bytesPerVertex )
+		{
+			unsigned char *gpuVertexData = reinterpret_cast<unsigned char*>(
+											   OGRE_MALLOC_SIMD( optimizedNumVertices * gpuBytesPerVertex,
+																 Ogre::MEMCATEGORY_GEOMETRY ) );
+			VertexUtils::compactVertices( gpuVertexData, vertexData, bytesPerVertex,
+										  static_cast<uint32_t>( optimizedNumVertices ),
+										  hasColour, numUVs, hasNormalMapping, meshFormat );
+			OGRE_FREE_SIMD( vertexData, Ogre::MEMCATEGORY_GEOMETRY );
+			vertexData = gpuVertexData;
+			dataPtrContainer.ptr = vertexData;
+		}
+
 		//We've got all the data the way we want/need. Now deal with Ogre.
+		setMeshBuffers( meshId, meshName, optimizedNumVertices, gpuVertexElements,
+						dataPtrContainer, indices, aabb );
+
+		//Now setup/update the materials
+		std::vector<Ogre::String> materialNames;
+		materialNames.reserve( uniqueMaterials.size() );
+		for( size_t i=0; i<uniqueMaterials.size(); ++i )
+		{
+			const uint16_t tableIdx = uniqueMaterials[i];
+			Ogre::String materialIdStr;
+			if( tableIdx < materialTable.size() )
+			{
+				const uint32_t materialId = materialTable[tableIdx];
+				materialIdStr = Ogre::StringConverter::toString( materialId );
+			}
+			materialNames.push_back( materialIdStr );
+		}
+		setMeshMaterials( meshId, materialNames );
+
+		//The skin (if any) was for the old vertices
+		m_meshes[meshId].skinData = SkinData();
+
+		//Remember where every vertex came from, so MeshVertexUpdate can patch them
+		VertexPatchData &vertexPatchData = m_meshes[meshId].vertexPatchData;
+		vertexPatchData.bytesPerVertex	= bytesPerVertex;
+		vertexPatchData.tangentStride	= hasNormalMapping ? bytesPerVertexWithoutTangent : 0;
+		vertexPatchData.tangentUvStride	= sizeof(float)*3*2 + sizeof(float) * 2 * tangentUVSource;
+		vertexPatchData.gpuBytesPerVertex	= gpuBytesPerVertex;
+		vertexPatchData.meshFormat			= meshFormat;
+		vertexPatchData.hasColour			= hasColour;
+		vertexPatchData.numUVs				= numUVs;
+		createVertexPatchData( vertexPatchData, meshData, vertexConversionLut,
+							   optimizedNumVertices, optimized );
+
+		//Not optimized only because it's being edited? Then it will be once it
+		//settles (see optimizeSettledMeshes)
+		m_meshes[meshId].lastChangeTime = now;
+		if( !optimized && shouldOptimizeMesh( meshFormat, numVertices,
+											  std::numeric_limits<unsigned long>::max() ) )
+		{
+			m_unoptimizedMeshes[meshId] = now;
+		}
+		else
+		{
+			m_unoptimizedMeshes.erase( meshId );
+		}
+	}
+	//-----------------------------------------------------------------------------------
+	bool DergoSystem::shouldOptimizeMesh( uint8_t meshFormat, uint32_t numVertices,
+										  unsigned long timeSinceLastChange ) const
+	{
+		if( meshFormat & Network::MeshFormat::OptimizeAlways )
+			return true;
+		if( meshFormat & Network::MeshFormat::OptimizeNever )
+			return false;
+
+		return numVertices < c_maxAutoOptimizedVertices && timeSinceLastChange >= c_meshSettleTime;
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::optimizeSettledMeshes()
+	{
+		const unsigned long now = mRoot->getTimer()->getMilliseconds();
+
+		std::vector<uint32_t> settledMeshes;
+
+		std::map<uint32_t, unsigned long>::const_iterator itor = m_unoptimizedMeshes.begin();
+		std::map<uint32_t, unsigned long>::const_iterator end  = m_unoptimizedMeshes.end();
+
+		while( itor != end )
+		{
+			if( now - itor->second >= c_meshSettleTime )
+				settledMeshes.push_back( itor->first );
+			++itor;
+		}
+
+		//optimizeSettledMesh modifies m_unoptimizedMeshes
+		for( size_t i=0; i<settledMeshes.size(); ++i )
+		{
+			optimizeSettledMesh( settledMeshes[i] );
+			m_unoptimizedMeshes.erase( settledMeshes[i] );
+		}
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::optimizeSettledMesh( uint32_t meshId )
+	{
+		BlenderMeshMap::iterator meshEntryIt = m_meshes.find( meshId );
+		if( meshEntryIt == m_meshes.end() )
+			return;
+
+		const BlenderMesh &meshEntry = meshEntryIt->second;
+		const VertexPatchData &patchData = meshEntry.vertexPatchData;
+		Ogre::Mesh *meshPtr = meshEntry.meshPtr;
+
+		//Empty, or already optimized. Nothing to do.
+		if( meshPtr->getNumSubMeshes() == 0 || patchData.numVertices == 0 ||
+			!patchData.vertexConversionLut.empty() )
+		{
+			return;
+		}
+
+		//Not optimized means the buffer still has 3 vertices per triangle, in the
+		//order DeindexTask wrote them. Read them back instead of asking the client.
+		Ogre::VertexBufferPacked *vertexBuffer =
+				meshPtr->getSubMesh( 0 )->mVao[0][0]->getVertexBuffers()[0];
+		const uint32_t bytesPerVertex	= patchData.bytesPerVertex;
+		const uint32_t numVertices		= patchData.numVertices;
+
+		unsigned char *vertexData = reinterpret_cast<unsigned char*>( OGRE_MALLOC_SIMD(
+																		  numVertices * bytesPerVertex,
+																		  Ogre::MEMCATEGORY_GEOMETRY ) );
+		Ogre::FreeOnDestructor dataPtrContainer( vertexData );
+		const bool hasTangent = patchData.tangentStride != 0;
+		if( patchData.gpuBytesPerVertex == bytesPerVertex )
+			memcpy( vertexData, vertexBuffer->getShadowCopy(), numVertices * bytesPerVertex );
+		else
+		{
+			VertexUtils::expandVertices( vertexData,
+										 reinterpret_cast<const uint8_t*>(
+											 vertexBuffer->getShadowCopy() ),
+										 bytesPerVertex, numVertices, patchData.hasColour,
+										 patchData.numUVs, hasTangent, patchData.meshFormat );
+		}
+
+		//Tangents we generated were averaged per vertex. Like in buildMesh, merge
+		//without them and generate them again afterwards.
+		const bool generateTangents = hasTangent &&
+									  !(patchData.meshFormat & Network::MeshFormat::HasTangents);
+		if( generateTangents )
+		{
+			for( uint32_t i=0; i<numVertices; ++i )
+			{
+				memset( vertexData + i * bytesPerVertex + patchData.tangentStride, 0,
+						bytesPerVertex - patchData.tangentStride );
+			}
+		}
+
+		Ogre::FastArray<uint32_t> vertexConversionLut;
+		const uint32_t optimizedNumVertices = VertexUtils::shrinkVertexBuffer( vertexData,
+																						vertexConversionLut,
+																						bytesPerVertex,
+																						numVertices );
+
+		//Nothing got merged. The buffer is fine as it is.
+		if( optimizedNumVertices == numVertices )
+			return;
+
+		if( generateTangents )
+		{
+			GenerateTangentsTask tangentTask( vertexData, bytesPerVertex, optimizedNumVertices, 0,
+											  sizeof(float)*3, patchData.tangentStride,
+											  patchData.tangentUvStride, vertexConversionLut.begin(),
+											  vertexConversionLut.size(),
+											  mSceneManager->getNumWorkerThreads() );
+			mSceneManager->executeUserScalableTask( &tangentTask, true );
+		}
+
+		if( patchData.gpuBytesPerVertex != bytesPerVertex )
+		{
+			unsigned char *gpuVertexData = reinterpret_cast<unsigned char*>(
+											   OGRE_MALLOC_SIMD( optimizedNumVertices * patchData.gpuBytesPerVertex,
+																 Ogre::MEMCATEGORY_GEOMETRY ) );
+			VertexUtils::compactVertices( gpuVertexData, vertexData, bytesPerVertex,
+										  optimizedNumVertices, patchData.hasColour, patchData.numUVs,
+										  hasTangent, patchData.meshFormat );
+			OGRE_FREE_SIMD( vertexData, Ogre::MEMCATEGORY_GEOMETRY );
+			vertexData = gpuVertexData;
+			dataPtrContainer.ptr = vertexData;
+		}
+
+		//Same triangles & materials, pointing to the merged vertices
+		std::vector< std::vector<uint32_t> > indices( meshPtr->getNumSubMeshes() );
+		std::vector<Ogre::String> materialNames( meshPtr->getNumSubMeshes() );
+		for( uint16_t i=0; i<meshPtr->getNumSubMeshes(); ++i )
+		{
+			Ogre::SubMesh *subMesh = meshPtr->getSubMesh( i );
+			Ogre::VertexArrayObject *vao = subMesh->mVao[0][0];
+			Ogre::IndexBufferPacked *indexBuffer = vao->getIndexBuffer();
+
+			std::vector<uint32_t> &subMeshIndices = indices[i];
+			subMeshIndices.resize( vao->getPrimitiveCount() );
+
+			if( indexBuffer->getIndexType() == Ogre::IndexBufferPacked::IT_32BIT )
+			{
+				const uint32_t *srcIndices = reinterpret_cast<const uint32_t*>(
+												 indexBuffer->getShadowCopy() );
+				for( size_t j=0; j<subMeshIndices.size(); ++j )
+					subMeshIndices[j] = vertexConversionLut[srcIndices[j]];
+			}
+			else
+			{
+				const uint16_t *srcIndices = reinterpret_cast<const uint16_t*>(
+												 indexBuffer->getShadowCopy() );
+				for( size_t j=0; j<subMeshIndices.size(); ++j )
+					subMeshIndices[j] = vertexConversionLut[srcIndices[j]];
+			}
+
+			materialNames[i] = subMesh->getMaterialName();
+		}
+
+		//Positions didn't change
+		const Ogre::Aabb aabb = meshPtr->getAabb();
+		const Ogre::String meshName = meshEntry.userFriendlyName;
+		const Ogre::VertexElement2VecVec vertexElements( 1, vertexBuffer->getVertexElements() );
+
+		//Warning: meshEntry & patchData get invalidated
+		setMeshBuffers( meshId, meshName, optimizedNumVertices, vertexElements,
+						dataPtrContainer, indices, aabb );
+		setMeshMaterials( meshId, materialNames );
+
+		//From now on MeshVertexUpdate patches the optimized buffer
+		VertexPatchData &newPatchData = m_meshes[meshId].vertexPatchData;
+		newPatchData.numVertices = optimizedNumVertices;
+		newPatchData.vertexConversionLut.assign( vertexConversionLut.begin(),
+												 vertexConversionLut.end() );
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::createVertexPatchData( VertexPatchData &outPatchData,
+											 const BlenderMeshData &meshData,
+											 const Ogre::FastArray<uint32_t> &vertexConversionLut,
+											 uint32_t optimizedNumVertices, bool optimized )
+	{
+		outPatchData.numFaces		= meshData.numFaces;
+		outPatchData.numRawVertices	= meshData.numRawVertices;
+		outPatchData.numVertices	= optimizedNumVertices;
+
+		outPatchData.rawVertexLut.clear();
+		outPatchData.flatFaceLut.clear();
+		outPatchData.rawVertexLut.reserve( vertexConversionLut.size() );
+		outPatchData.flatFaceLut.reserve( vertexConversionLut.size() );
+
+		//Walk the faces in the same order DeindexTask writes the vertices.
+		std::vector<BlenderFace>::const_iterator itor = meshData.faces.begin();
+		std::vector<BlenderFace>::const_iterator end  = meshData.faces.end();
+
+		while( itor != end )
+		{
+			const uint32_t faceIdx = static_cast<uint32_t>( itor - meshData.faces.begin() );
+			const uint32_t flatFace = (itor->materialId & 0x8000) ? c_smoothVertex : faceIdx;
+
+			//A quad is split in (0, 1, 2) & (0, 2, 3)
+			const uint32_t corners[6] =
+			{
+				itor->vertexIndex[0], itor->vertexIndex[1], itor->vertexIndex[2],
+				itor->vertexIndex[0], itor->vertexIndex[2], itor->vertexIndex[3]
+			};
+			const size_t numCorners = itor->numIndicesInFace == 4 ? 6u : 3u;
+
+			for( size_t i=0; i<numCorners; ++i )
+			{
+				outPatchData.rawVertexLut.push_back( corners[i] );
+				outPatchData.flatFaceLut.push_back( flatFace );
+			}
+
+			++itor;
+		}
+
+		outPatchData.vertexConversionLut.clear();
+		if( optimized )
+		{
+			outPatchData.vertexConversionLut.assign( vertexConversionLut.begin(),
+													 vertexConversionLut.end() );
+		}
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::setMeshBuffers( uint32_t meshId, const Ogre::String &meshName,
+									  uint32_t optimizedNumVertices,
+									  const Ogre::VertexElement2VecVec &vertexElements,
+									  Ogre::FreeOnDestructor &vertexDataPtrContainer,
+									  const std::vector< std::vector<uint32_t> > &indices,
+									  const Ogre::Aabb &aabb )
+	{
 		BlenderMeshMap::const_iterator meshEntryIt = m_meshes.find( meshId );
 		if( meshEntryIt == m_meshes.end() )
 		{
 			//We don't have this mesh.
 			createMesh( meshId, meshName, optimizedNumVertices, vertexElements,
-						dataPtrContainer, indices, aabb );
+						vertexDataPtrContainer, indices, aabb );
 		}
 		else
 		{
@@ -883,35 +1839,29 @@ namespace DERGO
 			if( canReuse )
 			{
 				updateMesh( meshEntryIt->second, optimizedNumVertices,
-							dataPtrContainer, indices, aabb );
+							vertexDataPtrContainer, indices, aabb );
 			}
 			else
 			{
 				//Warning: meshEntryIt gets invalidated
 				recreateMesh( meshEntryIt->first, meshEntryIt->second, optimizedNumVertices,
-							  vertexElements, dataPtrContainer, indices, aabb );
+							  vertexElements, vertexDataPtrContainer, indices, aabb );
 			}
 		}
-
-		//Now setup/update the materials
-		meshEntryIt = m_meshes.find( meshId );
-		const BlenderMesh &meshEntry = meshEntryIt->second;
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::setMeshMaterials( uint32_t meshId, const std::vector<Ogre::String> &materialNames )
+	{
+		const BlenderMesh &meshEntry = m_meshes[meshId];
 		Ogre::Mesh *meshPtr = meshEntry.meshPtr;
 		for( size_t i=0; i<meshPtr->getNumSubMeshes(); ++i )
 		{
-			const uint16_t tableIdx = uniqueMaterials[i];
-			Ogre::String materialIdStr;
-			if( tableIdx < materialTable.size() )
-			{
-				const uint32_t materialId = materialTable[tableIdx];
-				materialIdStr = Ogre::StringConverter::toString( materialId );
-			}
-			meshPtr->getSubMesh( i )->setMaterialName( materialIdStr );
+			meshPtr->getSubMesh( i )->setMaterialName( materialNames[i] );
 
 			BlenderItemVec::const_iterator itItem = meshEntry.items.begin();
 			BlenderItemVec::const_iterator enItem = meshEntry.items.end();
 
-			const Ogre::IdString materialIdHash = materialIdStr;
+			const Ogre::IdString materialIdHash = materialNames[i];
 			while( itItem != enItem )
 			{
 				itItem->item->getSubItem( i )->setDatablock( materialIdHash );
@@ -1089,13 +2039,17 @@ namespace DERGO
 		Ogre::MeshManager::getSingleton().remove( meshEntry.meshPtr->getName() );
 		meshEntry.meshPtr = 0;
 		m_meshes.erase( meshId );
+		m_unoptimizedMeshes.erase( meshId );
 
 		//Create mesh again.
 		createMesh( meshId, userFriendlyName, optimizedNumVertices,
 					vertexElements, vertexDataPtrContainer, indices, aabb );
 
-		//Restore the items.
+		//Restore the items, and what we know about the vertices.
 		BlenderMesh &newBlenderMesh = m_meshes[meshId];
+		newBlenderMesh.vertexPatchData	= meshEntry.vertexPatchData;
+		newBlenderMesh.skinData		= meshEntry.skinData;
+		newBlenderMesh.lastChangeTime	= meshEntry.lastChangeTime;
 
 		ItemDataVec::const_iterator itItem = itemsData.begin();
 		ItemDataVec::const_iterator enItem = itemsData.end();
@@ -1148,8 +2102,10 @@ namespace DERGO
 		}
 		else
 		{
-			//Shouldn't happen! Tell client to resync
+			//Shouldn't happen! Tell client to resync the mesh, then the item
 			assert( false );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			requestResync( Network::ResyncEntity::Item, itemData.id );
 			retVal = false;
 		}
 
@@ -1197,8 +2153,11 @@ namespace DERGO
 		}
 		else
 		{
-			//Shouldn't happen! Tell client to resync
+			//Shouldn't happen! Tell client to resync. If the item is
+			//still alive on its side, it will be sent again.
 			assert( false );
+			requestResync( Network::ResyncEntity::Mesh, meshId );
+			requestResync( Network::ResyncEntity::Item, itemId );
 			retVal = false;
 		}
 
@@ -1627,6 +2586,11 @@ namespace DERGO
 										  texLocation.xIdx, texLocation.texture );
 			}*/
 		}
+		else
+		{
+			//Tell the client to send the material (and its textures) again
+			requestResync( Network::ResyncEntity::Material, materialId );
+		}
 
 		assert( retVal );
 
@@ -1700,6 +2664,10 @@ namespace DERGO
 		hlmsPbs->setParallaxCorrectedCubemap( 0 );
 		hlmsPbs->setIrradianceVolume( 0 );
 
+		m_pendingMeshes.clear();
+		m_resyncEntries.clear();
+		m_unoptimizedMeshes.clear();
+
 		{
 			BlenderMeshMap::iterator itor = m_meshes.begin();
 			BlenderMeshMap::iterator end  = m_meshes.end();
@@ -1781,6 +2749,40 @@ namespace DERGO
 		}
 	}
 	//-----------------------------------------------------------------------------------
+	void DergoSystem::requestResync( Network::ResyncEntity::ResyncEntity entityType, uint32_t id )
+	{
+		m_resyncEntries.push_back( ResyncEntry( static_cast<uint8_t>( entityType ), id ) );
+	}
+	//-----------------------------------------------------------------------------------
+	void DergoSystem::sendResync( bufferevent *bev, NetworkSystem &networkSystem )
+	{
+		if( m_resyncEntries.empty() )
+		{
+			//We don't know what went wrong. Ask for everything
+			networkSystem.send( bev, Network::FromServer::Resync, 0, 0 );
+			return;
+		}
+
+		std::vector<uint8_t> data( sizeof(uint32_t) + m_resyncEntries.size() *
+								   (sizeof(uint8_t) + sizeof(uint32_t)) );
+		Network::SmartData smartData( &data[0], data.size(), false );
+		smartData.write<uint32_t>( static_cast<uint32_t>( m_resyncEntries.size() ) );
+
+		std::vector<ResyncEntry>::const_iterator itor = m_resyncEntries.begin();
+		std::vector<ResyncEntry>::const_iterator end  = m_resyncEntries.end();
+
+		while( itor != end )
+		{
+			smartData.write<uint8_t>( itor->first );
+			smartData.write<uint32_t>( itor->second );
+			++itor;
+		}
+
+		networkSystem.send( bev, Network::FromServer::Resync, smartData.getBasePtr(),
+							static_cast<Ogre::uint32>( smartData.getOffset() ) );
+		m_resyncEntries.clear();
+	}
+	//-----------------------------------------------------------------------------------
 	void DergoSystem::exportToFile( Network::SmartData &smartData )
 	{
 		const Ogre::String &fullPath = smartData.getString();
@@ -1863,13 +2865,44 @@ namespace DERGO
 		case Network::FromClient::Mesh:
 			syncMesh( smartData );
 			break;
+		case Network::FromClient::MeshV2:
+			if( !syncMeshV2( smartData, header.sizeBytes ) )
+				sendResync( bev, networkSystem );
+			break;
+		case Network::FromClient::MeshIndexed:
+			if( !syncMeshIndexed( smartData, header.sizeBytes ) )
+				sendResync( bev, networkSystem );
+			break;
+		case Network::FromClient::MeshBegin:
+			syncMeshBegin( smartData );
+			break;
+		case Network::FromClient::MeshChunk:
+			if( !syncMeshChunk( smartData, header.sizeBytes ) )
+				sendResync( bev, networkSystem );
+			break;
+		case Network::FromClient::MeshEnd:
+			if( !syncMeshEnd( smartData ) )
+				sendResync( bev, networkSystem );
+			break;
+		case Network::FromClient::MeshVertexUpdate:
+			if( !syncMeshVertexUpdate( smartData, header.sizeBytes ) )
+				sendResync( bev, networkSystem );
+			break;
+		case Network::FromClient::MeshSkin:
+			if( !syncMeshSkin( smartData, header.sizeBytes ) )
+				sendResync( bev, networkSystem );
+			break;
+		case Network::FromClient::MeshSkinPose:
+			if( !syncMeshSkinPose( smartData, header.sizeBytes ) )
+				sendResync( bev, networkSystem );
+			break;
 		case Network::FromClient::Item:
 			if( !syncItem( smartData ) )
-				networkSystem.send( bev, Network::FromServer::Resync, 0, 0 );
+				sendResync( bev, networkSystem );
 			break;
 		case Network::FromClient::ItemRemove:
 			if( !destroyItem( smartData ) )
-				networkSystem.send( bev, Network::FromServer::Resync, 0, 0 );
+				sendResync( bev, networkSystem );
 			break;
 		case Network::FromClient::Light:
 			syncLight( smartData );
@@ -1888,7 +2921,7 @@ namespace DERGO
 			break;
 		case Network::FromClient::MaterialTexture:
 			if( !syncMaterialTexture( smartData ) )
-				networkSystem.send( bev, Network::FromServer::Resync, 0, 0 );
+				sendResync( bev, networkSystem );
 			break;
 		case Network::FromClient::Texture:
 			syncTexture( smartData );
@@ -1901,6 +2934,9 @@ namespace DERGO
 			break;
 		case Network::FromClient::Render:
 		{
+			//The user stopped editing these
+			optimizeSettledMeshes();
+
 			const bool returnResult		= smartData.read<uint8_t>() != 0;
 			const uint64_t windowId		= smartData.read<uint64_t>();
 			const Ogre::uint16 width	= smartData.read<Ogre::uint16>();
@@ -2104,6 +3140,14 @@ namespace DERGO
 		m_renderWindows.clear();
 	}
 	//-----------------------------------------------------------------------------------
+	Ogre::uint32 DergoSystem::getCapabilities() const
+	{
+		return Network::Capabilities::ChunkedMeshes | Network::Capabilities::VertexUpdates |
+				Network::Capabilities::Skinning | Network::Capabilities::CompactVertexFormats |
+				Network::Capabilities::SoaMeshes | Network::Capabilities::IndexedMeshes |
+				Network::Capabilities::ClientTangents | Network::Capabilities::VertexOptimization;
+	}
+	//-----------------------------------------------------------------------------------
 	void DergoSystem::savingChangeTextureName( Ogre::String &inOutTexName )
 	{
 		TexAliasToFullPathMap::const_iterator itor = m_textures.find( inOutTexName );
@@ -0,0 +1,156 @@
+
+#include "Network/Compression.h"
+#include "Network/NetworkMessage.h"
+
+#ifdef DERGO_HAS_ZLIB
+	#include <zlib.h>
+#endif
+#ifdef DERGO_HAS_LZ4
+	#include <lz4.h>
+	#include <lz4hc.h>
+#endif
+
+#include <string.h>
+
+namespace DERGO
+{
+	Ogre::uint32 Compression::getCapabilities()
+	{
+		Ogre::uint32 retVal = 0;
+#ifdef DERGO_HAS_ZLIB
+		retVal |= Network::Capabilities::CompressionZlib;
+#endif
+#ifdef DERGO_HAS_LZ4
+		retVal |= Network::Capabilities::CompressionLz4;
+#endif
+		return retVal;
+	}
+	//-------------------------------------------------------------------------
+	Ogre::uint32 Compression::getCodecCapability( Ogre::uint8 codec )
+	{
+		switch( codec )
+		{
+		case Network::Codec::Zlib:
+			return Network::Capabilities::CompressionZlib;
+		case Network::Codec::Lz4:
+			return Network::Capabilities::CompressionLz4;
+		default:
+			return 0;
+		}
+	}
+	//-------------------------------------------------------------------------
+	bool Compression::readPayloadHeader( const Ogre::uint8 *src, size_t srcSize,
+										 Ogre::uint8 &outCodec, Ogre::uint32 &outUncompressedSize )
+	{
+		if( srcSize < c_payloadHeaderSize )
+			return false;
+
+		outCodec = src[0];
+		memcpy( &outUncompressedSize, src + 1u, sizeof(Ogre::uint32) );
+
+		return (getCapabilities() & getCodecCapability( outCodec )) != 0;
+	}
+	//-------------------------------------------------------------------------
+	bool Compression::decompress( const Ogre::uint8 *src, size_t srcSize,
+								  Ogre::uint8 *dst, size_t dstSize )
+	{
+		Ogre::uint8 codec;
+		Ogre::uint32 uncompressedSize;
+		if( !readPayloadHeader( src, srcSize, codec, uncompressedSize ) ||
+			uncompressedSize != dstSize )
+		{
+			return false;
+		}
+
+		src		+= c_payloadHeaderSize;
+		srcSize	-= c_payloadHeaderSize;
+
+		switch( codec )
+		{
+#ifdef DERGO_HAS_ZLIB
+		case Network::Codec::Zlib:
+		{
+			uLongf decompressedSize = static_cast<uLongf>( dstSize );
+			const int result = uncompress( dst, &decompressedSize, src, static_cast<uLong>( srcSize ) );
+			return result == Z_OK && decompressedSize == dstSize;
+		}
+#endif
+#ifdef DERGO_HAS_LZ4
+		case Network::Codec::Lz4:
+		{
+			const int result = LZ4_decompress_safe( reinterpret_cast<const char*>( src ),
+													reinterpret_cast<char*>( dst ),
+													static_cast<int>( srcSize ),
+													static_cast<int>( dstSize ) );
+			return result >= 0 && static_cast<size_t>( result ) == dstSize;
+		}
+#endif
+		default:
+			return false;
+		}
+	}
+	//-------------------------------------------------------------------------
+	bool Compression::compress( Ogre::uint8 codec, int level, const Ogre::uint8 *src, size_t srcSize,
+								std::vector<Ogre::uint8> &outDst )
+	{
+		if( !(getCapabilities() & getCodecCapability( codec )) )
+			return false;
+
+		size_t compressedSize = 0;
+
+		switch( codec )
+		{
+#ifdef DERGO_HAS_ZLIB
+		case Network::Codec::Zlib:
+		{
+			uLongf dstSize = compressBound( static_cast<uLong>( srcSize ) );
+			outDst.resize( c_payloadHeaderSize + dstSize );
+			if( compress2( &outDst[c_payloadHeaderSize], &dstSize, src,
+						   static_cast<uLong>( srcSize ), level ) != Z_OK )
+			{
+				return false;
+			}
+			compressedSize = dstSize;
+			break;
+		}
+#endif
+#ifdef DERGO_HAS_LZ4
+		case Network::Codec::Lz4:
+		{
+			const int dstSize = LZ4_compressBound( static_cast<int>( srcSize ) );
+			outDst.resize( c_payloadHeaderSize + dstSize );
+			//Level 1 is plain LZ4, anything above uses LZ4 HC at that level
+			int result;
+			if( level > 1 )
+			{
+				result = LZ4_compress_HC( reinterpret_cast<const char*>( src ),
+										  reinterpret_cast<char*>( &outDst[c_payloadHeaderSize] ),
+										  static_cast<int>( srcSize ), dstSize, level );
+			}
+			else
+			{
+				result = LZ4_compress_default( reinterpret_cast<const char*>( src ),
+											   reinterpret_cast<char*>( &outDst[c_payloadHeaderSize] ),
+											   static_cast<int>( srcSize ), dstSize );
+			}
+			if( result <= 0 )
+				return false;
+			compressedSize = static_cast<size_t>( result );
+			break;
+		}
+#endif
+		default:
+			return false;
+		}
+
+		if( c_payloadHeaderSize + compressedSize >= srcSize )
+			return false;
+
+		const Ogre::uint32 uncompressedSize = static_cast<Ogre::uint32>( srcSize );
+		outDst[0] = codec;
+		memcpy( &outDst[1], &uncompressedSize, sizeof(Ogre::uint32) );
+		outDst.resize( c_payloadHeaderSize + compressedSize );
+
+		return true;
+	}
+}
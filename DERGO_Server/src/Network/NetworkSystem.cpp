@@ -12,10 +12,15 @@
 #include <signal.h>
 #ifndef _WIN32
 #include <netinet/in.h>
+#include <netinet/tcp.h>
 # ifdef _XOPEN_SOURCE_EXTENDED
 #  include <arpa/inet.h>
 # endif
 #include <sys/socket.h>
+#include <sys/un.h>
+#include <unistd.h>
+#else
+#include <windows.h>
 #endif
 
 #include <event2/bufferevent.h>
@@ -24,10 +29,23 @@
 #include <event2/util.h>
 #include <event2/event.h>
 
-static const int PORT = 9995;
-
 namespace DERGO
 {
+	/// Bytes at the start of the upload segment reserved for the consumed position.
+	static const size_t c_sharedMemoryRingHeaderSize = 64;
+	/// Bytes at the start of the result segment reserved for the sequence of each slot.
+	static const size_t c_sharedMemoryResultHeaderSize = 64;
+
+	/// Makes our writes to shared memory visible to the client in program order
+	static inline void sharedMemoryBarrier()
+	{
+#ifdef _WIN32
+		MemoryBarrier();
+#else
+		__sync_synchronize();
+#endif
+	}
+
 	static void buffered_on_read( bufferevent *bev, void *_userData )
 	{
 		NetworkSystem *networkSystem = reinterpret_cast<NetworkSystem*>( _userData );
@@ -47,6 +65,12 @@ namespace DERGO
 		networkSystem->_conn_eventcb( bev, events );
 	}
 
+	static void resume_bulk_cb( evutil_socket_t fd, short events, void *_userData )
+	{
+		NetworkSystem *networkSystem = reinterpret_cast<NetworkSystem*>( _userData );
+		networkSystem->_resume_bulk_cb();
+	}
+
 	static void signal_cb( evutil_socket_t sig, short events, void *_userData )
 	{
 		NetworkSystem *networkSystem = reinterpret_cast<NetworkSystem*>( _userData );
@@ -55,7 +79,15 @@ namespace DERGO
 
 	NetworkSystem::NetworkSystem() :
 		m_eventBase( 0 ),
-		m_numActiveConnections( 0 )
+		m_resumeBulkEvent( 0 ),
+		m_numActiveConnections( 0 ),
+		m_connectionAborted( false ),
+		m_bulkMessageProcessed( false ),
+		m_capabilities( 0 ),
+		m_resultCodec( Network::Codec::Uncompressed ),
+		m_resultCompressionLevel( 1 ),
+		m_resultCompressionThreshold( 0 ),
+		m_resultSequence( 0 )
 	{
 		assert( sizeof(Network::MessageHeader) == HEADER_SIZE );
 		m_rcvBuffer.resize( 8 * 1024 * 1024 );
@@ -72,9 +104,27 @@ namespace DERGO
 		m_listeners.push_back( listener );
 	}
 	//-------------------------------------------------------------------------
-	int NetworkSystem::start()
+	Ogre::uint32 NetworkSystem::getLocalCapabilities() const
+	{
+		Ogre::uint32 retVal = Network::Capabilities::SharedMemory |
+							  Network::Capabilities::BulkChannel |
+							  Compression::getCapabilities();
+
+		std::vector<NetworkListener*>::const_iterator itor = m_listeners.begin();
+		std::vector<NetworkListener*>::const_iterator end  = m_listeners.end();
+
+		while( itor != end )
+		{
+			retVal |= (*itor)->getCapabilities();
+			++itor;
+		}
+
+		return retVal;
+	}
+	//-------------------------------------------------------------------------
+	int NetworkSystem::start( Ogre::uint16 port, const Ogre::String &unixSocketPath )
 	{
-		m_currentStream.clear();
+		m_connections.clear();
 		m_eventBase = event_base_new();
 		if( !m_eventBase )
 		{
@@ -82,10 +132,16 @@ namespace DERGO
 			return 1;
 		}
 
+		//Priority 0 (highest) for the interactive channel, 1 for the bulk one.
+		event_base_priority_init( m_eventBase, 2 );
+		m_resumeBulkEvent = event_new( m_eventBase, -1, 0, resume_bulk_cb,
+									   reinterpret_cast<void*>(this) );
+		event_priority_set( m_resumeBulkEvent, 1 );
+
 		struct sockaddr_in sin;
 		memset(&sin, 0, sizeof(sin));
 		sin.sin_family = AF_INET;
-		sin.sin_port = htons(PORT);
+		sin.sin_port = htons(port);
 
 		evconnlistener *listener = evconnlistener_new_bind( m_eventBase, listener_cb,
 															reinterpret_cast<void*>(this),
@@ -98,6 +154,29 @@ namespace DERGO
 			return 1;
 		}
 
+		evconnlistener *unixListener = 0;
+#ifndef _WIN32
+		if( !unixSocketPath.empty() )
+		{
+			struct sockaddr_un sun;
+			memset(&sun, 0, sizeof(sun));
+			sun.sun_family = AF_UNIX;
+			strncpy( sun.sun_path, unixSocketPath.c_str(), sizeof(sun.sun_path) - 1 );
+
+			//Remove the socket file left behind by a previous run
+			unlink( sun.sun_path );
+
+			unixListener = evconnlistener_new_bind( m_eventBase, listener_cb,
+													reinterpret_cast<void*>(this),
+													LEV_OPT_CLOSE_ON_FREE, -1,
+													(struct sockaddr*)&sun, sizeof(sun) );
+			if( !unixListener )
+				fprintf( stderr, "Could not listen on %s. Only TCP will work.\n", sun.sun_path );
+			else
+				printf( "Listening on %s\n", sun.sun_path );
+		}
+#endif
+
 		event *signal_event = evsignal_new( m_eventBase, SIGINT, signal_cb,
 											reinterpret_cast<void*>(this) );
 
@@ -110,7 +189,16 @@ namespace DERGO
 		event_base_dispatch( m_eventBase );
 
 		evconnlistener_free( listener );
+		if( unixListener )
+		{
+			evconnlistener_free( unixListener );
+#ifndef _WIN32
+			unlink( unixSocketPath.c_str() );
+#endif
+		}
 		event_free( signal_event );
+		event_free( m_resumeBulkEvent );
+		m_resumeBulkEvent = 0;
 		event_base_free( m_eventBase );
 		m_eventBase = 0;
 
@@ -119,13 +207,63 @@ namespace DERGO
 	//-------------------------------------------------------------------------
 	void NetworkSystem::send( bufferevent *bev, Network::FromServer::FromServer msg,
 							  const void *data, Ogre::uint32 sizeBytes )
+	{
+		if( m_channels[Interactive].bev )
+			bev = m_channels[Interactive].bev;
+
+		Ogre::uint8 sharedMemoryResult[sizeof(Ogre::uint64) + sizeof(Ogre::uint32)];
+		const size_t resultSlotSize = m_resultMemory.getSizeBytes() > c_sharedMemoryResultHeaderSize ?
+										  (m_resultMemory.getSizeBytes() -
+										   c_sharedMemoryResultHeaderSize) / 2u : 0;
+		if( msg == Network::FromServer::Result && m_resultMemory.isOpen() &&
+			sizeBytes <= resultSlotSize )
+		{
+			//Alternate between both slots, so the frame the client may still be
+			//copying isn't overwritten by the next one. If it falls further behind,
+			//it'll notice the slot's sequence changed while it was copying.
+			const Ogre::uint64 sequence = ++m_resultSequence;
+			const size_t slot = static_cast<size_t>( sequence & 1u );
+			volatile Ogre::uint64 *slotSequence =
+					reinterpret_cast<volatile Ogre::uint64*>( m_resultMemory.getData() ) + slot;
+			*slotSequence = 0;
+			sharedMemoryBarrier();
+			memcpy( m_resultMemory.getData() + c_sharedMemoryResultHeaderSize +
+					slot * resultSlotSize, data, sizeBytes );
+			sharedMemoryBarrier();
+			*slotSequence = sequence;
+
+			Network::SmartData smartData( sharedMemoryResult, sizeof(sharedMemoryResult), false );
+			smartData.write<Ogre::uint64>( sequence );
+			smartData.write<Ogre::uint32>( sizeBytes );
+			msg			= Network::FromServer::SharedMemoryResult;
+			data		= sharedMemoryResult;
+			sizeBytes	= sizeof( sharedMemoryResult );
+		}
+
+		Ogre::uint8 messageType = msg;
+		if( msg == Network::FromServer::Result && m_resultCodec != Network::Codec::Uncompressed &&
+			sizeBytes >= m_resultCompressionThreshold &&
+			Compression::compress( m_resultCodec, m_resultCompressionLevel,
+								   reinterpret_cast<const Ogre::uint8*>( data ), sizeBytes,
+								   m_compressBuffer ) )
+		{
+			messageType	|= COMPRESSED_MESSAGE_FLAG;
+			data		= &m_compressBuffer[0];
+			sizeBytes	= static_cast<Ogre::uint32>( m_compressBuffer.size() );
+		}
+
+		writeMessage( bev, messageType, data, sizeBytes );
+	}
+	//-------------------------------------------------------------------------
+	void NetworkSystem::writeMessage( bufferevent *bev, Ogre::uint8 messageType,
+									  const void *data, Ogre::uint32 sizeBytes )
 	{
 		m_stashData.resize( sizeof(Network::MessageHeader) + sizeBytes );
 
 		Network::SmartData smartData( &m_stashData[0], m_stashData.size(), false );
 
 		smartData.write<Ogre::uint32>( sizeBytes );
-		smartData.write<Ogre::uint8>( msg );
+		smartData.write<Ogre::uint8>( messageType );
 		smartData.write( reinterpret_cast<const unsigned char*>(data), sizeBytes );
 
 		bufferevent_write( bev, smartData.getBasePtr(), smartData.getOffset() );
@@ -137,12 +275,350 @@ namespace DERGO
 
 		assert( false );
 
+		m_connectionAborted = true;
+		connectionClosed( bev );
+	}
+	//-------------------------------------------------------------------------
+	void NetworkSystem::connectionClosed( bufferevent *bev )
+	{
+		m_connections.erase( bev );
+		for( size_t i=0; i<NumChannels; ++i )
+		{
+			if( m_channels[i].bev == bev )
+				m_channels[i].bev = 0;
+		}
+
+		--m_numActiveConnections;
+
+		if( m_numActiveConnections == 0 )
+		{
+			for( size_t i=0; i<NumChannels; ++i )
+				m_channels[i] = ChannelState();
+			m_uploadMemory.close();
+			m_resultMemory.close();
+			m_capabilities = 0;
+			m_resultCodec = Network::Codec::Uncompressed;
+
+			std::vector<NetworkListener*>::const_iterator itor = m_listeners.begin();
+			std::vector<NetworkListener*>::const_iterator end  = m_listeners.end();
+
+			while( itor != end )
+			{
+				(*itor)->allConnectionsTerminated();
+				++itor;
+			}
+		}
+
 		bufferevent_free( bev );
-		m_currentStream.clear();
+	}
+	//-------------------------------------------------------------------------
+	bool NetworkSystem::isOrderedMessage( Ogre::uint8 messageType )
+	{
+		switch( messageType )
+		{
+		case Network::FromClient::ConnectionTest:
+		case Network::FromClient::Render:
+		case Network::FromClient::InitAsync:
+		case Network::FromClient::FinishAsync:
+		case Network::FromClient::ChannelInit:
+		case Network::FromClient::SharedMemoryInit:
+		case Network::FromClient::CompressionInit:
+		case Network::FromClient::Handshake:
+		case Network::FromClient::Barrier:
+			return false;
+		default:
+			return true;
+		}
+	}
+	//-------------------------------------------------------------------------
+	bool NetworkSystem::isChannelBlocked( size_t channelIdx ) const
+	{
+		return m_channels[1u - channelIdx].numProcessed < m_channels[channelIdx].waitForOther;
+	}
+	//-------------------------------------------------------------------------
+	void NetworkSystem::processIncomingMessage( Connection &connection,
+												const Network::MessageHeader &header,
+												Network::SmartData &smartData, bufferevent *bev )
+	{
+		if( header.messageType == Network::FromClient::ChannelInit )
+		{
+			const Ogre::uint8 channelIdx = smartData.read<Ogre::uint8>();
+			if( channelIdx >= NumChannels )
+			{
+				abortConnection( "Invalid channel!!!\n", bev );
+				return;
+			}
+
+			for( size_t i=0; i<NumChannels; ++i )
+			{
+				if( m_channels[i].bev == bev )
+					m_channels[i].bev = 0;
+			}
+			connection.channel = channelIdx;
+			m_channels[channelIdx].bev = bev;
+			bufferevent_priority_set( bev, channelIdx == Bulk ? 1 : 0 );
+			return;
+		}
+
+		if( !isOrderedMessage( header.messageType ) &&
+			header.messageType != Network::FromClient::Barrier )
+		{
+			//Render & co. never wait.
+			dispatchMessage( header, smartData, bev );
+			return;
+		}
+
+		ChannelState &channel = m_channels[connection.channel];
+		if( channel.deferred.empty() )
+		{
+			if( header.messageType == Network::FromClient::Barrier )
+			{
+				channel.waitForOther = smartData.read<Ogre::uint32>();
+				return;
+			}
+
+			if( !isChannelBlocked( connection.channel ) )
+			{
+				dispatchMessage( header, smartData, bev );
+				++channel.numProcessed;
+				return;
+			}
+		}
+
+		//Has to wait for the other channel (or for the messages that are already waiting).
+		const Ogre::uint8 *messageStart =
+				reinterpret_cast<const Ogre::uint8*>( smartData.getCurrentPtr() ) - HEADER_SIZE;
+		channel.deferred.push_back( std::vector<Ogre::uint8>( messageStart, messageStart +
+															  HEADER_SIZE + header.sizeBytes ) );
+	}
+	//-------------------------------------------------------------------------
+	void NetworkSystem::processDeferredMessages()
+	{
+		bool madeProgress = true;
+		while( madeProgress )
+		{
+			madeProgress = false;
+			for( size_t i=0; i<NumChannels; ++i )
+			{
+				ChannelState &channel = m_channels[i];
+				while( !channel.deferred.empty() )
+				{
+					std::vector<Ogre::uint8> &message = channel.deferred.front();
+					Network::SmartData smartData( &message[0], message.size(), false );
+					const Network::MessageHeader header = smartData.read<Network::MessageHeader>();
+
+					if( header.messageType == Network::FromClient::Barrier )
+					{
+						channel.waitForOther = smartData.read<Ogre::uint32>();
+					}
+					else if( isChannelBlocked( i ) || yieldBulkChannel( i ) )
+					{
+						break;
+					}
+					else
+					{
+						dispatchMessage( header, smartData, channel.bev );
+						if( m_connectionAborted )
+							return;
+						++channel.numProcessed;
+						madeProgress = true;
+					}
+
+					channel.deferred.pop_front();
+				}
+			}
+		}
+	}
+	//-------------------------------------------------------------------------
+	bool NetworkSystem::yieldBulkChannel( size_t channelIdx )
+	{
+		if( channelIdx != Bulk )
+			return false;
+
+		if( m_bulkMessageProcessed )
+		{
+			//Let the interactive channel go first. Libevent runs the higher
+			//priority events that are ready before getting back to us.
+			event_active( m_resumeBulkEvent, EV_TIMEOUT, 0 );
+			return true;
+		}
+
+		m_bulkMessageProcessed = true;
+		return false;
+	}
+	//-------------------------------------------------------------------------
+	void NetworkSystem::dispatchMessage( const Network::MessageHeader &header,
+										 Network::SmartData &smartData, bufferevent *bev )
+	{
+		if( processHandshakeMessage( header, smartData, bev ) ||
+			processSharedMemoryMessage( header, smartData, bev ) ||
+			processCompressionMessage( header, smartData, bev ) )
+		{
+			return;
+		}
+
+		std::vector<NetworkListener*>::const_iterator itor = m_listeners.begin();
+		std::vector<NetworkListener*>::const_iterator end  = m_listeners.end();
+
+		while( itor != end )
+		{
+			(*itor)->processMessage( header, smartData, bev, *this );
+			++itor;
+		}
+	}
+	//-------------------------------------------------------------------------
+	bool NetworkSystem::processSharedMemoryMessage( const Network::MessageHeader &header,
+													Network::SmartData &smartData, bufferevent *bev )
+	{
+		if( header.messageType == Network::FromClient::SharedMemoryInit )
+		{
+			const Ogre::String uploadName		= smartData.getString();
+			const Ogre::uint32 uploadSize		= smartData.read<Ogre::uint32>();
+			const Ogre::String resultName		= smartData.getString();
+			const Ogre::uint32 resultSize		= smartData.read<Ogre::uint32>();
+
+			//If it fails, the client will just see Result messages rather than SharedMemoryResult.
+			//Uploads must work though, or we won't be able to read anything it sends.
+			if( uploadSize <= c_sharedMemoryRingHeaderSize || !m_uploadMemory.open( uploadName, uploadSize ) )
+			{
+				abortConnection( "Could not open the client's shared memory\n", bev );
+				return true;
+			}
+			m_resultMemory.open( resultName, resultSize );
+			m_resultSequence = 0;
+
+			printf( "Using shared memory for uploads (%u bytes) and results (%u bytes)\n",
+					uploadSize, static_cast<Ogre::uint32>( m_resultMemory.getSizeBytes() ) );
+			return true;
+		}
+		else if( header.messageType == Network::FromClient::SharedMemoryData )
+		{
+			Network::MessageHeader realHeader;
+			realHeader.messageType			= smartData.read<Ogre::uint8>();
+			const Ogre::uint64 startPos		= smartData.read<Ogre::uint64>();
+			realHeader.sizeBytes			= smartData.read<Ogre::uint32>();
+
+			if( !m_uploadMemory.isOpen() )
+			{
+				abortConnection( "SharedMemoryData received before SharedMemoryInit\n", bev );
+				return true;
+			}
+
+			const size_t capacity = m_uploadMemory.getSizeBytes() - c_sharedMemoryRingHeaderSize;
+			const size_t offset = static_cast<size_t>( startPos % capacity );
+			if( offset + realHeader.sizeBytes > capacity ||
+				realHeader.messageType >= Network::FromClient::NumClientMessages ||
+				realHeader.messageType == Network::FromClient::SharedMemoryInit ||
+				realHeader.messageType == Network::FromClient::SharedMemoryData )
+			{
+				abortConnection( "SharedMemoryData is corrupt!!!\n", bev );
+				return true;
+			}
+
+			Ogre::uint8 *ringData = m_uploadMemory.getData() + c_sharedMemoryRingHeaderSize;
+			Network::SmartData realData( ringData + offset, realHeader.sizeBytes, false );
+			dispatchMessage( realHeader, realData, bev );
+			if( m_connectionAborted )
+				return true;
+
+			//Let the client reuse that space.
+			volatile Ogre::uint64 *consumedPos =
+					reinterpret_cast<volatile Ogre::uint64*>( m_uploadMemory.getData() );
+			*consumedPos = startPos + realHeader.sizeBytes;
+			return true;
+		}
+
+		return false;
+	}
+	//-------------------------------------------------------------------------
+	bool NetworkSystem::processCompressionMessage( const Network::MessageHeader &header,
+												   Network::SmartData &smartData, bufferevent *bev )
+	{
+		if( header.messageType != Network::FromClient::CompressionInit )
+			return false;
+
+		m_resultCodec					= smartData.read<Ogre::uint8>();
+		m_resultCompressionLevel		= smartData.read<Ogre::uint8>();
+		m_resultCompressionThreshold	= smartData.read<Ogre::uint32>();
+
+		if( !(m_capabilities & Compression::getCodecCapability( m_resultCodec )) )
+			m_resultCodec = Network::Codec::Uncompressed;
+
+		return true;
+	}
+	//-------------------------------------------------------------------------
+	bool NetworkSystem::processHandshakeMessage( const Network::MessageHeader &header,
+												 Network::SmartData &smartData, bufferevent *bev )
+	{
+		if( header.messageType != Network::FromClient::Handshake )
+			return false;
+
+		const Ogre::uint32 clientVersion		= smartData.read<Ogre::uint32>();
+		const Ogre::uint32 clientCapabilities	= smartData.read<Ogre::uint32>();
+		const Ogre::uint32 localCapabilities	= getLocalCapabilities();
+
+		if( clientVersion == PROTOCOL_VERSION )
+		{
+			m_capabilities = clientCapabilities & localCapabilities;
+		}
+		else
+		{
+			//Only the basic protocol. Not even that may work, but the client will complain.
+			printf( "Client uses protocol version %u, we use %u. Disabling all optional features\n",
+					clientVersion, PROTOCOL_VERSION );
+			m_capabilities = 0;
+		}
+
+		//Reply through the same connection, which may not be the interactive
+		//channel yet (e.g. the previous client's is still being torn down)
+		Ogre::uint32 reply[2] = { PROTOCOL_VERSION, localCapabilities };
+		writeMessage( bev, Network::FromServer::Handshake, reply, sizeof(reply) );
+		return true;
+	}
+	//-------------------------------------------------------------------------
+	void NetworkSystem::processCompressedMessage( Connection &connection,
+												  const Network::MessageHeader &header,
+												  Network::SmartData &smartData, bufferevent *bev )
+	{
+		const Ogre::uint8 *compressedData =
+				reinterpret_cast<const Ogre::uint8*>( smartData.getCurrentPtr() );
+
+		Ogre::uint8 codec;
+		Network::MessageHeader realHeader;
+		realHeader.messageType = header.messageType & ~COMPRESSED_MESSAGE_FLAG;
+		if( !Compression::readPayloadHeader( compressedData, header.sizeBytes,
+											 codec, realHeader.sizeBytes ) )
+		{
+			abortConnection( "Compressed message uses an unknown codec!!!\n", bev );
+			return;
+		}
+
+		//Keep the header in front of the data, as if it had arrived uncompressed
+		//(processIncomingMessage may need to make a copy of the whole message).
+		m_decompressBuffer.resize( HEADER_SIZE + realHeader.sizeBytes );
+		memcpy( &m_decompressBuffer[0], &realHeader, HEADER_SIZE );
+		if( !Compression::decompress( compressedData, header.sizeBytes,
+									  &m_decompressBuffer[HEADER_SIZE], realHeader.sizeBytes ) )
+		{
+			abortConnection( "Could not decompress message. Message is corrupt!!!\n", bev );
+			return;
+		}
+
+		Network::SmartData realData( &m_decompressBuffer[0], m_decompressBuffer.size(), false );
+		realData.seekSet( HEADER_SIZE );
+		processIncomingMessage( connection, realHeader, realData, bev );
 	}
 	//-------------------------------------------------------------------------
 	void NetworkSystem::_buffered_on_read( bufferevent *bev )
 	{
+		m_connectionAborted = false;
+		m_bulkMessageProcessed = false;
+
+		ConnectionMap::iterator itConnection = m_connections.find( bev );
+		assert( itConnection != m_connections.end() );
+		Connection &connection = itConnection->second;
+		std::vector<Ogre::uint8> &currentStream = connection.stream;
+
 		//Ogre::uint8 data[8192];
 
 		/* Read 8k at a time and send it to all connected clients. */
@@ -165,29 +641,38 @@ namespace DERGO
 				break;
 			}
 
-			const size_t oldSize = m_currentStream.size();
-			m_currentStream.resize( oldSize + bytesRead );
-			memcpy( &m_currentStream[oldSize], &m_rcvBuffer[0], bytesRead );
+			const size_t oldSize = currentStream.size();
+			currentStream.resize( oldSize + bytesRead );
+			memcpy( &currentStream[oldSize], &m_rcvBuffer[0], bytesRead );
 		}
 
-		if( m_currentStream.empty() )
+		processStream( connection, bev );
+	}
+	//-------------------------------------------------------------------------
+	void NetworkSystem::processStream( Connection &connection, bufferevent *bev )
+	{
+		std::vector<Ogre::uint8> &currentStream = connection.stream;
+
+		if( currentStream.empty() )
 			return;
 
-		Network::SmartData smartData( &m_currentStream[0], m_currentStream.size(), false );
+		Network::SmartData smartData( &currentStream[0], currentStream.size(), false );
+		smartData.seekSet( connection.streamStart );
 
 		size_t remainingBytes = smartData.getCapacity() - smartData.getOffset();
 
 		while( remainingBytes >= HEADER_SIZE )
 		{
 			Network::MessageHeader header = smartData.read<Network::MessageHeader>();
-			if( header.sizeBytes > smartData.getCapacity() - smartData.getOffset() )
+			if( header.sizeBytes > smartData.getCapacity() - smartData.getOffset() ||
+				yieldBulkChannel( connection.channel ) )
 			{
-				//Packet is incomplete. Process it the next time.
+				//Packet is incomplete (or it's someone else's turn). Process it the next time.
 				smartData.seekCur( -HEADER_SIZE );
 				break;
 			}
 
-			if( header.messageType >= Network::FromClient::NumClientMessages )
+			if( (header.messageType & ~COMPRESSED_MESSAGE_FLAG) >= Network::FromClient::NumClientMessages )
 			{
 				abortConnection( "Message type is higher than NumClientMessages. "
 								 "Message is corrupt!!!\n", bev );
@@ -196,14 +681,12 @@ namespace DERGO
 
 			const size_t nextPos = smartData.getOffset() + header.sizeBytes;
 
-			std::vector<NetworkListener*>::const_iterator itor = m_listeners.begin();
-			std::vector<NetworkListener*>::const_iterator end  = m_listeners.end();
-
-			while( itor != end )
-			{
-				(*itor)->processMessage( header, smartData, bev, *this );
-				++itor;
-			}
+			if( header.messageType & COMPRESSED_MESSAGE_FLAG )
+				processCompressedMessage( connection, header, smartData, bev );
+			else
+				processIncomingMessage( connection, header, smartData, bev );
+			if( m_connectionAborted )
+				return;
 
 			assert( smartData.getOffset() <= nextPos &&
 					"processMessage read beyond of what it was allowed" );
@@ -212,16 +695,42 @@ namespace DERGO
 			remainingBytes = smartData.getCapacity() - smartData.getOffset();
 		}
 
-		const size_t bytesLeftUnread = smartData.getCapacity() - smartData.getOffset();
-		if( bytesLeftUnread )
+		//If there was any leftover, we'll read it the next time. The bulk channel
+		//leaves a lot behind when it yields, so only move it once the processed
+		//data takes up half of the stream.
+		connection.streamStart = smartData.getOffset();
+		const size_t bytesLeftUnread = currentStream.size() - connection.streamStart;
+		if( connection.streamStart * 2u >= currentStream.size() )
 		{
-			//If there was any leftover, we'll read it the next time.
-			memmove( &m_currentStream[0],
-					&m_currentStream[smartData.getOffset()],
-					bytesLeftUnread );
+			if( bytesLeftUnread )
+			{
+				memmove( &currentStream[0],
+						&currentStream[connection.streamStart],
+						bytesLeftUnread );
+			}
+
+			currentStream.resize( bytesLeftUnread );
+			connection.streamStart = 0;
 		}
 
-		m_currentStream.resize( bytesLeftUnread );
+		//New data in this channel may have unblocked the other one.
+		processDeferredMessages();
+	}
+	//-------------------------------------------------------------------------
+	void NetworkSystem::_resume_bulk_cb()
+	{
+		m_connectionAborted = false;
+		m_bulkMessageProcessed = false;
+
+		//Deferred messages were sent before what's left in the stream.
+		processDeferredMessages();
+		if( m_connectionAborted )
+			return;
+
+		bufferevent *bev = m_channels[Bulk].bev;
+		ConnectionMap::iterator itConnection = m_connections.find( bev );
+		if( bev && itConnection != m_connections.end() )
+			processStream( itConnection->second, bev );
 	}
 	//-------------------------------------------------------------------------
 	void NetworkSystem::_listener_cb( evconnlistener *listener, evutil_socket_t fd,
@@ -235,9 +744,20 @@ namespace DERGO
 			return;
 		}
 		bufferevent_setcb( bev, buffered_on_read, /*conn_writecb*/NULL, conn_eventcb, this );
+		bufferevent_priority_set( bev, 0 );
 		bufferevent_enable( bev, EV_WRITE );
 		bufferevent_enable( bev, EV_READ );
 
+		if( sa->sa_family == AF_INET || sa->sa_family == AF_INET6 )
+		{
+			//Results are written in one go. Don't let Nagle hold back their last
+			//segment until the client ACKs (which it delays when it's got nothing
+			//to send on this connection, e.g. when uploads go through the bulk one).
+			int noDelay = 1;
+			setsockopt( fd, IPPROTO_TCP, TCP_NODELAY,
+						reinterpret_cast<const char*>( &noDelay ), sizeof(noDelay) );
+		}
+
 		char ipAddress[INET6_ADDRSTRLEN];
 		switch( sa->sa_family )
 		{
@@ -253,11 +773,22 @@ namespace DERGO
 			inet_ntop( AF_INET6, &addr_in6->sin6_addr, ipAddress, INET6_ADDRSTRLEN );
 			break;
 		}
+#ifndef _WIN32
+		case AF_UNIX:
+			strcpy( ipAddress, "local socket" );
+			break;
+#endif
 		default:
+			strcpy( ipAddress, "unknown" );
 			break;
 		}
 
+		m_connections[bev] = Connection();
+		if( !m_channels[Interactive].bev )
+			m_channels[Interactive].bev = bev;
+
 		++m_numActiveConnections;
+		m_connectionAborted = false;
 
 		printf( "Incoming new client connection from %s\n", ipAddress );
 	}
@@ -271,23 +802,9 @@ namespace DERGO
 				strerror(errno));/*XXX win32*/
 		}
 
-		--m_numActiveConnections;
-
-		if( m_numActiveConnections == 0 )
-		{
-			std::vector<NetworkListener*>::const_iterator itor = m_listeners.begin();
-			std::vector<NetworkListener*>::const_iterator end  = m_listeners.end();
-
-			while( itor != end )
-			{
-				(*itor)->allConnectionsTerminated();
-				++itor;
-			}
-		}
-
 		/* None of the other events can happen here, since we haven't enabled
 		 * timeouts */
-		bufferevent_free( bev );
+		connectionClosed( bev );
 	}
 	//-------------------------------------------------------------------------
 	void NetworkSystem::_signal_cb( evutil_socket_t sig, short events )
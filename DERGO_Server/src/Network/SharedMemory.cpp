@@ -0,0 +1,103 @@
+
+#include "Network/SharedMemory.h"
+
+#ifdef _WIN32
+	#define NOMINMAX
+	#define VC_EXTRALEAN
+	#define WIN32_LEAN_AND_MEAN
+	#include <windows.h>
+#else
+	#include <sys/mman.h>
+	#include <sys/stat.h>
+	#include <fcntl.h>
+	#include <unistd.h>
+#endif
+
+#include <stdio.h>
+
+namespace DERGO
+{
+	SharedMemory::SharedMemory() :
+		m_data( 0 ),
+		m_sizeBytes( 0 )
+#ifdef _WIN32
+		, m_fileMapping( 0 )
+#endif
+	{
+	}
+	//-------------------------------------------------------------------------
+	SharedMemory::~SharedMemory()
+	{
+		close();
+	}
+	//-------------------------------------------------------------------------
+	bool SharedMemory::open( const Ogre::String &name, size_t sizeBytes )
+	{
+		close();
+
+#ifdef _WIN32
+		m_fileMapping = OpenFileMappingA( FILE_MAP_ALL_ACCESS, FALSE, name.c_str() );
+		if( !m_fileMapping )
+		{
+			fprintf( stderr, "Could not open shared memory %s\n", name.c_str() );
+			return false;
+		}
+
+		m_data = reinterpret_cast<Ogre::uint8*>( MapViewOfFile( m_fileMapping, FILE_MAP_ALL_ACCESS,
+																0, 0, sizeBytes ) );
+		if( !m_data )
+		{
+			fprintf( stderr, "Could not map shared memory %s\n", name.c_str() );
+			CloseHandle( m_fileMapping );
+			m_fileMapping = 0;
+			return false;
+		}
+#else
+		//Python strips the leading slash from the name it reports
+		const Ogre::String posixName = name[0] == '/' ? name : ("/" + name);
+		const int fd = shm_open( posixName.c_str(), O_RDWR, 0 );
+		if( fd < 0 )
+		{
+			fprintf( stderr, "Could not open shared memory %s\n", posixName.c_str() );
+			return false;
+		}
+
+		struct stat fileStat;
+		if( fstat( fd, &fileStat ) != 0 || static_cast<size_t>( fileStat.st_size ) < sizeBytes )
+		{
+			fprintf( stderr, "Shared memory %s is smaller than advertised\n", posixName.c_str() );
+			::close( fd );
+			return false;
+		}
+
+		void *data = mmap( 0, sizeBytes, PROT_READ|PROT_WRITE, MAP_SHARED, fd, 0 );
+		//The mapping stays valid after closing the descriptor
+		::close( fd );
+		if( data == MAP_FAILED )
+		{
+			fprintf( stderr, "Could not map shared memory %s\n", posixName.c_str() );
+			return false;
+		}
+		m_data = reinterpret_cast<Ogre::uint8*>( data );
+#endif
+
+		m_sizeBytes = sizeBytes;
+		return true;
+	}
+	//-------------------------------------------------------------------------
+	void SharedMemory::close()
+	{
+		if( !m_data )
+			return;
+
+#ifdef _WIN32
+		UnmapViewOfFile( m_data );
+		CloseHandle( m_fileMapping );
+		m_fileMapping = 0;
+#else
+		munmap( m_data, m_sizeBytes );
+#endif
+		m_data = 0;
+		m_sizeBytes = 0;
+	}
+}
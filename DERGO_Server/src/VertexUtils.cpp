@@ -3,9 +3,13 @@
 
 #include "OgreVector2.h"
 #include "OgreVector3.h"
+#include "OgreMatrix3.h"
+#include "OgreBitwise.h"
 
 #include "OgreHardwareVertexBuffer.h"
 
+#include "Network/NetworkMessage.h"
+
 namespace DERGO
 {
 #if defined( _MSC_VER ) && _MSC_VER < 1600
@@ -14,6 +18,237 @@ namespace DERGO
     using ::uint8_t;
 #endif
 
+	size_t VertexUtils::getWireElementSize( uint8_t section, uint8_t meshFormat )
+	{
+		const size_t normalSize = (meshFormat & Network::MeshFormat::CompactNormals) ?
+									  sizeof(int16_t) * 2u : sizeof(Ogre::Vector3);
+
+		switch( section )
+		{
+		case Network::MeshSection::Faces:
+			return sizeof(uint32_t) * 4u + normalSize + sizeof(uint16_t) + sizeof(uint8_t);
+		case Network::MeshSection::FaceColours:
+			return (meshFormat & Network::MeshFormat::CompactColours) ?
+						sizeof(uint8_t) * 4u * 4u : sizeof(BlenderFaceColour);
+		case Network::MeshSection::FaceUvs:
+			return (meshFormat & Network::MeshFormat::CompactUvs) ?
+						sizeof(uint16_t) * 2u * 4u : sizeof(BlenderFaceUv);
+		case Network::MeshSection::RawVertices:
+			return ((meshFormat & Network::MeshFormat::QuantizedPositions) ?
+						sizeof(uint16_t) * 3u : sizeof(Ogre::Vector3)) + normalSize;
+		case Network::MeshSection::FaceIndices:
+			return sizeof(uint32_t) * 4u;
+		case Network::MeshSection::FaceNormals:
+			return normalSize;
+		case Network::MeshSection::FaceMaterials:
+			return sizeof(uint16_t);
+		case Network::MeshSection::FaceFlags:
+			return sizeof(uint8_t);
+		case Network::MeshSection::RawTangents:
+			return sizeof(BlenderRawTangent);
+		}
+
+		return 0;
+	}
+	//-------------------------------------------------------------------------
+	void VertexUtils::decodeSection( void * RESTRICT_ALIAS dstData, const uint8_t *srcData,
+									 size_t numElements, uint8_t section, uint8_t meshFormat,
+									 const Ogre::Vector3 &aabbMin, const Ogre::Vector3 &aabbMax )
+	{
+		using namespace Ogre;
+
+		const bool compactNormals = (meshFormat & Network::MeshFormat::CompactNormals) != 0;
+
+		switch( section )
+		{
+		case Network::MeshSection::Faces:
+		{
+			BlenderFace * RESTRICT_ALIAS faces = reinterpret_cast<BlenderFace*>( dstData );
+			for( size_t i=0; i<numElements; ++i )
+			{
+				memcpy( faces[i].vertexIndex, srcData, sizeof(uint32_t) * 4u );
+				srcData += sizeof(uint32_t) * 4u;
+
+				if( compactNormals )
+				{
+					int16_t oct[2];
+					memcpy( oct, srcData, sizeof(oct) );
+					faces[i].faceNormal = decodeOctNormal( oct[0], oct[1] );
+					srcData += sizeof(oct);
+				}
+				else
+				{
+					memcpy( &faces[i].faceNormal, srcData, sizeof(Vector3) );
+					srcData += sizeof(Vector3);
+				}
+
+				memcpy( &faces[i].materialId, srcData, sizeof(uint16_t) );
+				srcData += sizeof(uint16_t);
+				faces[i].numIndicesInFace = *srcData++;
+			}
+			break;
+		}
+		case Network::MeshSection::FaceColours:
+		{
+			BlenderFaceColour * RESTRICT_ALIAS faceColours =
+					reinterpret_cast<BlenderFaceColour*>( dstData );
+			if( !(meshFormat & Network::MeshFormat::CompactColours) )
+			{
+				memcpy( faceColours, srcData, sizeof(BlenderFaceColour) * numElements );
+				break;
+			}
+
+			//deindex() turns them back into the same bytes
+			for( size_t i=0; i<numElements; ++i )
+			{
+				for( int j=0; j<4; ++j )
+				{
+					faceColours[i].colour[j] = Vector3( srcData[0], srcData[1], srcData[2] ) / 255.0f;
+					srcData += sizeof(uint8_t) * 4u;
+				}
+			}
+			break;
+		}
+		case Network::MeshSection::FaceUvs:
+		{
+			BlenderFaceUv * RESTRICT_ALIAS faceUvs = reinterpret_cast<BlenderFaceUv*>( dstData );
+			if( !(meshFormat & Network::MeshFormat::CompactUvs) )
+			{
+				memcpy( faceUvs, srcData, sizeof(BlenderFaceUv) * numElements );
+				break;
+			}
+
+			for( size_t i=0; i<numElements; ++i )
+			{
+				for( int j=0; j<4; ++j )
+				{
+					uint16_t uv[2];
+					memcpy( uv, srcData, sizeof(uv) );
+					faceUvs[i].uv[j] = Vector2( Bitwise::halfToFloat( uv[0] ),
+												Bitwise::halfToFloat( uv[1] ) );
+					srcData += sizeof(uv);
+				}
+			}
+			break;
+		}
+		case Network::MeshSection::RawVertices:
+		{
+			BlenderRawVertex * RESTRICT_ALIAS rawVertices =
+					reinterpret_cast<BlenderRawVertex*>( dstData );
+			const bool quantizedPositions =
+					(meshFormat & Network::MeshFormat::QuantizedPositions) != 0;
+			const Vector3 quantizationScale = (aabbMax - aabbMin) / 65535.0f;
+
+			for( size_t i=0; i<numElements; ++i )
+			{
+				if( quantizedPositions )
+				{
+					uint16_t pos[3];
+					memcpy( pos, srcData, sizeof(pos) );
+					rawVertices[i].vPos = aabbMin + Vector3( pos[0], pos[1], pos[2] ) *
+													quantizationScale;
+					srcData += sizeof(pos);
+				}
+				else
+				{
+					memcpy( &rawVertices[i].vPos, srcData, sizeof(Vector3) );
+					srcData += sizeof(Vector3);
+				}
+
+				if( compactNormals )
+				{
+					int16_t oct[2];
+					memcpy( oct, srcData, sizeof(oct) );
+					rawVertices[i].vNormal = decodeOctNormal( oct[0], oct[1] );
+					srcData += sizeof(oct);
+				}
+				else
+				{
+					memcpy( &rawVertices[i].vNormal, srcData, sizeof(Vector3) );
+					srcData += sizeof(Vector3);
+				}
+			}
+			break;
+		}
+		case Network::MeshSection::FaceIndices:
+		{
+			BlenderFace * RESTRICT_ALIAS faces = reinterpret_cast<BlenderFace*>( dstData );
+			for( size_t i=0; i<numElements; ++i )
+			{
+				memcpy( faces[i].vertexIndex, srcData, sizeof(uint32_t) * 4u );
+				srcData += sizeof(uint32_t) * 4u;
+			}
+			break;
+		}
+		case Network::MeshSection::FaceNormals:
+		{
+			BlenderFace * RESTRICT_ALIAS faces = reinterpret_cast<BlenderFace*>( dstData );
+			for( size_t i=0; i<numElements; ++i )
+			{
+				if( compactNormals )
+				{
+					int16_t oct[2];
+					memcpy( oct, srcData, sizeof(oct) );
+					faces[i].faceNormal = decodeOctNormal( oct[0], oct[1] );
+					srcData += sizeof(oct);
+				}
+				else
+				{
+					memcpy( &faces[i].faceNormal, srcData, sizeof(Vector3) );
+					srcData += sizeof(Vector3);
+				}
+			}
+			break;
+		}
+		case Network::MeshSection::FaceMaterials:
+		{
+			//The use_smooth bit comes from FaceFlags
+			BlenderFace * RESTRICT_ALIAS faces = reinterpret_cast<BlenderFace*>( dstData );
+			for( size_t i=0; i<numElements; ++i )
+			{
+				uint16_t materialId;
+				memcpy( &materialId, srcData, sizeof(uint16_t) );
+				faces[i].materialId = (faces[i].materialId & 0x8000) | (materialId & 0x7FFF);
+				srcData += sizeof(uint16_t);
+			}
+			break;
+		}
+		case Network::MeshSection::FaceFlags:
+		{
+			BlenderFace * RESTRICT_ALIAS faces = reinterpret_cast<BlenderFace*>( dstData );
+			for( size_t i=0; i<numElements; ++i )
+			{
+				const uint8_t flags = *srcData++;
+				faces[i].numIndicesInFace = flags & 0x7F;
+				faces[i].materialId = (faces[i].materialId & 0x7FFF) |
+									  static_cast<uint16_t>( (flags & 0x80) << 8u );
+			}
+			break;
+		}
+		case Network::MeshSection::RawTangents:
+			memcpy( dstData, srcData, sizeof(BlenderRawTangent) * numElements );
+			break;
+		}
+	}
+	//-------------------------------------------------------------------------
+	Ogre::Vector3 VertexUtils::decodeOctNormal( int16_t x, int16_t y )
+	{
+		using namespace Ogre;
+
+		Vector3 vNormal( std::max( x / 32767.0f, -1.0f ), std::max( y / 32767.0f, -1.0f ), 0.0f );
+		vNormal.z = 1.0f - Math::Abs( vNormal.x ) - Math::Abs( vNormal.y );
+		if( vNormal.z < 0.0f )
+		{
+			//The lower hemisphere is folded over the diagonals
+			const Real oldX = vNormal.x;
+			vNormal.x = (1.0f - Math::Abs( vNormal.y )) * (oldX >= 0.0f ? 1.0f : -1.0f);
+			vNormal.y = (1.0f - Math::Abs( oldX )) * (vNormal.y >= 0.0f ? 1.0f : -1.0f);
+		}
+		vNormal.normalise();
+
+		return vNormal;
+	}
+	//-------------------------------------------------------------------------
 	void VertexUtils::deindex( uint8_t * RESTRICT_ALIAS dstData, uint32_t bytesPerVertex,
 							   const BlenderFace *faces, uint32_t numFaces,
 							   const BlenderRawVertex *blenderRawVertices,
@@ -184,6 +419,39 @@ namespace DERGO
 		}
 	}
 	//-------------------------------------------------------------------------
+	void VertexUtils::deindex( uint8_t * RESTRICT_ALIAS dstData, uint32_t bytesPerVertex,
+							   const BlenderFace *faces, uint32_t numFaces,
+							   const BlenderRawTangent *rawTangents, uint32_t tangentStride )
+	{
+		for( ::uint32_t i=0; i<numFaces; ++i )
+		{
+			const ::uint32_t k0 = faces[i].vertexIndex[0];
+			const ::uint32_t k1 = faces[i].vertexIndex[1];
+			const ::uint32_t k2 = faces[i].vertexIndex[2];
+
+			memcpy( dstData + tangentStride, &rawTangents[k0], sizeof(BlenderRawTangent) );
+			memcpy( dstData + tangentStride + bytesPerVertex, &rawTangents[k1],
+					sizeof(BlenderRawTangent) );
+			memcpy( dstData + tangentStride + bytesPerVertex * 2u, &rawTangents[k2],
+					sizeof(BlenderRawTangent) );
+
+			dstData += bytesPerVertex * 3u;
+
+			if( faces[i].numIndicesInFace == 4 )
+			{
+				const ::uint32_t k3 = faces[i].vertexIndex[3];
+
+				memcpy( dstData + tangentStride, &rawTangents[k0], sizeof(BlenderRawTangent) );
+				memcpy( dstData + tangentStride + bytesPerVertex, &rawTangents[k2],
+						sizeof(BlenderRawTangent) );
+				memcpy( dstData + tangentStride + bytesPerVertex * 2u, &rawTangents[k3],
+						sizeof(BlenderRawTangent) );
+
+				dstData += bytesPerVertex * 3u;
+			}
+		}
+	}
+	//-------------------------------------------------------------------------
 	uint32_t VertexUtils::shrinkVertexBuffer( uint8_t *vertexData,
 											  Ogre::FastArray<uint32_t> &vertexConversionLutArg,
 											  uint32_t bytesPerVertex,
@@ -254,6 +522,62 @@ namespace DERGO
 		return newNumVertices;
 	}
 	//-----------------------------------------------------------------------------------
+	void VertexUtils::skin( const BlenderRawVertex *restVertices,
+							const BlenderSkinWeights *skinWeights,
+							const BlenderBoneMatrix *boneMatrices,
+							BlenderRawVertex * RESTRICT_ALIAS outVertices,
+							uint32_t numVertices )
+	{
+		using namespace Ogre;
+
+		for( ::uint32_t i=0; i<numVertices; ++i )
+		{
+			//Blend the matrices, then transform (same result as blending the vertices)
+			float m[3][4] = { { 0 } };
+			float totalWeight = 0;
+			for( int j=0; j<4; ++j )
+			{
+				const float weight = skinWeights[i].weights[j];
+				if( weight != 0 )
+				{
+					const BlenderBoneMatrix &boneMatrix =
+							boneMatrices[skinWeights[i].boneIndices[j]];
+					for( int row=0; row<3; ++row )
+					{
+						for( int col=0; col<4; ++col )
+							m[row][col] += boneMatrix.m[row][col] * weight;
+					}
+					totalWeight += weight;
+				}
+			}
+
+			//Same threshold as Blender's Armature modifier
+			if( totalWeight <= 0.0001f )
+			{
+				outVertices[i] = restVertices[i];
+				continue;
+			}
+
+			const float invTotalWeight = 1.0f / totalWeight;
+			for( int row=0; row<3; ++row )
+			{
+				for( int col=0; col<4; ++col )
+					m[row][col] *= invTotalWeight;
+			}
+
+			const Vector3 &vPos		= restVertices[i].vPos;
+			const Vector3 &vNormal	= restVertices[i].vNormal;
+
+			outVertices[i].vPos = Vector3( m[0][0] * vPos.x + m[0][1] * vPos.y + m[0][2] * vPos.z + m[0][3],
+										   m[1][0] * vPos.x + m[1][1] * vPos.y + m[1][2] * vPos.z + m[1][3],
+										   m[2][0] * vPos.x + m[2][1] * vPos.y + m[2][2] * vPos.z + m[2][3] );
+			outVertices[i].vNormal = Vector3( m[0][0] * vNormal.x + m[0][1] * vNormal.y + m[0][2] * vNormal.z,
+											  m[1][0] * vNormal.x + m[1][1] * vNormal.y + m[1][2] * vNormal.z,
+											  m[2][0] * vNormal.x + m[2][1] * vNormal.y + m[2][2] * vNormal.z );
+			outVertices[i].vNormal.normalise();
+		}
+	}
+	//-----------------------------------------------------------------------------------
 	void VertexUtils::generateTangents( uint8_t *vertexData, uint32_t bytesPerVertex,
 										uint32_t numVertices, uint32_t posStride, uint32_t normalStride,
 										uint32_t tangentStride, uint32_t uvStride )
@@ -430,6 +754,192 @@ namespace DERGO
 		}
 	}
 	//-----------------------------------------------------------------------------------
+	Ogre::Quaternion VertexUtils::createQTangent( const Ogre::Vector3 &vNormal,
+												  Ogre::Vector3 vTangent, float parity )
+	{
+		using namespace Ogre;
+
+		//The TBN matrix must be a rotation, whether we have a good tangent or not
+		vTangent -= vNormal * vNormal.dotProduct( vTangent );
+		if( vTangent.squaredLength() < 1e-12f )
+			vTangent = vNormal.perpendicular();
+		vTangent.normalise();
+
+		Matrix3 tbn;
+		tbn.FromAxes( vNormal, vTangent, vNormal.crossProduct( vTangent ) );
+		Quaternion qTangent( tbn );
+		qTangent.normalise();
+
+		//Make sure QTangent is always positive
+		if( qTangent.w < 0 )
+			qTangent = -qTangent;
+
+		//The sign of w is the parity, but '-0' can't be stored as an integer.
+		//Keep w away from 0 while making sure the quaternion stays normalised.
+		const Real bias = 1.0f / 32767.0f;
+		if( qTangent.w < bias )
+		{
+			const Real normFactor = Math::Sqrt( 1 - bias * bias );
+			qTangent.w = bias;
+			qTangent.x *= normFactor;
+			qTangent.y *= normFactor;
+			qTangent.z *= normFactor;
+		}
+
+		if( parity < 0 )
+			qTangent = -qTangent;
+
+		return qTangent;
+	}
+	//-----------------------------------------------------------------------------------
+	void VertexUtils::compactVertices( uint8_t * RESTRICT_ALIAS dstData, const uint8_t *srcData,
+									   uint32_t bytesPerVertex, uint32_t numVertices,
+									   bool hasColour, uint8_t numUVs, bool hasTangent,
+									   uint8_t meshFormat )
+	{
+		using namespace Ogre;
+
+		const bool compactNormals	= (meshFormat & Network::MeshFormat::CompactNormals) != 0;
+		const bool compactUvs		= (meshFormat & Network::MeshFormat::CompactUvs) != 0;
+		const uint32_t uvStride		= sizeof(Vector3) * 2u + (hasColour ? sizeof(uint8_t) * 4u : 0u);
+		const uint32_t tangentStride= uvStride + sizeof(Vector2) * numUVs;
+
+		for( ::uint32_t i=0; i<numVertices; ++i )
+		{
+			//Position
+			memcpy( dstData, srcData, sizeof(Vector3) );
+			dstData += sizeof(Vector3);
+
+			const Vector3 *vNormal = reinterpret_cast<const Vector3*>( srcData + sizeof(Vector3) );
+			if( compactNormals )
+			{
+				Vector3 vTangent( Vector3::ZERO );
+				float parity = 1.0f;
+				if( hasTangent )
+				{
+					vTangent = *reinterpret_cast<const Vector3*>( srcData + tangentStride );
+					parity = *reinterpret_cast<const float*>( srcData + tangentStride + sizeof(Vector3) );
+				}
+
+				const Quaternion qTangent = createQTangent( *vNormal, vTangent, parity );
+				int16_t * RESTRICT_ALIAS dstQTangent = reinterpret_cast<int16_t*>( dstData );
+				dstQTangent[0] = static_cast<int16_t>( Math::Floor( qTangent.x * 32767.0f + 0.5f ) );
+				dstQTangent[1] = static_cast<int16_t>( Math::Floor( qTangent.y * 32767.0f + 0.5f ) );
+				dstQTangent[2] = static_cast<int16_t>( Math::Floor( qTangent.z * 32767.0f + 0.5f ) );
+				dstQTangent[3] = static_cast<int16_t>( Math::Floor( qTangent.w * 32767.0f + 0.5f ) );
+				dstData += sizeof(int16_t) * 4u;
+			}
+			else
+			{
+				memcpy( dstData, vNormal, sizeof(Vector3) );
+				dstData += sizeof(Vector3);
+			}
+
+			if( hasColour )
+			{
+				memcpy( dstData, srcData + sizeof(Vector3) * 2u, sizeof(uint8_t) * 4u );
+				dstData += sizeof(uint8_t) * 4u;
+			}
+
+			const Vector2 *uv = reinterpret_cast<const Vector2*>( srcData + uvStride );
+			for( uint8_t j=0; j<numUVs; ++j )
+			{
+				if( compactUvs )
+				{
+					uint16_t * RESTRICT_ALIAS dstUv = reinterpret_cast<uint16_t*>( dstData );
+					dstUv[0] = Bitwise::floatToHalf( uv[j].x );
+					dstUv[1] = Bitwise::floatToHalf( uv[j].y );
+					dstData += sizeof(uint16_t) * 2u;
+				}
+				else
+				{
+					memcpy( dstData, &uv[j], sizeof(Vector2) );
+					dstData += sizeof(Vector2);
+				}
+			}
+
+			if( hasTangent && !compactNormals )
+			{
+				memcpy( dstData, srcData + tangentStride, sizeof(float) * 4u );
+				dstData += sizeof(float) * 4u;
+			}
+
+			srcData += bytesPerVertex;
+		}
+	}
+	//-----------------------------------------------------------------------------------
+	void VertexUtils::expandVertices( uint8_t * RESTRICT_ALIAS dstData, const uint8_t *srcData,
+									  uint32_t bytesPerVertex, uint32_t numVertices,
+									  bool hasColour, uint8_t numUVs, bool hasTangent,
+									  uint8_t meshFormat )
+	{
+		using namespace Ogre;
+
+		const bool compactNormals	= (meshFormat & Network::MeshFormat::CompactNormals) != 0;
+		const bool compactUvs		= (meshFormat & Network::MeshFormat::CompactUvs) != 0;
+		const uint32_t uvStride		= sizeof(Vector3) * 2u + (hasColour ? sizeof(uint8_t) * 4u : 0u);
+		const uint32_t tangentStride= uvStride + sizeof(Vector2) * numUVs;
+
+		for( ::uint32_t i=0; i<numVertices; ++i )
+		{
+			//Position
+			memcpy( dstData, srcData, sizeof(Vector3) );
+			srcData += sizeof(Vector3);
+
+			Vector3 *vNormal = reinterpret_cast<Vector3*>( dstData + sizeof(Vector3) );
+			if( compactNormals )
+			{
+				const int16_t *srcQTangent = reinterpret_cast<const int16_t*>( srcData );
+				Quaternion qTangent( srcQTangent[3] / 32767.0f, srcQTangent[0] / 32767.0f,
+									 srcQTangent[1] / 32767.0f, srcQTangent[2] / 32767.0f );
+				qTangent.normalise();
+				*vNormal = qTangent.xAxis();
+				if( hasTangent )
+				{
+					*reinterpret_cast<Vector3*>( dstData + tangentStride ) = qTangent.yAxis();
+					*reinterpret_cast<float*>( dstData + tangentStride + sizeof(Vector3) ) =
+							qTangent.w < 0 ? -1.0f : 1.0f;
+				}
+				srcData += sizeof(int16_t) * 4u;
+			}
+			else
+			{
+				memcpy( vNormal, srcData, sizeof(Vector3) );
+				srcData += sizeof(Vector3);
+			}
+
+			if( hasColour )
+			{
+				memcpy( dstData + sizeof(Vector3) * 2u, srcData, sizeof(uint8_t) * 4u );
+				srcData += sizeof(uint8_t) * 4u;
+			}
+
+			Vector2 *uv = reinterpret_cast<Vector2*>( dstData + uvStride );
+			for( uint8_t j=0; j<numUVs; ++j )
+			{
+				if( compactUvs )
+				{
+					const uint16_t *srcUv = reinterpret_cast<const uint16_t*>( srcData );
+					uv[j] = Vector2( Bitwise::halfToFloat( srcUv[0] ), Bitwise::halfToFloat( srcUv[1] ) );
+					srcData += sizeof(uint16_t) * 2u;
+				}
+				else
+				{
+					memcpy( &uv[j], srcData, sizeof(Vector2) );
+					srcData += sizeof(Vector2);
+				}
+			}
+
+			if( hasTangent && !compactNormals )
+			{
+				memcpy( dstData + tangentStride, srcData, sizeof(float) * 4u );
+				srcData += sizeof(float) * 4u;
+			}
+
+			dstData += bytesPerVertex;
+		}
+	}
+	//-----------------------------------------------------------------------------------
 	void GenerateTangentsTask::execute( size_t threadId, size_t numThreads )
 	{
 		if( !indexData )
@@ -482,6 +992,23 @@ namespace DERGO
 		}
 	}
 	//-----------------------------------------------------------------------------------
+	void SkinningTask::execute( size_t threadId, size_t numThreads )
+	{
+		const uint32_t numVerticesPerThread = Ogre::alignToNextMultiple( numVertices,
+																		 numThreads ) / numThreads;
+
+		//If we've got 4 threads and 2 vertices, threads 2 & 3 need
+		//to process 0 vertices: Make sure we don't overflow.
+		uint32_t numVerticesToProcess = numVertices - std::min<uint32_t>( numVertices,
+																		  threadId *
+																		  numVerticesPerThread );
+		numVerticesToProcess = std::min( numVerticesPerThread, numVerticesToProcess );
+
+		const size_t offset = threadId * numVerticesPerThread;
+		VertexUtils::skin( restVertices + offset, skinWeights + offset, boneMatrices,
+						   outVertices + offset, numVerticesToProcess );
+	}
+	//-----------------------------------------------------------------------------------
 	void DeindexTask::execute( size_t threadId, size_t numThreads )
 	{
 		const uint32_t totalFaces = static_cast<uint32_t>( faces->size() );
@@ -540,5 +1067,13 @@ namespace DERGO
 
 			uvStride += sizeof(Ogre::Vector2);
 		}
+
+		if( !rawTangents->empty() )
+		{
+			VertexUtils::deindex( vertexData + vertexStartThreadIdx[threadId] * bytesPerVertex,
+								  bytesPerVertex,
+								  ptrFaces + threadId * numFacesPerThread,
+								  numFacesToProcess, &(*rawTangents)[0], tangentStride );
+		}
 	}
 }
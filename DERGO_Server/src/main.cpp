@@ -13,13 +13,51 @@
 #include "Network/SmartData.h"
 #include "Network/NetworkMessage.h"
 
+#include <stdlib.h>
+#include <string.h>
+
 static const int PORT = 9995;
+#ifndef _WIN32
+static const char *UNIX_SOCKET_PATH = "/tmp/dergo.sock";
+#else
+static const char *UNIX_SOCKET_PATH = "";
+#endif
 
 #include "DergoSystem.h"
 #include "Network/NetworkSystem.h"
 
+static void printUsage( const char *programName )
+{
+	printf( "Usage: %s [--port <tcp port>] [--unix <socket path>] [--no-unix]\n"
+			"Defaults: --port %i --unix %s\n", programName, PORT, UNIX_SOCKET_PATH );
+}
+
 int main( int argc, char **argv )
 {
+	int port = PORT;
+	Ogre::String unixSocketPath = UNIX_SOCKET_PATH;
+
+	for( int i=1; i<argc; ++i )
+	{
+		if( !strcmp( argv[i], "--port" ) && i + 1 < argc )
+			port = atoi( argv[++i] );
+		else if( !strcmp( argv[i], "--unix" ) && i + 1 < argc )
+			unixSocketPath = argv[++i];
+		else if( !strcmp( argv[i], "--no-unix" ) )
+			unixSocketPath.clear();
+		else
+		{
+			printUsage( argv[0] );
+			return 1;
+		}
+	}
+
+	if( port <= 0 || port > 65535 )
+	{
+		printUsage( argv[0] );
+		return 1;
+	}
+
 	DERGO::DergoSystem dergoSystem;
 	DERGO::NetworkSystem networkSystem;
 
@@ -32,7 +70,7 @@ int main( int argc, char **argv )
 
 	networkSystem.addListener( &dergoSystem );
 
-	int retVal = networkSystem.start();
+	int retVal = networkSystem.start( static_cast<Ogre::uint16>( port ), unixSocketPath );
 
 	dergoSystem.deinitialize();
 